@@ -25,6 +25,38 @@ def create_app(test_config=None):
     from .extensions import mail
     mail.init_app(app)
     telegram_bot.init_app(app)
+    from .utils.pricing import price_resolver
+    price_resolver.init_app(app)
+    from .utils.jobs import job_queue
+    job_queue.init_app(app)
+    from .utils.search import search_service
+    search_service.init_app(app)
+    from .utils.slots import slot_engine
+    slot_engine.init_app(app)
+    from .utils.certificate_renderer import certificate_renderer
+    certificate_renderer.init_app(app)
+    from .utils.assets import asset_cache
+    asset_cache.init_app(app)
+    from .utils.certificate_compositor import certificate_compositor
+    certificate_compositor.init_app(app)
+    from .utils.certificate_pipeline import certificate_pipeline
+    certificate_pipeline.init_app(app)
+    from .utils.pdf_pages import pdf_pages
+    pdf_pages.init_app(app)
+    from .utils.retention import certificate_retention
+    certificate_retention.init_app(app)
+    from .utils.chat_events import chat_broker
+    chat_broker.init_app(app)
+    from .utils.stats_rollup import stats_cli
+    app.cli.add_command(stats_cli)
+    from .utils.chat_threads import chat_cli
+    app.cli.add_command(chat_cli)
+    from .utils.bench import bench_cli
+    app.cli.add_command(bench_cli)
+    from .utils.settings import settings_registry
+    settings_registry.init_app(app)
+    from .utils.instrumentation import request_metrics
+    request_metrics.init_app(app)
 
     # ProxyFix for production
     if app.config.get('IS_PRODUCTION', False) or os.environ.get('FLASK_ENV') == 'production':
@@ -53,12 +85,10 @@ def create_app(test_config=None):
     # Global Context Processor
     @app.context_processor
     def inject_global_vars():
-        from app.models import GlobalSetting
-        chat_img = GlobalSetting.query.get('chat_image')
-        guac_url = GlobalSetting.query.get('guacamole_base_url')
+        from .utils.settings import settings_registry
         return dict(
-            chat_image=chat_img.value if chat_img else None,
-            guacamole_base_url=guac_url.value if guac_url else 'https://guacamole.medical-system.ru'
+            chat_image=settings_registry.chat_image,
+            guacamole_base_url=settings_registry.guacamole_base_url
         )
 
     # Register blueprints 
@@ -115,6 +145,8 @@ def create_app(test_config=None):
         # However, at exit, app context might be gone. TelegramBot.send_message uses internal valid checks.
         if app.config.get('TELEGRAM_BOT_TOKEN'):
             telegram_bot.send_shutdown_notification()
+            # Whatever is still queued stays spooled for the next start
+            telegram_bot.outbox.drain(timeout=5)
     
     atexit.register(on_exit)
 
@@ -144,6 +176,24 @@ def create_app(test_config=None):
             replace_existing=True
         )
         
+        # Remove abandoned stamp tool documents hourly
+        scheduler.add_job(
+            func=lambda: cleanup_temp_docs_job(app),
+            trigger=CronTrigger(minute=30),
+            id='cleanup_temp_docs',
+            name='Cleanup Stamp Tool Documents',
+            replace_existing=True
+        )
+        
+        # Write request metrics every minute
+        scheduler.add_job(
+            func=lambda: flush_request_metrics_job(app),
+            trigger=CronTrigger(minute='*'),
+            id='flush_request_metrics',
+            name='Flush Request Metrics',
+            replace_existing=True
+        )
+        
         scheduler.start()
         
         # Shutdown scheduler on exit
@@ -160,6 +210,17 @@ def collect_system_metrics_job(app):
 def cleanup_certificates_job(app):
     """Job function to cleanup old certificates with app context"""
     with app.app_context():
-        from app.blueprints.main import cleanup_old_certificates
+        from app.blueprints.admin import cleanup_old_certificates
         cleanup_old_certificates()
 
+def cleanup_temp_docs_job(app):
+    """Job function to sweep expired stamp tool sessions with app context"""
+    with app.app_context():
+        from app.utils.pdf_pages import pdf_pages
+        pdf_pages.sweep()
+
+def flush_request_metrics_job(app):
+    """Job function to write request metrics with app context"""
+    with app.app_context():
+        from app.utils.instrumentation import request_metrics
+        request_metrics.flush()
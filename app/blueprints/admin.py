@@ -1,4 +1,4 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, abort, current_app
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, abort, current_app, Response
 
 from flask_login import login_required, current_user, login_user
 
@@ -8,16 +8,38 @@ from app.models import (
 
     User, Location, Doctor, Service, AdditionalService, ServicePrice, AdditionalServicePrice,
 
-    Clinic, Manager, PaymentMethod, Appointment, Organization, GlobalSetting, BonusPeriod,
+    Clinic, Manager, PaymentMethod, Appointment, Organization, BonusPeriod,
 
     AppointmentHistory, AppointmentAdditionalService, AppointmentService, BonusValue, SystemMetrics,
     
-    MedicalCertificate, Notification, NotificationStatus, SupportTicket
+    MedicalCertificate, Notification, SupportTicket, BackgroundJob
 
 )
 
 from app.telegram_bot import telegram_bot
 
+from app.utils.recalculation import recalculate_costs
+from app.utils.stats_rollup import refresh_stats_days, rebuild_stats
+from app.utils.slots import slot_engine
+from app.utils.assets import asset_cache
+from app.utils.retention import certificate_retention
+from app.utils.settings import settings_registry
+from app.utils.notifications import recipient_filter, fan_out
+from app.utils.chat_threads import record_rename
+from app.utils.instrumentation import request_metrics
+
+from app.utils.summary_report import cached_summary, summary_csv, VIEW_TYPES as SUMMARY_VIEW_TYPES
+
+from app.utils.journal_import import (
+    detect_columns, ImportLookups, resolve_journal_rows, bulk_insert_appointments
+)
+
+from app.utils.row_reader import iter_rows, peek_rows, is_supported, cell_str
+
+from app.utils.jobs import job_queue, save_upload
+
+from itertools import islice
+
 import psutil
 
 from datetime import datetime, timedelta
@@ -26,6 +48,8 @@ from werkzeug.security import generate_password_hash, check_password_hash
 
 import os
 
+import json
+
 
 
 admin = Blueprint('admin', __name__)
@@ -82,14 +106,10 @@ def additional():
     cities = Location.query.filter_by(type='city', parent_id=None).all()
     centers = Location.query.filter_by(type='center').all()
     
-    chat_setting = GlobalSetting.query.get('chat_image')
-    chat_image = chat_setting.value if chat_setting else None
-    
-    stamp_setting = GlobalSetting.query.get('stamp_image')
-    stamp_image = stamp_setting.value if stamp_setting else None
-    
-    guacamole_setting = GlobalSetting.query.get('guacamole_base_url')
-    guacamole_base_url = guacamole_setting.value if guacamole_setting else ''
+    chat_image = settings_registry.chat_image
+    stamp_image = settings_registry.stamp_image
+    # The form shows only a stored URL, not the default used for rendering
+    guacamole_base_url = settings_registry.get('guacamole_base_url', '')
     
     return render_template('admin_additional.html', 
                          managers=managers, 
@@ -158,7 +178,15 @@ def clear_journal_data():
 
         ).delete(synchronize_session=False)
 
-        
+        # The bulk delete bypasses the ORM: refresh the rollup and the slot cache by hand
+
+        rebuild_stats(int(center_id), start_date, end_date)
+
+        slot_engine.invalidate_on_commit(
+
+            (int(center_id), start_date + timedelta(days=offset)) for offset in range(last_day)
+
+        )
 
         db.session.commit()
 
@@ -178,957 +206,242 @@ def clear_journal_data():
 
 
 
-@admin.route('/journal/recalculate', methods=['POST'])
-
-@login_required
-
-def recalculate_journal_data():
-
-    center_id = request.form.get('center_id')
-
-    month_str = request.form.get('month')
+def _recalculate_journal_job(job, center_id, year, month, dry_run=False):
 
-    
+    start_date = date(year, month, 1)
 
-    if not center_id or not month_str:
+    _, last_day = calendar.monthrange(year, month)
 
-        flash('Центр и Месяц обязательны', 'error')
+    end_date = date(year, month, last_day)
 
-        return redirect(url_for('admin.additional'))
+    # One UPDATE ... FROM against the date-effective price tables (app/utils/recalculation.py)
+    result = recalculate_costs(center_id, start_date, end_date, dry_run=dry_run)
 
-        
+    if not dry_run and result['changed']:
 
-    try:
+        rebuild_stats(center_id, start_date, end_date)
 
-        year, month = map(int, month_str.split('-'))
+    job.progress(result['total'], total=result['total'])
 
-        start_date = date(year, month, 1)
-
-        _, last_day = calendar.monthrange(year, month)
-
-        end_date = date(year, month, last_day)
-
-
-
-        appointments = Appointment.query.filter(
-
-            Appointment.center_id == int(center_id),
-
-            Appointment.date >= start_date,
-
-            Appointment.date <= end_date
-
-        ).all()
-
-        
-
-        updated_count = 0
-
-        
-
-        for appt in appointments:
-
-            if not appt.service: continue
-
-            
-
-            # Find service object by name to get price logic
-
-            # Note: appt.service is string name. 
-
-            service_obj = Service.query.filter(Service.name.ilike(appt.service)).first()
-
-            
+    if dry_run:
 
-            price = 0.0
-
-            if service_obj:
-
-               price = service_obj.get_price(appt.date)
-
-               
-
-            # Additional services cost
-
-            add_svc_cost = 0.0
-
-            for add_svc in appt.additional_services:
-
-                add_svc_cost += add_svc.get_price(appt.date)
+        db.session.rollback()
 
-                
+        result['message'] = f"Проверка: будет изменено {result['changed']} из {result['total']} записей"
 
-            qty = appt.quantity if appt.quantity else 1
+        result['category'] = 'info'
 
-            add_qty = appt.additional_service_quantity if appt.additional_service_quantity else 1
+        return result
 
-            
+    db.session.commit()
 
-            discount = appt.discount if appt.discount else 0.0
+    result['message'] = f"Пересчитано записей: {result['total']} (изменено: {result['changed']})"
 
-            
+    result['category'] = 'success'
 
-            # Recalculate Total
+    return result
 
-            # Formula: (ServicePrice * Qty) + (AddServicePriceTotal * AddQty) - Discount
 
-            # Note: AddServicePriceTotal is sum of unit prices of all attached additional services
 
-            
 
-            # Wait, additional_services is a list. Do we multiply sum by add_qty OR 
 
-            # does add_qty apply to each? 
+def _job_response(job_id, endpoint, error_prefix='Ошибка', **values):
 
-            # In API create_appointment: 
+    """Answers a route that enqueued a job: JSON for XHR callers, otherwise flash + redirect."""
 
-            # add_services_cost = sum(add_svc.get_price(appt.date) for add_svc in appt.additional_services)
+    status_url = url_for('admin.job_status', id=job_id)
 
-            # total_cost = (service_price * appt.quantity) + (add_services_cost * appt.additional_service_quantity)
+    if request.headers.get('X-Requested-With') == 'XMLHttpRequest' or request.accept_mimetypes.best == 'application/json':
 
-            # This matches plan.
+        return jsonify({'job_id': job_id, 'status_url': status_url}), 202
 
-            
+    job = db.session.get(BackgroundJob, job_id)
 
-            new_cost = (price * qty) + (add_svc_cost * add_qty) - discount
+    if job.status == 'done':
 
-            if new_cost < 0: new_cost = 0.0
+        report = json.loads(job.result) if job.result else {}
 
-            
+        flash(report.get('message', 'Готово'), report.get('category', 'success'))
 
-            appt.cost = new_cost
+    elif job.status == 'failed':
 
-            updated_count += 1
+        flash(f'{error_prefix}: {job.error}', 'error')
 
-            
+    else:
 
-        db.session.commit()
+        flash(f'Задача #{job_id} выполняется в фоне. Статус: {status_url}', 'info')
 
-        flash(f'Пересчитано записей: {updated_count}', 'success')
+    return redirect(url_for(endpoint, **values))
 
 
 
-    except Exception as e:
+@admin.route('/jobs/<int:id>')
 
-        db.session.rollback()
+@login_required
 
-        flash(f'Ошибка: {str(e)}', 'error')
+def job_status(id):
 
-        
+    job = BackgroundJob.query.get_or_404(id)
 
-    return redirect(url_for('admin.additional'))
+    return jsonify(job.to_dict())
 
 
 
-@admin.route('/journal/import', methods=['POST'])
+@admin.route('/journal/recalculate', methods=['POST'])
 
 @login_required
 
-def import_journal_data():
+def recalculate_journal_data():
 
     center_id = request.form.get('center_id')
 
-    if not center_id:
-
-        flash('Не выбран центр', 'error')
-
-        return redirect(url_for('admin.additional'))
-
-
-
-    if 'file' not in request.files:
-
-        flash('Нет файла', 'error')
-
-        return redirect(url_for('admin.additional'))
+    month_str = request.form.get('month')
 
     
 
-    file = request.files['file']
-
-    if file.filename == '':
-
-        flash('Файл не выбран', 'error')
-
-        return redirect(url_for('admin.additional'))
-
-        
-
-    original_filename = file.filename
-
-    if not (original_filename.lower().endswith('.csv') or original_filename.lower().endswith('.xlsx')):
-
-        flash('Неподдерживаемый формат. Используйте CSV или XLSX.', 'error')
-
-        return redirect(url_for('admin.additional'))
-
-        
-
-    filename = secure_filename(file.filename)
-
-
-
-    try:
-
-        rows = []
-
-        if original_filename.lower().endswith('.csv'):
-
-            content = file.stream.read()
-
-            text = None
-
-            try:
-
-                text = content.decode("utf-8-sig")
-
-            except UnicodeDecodeError:
-
-                try:
-
-                    text = content.decode("cp1251")
-
-                except UnicodeDecodeError:
-
-                    text = content.decode("utf-8", errors="ignore")
-
-            
-
-            stream = io.StringIO(text, newline=None)
-
-            stream.seek(0)
-
-            
-
-            try:
-
-                sample = stream.read(2048)
-
-                stream.seek(0)
-
-                if not sample: 
-
-                    rows = []
-
-                else:
-
-                    dialect = csv.Sniffer().sniff(sample, delimiters=";,|\t")
-
-                    csv_input = csv.reader(stream, dialect)
-
-                    rows = list(csv_input)
-
-            except csv.Error:
-
-                stream.seek(0)
-
-                csv_input = csv.reader(stream)
-
-                rows = list(csv_input)
-
-            except Exception:
-
-                stream.seek(0)
-
-                rows = list(csv.reader(stream))
-
-            
-
-        elif original_filename.lower().endswith('.xlsx'):
-
-            wb = openpyxl.load_workbook(file, data_only=True)
-
-            sheet = wb.active
-
-            for r in sheet.iter_rows(values_only=True):
-
-                rows.append(list(r))
-
-        
-
-        if not rows:
-
-            flash(f'Файл пуст (Filename: {original_filename})', 'error')
-
-            return redirect(url_for('admin.additional'))
-
-            
-
-        delete_old = request.form.get('delete_old') == 'on'
-
-
-
-        # Header Detection
-
-        headers = []
-
-        if rows:
-
-            headers = [str(h).strip().lower() if h else '' for h in rows[0]]
-
-        
-
-        header_row_idx = 0
-
-        if 'дата' not in headers and len(rows) > 1:
-
-             headers = [str(h).strip().lower() if h else '' for h in rows[1]]
-
-             header_row_idx = 1
-
-             
-
-        col_map = {}
-
-        for idx, h in enumerate(headers):
-
-            if 'дата' in h and 'рождения' not in h: col_map['date'] = idx
-
-            elif 'пациент' in h: col_map['patient'] = idx
-
-            elif 'врач' in h: col_map['doctor'] = idx
-
-            elif 'исследование' in h or 'услуга' in h: col_map['service'] = idx
-
-            elif 'оплата' in h: col_map['payment'] = idx
-
-            elif 'скидка' in h: col_map['discount'] = idx
-
-            elif 'сумма' in h: col_map['cost'] = idx
-
-            elif 'стоимость' in h and 'cost' not in col_map: col_map['cost'] = idx 
-
-            elif 'договор' in h: col_map['contract'] = idx
-
-            elif 'ребенок' in h: col_map['is_child'] = idx
-
-            elif 'клиника' in h: col_map['clinic'] = idx
-
-            elif 'кол-во' in h: col_map['quantity'] = idx
-
-            elif 'доп' in h and 'услуги' in h: col_map['additional_services'] = idx
-
-            elif 'комментарий' in h: col_map['comment'] = idx
-
-            
-
-        if 'date' not in col_map or 'patient' not in col_map:
-
-            col_map = {
-
-                'date': 0, 'contract': 3, 'patient': 4, 'is_child': 5, 'doctor': 6,
-
-                'clinic': 8, 'service': 9, 'additional_services': 10, 'quantity': 11,
-
-                'payment': 14, 'discount': 15, 'cost': 16, 'comment': 12
-
-            }
-
-
-
-        valid_rows_to_insert = []
-
-        unique_dates_to_clean = set()
-
-        warnings = []
-
-
-
-        for i in range(header_row_idx + 1, len(rows)):
-
-            row = rows[i]
-
-            if not row or len(row) < 5: continue
-
-            
-
-            def get_val(key):
-
-                idx = col_map.get(key)
-
-                if idx is not None and idx < len(row):
-
-                   return row[idx]
-
-                return None
-
-
-
-            date_val = get_val('date')
-
-            if not date_val: continue
-
-            
-
-            appt_date = None
-
-            if isinstance(date_val, datetime): appt_date = date_val.date()
-
-            elif isinstance(date_val, date): appt_date = date_val
-
-            elif isinstance(date_val, str): 
-
-                val_str = date_val.strip()
-
-                if not val_str: continue
-
-                # Remove timestamps if present in string like "2025-12-01 00:00:00"
-
-                # Replace comma with dot (e.g. 09,12.2025 -> 09.12.2025)
-
-                val_str = val_str.replace(',', '.')
-
-                
-
-                for fmt in ['%d.%m.%Y', '%Y-%m-%d', '%d.%m.%y', '%d/%m/%Y']:
-
-                    try:
-
-                        appt_date = datetime.strptime(val_str, fmt).date()
-
-                        break
-
-                    except: pass
-
-            
-
-            if not appt_date: 
-
-                warnings.append(f"Строка {i+1}: Неверный формат даты '{date_val}'.")
-
-                continue
-
-            
-
-            patient = str(get_val('patient') or '').strip()
-
-            if not patient: continue
-
-            
-
-            # --- STRICT LOGIC ---
-
-            
-
-            # 1. DOCTOR MATCHING
-
-            doctor_name = str(get_val('doctor') or '').strip()
-
-            
-
-            # New Rule: Empty doctor -> "Без врача"
-
-            if not doctor_name:
-
-                doctor_name = "Без врача"
-
-            
-
-            doc_obj = None
-
-            if doctor_name:
-
-                doc_obj = Doctor.query.filter(Doctor.name.ilike(doctor_name)).first()
-
-            
-
-            if not doc_obj:
-
-                # 1b. Fuzzy fallback: Clean spaces and try again
-
-                import re
-
-                
-
-                # Normalize spaces (e.g. "Name  Surname" -> "Name Surname")
-
-                clean_name = re.sub(r'\s+', ' ', doctor_name)
-
-                if clean_name != doctor_name:
-
-                    doc_obj = Doctor.query.filter(Doctor.name.ilike(clean_name)).first()
-
-                
-
-                # 1c. Super-fuzzy fallback: Replace spaces with wildcards
-
-                if not doc_obj:
-
-                    # "Ivanov Ivan" -> "Ivanov%Ivan"
-
-                    wildcard_name = clean_name.replace(' ', '%')
-
-                    doc_obj = Doctor.query.filter(Doctor.name.ilike(wildcard_name)).first()
-
-
-
-            if not doc_obj:
-
-                warnings.append(f"Строка {i+1}: Врач '{doctor_name}' не найден (даже с нечетким поиском).")
-
-                continue # Skip row
-
-                
-
-            # 2. MANAGER AUTO-ASSIGN
-
-            manager_id = None
-
-            if doc_obj.manager:
-
-                mgr = User.query.filter(User.username.ilike(doc_obj.manager)).first()
-
-                if mgr: manager_id = mgr.id
-
-            
-
-            # 3. CLINIC MATCHING
-
-            clinic_name = str(get_val('clinic') or '').strip()
-
-            clinic_obj = None
-
-            if clinic_name:
-
-                 clinic_obj = Clinic.query.filter(Clinic.name.ilike(clinic_name)).first()
-
-                 
-
-            # Warning if clinic provided but not found? Or just ignore? 
-
-            # Plan said "Match Clinic (skip if not found) or Warning".
-
-            # Let's skip if clinic name was provided but not found, to be safe.
-
-            # 4. SERVICE MATCHING
-
-            service_name = str(get_val('service') or '').strip()
-
-            service_obj = None
-
-            
-
-            if service_name:
-
-                service_obj = Service.query.filter(Service.name.ilike(service_name)).first()
-
-                if not service_obj:
-
-                     warnings.append(f"Строка {i+1}: Услуга '{service_name}' не найдена (игнорируется, так как не найдена в каталоге).")
-
-                     # If service name was present but invalid, should we treat it as "No Service" or "Skip"?
-
-                     # Strict mode usually implies Skip. But let's see if we have Add Services.
-
-                     # If user says "Load data if Add Srv not empty", maybe we treat invalid main service as None?
-
-                     # Let's keep strictness: If valid name provided but not found -> Warning (and effectively None for logic below).
-
-                     pass
-
-
-
-            # 5. ADDITIONAL SERVICES MATCHING
-
-            add_services_str = str(get_val('additional_services') or '').strip()
-
-            add_service_objs = []
-
-            if add_services_str:
-
-                # Split by comma
-
-                for raw_name in add_services_str.split(','):
-
-                    name = raw_name.strip()
-
-                    if not name: continue
-
-                    
-
-                    add_srv = AdditionalService.query.filter(AdditionalService.name.ilike(name)).first()
-
-                    if not add_srv:
-
-                         warnings.append(f"Строка {i+1}: Доп. услуга '{name}' не найдена.")
-
-                         # Strict: If explicitly listed but not found, we skip the row to avoid data loss/corruption.
-
-                         add_service_objs = [] # clear to trigger skip
-
-                         service_obj = None # ensure skip
-
-                         break
-
-                    
-
-                    add_service_objs.append(add_srv)
-
-
-
-            # VALIDATION: Must have either Main Service OR Additional Services
-
-            if not service_obj and not add_service_objs:
-
-                 if not warnings: # Don't duplicate if we already warned about invalid service
-
-                     warnings.append(f"Строка {i+1}: Не указана ни основная, ни доп. услуга.")
-
-                 continue
-
-
-
-            # COST CALCULATION
-
-            # Parse quantity first for cost calc
-
-            excel_qty = 1
-
-            raw_qty = get_val('quantity')
-
-            if raw_qty:
-
-                try: excel_qty = int(float(str(raw_qty).replace(',', '.')))
-
-                except: excel_qty = 1
-
-
-
-            cost = 0.0
-
-            if service_obj:
-
-                cost += service_obj.get_price(appt_date) # Main service always quantity 1
-
-            
-
-            for ads in add_service_objs:
-
-                cost += ads.get_price(appt_date) * excel_qty
-
-
-
-            
-
-            # --- END STRICT LOGIC ---
-
-            
-
-            valid_rows_to_insert.append({
-
-                'date': appt_date,
-
-                'patient': patient,
-
-                'service_obj': service_obj, # Store obj
-
-                'doctor_obj': doc_obj,      # Store obj
-
-                'clinic_obj': clinic_obj,   # Store obj
-
-                'manager_id': manager_id,
-
-                'contract': str(get_val('contract') or '').strip(),
-
-                'cost': cost, # Catalog price (Main + Additional)
-
-                'discount_raw': get_val('discount'), # Raw discount
-
-                'payment_raw': str(get_val('payment') or '').strip(),
-
-                'is_child_raw': get_val('is_child'),
-
-                'quantity_raw': get_val('quantity'),
-
-                'quantity_raw': get_val('quantity'),
-
-                'add_service_objs': add_service_objs, # List of objects
-
-                'add_services_raw': add_services_str, # For legacy comment if needed?
-
-                'comment_raw': str(get_val('comment') or '').strip()
-
-            })
-
-            unique_dates_to_clean.add(appt_date)
-
-            
-
-        if not valid_rows_to_insert:
-
-            msg = 'Не найдено валидных строк.'
-
-            if warnings: msg += f" Ошибки ({len(warnings)}): " + "; ".join(warnings[:5]) + "..."
-
-            flash(msg, 'warning')
-
-            return redirect(url_for('admin.additional'))
-
-
-
-        if delete_old and unique_dates_to_clean:
-
-             # Fetch IDs to delete dependencies first (query.delete bypasses cascade)
-
-             appts_to_delete = db.session.query(Appointment.id).filter(
-
-                 Appointment.center_id == int(center_id),
-
-                 Appointment.date.in_(unique_dates_to_clean)
-
-             ).all()
-
-             
-
-             appt_ids = [a[0] for a in appts_to_delete]
-
-             
-
-             if appt_ids:
-
-                 # Delete associations manually (using models)
-
-                 # AppointmentAdditionalService (Additional Services)
-
-                 AppointmentAdditionalService.query.filter(
-
-                     AppointmentAdditionalService.appointment_id.in_(appt_ids)
-
-                 ).delete(synchronize_session=False)
-
-
-
-                 # AppointmentService (Main Services)
-
-                 AppointmentService.query.filter(
-
-                     AppointmentService.appointment_id.in_(appt_ids)
-
-                 ).delete(synchronize_session=False)
-
-
-
-                 # History
-
-                 AppointmentHistory.query.filter(
-
-                     AppointmentHistory.appointment_id.in_(appt_ids)
-
-                 ).delete(synchronize_session=False)
-
-
-
-                 # Finally delete Appointments
-
-                 Appointment.query.filter(
-
-                     Appointment.id.in_(appt_ids)
-
-                 ).delete(synchronize_session=False)
-
-
-
-        created_count = 0
-
-        current_center_id = int(center_id)
-
-        current_user_id = current_user.id
-
-        
-
-        for data in valid_rows_to_insert:
-
-            # Boolean
-
-            is_child = False
-
-            raw_child = data['is_child_raw']
-
-            if raw_child:
-
-                if isinstance(raw_child, bool): is_child = raw_child
-
-                else:
-
-                    s = str(raw_child).lower()
-
-                    if s in ['true', 'yes', 'да', '1', '+']: is_child = True
-
-
-
-            # Payment Method
-
-            pm_name = data['payment_raw']
-
-            pm_id = None
-
-            if pm_name:
-
-                pm = PaymentMethod.query.filter(PaymentMethod.name.ilike(pm_name)).first()
-
-                if pm: pm_id = pm.id
-
-                else:
-
-                     pm = PaymentMethod(name=pm_name)
-
-                     db.session.add(pm)
-
-                     db.session.flush()
-
-                     pm_id = pm.id
-
-            
-
-            # Discount
-
-            discount = 0.0
-
-            if data['discount_raw'] is not None:
-
-                if isinstance(data['discount_raw'], (int, float)):
+    if not center_id or not month_str:
 
-                    discount = float(data['discount_raw'])
+        flash('Центр и Месяц обязательны', 'error')
 
-                else:
+        return redirect(url_for('admin.additional'))
 
-                    d_str = str(data['discount_raw']).replace(u'\xa0', '').replace(' ', '').replace(',', '.')
+        
 
-                    try: discount = float(d_str)
+    try:
 
-                    except: discount = 0.0
+        year, month = map(int, month_str.split('-'))
 
-                
+    except ValueError:
 
-            # Quantity parsed above (excel_qty)
+        flash('Неверный формат месяца', 'error')
 
-            
+        return redirect(url_for('admin.additional'))
 
-            # Legacy Quantity (Main Service) set to 1
+    # Runs in the background, progress at /admin/jobs/<id>
 
-            main_qty = 1
+    dry_run = request.form.get('dry_run') == 'on'
 
+    job_id = job_queue.enqueue('journal_recalculate', _recalculate_journal_job, int(center_id), year, month, dry_run, user_id=current_user.id)
 
+    return _job_response(job_id, 'admin.additional')
 
-            appt = Appointment(
 
-                center_id=current_center_id,
 
-                date=data['date'],
+def _import_journal_job(job, path, original_filename, center_id, author_id, delete_old):
 
-                time="09:00",
+    try:
 
-                patient_name=data['patient'],
+        with open(path, 'rb') as fh:
 
-                service=data['service_obj'].name if data['service_obj'] else "Доп. услуги", # Fallback name
+            head, rows = peek_rows(iter_rows(fh, original_filename), 2)
 
-                # Link M2M service
+            if not head:
 
-                doctor=data['doctor_obj'].name,
+                return {'message': f'Файл пуст (Filename: {original_filename})', 'category': 'error', 'created': 0}
 
-                doctor_id=data['doctor_obj'].id,
+            # Parse -> resolve against catalog dictionaries -> validate -> bulk insert,
 
-                manager_id=data['manager_id'], # Auto-assigned
+            # streamed row by row (see app/utils/journal_import.py)
 
-                clinic_id=data['clinic_obj'].id if data['clinic_obj'] else None,
+            col_map, header_row_idx = detect_columns(head)
 
-                cost=float(data['cost']),
+            lookups = ImportLookups()
 
-                discount=discount,
+            valid_rows = resolve_journal_rows(islice(rows, header_row_idx + 1, None), col_map, header_row_idx, lookups, job.warnings)
 
-                payment_method_id=pm_id,
+            created_count = bulk_insert_appointments(valid_rows, center_id, author_id, lookups, delete_old=delete_old, progress=job.progress)
 
-                is_child=is_child,
+    finally:
 
-                contract_number=data['contract'],
+        os.remove(path)
 
-                quantity=main_qty, # Always 1 for main service
+    warnings = job.warnings
 
-                author_id=current_user_id,
+    if not created_count:
 
-                comment=data['comment_raw']
+        db.session.rollback()
 
-            )
+        msg = 'Не найдено валидных строк.'
 
-            
+        if warnings: msg += f" Ошибки ({len(warnings)}): " + "; ".join(warnings[:5]) + "..."
 
-            # Add service to M2M relationship (Force Quantity 1 for Main)
+        return {'message': msg, 'category': 'warning', 'created': 0}
 
-            if data['service_obj']:
+    db.session.commit()
 
-                appt.service_associations.append(AppointmentService(service=data['service_obj'], quantity=1))
+    success_msg = f'Успешно импортировано: {created_count}.'
 
-            
+    if warnings:
 
-            # Add Additional Services to M2M (Use Excel Quantity)
+        # Show top 5 warnings
 
-            if data['add_service_objs']:
+        warn_msg = f" Пропущено строк: {len(warnings)}. Примеры: " + "; ".join(warnings[:5])
 
-                for ads in data['add_service_objs']:
+        return {'message': success_msg + warn_msg, 'category': 'warning', 'created': created_count}
 
-                    appt.additional_service_associations.append(AppointmentAdditionalService(additional_service=ads, quantity=excel_qty))
+    return {'message': success_msg, 'category': 'success', 'created': created_count}
 
-            
 
-            # Legacy comment? Maybe keep strict? 
 
-            # User said "map column... cost substituted". 
+@admin.route('/journal/import', methods=['POST'])
 
-            # If mapped, no need for raw text in comment unless unmapped content exists (which we skip now).
+@login_required
 
-            # So we can remove the comment assignment or keep it if strictly necessary. 
+def import_journal_data():
 
-            # Let's keep a cleaner comment:
+    center_id = request.form.get('center_id')
 
-            if data['add_services_raw']:
+    if not center_id:
 
-                 # If we mapped them, maybe we don't need "Доп: ..." in comment?
+        flash('Не выбран центр', 'error')
 
-                 # But sticking to previous behavior is safer, let's just log it if needed.
+        return redirect(url_for('admin.additional'))
 
-                 # Actually, better to NOT duplicate logic in comment if it's real data now.
 
-                 pass 
 
-            
+    if 'file' not in request.files:
 
-            db.session.add(appt)
+        flash('Нет файла', 'error')
 
-            created_count += 1
+        return redirect(url_for('admin.additional'))
 
-            
+    
 
-        db.session.commit()
+    file = request.files['file']
 
-        
+    if file.filename == '':
 
-        success_msg = f'Успешно импортировано: {created_count}.'
+        flash('Файл не выбран', 'error')
 
-        if warnings:
+        return redirect(url_for('admin.additional'))
 
-            # flash works with categories. detailed warning list might be too long.
+        
 
-            # let's show top 5 warnings.
+    original_filename = file.filename
 
-            warn_msg = f" Пропущено строк: {len(warnings)}. Примеры: " + "; ".join(warnings[:5])
+    if not (original_filename.lower().endswith('.csv') or original_filename.lower().endswith('.xlsx')):
 
-            flash(success_msg + warn_msg, 'warning') # Use warning color to draw attention
+        flash('Неподдерживаемый формат. Используйте CSV или XLSX.', 'error')
 
-        else:
+        return redirect(url_for('admin.additional'))
 
-            flash(success_msg, 'success')
+        
 
+    # Runs in the background, progress at /admin/jobs/<id>
 
+    delete_old = request.form.get('delete_old') == 'on'
 
-    except Exception as e:
+    job_id = job_queue.enqueue(
 
-        db.session.rollback()
+        'journal_import', _import_journal_job,
 
-        flash(f'Ошибка импорта: {str(e)}', 'error')
+        save_upload(file), original_filename, int(center_id), current_user.id, delete_old,
 
+        user_id=current_user.id
 
+    )
 
-    return redirect(url_for('admin.additional'))
+    return _job_response(job_id, 'admin.additional', error_prefix='Ошибка импорта')
 
 
 
@@ -1312,17 +625,7 @@ def update_chat_settings():
 
         
 
-        setting = GlobalSetting.query.get('chat_image')
-
-        if not setting:
-
-            setting = GlobalSetting(key='chat_image')
-
-            db.session.add(setting)
-
-        
-
-        setting.value = relative_path
+        settings_registry.set('chat_image', relative_path)
 
         db.session.commit()
 
@@ -1340,11 +643,7 @@ def update_chat_settings():
 def update_viewer_settings():
     guac_url = request.form.get('guacamole_base_url')
     if guac_url:
-        setting = GlobalSetting.query.get('guacamole_base_url')
-        if not setting:
-            setting = GlobalSetting(key='guacamole_base_url')
-            db.session.add(setting)
-        setting.value = guac_url
+        settings_registry.set('guacamole_base_url', guac_url)
         db.session.commit()
         flash('Настройки просмотрщика обновлены', 'success')
     return redirect(url_for('admin.additional'))
@@ -1391,25 +690,19 @@ def upload_stamp_image():
 
         file.save(file_path)
 
-        
-
-        # Save relative path to DB
+        # A stamp saved under an existing name must not be served from the cache
 
-        relative_path = f"uploads/stamps/{filename}"
+        asset_cache.invalidate(file_path)
 
         
 
-        setting = GlobalSetting.query.get('stamp_image')
-
-        if not setting:
-
-            setting = GlobalSetting(key='stamp_image')
+        # Save relative path to DB
 
-            db.session.add(setting)
+        relative_path = f"uploads/stamps/{filename}"
 
         
 
-        setting.value = relative_path
+        settings_registry.set('stamp_image', relative_path)
 
         db.session.commit()
 
@@ -1528,9 +821,9 @@ def generate_certificate():
         draw.text((700, 650), date.today().strftime('%d.%m.%Y'), fill='black', font=font_small)  # Сегодняшняя дата
         
         # Overlay stamp at bottom
-        stamp_setting = GlobalSetting.query.get('stamp_image')
-        if stamp_setting and stamp_setting.value:
-            stamp_path = os.path.join(current_app.static_folder, stamp_setting.value)
+        stamp_image = settings_registry.stamp_image
+        if stamp_image:
+            stamp_path = os.path.join(current_app.static_folder, stamp_image)
             if os.path.exists(stamp_path):
                 stamp = Image.open(stamp_path).convert('RGBA')
                 # Resize stamp if needed
@@ -1605,22 +898,9 @@ def list_certificates():
 
 
 def cleanup_old_certificates():
-    """Cleanup certificates older than 30 days"""
+    """Cleanup certificates older than CERT_RETENTION_DAYS (30) and orphaned files"""
     try:
-        cutoff = datetime.utcnow() - timedelta(days=30)
-        old_certs = MedicalCertificate.query.filter(
-            MedicalCertificate.generated_at < cutoff
-        ).all()
-        
-        for cert in old_certs:
-            # Delete file
-            filepath = os.path.join(current_app.static_folder, 'uploads', 'certificates', cert.filename)
-            if os.path.exists(filepath):
-                os.remove(filepath)
-            # Delete DB record
-            db.session.delete(cert)
-        
-        db.session.commit()
+        certificate_retention.run()
         return True
     except Exception as e:
         db.session.rollback()
@@ -1628,6 +908,13 @@ def cleanup_old_certificates():
         return False
 
 
+@admin.route('/stamp-tool/certificates/retention', methods=['GET'])
+@login_required
+def certificate_retention_stats():
+    """Last retention run (rows, files, reclaimed bytes) and totals"""
+    return jsonify(certificate_retention.stats())
+
+
 # ========== Monitoring Metrics Collection ==========
 
 # Simple in-memory cache for statistics (5-minute expiration)
@@ -1769,6 +1056,9 @@ def monitoring():
         'disk_used': [m.disk_used_gb for m in historical_metrics],
         'disk_percent': [m.disk_percent for m in historical_metrics]
     }
+    
+    # Request latency and SQL statistics (last 24 hours)
+    performance = request_metrics.summary(hours=24)
 
     
 
@@ -1796,11 +1086,21 @@ def monitoring():
                            stats=stats,
                            
                            # Graph data
-                           graph_data=graph_data
+                           graph_data=graph_data,
+                           
+                           performance=performance
 
                            )
 
 
+@admin.route('/monitoring/performance')
+@login_required
+def monitoring_performance():
+    """Request latency percentiles, N+1 candidates and slow queries as JSON"""
+    hours = min(request.args.get('hours', 24, type=int), 24 * 14)
+    return jsonify(request_metrics.summary(hours=hours))
+
+
 @admin.route('/monitoring/refresh', methods=['POST'])
 @login_required
 def monitoring_refresh():
@@ -1969,6 +1269,9 @@ def edit_user(user_id):
         user.doctor_id = None
         user.clinic_id = None
 
+    # The inbox searches the stored username and organization name
+    record_rename([user])
+
     try:
         db.session.commit()
         flash(f'Пользователь {user.username} успешно обновлен', 'success')
@@ -2314,143 +1617,89 @@ def delete_doctor(id):
 
 
 
-@admin.route('/doctors/import', methods=['POST'])
-
-def import_doctors():
-
-    if 'file' not in request.files:
-
-        flash('Нет файла', 'error')
-
-        return redirect(url_for('admin.doctors'))
-
-    
-
-    file = request.files['file']
-
-    if file.filename == '':
-
-        flash('Файл не выбран', 'error')
-
-        return redirect(url_for('admin.doctors'))
-
-
-
-    if file:
-
-        filename = secure_filename(file.filename)
-
-        doctors_created = 0
-
-        errors = 0
-
-        
-
-        try:
-
-            # Determine file type
-
-            if filename.endswith('.csv'):
-
-                # Handle CSV
-
-                stream = io.StringIO(file.stream.read().decode("UTF8"), newline=None)
-
-                csv_input = csv.reader(stream)
-
-                # Assume header: Name, Specialization, Manager
-
-                # Or just skip first row if it looks like header?
+def _import_doctors_job(job, path, filename):
 
-                # Let's assume with header if "Name" is in first row, or just simple loop.
+    doctors_created = 0
 
-                # Simplest: Assume Header exists.
-
-                header = next(csv_input, None)
-
-                
-
-                for row in csv_input:
-
-                    if len(row) >= 1: # At least name
-
-                        name = row[0].strip()
+    try:
 
-                        if not name: continue
+        with open(path, 'rb') as fh:
 
-                        specialization = row[1].strip() if len(row) > 1 else None
+            # Streamed row by row (CSV or XLSX), first row is the header
 
-                        manager = row[2].strip() if len(row) > 2 else None
+            rows = iter_rows(fh, filename)
 
-                        
+            header = next(rows, None)
 
-                        # Check exist
+            for row in rows:
 
-                        if not Doctor.query.filter_by(name=name).first():
+                job.advance()
 
-                            doc = Doctor(name=name, specialization=specialization, manager=manager)
+                name = cell_str(row[0]) if row else None
 
-                            db.session.add(doc)
+                if not name: continue
 
-                            doctors_created += 1
+                specialization = cell_str(row[1]) if len(row) > 1 else None
 
-                        
+                manager = cell_str(row[2]) if len(row) > 2 else None
 
-            elif filename.endswith('.xlsx'):
+                # Check exist
 
-                # Handle Excel
+                if not Doctor.query.filter_by(name=name).first():
 
-                wb = openpyxl.load_workbook(file)
+                    doc = Doctor(name=name, specialization=specialization, manager=manager)
 
-                sheet = wb.active
+                    db.session.add(doc)
 
-                
+                    doctors_created += 1
 
-                # Iterate rows, skipping header (min_row=2)
+    finally:
 
-                for row in sheet.iter_rows(min_row=2, values_only=True):
+        os.remove(path)
 
-                    if not row or not row[0]: continue
+    db.session.commit()
 
-                    name = str(row[0]).strip()
+    return {'message': f'Импортировано врачей: {doctors_created}', 'category': 'success', 'created': doctors_created}
 
-                    specialization = str(row[1]).strip() if len(row) > 1 and row[1] else None
 
-                    manager = str(row[2]).strip() if len(row) > 2 and row[2] else None
 
-                    
+@admin.route('/doctors/import', methods=['POST'])
 
-                    if not Doctor.query.filter_by(name=name).first():
+def import_doctors():
 
-                        doc = Doctor(name=name, specialization=specialization, manager=manager)
+    if 'file' not in request.files:
 
-                        db.session.add(doc)
+        flash('Нет файла', 'error')
 
-                        doctors_created += 1
+        return redirect(url_for('admin.doctors'))
 
+    
 
+    file = request.files['file']
 
-            else:
+    if file.filename == '':
 
-                 flash('Неподдерживаемый формат файла. Используйте CSV или XLSX.', 'error')
+        flash('Файл не выбран', 'error')
 
-                 return redirect(url_for('admin.doctors'))
+        return redirect(url_for('admin.doctors'))
 
 
 
-            db.session.commit()
+    if file:
 
-            flash(f'Импортировано врачей: {doctors_created}', 'success')
+        filename = secure_filename(file.filename)
 
+        if not is_supported(filename):
 
+             flash('Неподдерживаемый формат файла. Используйте CSV или XLSX.', 'error')
 
-        except Exception as e:
+             return redirect(url_for('admin.doctors'))
 
-            db.session.rollback()
+        # Runs in the background, progress at /admin/jobs/<id>
 
-            flash(f'Ошибка импорта: {str(e)}', 'error')
+        job_id = job_queue.enqueue('doctors_import', _import_doctors_job, save_upload(file), filename, user_id=current_user.id)
 
-            
+        return _job_response(job_id, 'admin.doctors', error_prefix='Ошибка импорта')
 
     return redirect(url_for('admin.doctors'))
 
@@ -2530,141 +1779,116 @@ def toggle_service_visibility(id):
     return redirect(url_for('admin.services'))
 
 
-@admin.route('/services/import', methods=['POST'])
-
-def import_services():
-
-    if 'file' not in request.files:
-
-        flash('Нет файла', 'error')
-
-        return redirect(url_for('admin.services'))
-
-    
-
-    file = request.files['file']
-
-    if file.filename == '':
-
-        flash('Файл не выбран', 'error')
-
-        return redirect(url_for('admin.services'))
-
-
-
-    if file:
-
-        filename = secure_filename(file.filename)
-
-        services_created = 0
+def _catalog_price(row, filename):
 
-        
+    """
 
-        try:
+    Price of a service catalog row, None when the row is skipped.
 
-            # Determine file type
+    CSV rows need a price; an empty XLSX price cell imports as 0.0, which
 
-            if filename.endswith('.csv'):
+    makes a child service use its parent's price.
 
-                # Handle CSV
+    """
 
-                stream = io.StringIO(file.stream.read().decode("UTF8"), newline=None)
+    price = cell_str(row[1]) if len(row) > 1 else None
 
-                csv_input = csv.reader(stream)
+    if price is None:
 
-                header = next(csv_input, None)
+        return None if filename.lower().endswith('.csv') else 0.0
 
-                
+    try:
 
-                for row in csv_input:
+        return float(price)
 
-                    if len(row) >= 2: # Name, Price required
+    except ValueError:
 
-                        name = row[0].strip()
+        return None
 
-                        if not name: continue
 
-                        try:
+def _import_services_job(job, path, filename):
 
-                            price = float(row[1].strip())
+    services_created = 0
 
-                        except ValueError:
+    try:
 
-                            continue
+        with open(path, 'rb') as fh:
 
-                            
+            # Streamed row by row (CSV or XLSX), first row is the header
 
-                        # Check exist
+            rows = iter_rows(fh, filename)
 
-                        if not Service.query.filter_by(name=name).first():
+            header = next(rows, None)
 
-                            service = Service(name=name, price=price)
+            for row in rows:
 
-                            db.session.add(service)
+                job.advance()
 
-                            services_created += 1
+                name = cell_str(row[0])
 
-                        
+                if not name: continue
 
-            elif filename.endswith('.xlsx'):
+                price = _catalog_price(row, filename)
 
-                # Handle Excel
+                if price is None: continue
 
-                wb = openpyxl.load_workbook(file)
+                # Check exist
 
-                sheet = wb.active
+                if not Service.query.filter_by(name=name).first():
 
-                
+                    service = Service(name=name, price=price)
 
-                # Iterate rows, skipping header (min_row=2)
+                    db.session.add(service)
 
-                for row in sheet.iter_rows(min_row=2, values_only=True):
+                    services_created += 1
 
-                    if not row or not row[0]: continue
+    finally:
 
-                    name = str(row[0]).strip()
+        os.remove(path)
 
-                    try:
+    db.session.commit()
 
-                        price = float(row[1]) if len(row) > 1 and row[1] is not None else 0.0
+    return {'message': f'Импортировано услуг: {services_created}', 'category': 'success', 'created': services_created}
 
-                    except (ValueError, TypeError):
 
-                        continue
 
-                    
+@admin.route('/services/import', methods=['POST'])
 
-                    if not Service.query.filter_by(name=name).first():
+def import_services():
 
-                        service = Service(name=name, price=price)
+    if 'file' not in request.files:
 
-                        db.session.add(service)
+        flash('Нет файла', 'error')
 
-                        services_created += 1
+        return redirect(url_for('admin.services'))
 
+    
 
+    file = request.files['file']
 
-            else:
+    if file.filename == '':
 
-                 flash('Неподдерживаемый формат файла. Используйте CSV или XLSX.', 'error')
+        flash('Файл не выбран', 'error')
 
-                 return redirect(url_for('admin.services'))
+        return redirect(url_for('admin.services'))
 
 
 
-            db.session.commit()
+    if file:
 
-            flash(f'Импортировано услуг: {services_created}', 'success')
+        filename = secure_filename(file.filename)
 
+        if not is_supported(filename):
 
+             flash('Неподдерживаемый формат файла. Используйте CSV или XLSX.', 'error')
 
-        except Exception as e:
+             return redirect(url_for('admin.services'))
 
-            db.session.rollback()
+        # Runs in the background, progress at /admin/jobs/<id>
 
-            flash(f'Ошибка импорта: {str(e)}', 'error')
+        job_id = job_queue.enqueue('services_import', _import_services_job, save_upload(file), filename, user_id=current_user.id)
 
-            
+        return _job_response(job_id, 'admin.services', error_prefix='Ошибка импорта')
 
     return redirect(url_for('admin.services'))
 
@@ -2844,141 +2068,89 @@ def delete_additional_service(id):
 
 
 
-@admin.route('/additional_services/import', methods=['POST'])
-
-def import_additional_services():
-
-    if 'file' not in request.files:
-
-        flash('Нет файла', 'error')
-
-        return redirect(url_for('admin.additional_services'))
-
-    
-
-    file = request.files['file']
-
-    if file.filename == '':
-
-        flash('Файл не выбран', 'error')
-
-        return redirect(url_for('admin.additional_services'))
-
-
-
-    if file:
-
-        filename = secure_filename(file.filename)
-
-        services_created = 0
-
-        
-
-        try:
-
-            # Determine file type
-
-            if filename.endswith('.csv'):
-
-                # Handle CSV
-
-                stream = io.StringIO(file.stream.read().decode("UTF8"), newline=None)
-
-                csv_input = csv.reader(stream)
-
-                header = next(csv_input, None)
-
-                
-
-                for row in csv_input:
-
-                    if len(row) >= 2: # Name, Price required
-
-                        name = row[0].strip()
-
-                        if not name: continue
-
-                        try:
+def _import_additional_services_job(job, path, filename):
 
-                            price = float(row[1].strip())
+    services_created = 0
 
-                        except ValueError:
+    try:
 
-                            continue
+        with open(path, 'rb') as fh:
 
-                            
+            # Streamed row by row (CSV or XLSX), first row is the header
 
-                        # Check exist
+            rows = iter_rows(fh, filename)
 
-                        if not AdditionalService.query.filter_by(name=name).first():
+            header = next(rows, None)
 
-                            service = AdditionalService(name=name, price=price)
+            for row in rows:
 
-                            db.session.add(service)
+                job.advance()
 
-                            services_created += 1
+                name = cell_str(row[0])
 
-                        
+                if not name: continue
 
-            elif filename.endswith('.xlsx'):
+                price = _catalog_price(row, filename)
 
-                # Handle Excel
+                if price is None: continue
 
-                wb = openpyxl.load_workbook(file)
+                # Check exist
 
-                sheet = wb.active
+                if not AdditionalService.query.filter_by(name=name).first():
 
-                
+                    service = AdditionalService(name=name, price=price)
 
-                # Iterate rows, skipping header (min_row=2)
+                    db.session.add(service)
 
-                for row in sheet.iter_rows(min_row=2, values_only=True):
+                    services_created += 1
 
-                    if not row or not row[0]: continue
+    finally:
 
-                    name = str(row[0]).strip()
+        os.remove(path)
 
-                    try:
+    db.session.commit()
 
-                        price = float(row[1]) if len(row) > 1 and row[1] is not None else 0.0
+    return {'message': f'Импортировано доп. услуг: {services_created}', 'category': 'success', 'created': services_created}
 
-                    except (ValueError, TypeError):
 
-                        continue
 
-                    
+@admin.route('/additional_services/import', methods=['POST'])
 
-                    if not AdditionalService.query.filter_by(name=name).first():
+def import_additional_services():
 
-                        service = AdditionalService(name=name, price=price)
+    if 'file' not in request.files:
 
-                        db.session.add(service)
+        flash('Нет файла', 'error')
 
-                        services_created += 1
+        return redirect(url_for('admin.additional_services'))
 
+    
 
+    file = request.files['file']
 
-            else:
+    if file.filename == '':
 
-                 flash('Неподдерживаемый формат файла. Используйте CSV или XLSX.', 'error')
+        flash('Файл не выбран', 'error')
 
-                 return redirect(url_for('admin.additional_services'))
+        return redirect(url_for('admin.additional_services'))
 
 
 
-            db.session.commit()
+    if file:
 
-            flash(f'Импортировано доп. услуг: {services_created}', 'success')
+        filename = secure_filename(file.filename)
 
+        if not is_supported(filename):
 
+             flash('Неподдерживаемый формат файла. Используйте CSV или XLSX.', 'error')
 
-        except Exception as e:
+             return redirect(url_for('admin.additional_services'))
 
-            db.session.rollback()
+        # Runs in the background, progress at /admin/jobs/<id>
 
-            flash(f'Ошибка импорта: {str(e)}', 'error')
+        job_id = job_queue.enqueue('additional_services_import', _import_additional_services_job, save_upload(file), filename, user_id=current_user.id)
 
-            
+        return _job_response(job_id, 'admin.additional_services', error_prefix='Ошибка импорта')
 
     return redirect(url_for('admin.additional_services'))
 
@@ -3358,6 +2530,8 @@ def import_journal():
 
                         time="00:00", # Default
 
+                        allow_overlap=True, # Imported journal rows carry no real time
+
                         author_id=current_user.id,
 
                         clinic_id=clinic_id,
@@ -3514,189 +2688,119 @@ def delete_clinic(id):
 
 
 
-@admin.route('/clinics/import', methods=['POST'])
-
-def import_clinics():
-
-    if 'file' not in request.files:
-
-        flash('Нет файла', 'error')
-
-        return redirect(url_for('admin.clinics'))
-
-    
-
-    file = request.files['file']
-
-    if file.filename == '':
-
-        flash('Файл не выбран', 'error')
-
-        return redirect(url_for('admin.clinics'))
-
-
-
-    if file:
-
-        filename = secure_filename(file.filename)
-
-        clinics_created = 0
-
-        cities_created = 0
-
-        
-
-        try:
-
-            # Determine file type
-
-            if filename.endswith('.csv'):
-
-                # Handle CSV
-
-                stream = io.StringIO(file.stream.read().decode("UTF8"), newline=None)
-
-                csv_input = csv.reader(stream)
-
-                header = next(csv_input, None)
+def _import_clinics_job(job, path, filename):
 
-                
-
-                for row in csv_input:
-
-                    if len(row) >= 1: # Name required
-
-                        name = row[0].strip()
-
-                        if not name: continue
-
-                        city_name = row[1].strip() if len(row) > 1 else None
-
-                        phone = row[2].strip() if len(row) > 2 else None
-
-                        
-
-                        # Process City
-
-                        city = None
-
-                        if city_name:
-
-                             city = Location.query.filter(Location.name.ilike(city_name)).first()
-
-                             if not city:
-
-                                 city = Location(name=city_name)
-
-                                 db.session.add(city)
+    clinics_created = 0
 
-                                 db.session.flush() # Get ID
-
-                                 cities_created += 1
+    cities_created = 0
 
+    try:
 
+        with open(path, 'rb') as fh:
 
-                        # Check exist
+            # Streamed row by row (CSV or XLSX), first row is the header
 
-                        if not Clinic.query.filter_by(name=name).first():
+            rows = iter_rows(fh, filename)
 
-                            # If city is None, we can't create Clinic because city_id is nullable=False in Model?
+            header = next(rows, None)
 
-                            # Model says: city_id = db.Column(..., nullable=False)
+            for row in rows:
 
-                            # So we MUST have a city. 
+                job.advance()
 
-                            # If no city in file, what to do? Skip or Default?
+                name = cell_str(row[0]) if row else None
 
-                            # Skip for now if no city.
+                if not name: continue
 
-                            if city:
+                city_name = cell_str(row[1]) if len(row) > 1 else None
 
-                                clinic = Clinic(name=name, city_id=city.id, phone=phone)
+                phone = cell_str(row[2]) if len(row) > 2 else None
 
-                                db.session.add(clinic)
+                # Process City
 
-                                clinics_created += 1
+                city = None
 
-                        
+                if city_name:
 
-            elif filename.endswith('.xlsx'):
+                     city = Location.query.filter(Location.name.ilike(city_name)).first()
 
-                # Handle Excel
+                     if not city:
 
-                wb = openpyxl.load_workbook(file)
+                         city = Location(name=city_name)
 
-                sheet = wb.active
+                         db.session.add(city)
 
-                
+                         db.session.flush() # Get ID
 
-                # Iterate rows, skipping header (min_row=2)
+                         cities_created += 1
 
-                for row in sheet.iter_rows(min_row=2, values_only=True):
+                # Check exist (city_id is required for Clinic, skip rows without a city)
 
-                    if not row or not row[0]: continue
+                if not Clinic.query.filter_by(name=name).first():
 
-                    name = str(row[0]).strip()
+                    if city:
 
-                    city_name = str(row[1]).strip() if len(row) > 1 and row[1] else None
+                        clinic = Clinic(name=name, city_id=city.id, phone=phone)
 
-                    phone = str(row[2]).strip() if len(row) > 2 and row[2] else None
+                        db.session.add(clinic)
 
-                    
+                        clinics_created += 1
 
-                    # Process City
+    finally:
 
-                    city = None
+        os.remove(path)
 
-                    if city_name:
+    db.session.commit()
 
-                         city = Location.query.filter(Location.name.ilike(city_name)).first()
+    return {
 
-                         if not city:
+        'message': f'Импортировано клиник: {clinics_created} (Новых городов: {cities_created})',
 
-                             city = Location(name=city_name)
+        'category': 'success',
 
-                             db.session.add(city)
+        'created': clinics_created
 
-                             db.session.flush() # Get ID
+    }
 
-                             cities_created += 1
 
-                    
 
-                    if not Clinic.query.filter_by(name=name).first():
+@admin.route('/clinics/import', methods=['POST'])
 
-                        if city: # City required
+def import_clinics():
 
-                            clinic = Clinic(name=name, city_id=city.id, phone=phone)
+    if 'file' not in request.files:
 
-                            db.session.add(clinic)
+        flash('Нет файла', 'error')
 
-                            clinics_created += 1
+        return redirect(url_for('admin.clinics'))
 
+    
 
+    file = request.files['file']
 
-            else:
+    if file.filename == '':
 
-                 flash('Неподдерживаемый формат файла. Используйте CSV или XLSX.', 'error')
+        flash('Файл не выбран', 'error')
 
-                 return redirect(url_for('admin.clinics'))
+        return redirect(url_for('admin.clinics'))
 
 
 
-            db.session.commit()
+    if file:
 
-            flash(f'Импортировано клиник: {clinics_created} (Новых городов: {cities_created})', 'success')
+        filename = secure_filename(file.filename)
 
+        if not is_supported(filename):
 
+             flash('Неподдерживаемый формат файла. Используйте CSV или XLSX.', 'error')
 
-        except Exception as e:
+             return redirect(url_for('admin.clinics'))
 
-            db.session.rollback()
+        # Runs in the background, progress at /admin/jobs/<id>
 
-            flash(f'Ошибка импорта: {str(e)}', 'error')
+        job_id = job_queue.enqueue('clinics_import', _import_clinics_job, save_upload(file), filename, user_id=current_user.id)
 
-            
+        return _job_response(job_id, 'admin.clinics', error_prefix='Ошибка импорта')
 
     return redirect(url_for('admin.clinics'))
 
@@ -3976,85 +3080,33 @@ def import_ics():
 
 
 
-@admin.route('/import_ics/confirm', methods=['POST'])
-
-@login_required
-
-def confirm_ics_import():
-
-    center_id = request.form.get('center_id')
-
-    
-
-    # Process form list data
-
-    # format: events[0][date], events[0][skip]...
-
-    # Flask doesn't parse nested dicts automatically well for arbitrary lists this way easily without third party lib or manual loop
-
-    # We will manually iterate since we know the structure or expected index count?
-
-    # Actually, easier to iterate keys.
-
-    
+def _confirm_ics_import_job(job, center_id, author_id, events_data):
 
     imported_count = 0
 
-    
-
-    # Reconstruct data from flat keys
-
-    events_data = {}
-
-    for key, value in request.form.items():
-
-        if key.startswith('events['):
-
-            # Key format: events[0][field_name]
-
-            try:
-
-                _, index_str, field_part = key.split('[')
-
-                index = int(index_str[:-1]) # remove ]
-
-                field = field_part[:-1] # remove ]
-
-                
-
-                if index not in events_data:
-
-                    events_data[index] = {}
-
-                events_data[index][field] = value
-
-            except ValueError:
-
-                continue
+    imported_dates = set()
 
-                
+    job.set_total(len(events_data))
 
     for index, data in events_data.items():
 
+        job.advance()
+
         if 'skip' in data and data['skip'] == '1':
 
             continue
 
-            
-
         try:
 
             date_obj = datetime.strptime(data['date'], '%Y-%m-%d').date()
 
             time_str = data['time']
 
-            
-
             # Create Appointment
 
             new_appt = Appointment(
 
-                center_id=int(center_id),
+                center_id=center_id,
 
                 date=date_obj,
 
@@ -4066,24 +3118,18 @@ def confirm_ics_import():
 
                 doctor_id=int(data['doctor_id']) if data.get('doctor_id') else None,
 
-                # Simple service handling (not linking M2M fully if just quick import, or link first one)
-
-                # Ideally we link AppointmentService
-
                 quantity=1,
 
-                author_id=current_user.id
+                author_id=author_id,
 
-            )
+                allow_overlap=True # Imported calendar events are kept as they were booked
 
-            
+            )
 
             db.session.add(new_appt)
 
             db.session.flush() # to get ID
 
-            
-
             svc_id = data.get('service_id')
 
             if svc_id:
@@ -4106,39 +3152,87 @@ def confirm_ics_import():
 
                 new_appt.service = "Импорт (Неизвестно)"
 
-            
-
             imported_count += 1
 
-            
+            imported_dates.add(date_obj)
 
         except Exception as e:
 
-            # Continue or fail?
+            # Continue for robust partial import, the row is reported as a warning
 
-            # Let's log/print and continue for robust partial import
-
-            print(f"Failed to import row {index}: {e}")
+            job.warn(f"Событие {index}: {e}")
 
             continue
 
+    refresh_stats_days((center_id, day) for day in imported_dates)
 
+    db.session.commit()
 
-    try:
+    return {'message': f'Успешно импортировано записей: {imported_count}', 'category': 'success', 'created': imported_count}
 
-        db.session.commit()
 
-        flash(f'Успешно импортировано записей: {imported_count}', 'success')
 
-    except Exception as e:
+@admin.route('/import_ics/confirm', methods=['POST'])
 
-        db.session.rollback()
+@login_required
 
-        flash(f'Ошибка сохранения: {str(e)}', 'error')
+def confirm_ics_import():
 
-        
+    center_id = request.form.get('center_id')
+
+    
+
+    # Process form list data
+
+    # format: events[0][date], events[0][skip]...
+
+    # Flask doesn't parse nested dicts automatically well for arbitrary lists this way easily without third party lib or manual loop
+
+    # We will manually iterate since we know the structure or expected index count?
+
+    # Actually, easier to iterate keys.
+
+    
+
+    
+
+    # Reconstruct data from flat keys
+
+    events_data = {}
+
+    for key, value in request.form.items():
+
+        if key.startswith('events['):
+
+            # Key format: events[0][field_name]
+
+            try:
+
+                _, index_str, field_part = key.split('[')
+
+                index = int(index_str[:-1]) # remove ]
+
+                field = field_part[:-1] # remove ]
+
+                
+
+                if index not in events_data:
+
+                    events_data[index] = {}
+
+                events_data[index][field] = value
+
+            except ValueError:
+
+                continue
+
+                
+
+    # Runs in the background, progress at /admin/jobs/<id>
 
-    return redirect(url_for('admin.import_ics'))
+    job_id = job_queue.enqueue('ics_import', _confirm_ics_import_job, int(center_id), current_user.id, events_data, user_id=current_user.id)
+
+    return _job_response(job_id, 'admin.import_ics', error_prefix='Ошибка сохранения')
 
 
 @admin.route('/users/impersonate/<int:user_id>')
@@ -4743,86 +3837,36 @@ def reports_summary_page():
 @login_required
 def reports_summary_data():
     """
-    Returns JSON with doctor patient counts by month
+    API endpoint for summary report data
+    
     Query params:
     - view_type: 'clinics' or 'doctors' (default: 'doctors')
     - months: number of months to include (default: 1, current month)
-    - search: optional search term for doctor names
+    - search: optional search term for doctor / clinic names
+    - format: 'csv' to download the table instead of JSON
     """
     if current_user.role != 'superadmin':
         return jsonify({'error': 'Access denied'}), 403
     
     try:
         view_type = request.args.get('view_type', 'doctors')
+        if view_type not in SUMMARY_VIEW_TYPES:
+            return jsonify({'error': f'Unknown view_type: {view_type}'}), 400
         months = int(request.args.get('months', 1))
         search = request.args.get('search', '').strip()
         
-        # Russian month names
-        RUSSIAN_MONTHS = {
-            1: 'Январь', 2: 'Февраль', 3: 'Март', 4: 'Апрель',
-            5: 'Май', 6: 'Июнь', 7: 'Июль', 8: 'Август',
-            9: 'Сентябрь', 10: 'Октябрь', 11: 'Ноябрь', 12: 'Декабрь'
-        }
-        
-        # Generate list of month periods (current month + previous months)
-        today = date.today()
-        month_periods = []
-        for i in range(months):
-            # Calculate previous months using standard library
-            year = today.year
-            month = today.month - i
-            while month <= 0:
-                month += 12
-                year -= 1
-            
-            month_name = f"{RUSSIAN_MONTHS[month]} {year}"
-            
-            month_periods.append({
-                'year': year,
-                'month': month,
-                'label': month_name
-            })
-        
-        # Get all doctors (filtered by search if provided)
-        doctors_query = Doctor.query
-        if search:
-            doctors_query = doctors_query.filter(Doctor.name.ilike(f'%{search}%'))
-        doctors = doctors_query.order_by(Doctor.name).all()
+        # One grouped query per view, cached for a short time (app/utils/summary_report.py)
+        data = cached_summary(view_type, months, search)
         
-        # Aggregate appointment counts by doctor and month
-        results = []
-        for doctor in doctors:
-            doctor_data = {
-                'id': doctor.id,
-                'name': doctor.name,
-                'months': []
-            }
-            
-            for period in month_periods:
-                # Count appointments for this doctor in this month
-                # PostgreSQL-compatible date filtering using extract
-                # Support both doctor_id (FK) and legacy doctor (string) field
-                from sqlalchemy import func, or_, extract
-                count = Appointment.query.filter(
-                    or_(
-                        Appointment.doctor_id == doctor.id,
-                        Appointment.doctor == doctor.name
-                    ),
-                    extract('year', Appointment.date) == period['year'],
-                    extract('month', Appointment.date) == period['month']
-                ).count()
-                
-                doctor_data['months'].append({
-                    'label': period['label'],
-                    'count': count
-                })
-            
-            results.append(doctor_data)
+        if request.args.get('format') == 'csv':
+            filename = f"summary_{view_type}_{date.today().isoformat()}.csv"
+            return Response(
+                summary_csv(data, view_type),
+                mimetype='text/csv; charset=utf-8',
+                headers={'Content-Disposition': f'attachment; filename={filename}'}
+            )
         
-        return jsonify({
-            'doctors': results,
-            'months': [p['label'] for p in month_periods]
-        })
+        return jsonify(data)
     except Exception as e:
         import traceback
         error_details = {
@@ -4915,26 +3959,9 @@ def notifications():
         db.session.add(notif)
         db.session.flush()
 
-        # Determine Recipients
-        recipients = []
-        if target_type == 'all':
-            recipients = User.query.filter_by(is_blocked=False).all()
-        elif target_type == 'role':
-            if target_role:
-                recipients = User.query.filter_by(role=target_role, is_blocked=False).all()
-        elif target_type == 'user':
-            if target_user_id:
-                recipients = User.query.filter_by(id=target_user_id).all()
-
-        # Create Statuses
-        count = 0
-        for user in recipients:
-            status = NotificationStatus(
-                notification_id=notif.id,
-                user_id=user.id
-            )
-            db.session.add(status)
-            count += 1
+        # One INSERT ... SELECT for all recipients
+        conditions = recipient_filter(target_type, target_role, target_user_id)
+        count = fan_out(notif, conditions)
         
         try:
             db.session.commit()
@@ -4952,11 +3979,11 @@ def notifications():
     # History (Last 20)
     history = Notification.query.order_by(Notification.created_at.desc()).limit(20).all()
     
-    # Enrich history with stats
+    # Read stats are counters on the notification itself
     history_data = []
     for n in history:
-        total = NotificationStatus.query.filter_by(notification_id=n.id).count()
-        read = NotificationStatus.query.filter_by(notification_id=n.id, is_read=True).count()
+        total = n.recipient_count
+        read = n.read_count
         history_data.append({
             'notif': n,
             'total': total,
@@ -1,8 +1,14 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, abort
 from flask_login import login_required, current_user
 from app.extensions import db, csrf
-from app.models import Appointment, Service, AdditionalService, AppointmentService, AppointmentAdditionalService, Doctor, Clinic, Message, User, Patient
+from app.models import Appointment, Service, AdditionalService, AppointmentService, AppointmentAdditionalService, Doctor, Clinic, Message, User, Patient, Location
 from datetime import datetime, timedelta
+from app.utils.pricing import price_resolver
+from app.utils.stats_rollup import refresh_stats_days
+from app.utils.search import search_service
+from app.utils.slots import slot_engine, is_overlap_violation
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
 
 api = Blueprint('api', __name__)
 
@@ -62,56 +68,10 @@ def create_appointment():
                 return None
             return int(val)
         
-        # New: Overlap Check
-        def check_overlap(date_obj, time_str, duration_mins, center_id_chk, exclude_id=None):
-            if not center_id_chk: return None
-            
-            # Helper to minutes
-            def t_to_m(t):
-                try:
-                    parts = t.split(':')
-                    return int(parts[0]) * 60 + int(parts[1])
-                except:
-                    return 0
-
-            start_m = t_to_m(time_str)
-            end_m = start_m + duration_mins
-            
-            print(f"DEBUG: Create Check. Date={date_obj}, Center={center_id_chk}, Start={start_m}, Dur={duration_mins}")
-
-            existing_appts = Appointment.query.filter_by(
-                date=date_obj,
-                center_id=center_id_chk
-            ).all()
-            
-            for ex in existing_appts:
-                if exclude_id and str(ex.id) == str(exclude_id): continue
-                
-                ex_start = t_to_m(ex.time)
-                ex_dur = (ex.duration or 15)
-                ex_end = ex_start + ex_dur
-                
-                if (ex_end > start_m) and (ex_start < end_m):
-                    clinic_name = ex.clinic.name if ex.clinic else "Unknown Clinic"
-                    debug_msg = f"Conflict: Requested {time_str} overlaps with Accession #{ex.contract_number or ex.id} at {ex.time} ({clinic_name})"
-                    print(debug_msg)
-                    return debug_msg 
-            return False
-
         duration = 30 if data.get('is_double_time') else 15
-        
-        # Validate Overlap (unless handled elsewhere, e.g. journal)
-        if not data.get('ignore_overlap'):
-            result = check_overlap(
-                datetime.strptime(data['date'], '%Y-%m-%d').date(),
-                data.get('time', '09:00'),
-                duration,
-                safe_int(data.get('center_id'))
-            )
-            if result:
-                 # error message is in result if true (string is truthy)
-                 msg = result if isinstance(result, str) else 'Выбранный интервал пересекается с существующей записью'
-                 return jsonify({'error': msg}), 400
+        # Overlaps are rejected by the database (see OVERLAP_CONSTRAINT) unless
+        # the caller bypasses the check, e.g. journal entries
+        requested = (safe_int(data.get('center_id')), datetime.strptime(data['date'], '%Y-%m-%d').date(), data.get('time', '09:00'), duration)
 
         appointment = Appointment(
             center_id=safe_int(data.get('center_id')),
@@ -130,6 +90,7 @@ def create_appointment():
             is_child=data.get('is_child', False),
 
             duration=duration,
+            allow_overlap=bool(data.get('ignore_overlap')),
             author_id=current_user.id,
             patient_id=safe_int(data.get('patient_id'))
         )
@@ -190,15 +151,32 @@ def create_appointment():
         )
         db.session.add(history)
 
+        refresh_stats_days([(appointment.center_id, appointment.date)])
+
         db.session.commit()
 
         return jsonify(appointment.to_dict()), 201
 
+    except IntegrityError as e:
+        db.session.rollback()
+        if not is_overlap_violation(e):
+            return jsonify({'error': str(e)}), 500
+        center_id, date_obj, time_str, duration = requested
+        ex = slot_engine.find_conflict(center_id, date_obj, time_str, duration)
+        if not ex:
+            return jsonify({'error': 'Выбранный интервал пересекается с существующей записью'}), 400
+        return jsonify({'error': f"Conflict: Requested {time_str} overlaps with Accession #{ex.contract_number or ex.id} at {ex.time} ({_clinic_name(ex.clinic_id)})"}), 400
+
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
 
+def _clinic_name(clinic_id):
+    clinic = Clinic.query.get(clinic_id) if clinic_id else None
+    return clinic.name if clinic else "Unknown Clinic"
+
+
 @api.errorhandler(400)
 def handle_400_error(e):
     return jsonify({'error': 'Bad Request', 'message': str(e)}), 400
@@ -305,6 +283,7 @@ def get_appointment_detail(id):
 @login_required
 def update_appointment(id):
     appointment = Appointment.query.get_or_404(id)
+    old_stats_day = (appointment.center_id, appointment.date)
     
     data = request.get_json()
     
@@ -322,64 +301,23 @@ def update_appointment(id):
         chk_center_id = safe_int(data['center_id']) if 'center_id' in data else appointment.center_id
         chk_time = data['time'] if 'time' in data else appointment.time
         
-        # Optimization: Only check if parameters actually changed vs current stored state
-        # Note: appointment.time might be "09:00" vs data "9:00", we should normalize or just check logic.
-        # We assume checking is cheap enough, but effectively we want to avoid False Positives on "Self".
-        
-        # Logic:
-        # If I am at 09:00 (15m). I save 09:00 (15m).
-        # Overlap check loop excludes MY ID.
-        # It should return False.
-        # If it returns True, it implies it found SOMETHING ELSE.
-        
-        # But to be safe and avoid issues, we can skip if identical.
-        # But comparing times strings is risky if formats differ.
-        # Let's trust the exclusion logic BUT print debug info if collision occurs.
-
-        def check_overlap_upd(date_obj, time_str, duration_mins, center_id_chk, exclude_id):
-            if not center_id_chk: return None
-            def t_to_m(t):
-                try:
-                    # Handle HH:MM:SS by taking first 2 parts
-                    parts = t.split(':')
-                    return int(parts[0]) * 60 + int(parts[1])
-                except:
-                    return 0
-
-            start_m = t_to_m(time_str)
-            end_m = start_m + duration_mins
-            
-            print(f"DEBUG: Check Overlap. Date={date_obj}, Center={center_id_chk}, Start={start_m}, Dur={duration_mins}, ExcludeID={exclude_id}")
-
-            existing_appts = Appointment.query.filter_by(date=date_obj, center_id=center_id_chk).all()
-            for ex in existing_appts:
-                if str(ex.id) == str(exclude_id): 
-                    # print(f"DEBUG: Skipping self {ex.id}")
-                    continue
-                
-                ex_start = t_to_m(ex.time)
-                ex_dur = (ex.duration or 15)
-                ex_end = ex_start + ex_dur
-                
-                if (ex_end > start_m) and (ex_start < end_m):
-                    clinic_name = ex.clinic.name if ex.clinic else "Unknown Clinic"
-                    debug_msg = f"Conflict: Custom ID {exclude_id} ({time_str} - {duration_mins}) overlaps with Existing ID {ex.id} ({ex.time}) at {clinic_name}"
-                    print(debug_msg)
-                    return debug_msg 
-            return False
-
-        if not data.get('ignore_overlap'):
-            result = check_overlap_upd(chk_date, chk_time, new_duration, chk_center_id, appointment.id)
-            if result:
-                 # error message is in result if true (string is truthy)
-                 msg = result if isinstance(result, str) else 'Выбранный интервал пересекается с существующей записью'
-                 # return jsonify({'error': msg}), 400
-                 # EDIT: User requested Journal bypass. For calendar, it should still block. 
-                 # But if bypass flag is present (from Journal JS), we skip.
-                 return jsonify({'error': msg}), 400
-    
-                 return jsonify({'error': msg}), 400
-    
+        # The database rejects overlaps of the new interval (the row itself is
+        # excluded); journal edits bypass the check with ignore_overlap
+        appointment.date = chk_date
+        appointment.center_id = chk_center_id
+        appointment.time = chk_time
+        appointment.allow_overlap = bool(data.get('ignore_overlap'))
+        try:
+            db.session.flush()
+        except IntegrityError as e:
+            db.session.rollback()
+            if not is_overlap_violation(e):
+                raise
+            ex = slot_engine.find_conflict(chk_center_id, chk_date, chk_time, new_duration, id)
+            if not ex:
+                return jsonify({'error': 'Выбранный интервал пересекается с существующей записью'}), 400
+            return jsonify({'error': f"Conflict: Custom ID {id} ({chk_time} - {new_duration}) overlaps with Existing ID {ex.id} ({ex.time}) at {_clinic_name(ex.clinic_id)}"}), 400
+
     if 'patient_name' in data: appointment.patient_name = data['patient_name'].strip().title()
     if 'patient_phone' in data: appointment.patient_phone = data['patient_phone']
     if 'patient_id' in data:
@@ -486,6 +424,8 @@ def update_appointment(id):
     )
     db.session.add(history)
 
+    refresh_stats_days([old_stats_day, (appointment.center_id, appointment.date)])
+
     db.session.commit()
     return jsonify(appointment.to_dict())
 
@@ -499,7 +439,9 @@ def delete_appointment(id):
         return jsonify({'error': 'Unauthorized'}), 403
 
     try:
+        stats_day = (appointment.center_id, appointment.date)
         db.session.delete(appointment)
+        refresh_stats_days([stats_day])
         db.session.commit()
         return jsonify({'message': 'Deleted successfully'}), 200
     except Exception as e:
@@ -513,27 +455,53 @@ def search_patients():
     if not query_str:
         return jsonify([])
 
-    # Search by patient name (case insensitive)
-    appointments = Appointment.query.filter(
-        Appointment.patient_name.ilike(f'%{query_str}%')
-    ).order_by(Appointment.date.desc(), Appointment.time.desc()).limit(20).all()
+    # Restricted roles only see their own appointments
+    where = []
+    if current_user.role in ['org', 'doctor']:
+        where.append(Appointment.author_id == current_user.id)
+    ids = search_service.search_appointment_ids(query_str, where=where, limit=20)
+    if not ids:
+        return jsonify([])
+
+    # Lightweight projection (no ORM objects, no lazy loads)
+    rows = db.session.execute(
+        select(
+            Appointment.id, Appointment.patient_name, Appointment.patient_phone, Appointment.date,
+            Appointment.time, Appointment.service, Appointment.doctor, Appointment.center_id,
+            Appointment.payment_method_id, Doctor.name.label('doctor_name'),
+            Location.name.label('center_name'), Clinic.name.label('clinic_name')
+        )
+        .outerjoin(Doctor, Doctor.id == Appointment.doctor_id)
+        .outerjoin(Location, Location.id == Appointment.center_id)
+        .outerjoin(Clinic, Clinic.id == Appointment.clinic_id)
+        .where(Appointment.id.in_(ids))
+    ).all()
+    rank = {appt_id: i for i, appt_id in enumerate(ids)}
 
     results = []
-    for appt in appointments:
-         # Check restrictions
-        if current_user.role in ['org', 'doctor'] and appt.author_id != current_user.id:
-            continue # Don't show results for other orgs if restricted
-        
-        data = appt.to_dict()
-        data['clinic_name'] = appt.clinic.name if appt.clinic else "Unknown"
-        results.append(data)
+    for row in sorted(rows, key=lambda r: rank[r.id]):
+        doctor_name = row.doctor_name or row.doctor or 'Unknown'
+        results.append({
+            'id': row.id,
+            'patient_name': row.patient_name,
+            'patient_phone': row.patient_phone,
+            'date': row.date.strftime('%Y-%m-%d'),
+            'time': row.time,
+            'service': row.service or '',
+            'doctor': doctor_name,
+            'doctor_name': doctor_name,
+            'center_id': row.center_id,
+            'center_name': row.center_name or '',
+            'clinic_name': row.clinic_name or "Unknown",
+            'payment_method_id': row.payment_method_id,
+            'status': 'completed' if row.payment_method_id else 'pending'
+        })
 
     return jsonify(results)
 
 @api.route('/service-price/<int:service_id>', methods=['GET'])
 @login_required
 def get_service_price(service_id):
-    service = Service.query.get_or_404(service_id)
     date_str = request.args.get('date')
     if date_str:
         try:
@@ -543,13 +511,14 @@ def get_service_price(service_id):
     else:
         query_date = datetime.now().date()
         
-    price = service.get_price(query_date)
+    price = price_resolver.get_price(service_id, query_date, kind='service')
+    if price is None:
+        abort(404)
     return jsonify({'price': price})
 
 @api.route('/additional-service-price/<int:service_id>', methods=['GET'])
 @login_required
 def get_additional_service_price(service_id):
-    service = AdditionalService.query.get_or_404(service_id)
     date_str = request.args.get('date')
     if date_str:
         try:
@@ -559,7 +528,9 @@ def get_additional_service_price(service_id):
     else:
         query_date = datetime.now().date()
         
-    price = service.get_price(query_date)
+    price = price_resolver.get_price(service_id, query_date, kind='additional')
+    if price is None:
+        abort(404)
     return jsonify({'price': price})
 
 @api.route('/slots', methods=['GET'])
@@ -578,76 +549,30 @@ def get_slots():
     except ValueError:
         return jsonify([])
 
-    # Generate all possible slots 08:00 - 19:30
-    slots = []
-    # Determine working hours based on day of week
-    # Saturday (5) and Sunday (6): 09:00 - 18:00
-    if query_date.weekday() >= 5:
-        start_minutes = 9 * 60
-        end_minutes = 17 * 60 + 45
-    else:
-        # Weekdays: 08:00 - 19:30
-        start_minutes = 8 * 60
-        end_minutes = 19 * 60 + 30
-    for m in range(start_minutes, end_minutes + 1, 15):
-        hh = m // 60
-        mm = m % 60
-        time_str = f"{hh:02d}:{mm:02d}"
-        
-        # Exclude Lunch Break (13:00 - 14:00)
-        if hh == 13:
-            continue
-        
-        # Role restriction for 'org' and 'doctor'
-        if current_user.role in ['org', 'doctor']:
-            if not (time_str.endswith(':15') or time_str.endswith(':45')):
-                continue
-        
-        slots.append(time_str)
+    # Working hours, lunch break and the :15/:45 restriction for org and doctor
+    # users are applied by the slot engine on the cached day bitmap
+    available = slot_engine.free_slots(center_id, query_date, current_user.role, exclude_appt_id)
 
-    # Fetch existing appointments to block slots
-    query = Appointment.query.filter_by(
-        date=query_date,
-        center_id=center_id
-    )
-    
-    existing = query.all()
-    occupied = set()
-    
-    # Helper to calculate end minutes
-    def time_to_min(t):
-        h, m = map(int, t.split(':'))
-        return h * 60 + m
-
-    for appt in existing:
-        if exclude_appt_id and str(appt.id) == str(exclude_appt_id):
-            continue
-        occupied.add(appt.time)
-        
-        # If appointment has duration > 15 (e.g. 30), block subsequent slots
-        if (getattr(appt, 'duration', 15) or 15) > 15:
-             start_m = time_to_min(appt.time)
-             # slots are 15 min steps.
-             # If 30 min, it occupies Start and Start+15.
-             # We need to block Start+15.
-             extra_slots = (appt.duration // 15) - 1
-             for i in range(extra_slots):
-                 next_m = start_m + (15 * (i + 1))
-                 hh = next_m // 60
-                 mm = next_m % 60
-                 next_time_str = f"{hh:02d}:{mm:02d}"
-                 occupied.add(next_time_str)
-
-    # Filter available
-    # ALSO: If a user asks what slots are available, we must ensure if they pick a slot,
-    # and they intend to use 30 mins, that slot AND the next one must be free?
-    # Usually UI handles "if I pick 30m, do I fit?".
-    # But `get_slots` usually just returns start times.
-    # However, standard logic: list all start times that are not occupied.
-    available = [s for s in slots if s not in occupied]
-    
     return jsonify(available)
 
+@api.route('/slots/week', methods=['GET'])
+@login_required
+def get_week_slots():
+    """Free slots of a center for seven days from start_date: {'YYYY-MM-DD': ['HH:MM', ...]}"""
+    start_str = request.args.get('start_date')
+    center_id = request.args.get('center_id')
+
+    if not start_str or not center_id:
+        return jsonify({})
+
+    try:
+        start_date = datetime.strptime(start_str, '%Y-%m-%d').date()
+        center_id = int(center_id)
+    except ValueError:
+        return jsonify({})
+
+    return jsonify(slot_engine.week_free_slots(center_id, start_date, current_user.role))
+
 @api.route('/referral-request', methods=['POST'])
 @login_required
 def create_referral_request():
@@ -707,38 +632,21 @@ def lookup_patients():
     if not query_str:
         return jsonify([])
 
-    # Split query into parts to handle "Surname Name" search
-    parts = query_str.split()
-    
-    query = Patient.query
-    
-    if len(parts) == 1:
-        # Search in surname OR name OR patronymic OR phone
-        term = f"%{parts[0]}%"
-        query = query.filter(
-            db.or_(
-                Patient.surname.ilike(term),
-                Patient.name.ilike(term),
-                Patient.patronymic.ilike(term),
-                Patient.phone.ilike(term)
-            )
-        )
-    elif len(parts) >= 2:
-        # Search surname AND name
-        s_term = f"%{parts[0]}%"
-        n_term = f"%{parts[1]}%"
-        query = query.filter(
-            Patient.surname.ilike(s_term),
-            Patient.name.ilike(n_term)
-        )
-        
-    patients = query.order_by(Patient.surname, Patient.name).limit(20).all()
+    ids = search_service.search_patient_ids(query_str, limit=20)
+    if not ids:
+        return jsonify([])
+
+    rows = db.session.execute(
+        select(Patient.id, Patient.surname, Patient.name, Patient.patronymic, Patient.phone, Patient.birth_date)
+        .where(Patient.id.in_(ids))
+    ).all()
+    rank = {patient_id: i for i, patient_id in enumerate(ids)}
     
     results = []
-    for p in patients:
+    for p in sorted(rows, key=lambda r: rank[r.id]):
         results.append({
             'id': p.id,
-            'full_name': p.full_name,
+            'full_name': " ".join(part for part in (p.surname, p.name, p.patronymic) if part),
             'surname': p.surname,
             'name': p.name,
             'patronymic': p.patronymic,
@@ -1,10 +1,24 @@
-from flask import Blueprint, jsonify, request, current_app
+from flask import Blueprint, jsonify, request, current_app, Response, stream_with_context, abort
 from flask_login import login_required, current_user
-from app.models import Message, MessageReaction, User, Organization, db
+from app.models import Message, MessageReaction, User, db
+from app.utils.chat_events import chat_broker
+from app.utils.chat_threads import inbox_page, record_message, record_support_read, THREAD_ROLES
 from datetime import datetime
+import json
+import time
 
 chat = Blueprint('chat', __name__)
 
+# Longest single wait of a long-poll request and between SSE keepalives (seconds)
+MAX_WAIT = 25
+# Messages loaded per query while a stream catches up
+DELTA_BATCH = 100
+
+
+def _thread_user_id(message):
+    """The org/doctor user a message belongs to (recipient_id=None means sent to Support)"""
+    return message.recipient_id if message.recipient_id else message.sender_id
+
 @chat.route('/messages/send', methods=['POST'])
 @login_required
 def send_message():
@@ -26,7 +40,15 @@ def send_message():
         is_read=False
     )
     db.session.add(msg)
+    db.session.flush()
+
+    # Inbox summary in the same transaction
+    thread_user = current_user if recipient_id is None else db.session.get(User, recipient_id)
+    if thread_user is not None and thread_user.role in THREAD_ROLES:
+        record_message(msg, thread_user)
+
     db.session.commit()
+    chat_broker.publish(_thread_user_id(msg), 'message', msg.id)
     return jsonify(msg.to_dict()), 201
 
 @chat.route('/messages/history', methods=['GET'])
@@ -86,93 +108,19 @@ def get_threads():
     if current_user.role in ['org', 'doctor']:
         return jsonify({'error': 'Unauthorized'}), 403
 
-    from sqlalchemy import func, or_
-    
-    search_query = request.args.get('search', '').lower()
-    
-    # Base query for Org and Doctor users
-    query = User.query.filter(User.role.in_(['org', 'doctor']))
-    
-    if search_query:
-        query = query.join(Organization, isouter=True).filter(
-            or_(
-                func.lower(User.username).contains(search_query),
-                func.lower(Organization.name).contains(search_query)
-            )
-        )
-    
-    org_users = query.all()
-    user_ids = [u.id for u in org_users]
-    
-    if not user_ids:
-        return jsonify([])
-
-    # 1. Get unread counts for all these users (messages to Support)
-    unread_counts = db.session.query(
-        Message.sender_id, 
-        func.count(Message.id).label('count')
-    ).filter(
-        Message.sender_id.in_(user_ids),
-        Message.recipient_id == None,
-        Message.is_read == False
-    ).group_by(Message.sender_id).all()
-    
-    unread_map = {u.sender_id: u.count for u in unread_counts}
-    
-    # 2. Get last messages for all these users
-    # Subquery to find max message ID for each "thread" (User <-> Support)
-    # A thread is messages where user is sender (to support) OR recipient (from support)
-    last_msg_ids = db.session.query(
-        func.max(Message.id)
-    ).filter(
-        or_(
-            (Message.sender_id.in_(user_ids)) & (Message.recipient_id == None),
-            (Message.recipient_id.in_(user_ids))
-        )
-    ).group_by(
-        func.coalesce(Message.recipient_id, Message.sender_id)
-    ).all()
-    
-    last_msg_ids = [mid[0] for mid in last_msg_ids if mid[0]]
-    last_messages_list = Message.query.filter(Message.id.in_(last_msg_ids)).all()
-    
-    # Map messages to users
-    last_msg_map = {}
-    for m in last_messages_list:
-        uid = m.recipient_id if m.recipient_id else m.sender_id
-        # Note: if both are set (not possible in our support schema where one side is always None), 
-        # we'd need more complex logic. But here recipient_id=None means sent to Support.
-        last_msg_map[uid] = m
-    
-    threads = []
-    for user in org_users:
-        last_msg = last_msg_map.get(user.id)
-        
-        # Filter: If no search query, only show active threads (with messages)
-        if not search_query and not last_msg:
-            continue
-            
-        unread_count = unread_map.get(user.id, 0)
-        
-        if user.role == 'org' and user.organization:
-            org_name = user.organization.name
-        else:
-            org_name = "Врач" if user.role == 'doctor' else "Пользователь"
-            
-        threads.append({
-            'user_id': user.id,
-            'username': user.username,
-            'org_name': org_name,
-            'display_name': f"{user.username} - {org_name}",
-            'last_message': last_msg.body if last_msg else '',
-            'last_timestamp': last_msg.timestamp.isoformat() + 'Z' if last_msg else None,
-            'unread_count': unread_count
-        })
-    
-    # Sort: unread first, then timestamp
-    threads.sort(key=lambda x: (x['unread_count'], x['last_timestamp'] or ''), reverse=True)
-    
-    return jsonify(threads)
+    # Served from the chat_threads summary: unread first, then newest.
+    # Further pages: ?cursor= from the X-Next-Cursor header
+    limit = min(max(request.args.get('limit', 100, type=int), 1), 500)
+    threads, next_cursor = inbox_page(
+        search=request.args.get('search', ''),
+        limit=limit,
+        cursor=request.args.get('cursor')
+    )
+
+    response = jsonify(threads)
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response
 
 @chat.route('/messages/read', methods=['POST'])
 @login_required
@@ -184,17 +132,179 @@ def mark_read():
         # Org/Doctor reading Support messages
         # Update messages where recipient=current_user
         Message.query.filter_by(recipient_id=current_user.id, is_read=False).update({'is_read': True})
+        thread_user_id = current_user.id
+        kind = 'user_read'
     else:
         # Support reading Org messages
         if not user_id:
             return jsonify({'error': 'User ID required'}), 400
+        try:
+            user_id = int(user_id)
+        except (TypeError, ValueError):
+            return jsonify({'error': 'Invalid User ID'}), 400
         # Update messages from this user to Support
         Message.query.filter_by(sender_id=user_id, recipient_id=None, is_read=False).update({'is_read': True})
+        record_support_read(user_id)
+        thread_user_id = user_id
+        kind = 'read'
         
     db.session.commit()
+    chat_broker.publish(thread_user_id, kind)
     return jsonify({'status': 'ok'})
 
 
+# ========== Push Delivery (SSE / Long-Poll) ==========
+
+def _subscription():
+    """
+    (thread user id, error response) of a push request: org/doctor users
+    follow their own thread, support follows ?user_id or, without it, the
+    whole inbox (thread user id None).
+    """
+    if current_user.role in ['org', 'doctor']:
+        return current_user.id, None
+    view_user_id = request.args.get('user_id')
+    if not view_user_id:
+        return None, None
+    try:
+        return int(view_user_id), None
+    except ValueError:
+        return None, (jsonify({'error': 'Invalid User ID'}), 400)
+
+
+def _start_cursor():
+    """Message id cursor from Last-Event-ID (a reconnecting stream) or ?after, else the newest message"""
+    after = request.headers.get('Last-Event-ID', type=int)
+    if after is None:
+        after = request.args.get('after', type=int)
+    if after is None:
+        after = db.session.query(db.func.max(Message.id)).scalar() or 0
+    return after
+
+
+def _deltas(thread_user_id, after_id, limit=100):
+    """Messages after the cursor: full messages of one thread, or inbox previews of all threads"""
+    from sqlalchemy.orm import joinedload
+    query = Message.query.filter(Message.id > after_id)
+    if thread_user_id is None:
+        messages = query.options(joinedload(Message.sender)).order_by(Message.id).limit(limit).all()
+        return [{
+            'id': m.id,
+            'thread_user_id': _thread_user_id(m),
+            'sender_id': m.sender_id,
+            'body': m.body[:200],
+            'timestamp': m.timestamp.isoformat() + 'Z',
+            # Counted in the thread's unread_for_support
+            'to_support': m.recipient_id is None and m.sender.role in THREAD_ROLES
+        } for m in messages]
+
+    messages = query.options(joinedload(Message.reactions), joinedload(Message.sender)).filter(
+        ((Message.sender_id == thread_user_id) & (Message.recipient_id == None)) |
+        (Message.recipient_id == thread_user_id)
+    ).order_by(Message.id).limit(limit).all()
+    return [m.to_dict() for m in messages]
+
+
+def _needs_reload(events):
+    return any(kind in ('message', 'reset') for _, _, kind, _ in events)
+
+
+def _read_threads(events):
+    """Read receipts: the thread and who read it ('support' read the user's messages, 'user' read the replies)"""
+    readers = {'read': 'support', 'user_read': 'user'}
+    return [
+        {'user_id': uid, 'by': readers[kind]}
+        for uid, kind in sorted({(uid, kind) for _, uid, kind, _ in events if kind in readers})
+    ]
+
+
+def _reset(events):
+    return any(kind == 'reset' for _, _, kind, _ in events)
+
+
+@chat.route('/stream', methods=['GET'])
+@login_required
+def stream():
+    """
+    Server-Sent Events of a thread (or of the support inbox): 'message'
+    events with the messages after the cursor (event id = message id, so
+    reconnects resume via Last-Event-ID), 'read' events and 'reset' when
+    events may have been missed (the client reloads then). The stream ends
+    after CHAT_STREAM_TIMEOUT seconds; EventSource reconnects by itself.
+
+    Each open stream holds a worker, so it is served only with
+    CHAT_SSE_ENABLED (threaded or async workers); otherwise 404 and the
+    pages keep polling.
+    """
+    if not current_app.config.get('CHAT_SSE_ENABLED'):
+        abort(404)
+    thread_user_id, error = _subscription()
+    if error:
+        return error
+    after = _start_cursor()
+    duration = current_app.config.get('CHAT_STREAM_TIMEOUT', 55)
+
+    def events():
+        cursor = after
+        deadline = time.monotonic() + duration
+        seq = chat_broker.cursor()
+        load = True
+        yield 'retry: 3000\n\n'
+        while True:
+            while load:
+                batch = _deltas(thread_user_id, cursor, DELTA_BATCH)
+                for item in batch:
+                    cursor = item['id']
+                    yield f"id: {cursor}\nevent: message\ndata: {json.dumps(item)}\n\n"
+                load = len(batch) == DELTA_BATCH
+            # Do not hold a pooled connection while waiting
+            db.session.close()
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            seq, new_events = chat_broker.wait(seq, thread_user_id, timeout=min(MAX_WAIT, remaining))
+            load = _needs_reload(new_events)
+            if _reset(new_events):
+                yield 'event: reset\ndata: {}\n\n'
+            for receipt in _read_threads(new_events):
+                yield f"event: read\ndata: {json.dumps(receipt)}\n\n"
+            if not new_events:
+                yield ': keepalive\n\n'
+
+    return Response(stream_with_context(events()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+
+@chat.route('/poll', methods=['GET'])
+@login_required
+def poll():
+    """Long-poll fallback of /stream: returns as soon as there is something after ?after (or after ?timeout)"""
+    thread_user_id, error = _subscription()
+    if error:
+        return error
+    after = _start_cursor()
+    timeout = min(max(request.args.get('timeout', MAX_WAIT, type=float), 0), MAX_WAIT)
+
+    seq = chat_broker.cursor()
+    messages = _deltas(thread_user_id, after)
+    read = []
+    if not messages and timeout:
+        db.session.close()
+        _, new_events = chat_broker.wait(seq, thread_user_id, timeout=timeout)
+        if _needs_reload(new_events):
+            messages = _deltas(thread_user_id, after)
+        read = _read_threads(new_events)
+
+    return jsonify({
+        'messages': messages,
+        'cursor': messages[-1]['id'] if messages else after,
+        'read': read
+    })
+
+
 @chat.route('/messages/<int:message_id>/react', methods=['POST'])
 @login_required
 def toggle_reaction(message_id):
@@ -1,44 +1,56 @@
 from flask import Blueprint, render_template, redirect, url_for, request, flash, jsonify, abort, current_app, send_file
 from flask_login import login_required, current_user
 from datetime import datetime, date, timedelta
-from app.models import Location, Organization, Doctor, Service, Appointment, AdditionalService, Clinic, PaymentMethod, GlobalSetting, MedicalCertificate, NotificationStatus, SupportTicket
+from app.models import Location, Organization, Doctor, Service, Appointment, AdditionalService, Clinic, PaymentMethod, MedicalCertificate, NotificationStatus, SupportTicket, Patient, AppointmentService
 from app import db
 from app.extensions import csrf
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
-from sqlalchemy import extract
+from sqlalchemy.orm import joinedload, selectinload
 import os
-import random
-import base64
-from PIL import Image, ImageEnhance, ImageFilter
+from PIL import Image
+from app.utils.stats_rollup import load_period_stats
+from app.utils.search import search_service
+from app.utils.certificate_renderer import certificate_renderer, RendererBusy
+from app.utils.assets import asset_cache
+from app.utils.certificate_compositor import certificate_compositor, form_layout, FIELD_LAYOUT, P2_OFFSET, STAMP_WIDTH
+from app.utils.certificate_pipeline import certificate_pipeline
+from app.utils.pdf_pages import pdf_pages, InvalidSession
+from app.utils.settings import settings_registry
+from app.utils.notifications import mark_read
+from app.utils.chat_threads import record_rename
+from sqlalchemy import select
 
 def to_base64_src(filename):
-    if not filename: return None
-    try:
-        # Static folder path correction
-        abspath = os.path.join(current_app.static_folder, filename)
-        if not os.path.exists(abspath):
-            # Try without leading slash if present
-            alt_path = os.path.join(current_app.static_folder, filename.lstrip('/'))
-            if os.path.exists(alt_path):
-                abspath = alt_path
-            else:
-                print(f"DEBUG: Base64 fail - {abspath} not found")
-                return None
-        with open(abspath, 'rb') as f:
-            b64data = base64.b64encode(f.read()).decode('utf-8')
-            ext = filename.split('.')[-1].lower()
-            mime = 'image/jpeg' if ext in ('jpg', 'jpeg') else 'image/png' if ext == 'png' else 'image/gif' if ext == 'gif' else 'application/octet-stream'
-            return f"data:{mime};base64,{b64data}"
-    except Exception as e:
-        print(f"DEBUG: Base64 error for {filename}: {e}")
-        return None
+    """data: URI of a static file (cached by path and mtime), None if missing"""
+    return asset_cache.data_uri(filename)
+
+def render_certificate_html(form_type, form_data, calibration, stamp_path):
+    """HTML of a certificate for the browser renderer, laid out from the compositor's maps"""
+    layout = form_layout(form_type)
+    backgrounds = layout['backgrounds']
+    return render_template(
+        'certificate_render.html',
+        form_data=form_data,
+        calibration=calibration,
+        bg_url=to_base64_src(backgrounds[0]),
+        bg_url_p2=to_base64_src(backgrounds[1]) if len(backgrounds) > 1 else None,
+        stamp_url=to_base64_src(stamp_path),
+        is_op=(form_type == 'knd1151156_op'),
+        form_type=form_type,
+        layout=layout,
+        field_layout=FIELD_LAYOUT,
+        p2_offset=P2_OFFSET,
+        stamp_width=STAMP_WIDTH
+    )
 
 main = Blueprint('main', __name__)
 
-def calculate_stats(appointments, breakdown_by=None):
+def calculate_stats(stat_rows, breakdown_by=None):
+    # stat_rows: rollup rows from load_period_stats (period = date or month number)
     # breakdown_by: 'day' (for month view) or 'month' (for year view)
     payment_methods = PaymentMethod.query.order_by(PaymentMethod.name).all()
+    pm_names = {pm.id: pm.name for pm in payment_methods}
     
     summary_stats = {
         'total_count': 0,
@@ -62,51 +74,39 @@ def calculate_stats(appointments, breakdown_by=None):
     # Prepare breakdown aggregation
     breakdown_map = {} # Key: date/month -> stats dict
 
-    for appt in appointments:
+    for row in stat_rows:
         # --- Totals ---
-        summary_stats['total_count'] += 1
-        val = (appt.cost or 0.0)
+        count = row.appointment_count or 0
+        val = row.cost_sum or 0.0
+        summary_stats['total_count'] += count
         
-        pm_name_lower = ''
-        pm_name = ''
-        if appt.payment_method:
-             pm_name_lower = appt.payment_method.name.lower().strip()
-             pm_name = appt.payment_method.name
-             
+        pm_name = pm_names.get(row.payment_method_id, '')
+        pm_name_lower = pm_name.lower().strip()
+        if pm_name:
              if pm_name_lower in FINANCIAL_METHODS:
                  summary_stats['total_sum'] += val
         
-             if pm_name not in summary_stats['methods']:
-                 summary_stats['methods'][pm_name] = {'count': 0, 'sum': 0.0}
-             
-             summary_stats['methods'][pm_name]['count'] += 1
+             summary_stats['methods'][pm_name]['count'] += count
              
              if pm_name_lower in FINANCIAL_METHODS:
                  summary_stats['methods'][pm_name]['sum'] += val
 
-        if appt.is_child:
-            summary_stats['children_count'] += 1
+        if row.is_child:
+            summary_stats['children_count'] += count
         else:
-            summary_stats['adults_count'] += 1
+            summary_stats['adults_count'] += count
             
-        qty = appt.quantity if appt.quantity else 1
-        
-        def categorize_service(name, is_child, stats_dict):
-             if not name: return
-             if 'КТ' in name or 'KT' in name:
-                 stats_dict['kt_count'] += qty
-                 if is_child: stats_dict['kt_children'] += qty
-                 else: stats_dict['kt_adults'] += qty
-             else:
-                 stats_dict['optg_count'] += qty
-                 if is_child: stats_dict['optg_children'] += qty
-                 else: stats_dict['optg_adults'] += qty
-
-        # Do main categorization for summary
-        if appt.services:
-            for s in appt.services: categorize_service(s.name, appt.is_child, summary_stats)
-        elif appt.service:
-             categorize_service(appt.service, appt.is_child, summary_stats)
+        # KT / OPTG service units (categorized when the rollup was built)
+        kt = row.kt_count or 0
+        optg = row.optg_count or 0
+        summary_stats['kt_count'] += kt
+        summary_stats['optg_count'] += optg
+        if row.is_child:
+            summary_stats['kt_children'] += kt
+            summary_stats['optg_children'] += optg
+        else:
+            summary_stats['kt_adults'] += kt
+            summary_stats['optg_adults'] += optg
 
         # --- Breakdown Logic ---
         if breakdown_by:
@@ -116,13 +116,13 @@ def calculate_stats(appointments, breakdown_by=None):
             
             if breakdown_by == 'day':
                 # Group by Day: "DD.MM"
-                key = appt.date.strftime('%d.%m')
+                key = row.period.strftime('%d.%m')
                 label = key
-                sort_key = appt.date
+                sort_key = row.period
             elif breakdown_by == 'month':
                 # Group by Month: "MonthName"
                 month_names = ['', 'Январь', 'Февраль', 'Март', 'Апрель', 'Май', 'Июнь', 'Июль', 'Август', 'Сентябрь', 'Октябрь', 'Ноябрь', 'Декабрь']
-                m = appt.date.month
+                m = int(row.period)
                 key = m
                 label = month_names[m]
                 sort_key = m
@@ -140,23 +140,23 @@ def calculate_stats(appointments, breakdown_by=None):
                 }
             
             s = breakdown_map[key]
-            s['total_count'] += 1
+            s['total_count'] += count
             if pm_name_lower in FINANCIAL_METHODS:
                  s['total_sum'] += val
             
             # Payment Buckets
             if pm_name_lower == 'наличные':
-                s['cash_count'] += 1; s['cash_sum'] += val
+                s['cash_count'] += count; s['cash_sum'] += val
             elif pm_name_lower == 'карта':
-                s['card_count'] += 1; s['card_sum'] += val
+                s['card_count'] += count; s['card_sum'] += val
             elif 'безнал' in pm_name_lower:
-                s['cashless_count'] += 1; s['cashless_sum'] += val
+                s['cashless_count'] += count; s['cashless_sum'] += val
             elif 'б/п' in pm_name_lower or 'бесплатно' in pm_name_lower:
-                s['free_count'] += 1; s['free_sum'] += val # Sum likely 0
+                s['free_count'] += count; s['free_sum'] += val # Sum likely 0
             
             # Demographics
-            if appt.is_child: s['children'] += 1
-            else: s['adults'] += 1
+            if row.is_child: s['children'] += count
+            else: s['adults'] += count
 
     if breakdown_by:
         summary_stats['breakdown'] = sorted(breakdown_map.values(), key=lambda x: x['sort_key'])
@@ -193,6 +193,8 @@ def profile():
             org_name = request.form.get('organization_name')
             if org_name and current_user.organization:
                  current_user.organization.name = org_name
+                 # The support inbox searches the stored organization name
+                 record_rename(current_user.organization.users)
             
             db.session.commit()
             flash('Профиль обновлен', 'success')
@@ -287,23 +289,31 @@ def statistics():
     selected_year = request.args.get('year', type=int, default=current_year)
     selected_month = request.args.get('month', type=int, default=None) # None = All Year
     
-    # Query
-    query = Appointment.query
+    # Aggregates come from the daily rollup (app/utils/stats_rollup.py)
+    stat_rows = load_period_stats(current_center_id, selected_year, selected_month)
     
-    if current_center_id:
-        query = query.filter_by(center_id=current_center_id)
-        
-    # Filter by Year
-    query = query.filter(extract('year', Appointment.date) == selected_year)
+    breakdown_by = 'day' if selected_month else 'month'
+    summary_stats = calculate_stats(stat_rows, breakdown_by=breakdown_by)
     
-    # Filter by Month if selected
+    # Only cashless appointments are listed individually
     if selected_month:
-        query = query.filter(extract('month', Appointment.date) == selected_month)
-        
-    appointments = query.all()
-    
-    breakdown_by = 'day' if selected_month else 'month'
-    summary_stats = calculate_stats(appointments, breakdown_by=breakdown_by)
+        start_date = date(selected_year, selected_month, 1)
+        end_date = date(selected_year + 1, 1, 1) if selected_month == 12 else date(selected_year, selected_month + 1, 1)
+    else:
+        start_date, end_date = date(selected_year, 1, 1), date(selected_year + 1, 1, 1)
+    cashless_ids = [pm.id for pm in PaymentMethod.query.all() if 'безнал' in pm.name.lower()]
+    appointments = []
+    if cashless_ids:
+        query = Appointment.query.options(
+            joinedload(Appointment.clinic), joinedload(Appointment.payment_method)
+        ).filter(
+            Appointment.payment_method_id.in_(cashless_ids),
+            Appointment.date >= start_date,
+            Appointment.date < end_date
+        )
+        if current_center_id:
+            query = query.filter_by(center_id=current_center_id)
+        appointments = query.order_by(Appointment.id).all()
     
     # Years for selector (2024 to current + 1)
     years = range(2024, (datetime.utcnow() + timedelta(hours=3)).year + 2)
@@ -496,7 +506,7 @@ def journal():
         current_center_id = centers[0].id
 
     # Fetch appointments for the journal
-    from app.models import Appointment, Service, AdditionalService, Clinic, PaymentMethod, Doctor
+    from app.models import Appointment, Service, AdditionalService, Clinic, PaymentMethod, Doctor, AppointmentAdditionalService, AppointmentHistory
     
     date_str = request.args.get('date')
     if date_str:
@@ -507,7 +517,13 @@ def journal():
     else:
         current_date = (datetime.utcnow() + timedelta(hours=3)).date()
     
-    query = Appointment.query.filter_by(date=current_date)
+    # Everything to_dict() and the table read, in a fixed number of queries however busy the day is
+    query = Appointment.query.options(
+        joinedload(Appointment.author), joinedload(Appointment.doctor_rel),
+        selectinload(Appointment.service_associations).joinedload(AppointmentService.service),
+        selectinload(Appointment.additional_service_associations).joinedload(AppointmentAdditionalService.additional_service),
+        selectinload(Appointment.history).joinedload(AppointmentHistory.user)
+    ).filter_by(date=current_date)
     
     if current_center_id:
         query = query.filter_by(center_id=current_center_id)
@@ -515,8 +531,8 @@ def journal():
     appointments = query.order_by(Appointment.time.asc()).all()
     
     # Filter hidden services for editor dropdowns
-    services = Service.query.filter(Service.is_hidden.isnot(True)).order_by(Service.name).all()
-    additional_services = AdditionalService.query.order_by(AdditionalService.name).all()
+    services = Service.query.options(selectinload(Service.children)).filter(Service.is_hidden.isnot(True)).order_by(Service.name).all()
+    additional_services = AdditionalService.query.options(selectinload(AdditionalService.children)).order_by(AdditionalService.name).all()
     clinics = Clinic.query.order_by(Clinic.name).all()
     payment_methods = PaymentMethod.query.order_by(PaymentMethod.name).all()
     doctors = Doctor.query.order_by(Doctor.name).all()
@@ -558,8 +574,7 @@ def journal():
 @login_required
 def stamp_tool():
     """Render the document stamp tool page"""
-    stamp_setting = GlobalSetting.query.get('stamp_image')
-    stamp_image = stamp_setting.value if stamp_setting else None
+    stamp_image = settings_registry.stamp_image
     
     current_center_id = request.args.get('center_id', type=int)
     centers = Location.query.filter_by(type='center').all()
@@ -581,9 +596,7 @@ def get_certificate_template():
 @login_required
 @csrf.exempt
 def stamp_tool_upload():
-    """Upload and convert PDF document to PNG images"""
-    from pdf2image import convert_from_path
-    import tempfile
+    """Store an uploaded PDF; its pages are rasterized on demand"""
     import uuid
     
     if 'file' not in request.files:
@@ -597,44 +610,51 @@ def stamp_tool_upload():
         return jsonify({'error': 'Invalid file format. Only PDF files are supported'}), 400
     
     try:
-        # Create temporary directory for processing
-        temp_dir = tempfile.mkdtemp()
         session_id = str(uuid.uuid4())
         
-        # Save uploaded PDF file
-        filename = secure_filename(file.filename)
-        pdf_path = os.path.join(temp_dir, filename)
-        file.save(pdf_path)
-        
-        # Create output directory for this session
-        output_dir = os.path.join(current_app.static_folder, 'uploads', 'temp_docs', session_id)
-        os.makedirs(output_dir, exist_ok=True)
-        
-        # Convert PDF to images using poppler
-        images = convert_from_path(pdf_path, dpi=200)
+        # Only the page count is read here (poppler pdfinfo)
+        total_pages = pdf_pages.open_session(file, session_id)
         
-        page_paths = []
-        for i, image in enumerate(images):
-            page_filename = f'page_{i+1}.png'
-            page_path = os.path.join(output_dir, page_filename)
-            image.save(page_path, 'PNG')
-            page_paths.append(f'static/uploads/temp_docs/{session_id}/{page_filename}')
-        
-        # Clean up temp directory
-        import shutil
-        shutil.rmtree(temp_dir, ignore_errors=True)
+        # Warm the first page while the client loads the page list
+        pdf_pages.prefetch(session_id, 1)
         
         return jsonify({
             'success': True,
             'session_id': session_id,
-            'pages': page_paths,
-            'total_pages': len(page_paths)
+            'pages': [url_for('main.stamp_tool_page', session_id=session_id, page=n) for n in range(1, total_pages + 1)],
+            'thumbnails': [url_for('main.stamp_tool_thumbnail', session_id=session_id, page=n) for n in range(1, total_pages + 1)],
+            'total_pages': total_pages
         })
             
     except Exception as e:
         return jsonify({'error': f'Conversion failed: {str(e)}'}), 500
 
 
+def _send_document_page(session_id, page, thumb):
+    try:
+        path = pdf_pages.page_path(session_id, page, thumb=thumb)
+    except (InvalidSession, ValueError):
+        abort(404)
+    
+    if not thumb:
+        pdf_pages.prefetch(session_id, page + 1)
+    return send_file(path, mimetype='image/jpeg' if thumb else 'image/png', max_age=3600)
+
+
+@main.route('/stamp-tool/documents/<session_id>/pages/<int:page>')
+@login_required
+def stamp_tool_page(session_id, page):
+    """Full page of an uploaded document (200 DPI PNG), rendered on first request"""
+    return _send_document_page(session_id, page, thumb=False)
+
+
+@main.route('/stamp-tool/documents/<session_id>/thumbnails/<int:page>')
+@login_required
+def stamp_tool_thumbnail(session_id, page):
+    """Low-resolution JPEG preview of a document page"""
+    return _send_document_page(session_id, page, thumb=True)
+
+
 @main.route('/stamp-tool/apply-stamp', methods=['POST'])
 @login_required
 @csrf.exempt
@@ -655,17 +675,16 @@ def stamp_tool_apply_stamp():
     
     try:
         # Get stamp image
-        stamp_setting = GlobalSetting.query.get('stamp_image')
-        if not stamp_setting or not stamp_setting.value:
+        stamp_image = settings_registry.stamp_image
+        if not stamp_image:
             return jsonify({'error': 'No stamp image uploaded'}), 400
         
-        stamp_path = os.path.join(current_app.static_folder, stamp_setting.value)
-        
-        # Get document page
-        page_filename = f'page_{page_index + 1}.png'
-        doc_page_path = os.path.join(current_app.static_folder, 'uploads', 'temp_docs', session_id, page_filename)
+        stamp_path = os.path.join(current_app.static_folder, stamp_image)
         
-        if not os.path.exists(doc_page_path):
+        # Get document page (rasterized now if it was never viewed)
+        try:
+            doc_page_path = pdf_pages.page_path(session_id, page_index + 1)
+        except (InvalidSession, ValueError):
             return jsonify({'error': 'Document page not found'}), 404
         
         # Open images
@@ -712,22 +731,15 @@ def get_patients_for_certificate():
         if not year:
             return jsonify({'success': False, 'error': 'Year is required'})
 
-        # Base query
-        query = Appointment.query
-        
         # Filter by Year
         start_date = date(year, 1, 1)
         end_date = date(year + 1, 1, 1)
-        query = query.filter(Appointment.date >= start_date, Appointment.date < end_date)
-
-        # Filter by Search Query (Patient Name)
-        if query_str:
-            query = query.filter(Appointment.patient_name.ilike(f'%{query_str}%'))
+        where = [Appointment.date >= start_date, Appointment.date < end_date]
         
         # FILTER: Only show appointments that are creating "Journal entries"
         # i.e., have a payment method selected (Paid or Free).
         # Unregistered/Calendar-only appointments should not appear.
-        query = query.filter(Appointment.payment_method_id.isnot(None))
+        where.append(Appointment.payment_method_id.isnot(None))
 
         # Security/Scope: If not superadmin/admin, restrict to own center?
         # User said "Remove center choice at top", implying global search is desired or user has specific rights?
@@ -737,23 +749,56 @@ def get_patients_for_certificate():
              # If simple user, maybe restrict? 
              # The tool is for 'admin_stamp_tool', usually accessed by admins/lab_techs.
              if current_user.center_id:
-                  query = query.filter(Appointment.center_id == current_user.center_id)
+                  where.append(Appointment.center_id == current_user.center_id)
 
-        appointments = query.order_by(Appointment.date.desc()).limit(200).all()
+        # Search by patient name (ranked by similarity), otherwise newest first
+        if query_str:
+            ids = search_service.search_appointment_ids(query_str, where=where, limit=200)
+            where = [Appointment.id.in_(ids)]
+        else:
+            ids = None
+
+        # Lightweight projection instead of ORM objects with lazy relations
+        rows = db.session.execute(
+            select(
+                Appointment.id, Appointment.date, Appointment.patient_name, Appointment.service,
+                Appointment.cost, Appointment.amount_paid,
+                PaymentMethod.name.label('payment_method_name'),
+                Location.name.label('center_name'), Patient.birth_date
+            )
+            .outerjoin(PaymentMethod, PaymentMethod.id == Appointment.payment_method_id)
+            .outerjoin(Location, Location.id == Appointment.center_id)
+            .outerjoin(Patient, Patient.id == Appointment.patient_id)
+            .where(*where)
+            .order_by(Appointment.date.desc())
+            .limit(200)
+        ).all()
+        if ids is not None:
+            rank = {appt_id: i for i, appt_id in enumerate(ids)}
+            rows.sort(key=lambda r: rank[r.id])
+
+        # Service names from associations where the summary string is empty
+        service_names = {}
+        missing = [row.id for row in rows if not row.service]
+        if missing:
+            for appt_id, name in db.session.execute(
+                select(AppointmentService.appointment_id, Service.name)
+                .join(Service, Service.id == AppointmentService.service_id)
+                .where(AppointmentService.appointment_id.in_(missing))
+            ):
+                service_names.setdefault(appt_id, []).append(name)
         
         results = []
-        for apt in appointments:
+        for apt in rows:
             # Determine service name
-            service_name = apt.service
-            if not service_name and apt.service_associations:
-                service_name = ", ".join([a.service.name for a in apt.service_associations])
+            service_name = apt.service or ", ".join(service_names.get(apt.id, []))
             
             # Cost Calculation Logic:
             # 1. If method is "Free" (Б/П) -> 0
             # 2. If 'amount_paid' is recorded (>0) -> Use it
             # 3. Fallback to 'cost' (price list)
             
-            pm_name_lower = apt.payment_method.name.lower() if apt.payment_method else ""
+            pm_name_lower = apt.payment_method_name.lower() if apt.payment_method_name else ""
             
             final_cost = apt.cost
             if 'б/п' in pm_name_lower:
@@ -765,12 +810,12 @@ def get_patients_for_certificate():
                 'id': apt.id,
                 'date': apt.date.strftime('%d.%m.%Y'),
                 'patient_name': apt.patient_name,
-                'center_name': apt.center.name if apt.center else '-',
+                'center_name': apt.center_name or '-',
                 'service': service_name or '-',
                 'cost': final_cost,
                 # hidden data for filing
-                'inn': apt.patient_record.inn if apt.patient_record and hasattr(apt.patient_record, 'inn') else '', # Model might not have INN yet, handled in frontend manual input
-                'birth_date': apt.patient_record.birth_date.strftime('%Y-%m-%d') if apt.patient_record and apt.patient_record.birth_date else ''
+                'inn': '', # Patient has no INN yet, handled in frontend manual input
+                'birth_date': apt.birth_date.strftime('%Y-%m-%d') if apt.birth_date else ''
             })
             
         return jsonify({'success': True, 'appointments': results})
@@ -877,9 +922,8 @@ def certificate_edit(appointment_id):
     rub, kop = cost_str.split('.')
     rub_formatted = str(int(rub)).ljust(13, '-') # Left align and pad with dashes to 13 cells
 
-    # Fetch stamp image from GlobalSetting
-    stamp_setting = GlobalSetting.query.get('stamp_image')
-    stamp_path = stamp_setting.value if stamp_setting else 'uploads/stamps/orbital_stamp.png'
+    # Stamp image from the cached global settings
+    stamp_path = settings_registry.get('stamp_image', 'uploads/stamps/orbital_stamp.png')
     
     patient_data = {
         'surname': surname,
@@ -945,45 +989,21 @@ def certificate_edit(appointment_id):
 @main.route('/stamp-tool/certificate/generate', methods=['POST'])
 @login_required
 def generate_certificate():
-    """Receive form data and generate JPEG using Playwright"""
+    """Receive form data and generate JPEG (Playwright renderer pool or Pillow compositor)"""
     try:
-        from playwright.sync_api import sync_playwright
         data = request.get_json()
         appointment_id = data.get('appointment_id')
         form_data = data.get('form_data', {})
         
         appointment = Appointment.query.get_or_404(appointment_id)
         
-        # Fetch stamp image from GlobalSetting
-        stamp_setting = GlobalSetting.query.get('stamp_image')
-        stamp_path = stamp_setting.value if stamp_setting else 'uploads/stamps/orbital_stamp.png'
+        # Stamp image from the cached global settings
+        stamp_path = settings_registry.get('stamp_image', 'uploads/stamps/orbital_stamp.png')
         
-        # Prepare render data for Playwright
-        is_op = (data.get('form_type') == 'knd1151156_op')
+        form_type = data.get('form_type')
+        calibration = data.get('calibration', {'x': 0, 'y': 0})
+        is_op = (form_type == 'knd1151156_op')
         
-        bg_filename = 'uploads/stampz_page-0001.jpg' if is_op else 'uploads/certificate_bg.png'
-        bg_filename_p2 = 'uploads/stampz_page-0002.jpg' if is_op else None
-        
-        render_data = {
-            'form_data': form_data,
-            'calibration': data.get('calibration', {'x': 0, 'y': 0}),
-            'bg_url': to_base64_src(bg_filename),
-            'bg_url_p2': to_base64_src(bg_filename_p2) if bg_filename_p2 else None,
-            'stamp_url': to_base64_src(stamp_path),
-            'is_op': is_op
-        }
-        
-        # We need a tiny template strictly for Playwright to "Photograph"
-        render_data['form_type'] = data.get('form_type')
-        html_to_screenshot = render_template('certificate_render.html', **render_data)
-        
-        # Save temp HTML
-        temp_dir = os.path.join(current_app.static_folder, 'uploads', 'temp')
-        os.makedirs(temp_dir, exist_ok=True)
-        temp_html_path = os.path.join(temp_dir, f'render_{int(datetime.now().timestamp())}.html')
-        with open(temp_html_path, 'w', encoding='utf-8') as f:
-            f.write(html_to_screenshot)
-            
         # Prepare output paths
         cert_dir = os.path.join(current_app.static_folder, 'uploads', 'certificates')
         os.makedirs(cert_dir, exist_ok=True)
@@ -991,116 +1011,52 @@ def generate_certificate():
         safe_name = "".join([c for c in appointment.patient_name if c.isalnum() or c in (' ', '_')]).rstrip()
         timestamp = int(datetime.now().timestamp())
         
-        is_op = (data.get('form_type') == 'knd1151156_op')
-        
         final_filename = f'cert_{safe_name}_{timestamp}.jpg'
         final_filepath = os.path.join(cert_dir, final_filename)
         
-        captured_images = []
-
-        import time
-        with sync_playwright() as p:
-            print(f"DEBUG: Launching Playwright for form_type: {data.get('form_type')}")
-            browser = p.chromium.launch()
-            # Viewport height double if OP
-            v_height = 3170 if is_op else 1585
-            page = browser.new_page(viewport={'width': 1121, 'height': v_height})
-            
-            # Use absolute path for file://
-            file_url = 'file:///' + temp_html_path.replace('\\', '/')
-            print(f"DEBUG: Navigating to {file_url}")
-            page.goto(file_url)
-            
-            # Wait for network idle AND a small buffer for rendering
-            page.wait_for_load_state('networkidle') 
-            print("DEBUG: Network idle reached, waiting 1.5s for rendering...")
-            time.sleep(1.5) 
-            
-            if is_op:
-                # Capture 2 pages separately
-                print("DEBUG: Capturing 2-page OP form...")
-                # Page 1
-                p1_path = os.path.join(temp_dir, f'p1_{timestamp}.jpg')
-                page.screenshot(path=p1_path, type='jpeg', quality=95, clip={'x':0, 'y':0, 'width':1121, 'height':1585})
-                captured_images.append(p1_path)
-                
-                # Page 2
-                p2_path = os.path.join(temp_dir, f'p2_{timestamp}.jpg')
-                page.screenshot(path=p2_path, type='jpeg', quality=95, clip={'x':0, 'y':1585, 'width':1121, 'height':1585})
-                captured_images.append(p2_path)
-            else:
-                # Single capture
-                print("DEBUG: Capturing single-page form...")
-                p1_path = os.path.join(temp_dir, f'p1_{timestamp}.jpg')
-                page.screenshot(path=p1_path, type='jpeg', quality=95)
-                captured_images.append(p1_path)
-
-            browser.close()
-            
-        # Post-process images
-        processed_pil_images = []
-        for img_path in captured_images:
+        # Pages (OP forms have 2): drawn directly with Pillow, or
+        # photographed by the shared browser pool (CERT_RENDER_BACKEND)
+        if current_app.config.get('CERT_RENDER_BACKEND', 'playwright') == 'pillow':
+            captured_pages = certificate_compositor.compose(
+                current_app.static_folder, form_type, form_data, calibration, stamp_path
+            )
+        else:
+            html_to_screenshot = render_certificate_html(form_type, form_data, calibration, stamp_path)
             try:
-                with Image.open(img_path) as img:
-                    img = img.convert('RGB')
-                    # 1. Subtle random rotation
-                    angle = random.uniform(-0.3, 0.3)
-                    img = img.rotate(angle, resample=Image.BICUBIC, expand=False, fillcolor='white')
-                    
-                    # 2. Enhance contrast
-                    enhancer = ImageEnhance.Contrast(img)
-                    img = enhancer.enhance(1.1)
-                    
-                    # 3. Adjust brightness
-                    enhancer = ImageEnhance.Brightness(img)
-                    img = enhancer.enhance(0.98)
-                    
-                    # 4. Filter
-                    img = img.filter(ImageFilter.GaussianBlur(radius=0.1))
-                    
-                    # Store in memory for PDF saving or save back
-                    # We need to copy it to keep it open in memory or save to temp
-                    # For PDF list we need open images
-                    processed_pil_images.append(img.copy())
-            except Exception as e:
-                print(f"Img process error: {e}")
+                captured_pages = certificate_renderer.render(html_to_screenshot, pages=len(form_layout(form_type)['backgrounds']))
+            except RendererBusy:
+                return jsonify({'success': False, 'error': 'Сервер занят формированием справок, повторите через минуту'}), 503
+
+        # Post-process in memory; each page is JPEG-encoded exactly once
+        page_jpegs = certificate_pipeline.process(captured_pages)
 
         # Save File and Records
         download_urls = []
         pdf_filename = None
         
-        if processed_pil_images:
-            # Generate PDF from processed images
+        if page_jpegs:
+            # Generate PDF from the same JPEG bytes
             try:
-                import img2pdf
                 pdf_filename_only = f'cert_{safe_name}_{timestamp}.pdf'
                 pdf_filepath = os.path.join(cert_dir, pdf_filename_only)
                 
-                # Convert PIL images to bytes for img2pdf
-                img_bytes_list = []
-                for pil_img in processed_pil_images:
-                    from io import BytesIO
-                    img_byte_arr = BytesIO()
-                    pil_img.save(img_byte_arr, format='JPEG', quality=90)
-                    img_bytes_list.append(img_byte_arr.getvalue())
-                
-                # Create PDF
                 with open(pdf_filepath, 'wb') as f:
-                    f.write(img2pdf.convert(img_bytes_list))
+                    f.write(certificate_pipeline.to_pdf(page_jpegs))
                 
                 pdf_filename = pdf_filename_only
-                print(f"DEBUG: Saved PDF to {pdf_filepath}")
-            except Exception as pdf_e:
-                print(f"WARNING: PDF generation failed: {pdf_e}")
+                current_app.logger.debug("Saved PDF to %s", pdf_filepath)
+            except Exception:
+                current_app.logger.warning("PDF generation failed", exc_info=True)
                 # Continue even if PDF fails
             
-            if is_op and len(processed_pil_images) >= 2:
+            if is_op and len(page_jpegs) >= 2:
                 # Save both pages to disk
                 p1_filename = f'cert_{safe_name}_{timestamp}_p1.jpg'
                 p2_filename = f'cert_{safe_name}_{timestamp}_p2.jpg'
                 
-                processed_pil_images[0].save(os.path.join(cert_dir, p1_filename), "JPEG", quality=90)
-                processed_pil_images[1].save(os.path.join(cert_dir, p2_filename), "JPEG", quality=90)
+                for page_filename, page_jpeg in zip((p1_filename, p2_filename), page_jpegs):
+                    with open(os.path.join(cert_dir, page_filename), 'wb') as f:
+                        f.write(page_jpeg)
                 
                 # Create SINGLE record with joined filenames
                 new_cert = MedicalCertificate(
@@ -1118,10 +1074,11 @@ def generate_certificate():
                     url_for('static', filename=f'uploads/certificates/{p1_filename}'),
                     url_for('static', filename=f'uploads/certificates/{p2_filename}')
                 ]
-                print(f"DEBUG: Saved 2 pages into one record: {new_cert.filename}")
+                current_app.logger.debug("Saved 2 pages into one record: %s", new_cert.filename)
             else:
                 # Save single page
-                processed_pil_images[0].save(final_filepath, "JPEG", quality=90)
+                with open(final_filepath, 'wb') as f:
+                    f.write(page_jpegs[0])
                 new_cert = MedicalCertificate(
                     appointment_id=appointment.id,
                     patient_name=appointment.patient_name,
@@ -1133,13 +1090,8 @@ def generate_certificate():
                 db.session.add(new_cert)
                 db.session.commit()
                 download_urls = [url_for('static', filename=f'uploads/certificates/{final_filename}')]
-                print(f"DEBUG: Saved single-page JPEG to {final_filepath}")
+                current_app.logger.debug("Saved single-page JPEG to %s", final_filepath)
             
-        # Cleanup temp
-        os.remove(temp_html_path)
-        for p in captured_images:
-             if os.path.exists(p): os.remove(p)
-
         return jsonify({
             'success': True, 
             'download_urls': download_urls,
@@ -1147,11 +1099,19 @@ def generate_certificate():
         })
         
     except Exception as e:
-        import traceback
-        traceback.print_exc()
+        current_app.logger.exception("Certificate generation failed")
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+@main.route('/stamp-tool/renderer-stats')
+@login_required
+def certificate_renderer_stats():
+    """Queue depth, counters and render timings of the certificate browser pool"""
+    if current_user.role != 'superadmin':
+        abort(403)
+    return jsonify(certificate_renderer.stats())
+
+
 @main.route('/stamp-tool/certificate/<int:cert_id>/download')
 @login_required
 def download_certificate(cert_id):
@@ -1238,11 +1198,11 @@ def delete_certificate(cert_id):
 def read_notification(status_id):
     status = NotificationStatus.query.get(status_id)
     if status and status.user_id == current_user.id:
-        status.is_read = True
-        status.read_at = datetime.utcnow()
+        mark_read(status.notification, current_user.id)
         db.session.commit()
         return jsonify({'success': True})
     return jsonify({'success': False}), 403
+
 @main.route('/support/create', methods=['POST'])
 @login_required
 def support_create():
@@ -1,5 +1,8 @@
 from flask_login import UserMixin
 from .extensions import db
+from .utils.search import normalize_search_text, normalize_phone
+from .utils.slots import SLOT_MINUTES, time_to_minutes
+from sqlalchemy import event, DDL
 from datetime import datetime
 
 class Organization(db.Model):
@@ -110,9 +113,22 @@ class Patient(db.Model):
     birth_date = db.Column(db.Date, nullable=True)
     comment = db.Column(db.Text, nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    # Normalised copies for search (app/utils/search.py), kept up to date on insert/update
+    search_text = db.Column(db.String(200), nullable=True)
+    search_phone = db.Column(db.String(20), nullable=True)
     
     appointments = db.relationship('Appointment', backref='patient_record', lazy=True)
 
+    __table_args__ = (
+        db.Index('ix_patients_search_text_trgm', 'search_text', postgresql_using='gin', postgresql_ops={'search_text': 'gin_trgm_ops'}),
+        db.Index('ix_patients_search_phone_trgm', 'search_phone', postgresql_using='gin', postgresql_ops={'search_phone': 'gin_trgm_ops'}),
+    )
+
+    def update_search_columns(self):
+        self.search_text = normalize_search_text(self.full_name)
+        self.search_phone = normalize_phone(self.phone)
+
     @property
     def full_name(self):
         parts = [self.surname, self.name]
@@ -145,10 +161,25 @@ class Patient(db.Model):
 
 class Appointment(db.Model):
     __tablename__ = 'appointments'
+    __table_args__ = (
+        # Calendar, slots and overlap checks, journal and statistics per center
+        db.Index('ix_appointments_center_date', 'center_id', 'date'),
+        # Reports over a period by payment method (journal entries)
+        db.Index('ix_appointments_date_payment_method', 'date', 'payment_method_id'),
+        db.Index('ix_appointments_author_date', 'author_id', 'date'),
+        db.Index('ix_appointments_doctor_date', 'doctor_id', 'date'),
+        # Patient search on the normalised name, trigram GIN on PostgreSQL
+        db.Index(
+            'ix_appointments_search_name_trgm', 'search_name',
+            postgresql_using='gin', postgresql_ops={'search_name': 'gin_trgm_ops'}
+        ),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     patient_name = db.Column(db.String(100), nullable=False)
     patient_phone = db.Column(db.String(50), nullable=True) # made nullable just in case
+    # normalize_search_text(patient_name); the default also covers bulk inserts
+    search_name = db.Column(db.String(100), nullable=True, default=lambda ctx: normalize_search_text(ctx.get_current_parameters().get('patient_name')))
     doctor = db.Column(db.String(100), nullable=True) 
     doctor_id = db.Column(db.Integer, db.ForeignKey('doctors.id'), nullable=True)
     
@@ -171,6 +202,11 @@ class Appointment(db.Model):
 
     date = db.Column(db.Date, nullable=False)
     time = db.Column(db.String(5), nullable=False)
+    # [start_minute, end_minute) of the day from time and duration; filled by defaults and before_update
+    start_minute = db.Column(db.Integer, nullable=False, default=lambda ctx: _appointment_span(ctx.get_current_parameters())[0])
+    end_minute = db.Column(db.Integer, nullable=False, default=lambda ctx: _appointment_span(ctx.get_current_parameters())[1])
+    # Journal entries and imports may overlap; everything else is checked by OVERLAP_CONSTRAINT
+    allow_overlap = db.Column(db.Boolean, nullable=False, default=False, server_default=db.false())
     author_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True) # made nullable
     clinic_id = db.Column(db.Integer, db.ForeignKey('clinics.id'), nullable=True)
     center_id = db.Column(db.Integer, db.ForeignKey('locations.id'), nullable=True)
@@ -353,31 +389,11 @@ class Service(db.Model):
     prices = db.relationship('ServicePrice', backref='service', lazy=True, cascade="all, delete-orphan")
 
     def get_price(self, date_obj=None):
-        if not date_obj:
-            date_obj = datetime.now().date()
-            
-        # Find a price override for this date
-        # Logic: start_date <= date <= end_date (if end_date exists)
-        # or start_date <= date (if end_date is None)
-        
-        # We sort by id desc to get the most recently created applicable price if overlaps exist (simple logic)
-        relevant_price = ServicePrice.query.filter(
-            ServicePrice.service_id == self.id,
-            ServicePrice.start_date <= date_obj
-        ).filter(
-            (ServicePrice.end_date >= date_obj) | (ServicePrice.end_date == None)
-        ).order_by(ServicePrice.id.desc()).first()
-        
-        if relevant_price:
-            return relevant_price.price
-            
-        if self.price > 0:
-            return self.price
-            
-        if self.parent:
-            return self.parent.get_price(date_obj)
-            
-        return self.price
+        # Resolved from the in-memory price index (periods + parent inheritance),
+        # see app/utils/pricing.py
+        from app.utils.pricing import price_resolver
+        price = price_resolver.get_price(self.id, date_obj, kind='service')
+        return self.price if price is None else price
 
     def to_dict(self):
         return {
@@ -409,26 +425,9 @@ class AdditionalService(db.Model):
     prices = db.relationship('AdditionalServicePrice', backref='additional_service', lazy=True, cascade="all, delete-orphan")
 
     def get_price(self, date_obj=None):
-        if not date_obj:
-            date_obj = datetime.now().date()
-            
-        relevant_price = AdditionalServicePrice.query.filter(
-            AdditionalServicePrice.additional_service_id == self.id,
-            AdditionalServicePrice.start_date <= date_obj
-        ).filter(
-            (AdditionalServicePrice.end_date >= date_obj) | (AdditionalServicePrice.end_date == None)
-        ).order_by(AdditionalServicePrice.id.desc()).first()
-        
-        if relevant_price:
-            return relevant_price.price
-            
-        if self.price > 0:
-            return self.price
-            
-        if self.parent:
-            return self.parent.get_price(date_obj)
-            
-        return self.price
+        from app.utils.pricing import price_resolver
+        price = price_resolver.get_price(self.id, date_obj, kind='additional')
+        return self.price if price is None else price
 
     def to_dict(self):
         return {
@@ -510,6 +509,12 @@ class Message(db.Model):
     sender = db.relationship('User', foreign_keys=[sender_id], backref=db.backref('sent_messages', lazy=True))
     recipient = db.relationship('User', foreign_keys=[recipient_id], backref=db.backref('received_messages', lazy=True))
 
+    __table_args__ = (
+        # Thread lookups: messages to Support by sender, messages from Support by recipient
+        db.Index('ix_messages_sender_recipient', 'sender_id', 'recipient_id'),
+        db.Index('ix_messages_recipient', 'recipient_id'),
+    )
+
     def get_reactions_summary(self):
         """Returns dict of {emoji: count}"""
         from collections import Counter
@@ -547,6 +552,31 @@ class MessageReaction(db.Model):
     __table_args__ = (db.UniqueConstraint('message_id', 'user_id', 'emoji', name='_message_user_emoji_uc'),)
 
 
+class ChatThread(db.Model):
+    """
+    Support inbox summary of one org/doctor user's conversation, maintained
+    by app.utils.chat_threads in the transaction that writes the message.
+    """
+    __tablename__ = 'chat_threads'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    last_message_id = db.Column(db.Integer, db.ForeignKey('messages.id'), nullable=False)
+    last_message_preview = db.Column(db.String(200), nullable=False, default='')
+    last_message_at = db.Column(db.DateTime, nullable=False)
+    # Messages to Support not read yet
+    unread_for_support = db.Column(db.Integer, nullable=False, default=0)
+    # normalize_search_text of "username org name"
+    search_text = db.Column(db.String(400), nullable=False, default='')
+
+    user = db.relationship('User')
+
+    __table_args__ = (
+        # Inbox order (unread first, newest first) and its keyset pagination
+        db.Index('ix_chat_threads_inbox', 'unread_for_support', 'last_message_at', 'user_id'),
+        db.Index('ix_chat_threads_search_text_trgm', 'search_text', postgresql_using='gin', postgresql_ops={'search_text': 'gin_trgm_ops'}),
+    )
+
+
 
 class BonusPeriod(db.Model):
     __tablename__ = 'bonus_periods'
@@ -625,6 +655,32 @@ class SystemMetrics(db.Model):
             'ram_percent': self.ram_percent
         }
 
+class RequestMetric(db.Model):
+    """Per-endpoint request statistics of one flush period (see app/utils/instrumentation.py)"""
+    __tablename__ = 'request_metrics'
+    __table_args__ = (
+        db.Index('ix_request_metrics_period_endpoint', 'period_start', 'endpoint'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    period_start = db.Column(db.DateTime, nullable=False)
+    endpoint = db.Column(db.String(120), nullable=False)
+
+    requests = db.Column(db.Integer, nullable=False, default=0)
+    errors = db.Column(db.Integer, nullable=False, default=0)
+    total_ms = db.Column(db.Float, nullable=False, default=0)
+    max_ms = db.Column(db.Float, nullable=False, default=0)
+    # JSON list of counts per LATENCY_BUCKETS_MS bucket
+    latency_buckets = db.Column(db.Text, nullable=False)
+
+    queries = db.Column(db.Integer, nullable=False, default=0)
+    sql_ms = db.Column(db.Float, nullable=False, default=0)
+    max_queries = db.Column(db.Integer, nullable=False, default=0)
+
+    # The statement run most often within one request (N+1 candidates)
+    repeated_statement = db.Column(db.Text, nullable=True)
+    repeated_count = db.Column(db.Integer, nullable=False, default=0)
+
 class MedicalCertificate(db.Model):
     __tablename__ = 'medical_certificates'
     
@@ -678,6 +734,10 @@ class Notification(db.Model):
     
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     author_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
+
+    # Read statistics, kept by app/utils/notifications.py
+    recipient_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    read_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     
     statuses = db.relationship('NotificationStatus', backref='notification', cascade='all, delete-orphan')
 
@@ -686,6 +746,10 @@ class Notification(db.Model):
 
 class NotificationStatus(db.Model):
     __tablename__ = 'notification_statuses'
+    __table_args__ = (
+        db.UniqueConstraint('notification_id', 'user_id', name='_notification_user_uc'),
+        db.Index('ix_notification_statuses_user', 'user_id', 'is_read'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     notification_id = db.Column(db.Integer, db.ForeignKey('notifications.id'), nullable=False)
@@ -791,3 +855,131 @@ class ReferralTooth(db.Model):
     referral_id = db.Column(db.Integer, db.ForeignKey("electronic_referrals.id"), nullable=False)
     tooth_number = db.Column(db.String(10), nullable=False)
 
+
+class BackgroundJob(db.Model):
+    __tablename__ = 'background_jobs'
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False) # e.g. 'journal_import', 'journal_recalculate'
+    status = db.Column(db.String(20), nullable=False, default='queued', index=True) # queued, running, done, failed
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
+
+    total = db.Column(db.Integer, nullable=True) # Unknown for streamed files
+    processed = db.Column(db.Integer, default=0)
+    warning_count = db.Column(db.Integer, default=0)
+    warnings = db.Column(db.Text, nullable=True) # JSON list, capped
+    result = db.Column(db.Text, nullable=True) # JSON report of the finished job
+    error = db.Column(db.Text, nullable=True)
+
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    user = db.relationship('User', backref=db.backref('background_jobs', lazy=True))
+
+    def to_dict(self):
+        import json
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'total': self.total,
+            'processed': self.processed or 0,
+            'warning_count': self.warning_count or 0,
+            'warnings': json.loads(self.warnings) if self.warnings else [],
+            'result': json.loads(self.result) if self.result else None,
+            'error': self.error,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
+
+
+class AppointmentDailyStat(db.Model):
+    """Per-day rollup of appointments for the statistics page (see app/utils/stats_rollup.py)."""
+    __tablename__ = 'appointment_daily_stats'
+    __table_args__ = (
+        db.Index('ix_appointment_daily_stats_center_date', 'center_id', 'date'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    center_id = db.Column(db.Integer, nullable=True)
+    date = db.Column(db.Date, nullable=False)
+    payment_method_id = db.Column(db.Integer, nullable=True) # Bucketed by payment method name when read
+    is_child = db.Column(db.Boolean, nullable=False, default=False)
+
+    appointment_count = db.Column(db.Integer, nullable=False, default=0)
+    cost_sum = db.Column(db.Float, nullable=False, default=0.0)
+    kt_count = db.Column(db.Integer, nullable=False, default=0) # Service units, weighted by quantity
+    optg_count = db.Column(db.Integer, nullable=False, default=0)
+
+
+def _appointment_span(values):
+    start = time_to_minutes(values.get('time'))
+    return start, start + (values.get('duration') or SLOT_MINUTES)
+
+
+@event.listens_for(Appointment, 'before_update')
+def _appointment_derived_columns(mapper, connection, target):
+    target.search_name = normalize_search_text(target.patient_name)
+    target.start_minute, target.end_minute = _appointment_span({'time': target.time, 'duration': target.duration})
+
+
+# Overlapping bookings of a center-day are rejected by the database itself:
+# an exclusion constraint on PostgreSQL, triggers raising the same name on SQLite.
+# The exemption is one-sided: a row with allow_overlap (journal and ICS imports,
+# ignore_overlap edits) may overlap anything, but a regular booking may overlap
+# nothing, flagged rows included. The exclusion constraint only covers pairs of
+# regular rows, so on PostgreSQL a trigger compares regular rows with flagged
+# ones under an advisory lock on the center-day.
+OVERLAP_CONSTRAINT = 'ex_appointments_no_overlap'
+
+event.listen(Appointment.__table__, 'after_create', DDL(
+    "CREATE EXTENSION IF NOT EXISTS btree_gist"
+).execute_if(dialect='postgresql'))
+event.listen(Appointment.__table__, 'after_create', DDL(
+    f"ALTER TABLE appointments ADD CONSTRAINT {OVERLAP_CONSTRAINT} EXCLUDE USING gist "
+    "(center_id WITH =, date WITH =, int4range(start_minute, end_minute) WITH &&) "
+    "WHERE (NOT allow_overlap)"
+).execute_if(dialect='postgresql'))
+event.listen(Appointment.__table__, 'after_create', DDL(
+    f"CREATE OR REPLACE FUNCTION {OVERLAP_CONSTRAINT}_flagged() RETURNS trigger AS $$ "
+    "BEGIN "
+    "IF NEW.center_id IS NULL THEN RETURN NEW; END IF; "
+    # Every writer of the center-day queues here, so a flagged row committed meanwhile is seen
+    "PERFORM pg_advisory_xact_lock(NEW.center_id, NEW.date - DATE '2000-01-01'); "
+    "IF NOT NEW.allow_overlap AND EXISTS (SELECT 1 FROM appointments a "
+    "WHERE a.id <> NEW.id AND a.center_id = NEW.center_id AND a.date = NEW.date AND a.allow_overlap "
+    "AND a.start_minute < NEW.end_minute AND a.end_minute > NEW.start_minute) THEN "
+    f"RAISE EXCEPTION 'conflicting key value violates exclusion constraint \"{OVERLAP_CONSTRAINT}\"' "
+    f"USING ERRCODE = 'exclusion_violation', CONSTRAINT = '{OVERLAP_CONSTRAINT}'; "
+    "END IF; "
+    "RETURN NEW; "
+    "END $$ LANGUAGE plpgsql"
+).execute_if(dialect='postgresql'))
+event.listen(Appointment.__table__, 'after_create', DDL(
+    f"CREATE TRIGGER {OVERLAP_CONSTRAINT}_flagged "
+    "BEFORE INSERT OR UPDATE OF center_id, date, start_minute, end_minute, allow_overlap ON appointments "
+    f"FOR EACH ROW EXECUTE FUNCTION {OVERLAP_CONSTRAINT}_flagged()"
+).execute_if(dialect='postgresql'))
+event.listen(Appointment.__table__, 'after_create', DDL(
+    f"CREATE TRIGGER {OVERLAP_CONSTRAINT}_insert BEFORE INSERT ON appointments "
+    "WHEN NOT NEW.allow_overlap BEGIN "
+    f"SELECT RAISE(ABORT, '{OVERLAP_CONSTRAINT}') WHERE EXISTS (SELECT 1 FROM appointments a "
+    "WHERE a.center_id = NEW.center_id AND a.date = NEW.date "
+    "AND a.start_minute < NEW.end_minute AND a.end_minute > NEW.start_minute); END"
+).execute_if(dialect='sqlite'))
+event.listen(Appointment.__table__, 'after_create', DDL(
+    f"CREATE TRIGGER {OVERLAP_CONSTRAINT}_update "
+    "BEFORE UPDATE OF center_id, date, start_minute, end_minute, allow_overlap ON appointments "
+    "WHEN NOT NEW.allow_overlap BEGIN "
+    f"SELECT RAISE(ABORT, '{OVERLAP_CONSTRAINT}') WHERE EXISTS (SELECT 1 FROM appointments a "
+    "WHERE a.id != NEW.id AND a.center_id = NEW.center_id AND a.date = NEW.date "
+    "AND a.start_minute < NEW.end_minute AND a.end_minute > NEW.start_minute); END"
+).execute_if(dialect='sqlite'))
+
+
+@event.listens_for(Patient, 'before_insert')
+@event.listens_for(Patient, 'before_update')
+def _patient_search_columns(mapper, connection, target):
+    target.update_search_columns()
@@ -3,6 +3,9 @@
 // Global State
 let chatPollingInterval = null;
 let currentChatUserId = null; // For Support Dashboard
+// Messages shown in #chat-messages; stream deltas are applied to them without refetching
+let shownMessages = [];
+let shownRole = 'org';
 
 document.addEventListener('DOMContentLoaded', function () {
     // Determine Role based on elements present
@@ -46,8 +49,96 @@ function startOrgPolling() {
     // Only call if we have the Org chat button (means we are Org/Doctor)
     const isOrg = document.getElementById('org-chat-btn');
     if (isOrg) {
-        loadMessages(); // Initial load
-        chatPollingInterval = setInterval(loadMessages, 5000); // Poll every 5s
+        loadMessages().then(() => {
+            // Then only the new messages and read receipts, from after the loaded history
+            if (!subscribeThread(`/api/chat/stream?after=${lastShownId()}`, () => loadMessages())) {
+                chatPollingInterval = setInterval(loadMessages, 5000); // Poll every 5s
+            }
+        });
+    }
+}
+
+// Server push: calls onEvent(type, data) for 'message', 'read' and 'reset'
+// events ('reset': events were missed, reload). Returns false when push is
+// disabled on the server (sync workers) or the browser has no EventSource;
+// the caller keeps polling then. Subscribers of one page share a single stream.
+const chatSources = {};
+
+function chatPushEnabled() {
+    return typeof chatStreamEnabled !== 'undefined' && chatStreamEnabled && !!window.EventSource;
+}
+
+function subscribeChat(url, onEvent) {
+    if (!chatPushEnabled()) return false;
+    const source = chatSources[url] || (chatSources[url] = new EventSource(url));
+    ['message', 'read', 'reset'].forEach(type => {
+        source.addEventListener(type, (e) => onEvent(type, JSON.parse(e.data)));
+    });
+    return source;
+}
+
+function unsubscribeChat(url) {
+    const source = chatSources[url];
+    if (source) {
+        source.close();
+        delete chatSources[url];
+    }
+}
+
+// Stream of the shown thread: messages are appended, receipts update the checks
+function subscribeThread(url, reload) {
+    return subscribeChat(url, (type, data) => {
+        if (type === 'message') addMessages([data]);
+        else if (type === 'read') markShownRead(data.by);
+        else reload();
+    });
+}
+
+function lastShownId() {
+    return shownMessages.length ? shownMessages[shownMessages.length - 1].id : 0;
+}
+
+function addMessages(messages) {
+    const known = new Set(shownMessages.map(m => m.id));
+    const fresh = messages.filter(m => !known.has(m.id));
+    if (!fresh.length) return;
+    shownMessages = shownMessages.concat(fresh).sort((a, b) => a.id - b.id);
+    showMessages();
+}
+
+// by 'support': Support read the user's messages; by 'user': the user read Support's replies
+function markShownRead(by) {
+    shownMessages.forEach(m => {
+        if ((m.recipient_id === null) === (by === 'support')) m.is_read = true;
+    });
+    showMessages();
+}
+
+function showMessages() {
+    if (shownRole === 'org') updateOrgUnread(shownMessages);
+    renderMessages(shownMessages, shownRole);
+}
+
+// Notification logic for Org: blink while a reply is unread and the chat is not in view
+function updateOrgUnread(messages) {
+    // If any message is Unread AND sent to me (recipient_id != null)
+    const hasUnread = messages.some(m => m.recipient_id !== null && m.is_read === false);
+
+    // Blink if unread and (hidden tab OR chat modal closed)
+    const modal = document.getElementById('chat-modal');
+    const isClosed = modal && modal.classList.contains('hidden');
+
+    if (hasUnread && (document.hidden || isClosed)) {
+        blinkTitle(true);
+        const btn = document.getElementById('org-chat-btn');
+        if (btn) btn.classList.add('blink-animation');
+        const circle = document.getElementById('chat-btn-circle');
+        if (circle) circle.classList.add('chat-btn-pulse');
+    } else {
+        const btn = document.getElementById('org-chat-btn');
+        if (btn) btn.classList.remove('blink-animation');
+        const circle = document.getElementById('chat-btn-circle');
+        if (circle) circle.classList.remove('chat-btn-pulse');
     }
 }
 
@@ -61,33 +152,13 @@ async function loadMessages(userId = null) {
         }
         const messages = await response.json();
 
-        // Determine mode based on whether userId was passed
-        const roleMode = userId ? 'support' : 'org';
-
-        // Notification logic for Org:
-        if (roleMode === 'org') {
-            // If any message is Unread AND sent to me (recipient_id != null)
-            const hasUnread = messages.some(m => m.recipient_id !== null && m.is_read === false);
-
-            // Blink if unread and (hidden tab OR chat modal closed)
-            const modal = document.getElementById('chat-modal');
-            const isClosed = modal && modal.classList.contains('hidden');
-
-            if (hasUnread && (document.hidden || isClosed)) {
-                blinkTitle(true);
-                const btn = document.getElementById('org-chat-btn');
-                if (btn) btn.classList.add('blink-animation');
-                const circle = document.getElementById('chat-btn-circle');
-                if (circle) circle.classList.add('chat-btn-pulse');
-            } else {
-                const btn = document.getElementById('org-chat-btn');
-                if (btn) btn.classList.remove('blink-animation');
-                const circle = document.getElementById('chat-btn-circle');
-                if (circle) circle.classList.remove('chat-btn-pulse');
-            }
-        }
+        // Another thread was opened meanwhile
+        if ((userId || null) != (currentChatUserId || null)) return;
 
-        renderMessages(messages, roleMode);
+        // Determine mode based on whether userId was passed
+        shownRole = userId ? 'support' : 'org';
+        shownMessages = messages;
+        showMessages();
     } catch (e) {
         console.error("Chat Error:", e);
     }
@@ -124,12 +195,12 @@ async function sendMessage() {
 
         if (response.ok) {
             input.value = '';
-            // Reload immediately using unified function
-            loadMessages(currentChatUserId);
+            // Shown right away; the stream delivers it once more and is ignored by id
+            addMessages([await response.json()]);
 
-            // If Support dashboard, reload thread list too
+            // If Support dashboard without the stream, reload thread list too
             const threadContainer = document.getElementById('chat-threads');
-            if (threadContainer && typeof loadThreads === 'function') {
+            if (!chatPushEnabled() && threadContainer && typeof loadThreads === 'function') {
                 loadThreads();
             }
         }
@@ -271,9 +342,26 @@ function scrollToBottom() {
 
 // --- Support Functions ---
 
+// Unread messages to Support per thread user, behind the header badge
+let supportUnread = {};
+
 function startSupportNotificationPolling() {
     checkSupportNotifications();
-    setInterval(checkSupportNotifications, 10000);
+    // Inbox stream: count new messages and receipts locally, reload only after a reset
+    const subscribed = subscribeChat('/api/chat/stream', (type, data) => {
+        if (type === 'message') {
+            if (data.to_support) supportUnread[data.thread_user_id] = (supportUnread[data.thread_user_id] || 0) + 1;
+        } else if (type === 'read') {
+            if (data.by === 'support') supportUnread[data.user_id] = 0;
+        } else {
+            checkSupportNotifications();
+            return;
+        }
+        showSupportUnread();
+    });
+    if (!subscribed) {
+        setInterval(checkSupportNotifications, 10000);
+    }
 }
 
 // --- Title Blinking Support ---
@@ -307,30 +395,34 @@ async function checkSupportNotifications() {
         if (!response.ok) return;
 
         const threads = await response.json();
-        let unread = 0;
-        threads.forEach(t => unread += t.unread_count);
+        supportUnread = {};
+        threads.forEach(t => supportUnread[t.user_id] = t.unread_count);
+        showSupportUnread();
+    } catch (e) {
+        console.error("Notif Error", e);
+    }
+}
 
-        const badge = document.getElementById('unread-badge');
-        const notif = document.getElementById('chat-notification');
+function showSupportUnread() {
+    const unread = Object.values(supportUnread).reduce((sum, count) => sum + count, 0);
+    const badge = document.getElementById('unread-badge');
+    const notif = document.getElementById('chat-notification');
 
-        if (unread > 0) {
-            if (badge) badge.innerText = unread;
-            if (notif) {
-                notif.style.display = 'inline-flex';
-                notif.classList.add('blink-animation');
-            }
-            if (badge) badge.style.display = 'block';
-            blinkTitle(true);
-        } else {
-            if (notif) {
-                notif.style.display = 'inline-flex';
-                notif.classList.remove('blink-animation');
-            }
-            if (badge) badge.style.display = 'none';
-            blinkTitle(false);
+    if (unread > 0) {
+        if (badge) badge.innerText = unread;
+        if (notif) {
+            notif.style.display = 'inline-flex';
+            notif.classList.add('blink-animation');
         }
-    } catch (e) {
-        console.error("Notif Error", e);
+        if (badge) badge.style.display = 'block';
+        blinkTitle(true);
+    } else {
+        if (notif) {
+            notif.style.display = 'inline-flex';
+            notif.classList.remove('blink-animation');
+        }
+        if (badge) badge.style.display = 'none';
+        blinkTitle(false);
     }
 }
 
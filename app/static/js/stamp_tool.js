@@ -80,7 +80,7 @@ function loadPage(pageIndex) {
         docCanvas.style.display = 'block';
         stampOverlay.style.display = 'none';
     };
-    img.src = '/' + pagePath;
+    img.src = pagePath;
 
     updatePageNav();
 }
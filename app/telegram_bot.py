@@ -1,7 +1,6 @@
-import requests
 import logging
 from flask import current_app
-import threading
+from app.utils.telegram_outbox import TelegramOutbox
 
 logger = logging.getLogger(__name__)
 
@@ -10,38 +9,31 @@ class TelegramBot:
         self.token = None
         self.chat_id = None
         self.base_url = None
+        self.outbox = TelegramOutbox()
     
     def init_app(self, app):
         """Initializes the bot with configuration from the app."""
         self.token = app.config.get('TELEGRAM_BOT_TOKEN')
         self.chat_id = app.config.get('TELEGRAM_CHAT_ID')
         if self.token:
-            self.base_url = f"https://api.telegram.org/bot{self.token}"
+            api_url = app.config.get('TELEGRAM_API_URL', 'https://api.telegram.org')
+            self.base_url = f"{api_url}/bot{self.token}"
+        self.outbox.init_app(app, self.base_url)
+        if self.token and self.chat_id and self.outbox.has_pending():
+            self.outbox.start()
         logger.info(f"Telegram bot initialized: token={bool(self.token)}, chat_id={self.chat_id}")
     
-    def _send_async(self, url, json_payload=None, files=None, data=None):
-        """Sends a request to Telegram in a separate thread to avoid blocking."""
-        def request_task():
-            try:
-                # If files are present, we cannot use json parameter, we must use data
-                # And files dict needs to be opened files
-                if files:
-                    real_files = {}
-                    for key, path in files.items():
-                        real_files[key] = open(path, 'rb')
-                    
-                    try:
-                        requests.post(url, data=data, files=real_files, timeout=30)
-                    finally:
-                        for f in real_files.values():
-                            f.close()
-                else:
-                    requests.post(url, json=json_payload, timeout=10)
-            except Exception as e:
-                logger.error(f"Failed to send async Telegram message: {e}")
+    def _send_async(self, method, json_payload=None, files=None, data=None):
+        """Hands a Bot API call to the outbox worker to avoid blocking."""
+        return self.outbox.enqueue(method, json_payload=json_payload, data=data, files=files)
 
-        thread = threading.Thread(target=request_task)
-        thread.start()
+    def _message_payload(self, text, parse_mode='HTML', disable_web_page_preview=True):
+        return {
+            'chat_id': self.chat_id,
+            'text': text,
+            'parse_mode': parse_mode,
+            'disable_web_page_preview': disable_web_page_preview
+        }
 
 
     def send_message(self, text, parse_mode='HTML', disable_web_page_preview=True):
@@ -51,17 +43,10 @@ class TelegramBot:
             return False
         
         try:
-            url = f"{self.base_url}/sendMessage"
-            payload = {
-                'chat_id': self.chat_id,
-                'text': text,
-                'parse_mode': parse_mode,
-                'disable_web_page_preview': disable_web_page_preview
-            }
+            payload = self._message_payload(text, parse_mode, disable_web_page_preview)
             
             # Use async sending to not block the request loop
-            self._send_async(url, payload)
-            return True
+            return self._send_async('sendMessage', payload)
             
         except Exception as e:
             logger.error(f"Error preparing Telegram message: {e}")
@@ -110,7 +95,25 @@ class TelegramBot:
 📜 <b>Traceback:</b>
 <pre>{tb}</pre>
             """
-            return self.send_message(text)
+            if not self.token or not self.chat_id:
+                logger.warning("Telegram token or chat_id not configured.")
+                return False
+
+            # Repeats of the same error within the digest window become one digest message
+            window = self.outbox.digest_window
+            digest = lambda count: f"""
+🔁 <b>ОШИБКА ПОВТОРЯЕТСЯ</b>
+
+⚠️ <b>Ошибка:</b> {error_msg}
+
+Ещё {count} раз(а) за {window} с.
+            """
+            return self.outbox.enqueue_coalesced(
+                f"{type(error).__name__}:{error_msg[:200]}",
+                'sendMessage',
+                self._message_payload(text),
+                digest
+            )
         except Exception as e:
             logger.error(f"Failed to send error notification: {e}")
             return False
@@ -148,7 +151,6 @@ class TelegramBot:
             
             if ticket.screenshot_filename:
                 # Send photo
-                url = f"{self.base_url}/sendPhoto"
                 import os
                 
                 # Check absolute path
@@ -167,7 +169,7 @@ class TelegramBot:
                          'parse_mode': 'HTML'
                      }
                      files = {'photo': file_path}
-                     self._send_async(url, data=payload, files=files)
+                     self._send_async('sendPhoto', data=payload, files=files)
                      return True
             
             # Fallback to text if no photo or photo not found
@@ -1,24 +1,142 @@
+from bisect import bisect_left
 from datetime import datetime, timedelta
 import difflib
 
+# SequenceMatcher threshold for the fuzzy fallback (typos in patient names)
+FUZZY_RATIO = 0.8
+
+
+def _char_tokens(text):
+    """Multiset of characters as distinct tokens: 'aab' -> ('a', 1), ('a', 2), ('b', 1)."""
+    seen = {}
+    tokens = []
+    for ch in text:
+        count = seen[ch] = seen.get(ch, 0) + 1
+        tokens.append((ch, count))
+    return tokens
+
+
+class PaidNameIndex:
+    """
+    Matching index over the paid (journal) patient names of one date.
+
+    Answers the same question as the old pairwise loop - does any paid name
+    match by prefix, surname + initial or fuzzy ratio - without comparing
+    against every name:
+    - prefix matches come from a sorted list (bisect),
+    - surname / initial matches from dict buckets,
+    - the fuzzy fallback only runs SequenceMatcher on candidates that share
+      enough characters to reach FUZZY_RATIO (character inverted index).
+    """
+
+    def __init__(self, names):
+        names = {n for n in names if n}
+        self.names = names
+        self.sorted_names = sorted(names)
+
+        self.surnames = set()
+        self.surname_initials = set()
+        for name in names:
+            parts = name.split()
+            self.surnames.add(parts[0])
+            if len(parts) > 1:
+                self.surname_initials.add((parts[0], parts[1][0]))
+
+        # Fuzzy matching works on compressed names (spaces removed), indexed
+        # per length: the number of shared characters a match needs depends on it
+        self.compressed = sorted({name.replace(' ', '') for name in names})
+        self.token_sets = []
+        self.matchers = [None] * len(self.compressed)
+        self.postings = {}
+        self.frequency = {}
+        for i, compressed in enumerate(self.compressed):
+            tokens = _char_tokens(compressed)
+            self.token_sets.append(frozenset(tokens))
+            by_token = self.postings.setdefault(len(compressed), {})
+            for token in tokens:
+                by_token.setdefault(token, []).append(i)
+                self.frequency[token] = self.frequency.get(token, 0) + 1
+
+        self._cache = {}
+
+    def matches(self, name):
+        if name not in self._cache:
+            self._cache[name] = self._matches(name)
+        return self._cache[name]
+
+    def _matches(self, name):
+        if not self.names:
+            return False
+
+        # Direct match
+        if name in self.names:
+            return True
+
+        # 1. Start-with match (e.g. "Ivanov" matches "Ivanov Ivan")
+        pos = bisect_left(self.sorted_names, name)
+        if pos < len(self.sorted_names) and self.sorted_names[pos].startswith(name):
+            return True
+
+        # 2. Surname + Initial check (e.g. "Ivanov I." matches "Ivanov Ivan")
+        parts = name.split()
+        if len(parts) == 1:
+            if parts[0] in self.surnames:
+                return True
+        elif (parts[0], parts[1][0]) in self.surname_initials:
+            return True
+
+        # 3. Fuzzy match (Final fallback)
+        return self._fuzzy_match(name.replace(' ', ''))
+
+    def _fuzzy_match(self, compressed):
+        # ratio = 2*M / (la + lb) where M never exceeds the number of shared
+        # characters, so a name of length lb can only match if more than
+        # 0.4 * (la + lb) of our characters occur in it. Any (la - needed + 1) of
+        # our character tokens then hit every possible match: take the rarest
+        # ones and, per length, only look at their postings.
+        length = len(compressed)
+        tokens = _char_tokens(compressed)
+        token_set = frozenset(tokens)
+        tokens.sort(key=lambda t: self.frequency.get(t, 0))
+        candidates = set()
+        for other_length, by_token in self.postings.items():
+            needed = int(FUZZY_RATIO / 2 * (length + other_length)) + 1
+            if needed > min(length, other_length):
+                continue
+            for token in tokens[:length - needed + 1]:
+                candidates.update(by_token.get(token, ()))
+
+        for i in sorted(candidates):
+            other = self.compressed[i]
+            total = length + len(other)
+            # Shared characters bound M (same bound as SequenceMatcher.quick_ratio)
+            if 2.0 * len(token_set & self.token_sets[i]) / total <= FUZZY_RATIO:
+                continue
+            matcher = self.matchers[i]
+            if matcher is None:
+                # seq2 is the paid name: its lookup tables are built once and reused
+                matcher = self.matchers[i] = difflib.SequenceMatcher(None, '', other)
+            matcher.set_seq1(compressed)
+            if matcher.ratio() > FUZZY_RATIO:
+                return True
+        return False
+
+
 def get_appointments_with_status_logic(appointments, user_role, user_id):
     """
     Consolidated logic for calculating appointment statuses.
     Optimized for high-volume dashboard rendering.
     """
-    # Group paid appointments by date for Fast O(1) date lookup and O(N) daily lookup
+    # Group paid appointments by date, one matching index per date
     paid_by_date = {}
     for pa in appointments:
         if pa.payment_method_id is not None:
-            d = pa.date
-            if d not in paid_by_date:
-                paid_by_date[d] = []
-            paid_by_date[d].append(pa.patient_name.lower().strip() if pa.patient_name else '')
+            paid_by_date.setdefault(pa.date, []).append(pa.patient_name.lower().strip() if pa.patient_name else '')
+    index_by_date = {}
 
     current_dt = (datetime.utcnow() + timedelta(hours=3))
     
     results = []
-    import difflib
     
     for appt in appointments:
         # Use to_dict_lite to avoid heavy N+1 relation queries
@@ -44,49 +162,12 @@ def get_appointments_with_status_logic(appointments, user_role, user_id):
             # 2. Match in Journal (Paid Appointments on same date)
             appt_raw_name = appt.patient_name.lower().strip() if appt.patient_name else ''
             
-            if appt_raw_name:
-                paid_names = paid_by_date.get(appt.date, [])
-                
-                # Direct match (Fast)
-                if appt_raw_name in paid_names:
+            if appt_raw_name and appt.date in paid_by_date:
+                index = index_by_date.get(appt.date)
+                if index is None:
+                    index = index_by_date[appt.date] = PaidNameIndex(paid_by_date[appt.date])
+                if index.matches(appt_raw_name):
                     status = 'completed'
-                else:
-                    # Smart matching logic
-                    appt_parts = appt_raw_name.split()
-                    
-                    for p_full_name in paid_names:
-                        if not p_full_name: continue
-                        
-                        # 1. Start-with match (e.g. "Ivanov" matches "Ivanov Ivan")
-                        if p_full_name.startswith(appt_raw_name):
-                            status = 'completed'
-                            break
-                            
-                        # 2. Surname + Initial check (e.g. "Ivanov I." matches "Ivanov Ivan")
-                        p_parts = p_full_name.split()
-                        if len(appt_parts) >= 1 and len(p_parts) >= 1:
-                            surname_match = (appt_parts[0] == p_parts[0])
-                            
-                            if surname_match:
-                                # If Calendar has only surname, and it matches Journal's surname - it's a match
-                                if len(appt_parts) == 1:
-                                    status = 'completed'
-                                    break
-                                
-                                # If Calendar has surname + something else (initial?)
-                                if len(appt_parts) > 1 and len(p_parts) > 1:
-                                    # Check if second part of Calendar entry is an initial of the Journal entry
-                                    if appt_parts[1].startswith(p_parts[1][0]) or p_parts[1].startswith(appt_parts[1][0]):
-                                        status = 'completed'
-                                        break
-
-                        # 3. Fuzzy match (Final fallback)
-                        # We use compressed names for fuzzy to stay consistent with previous behavior for typos
-                        appt_compressed = appt_raw_name.replace(' ', '')
-                        p_compressed = p_full_name.replace(' ', '')
-                        if difflib.SequenceMatcher(None, appt_compressed, p_compressed).ratio() > 0.8:
-                            status = 'completed'
-                            break
 
             if status != 'completed':
                 # 3. Time Check (25 minutes tolerance)
@@ -0,0 +1,116 @@
+import base64
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+from flask import current_app
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+MIME_TYPES = {'jpg': 'image/jpeg', 'jpeg': 'image/jpeg', 'png': 'image/png', 'gif': 'image/gif'}
+
+
+def _image_size(image):
+    return image.width * image.height * len(image.getbands())
+
+
+class AssetCache:
+    """
+    Certificate backgrounds and stamps, read from the static folder once:
+    base64 data URIs for the browser renderer and decoded (optionally
+    prepared, e.g. scaled) PIL images for the compositor.
+
+    Entries are keyed by path, kind and modification time, so a replaced
+    file is picked up on the next call; the least recently used entries are
+    evicted beyond CERT_ASSET_CACHE_BYTES.
+    """
+
+    def __init__(self):
+        self.max_bytes = 64 * 1024 * 1024
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.max_bytes = app.config.get('CERT_ASSET_CACHE_BYTES', 64 * 1024 * 1024)
+        self.invalidate()
+
+    def invalidate(self, path=None):
+        """Drops every cached form of `path` (absolute), or everything."""
+        with self._lock:
+            for key in [k for k in self._entries if path is None or k[0] == path]:
+                self._bytes -= self._entries.pop(key)[1]
+
+    @staticmethod
+    def resolve(filename, static_folder=None):
+        """Absolute path of a static file (leading slash tolerated), or None."""
+        if not filename:
+            return None
+        path = os.path.join(static_folder or current_app.static_folder, filename.lstrip('/'))
+        return path if os.path.isfile(path) else None
+
+    def _get(self, path, kind, build, size):
+        try:
+            key = (path, kind, os.path.getmtime(path))
+        except OSError:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry[0]
+
+        value = build()
+        value_size = size(value)
+        with self._lock:
+            # Older versions of the same file and kind go first
+            for stale in [k for k in self._entries if k[:2] == key[:2]]:
+                self._bytes -= self._entries.pop(stale)[1]
+            self._entries[key] = (value, value_size)
+            self._bytes += value_size
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+        return value
+
+    def data_uri(self, filename, static_folder=None):
+        """data: URI of a static file, None when it does not exist."""
+        path = self.resolve(filename, static_folder)
+        if not path:
+            logger.warning("Certificate asset not found: %s", filename)
+            return None
+
+        def build():
+            with open(path, 'rb') as f:
+                encoded = base64.b64encode(f.read()).decode('ascii')
+            mime = MIME_TYPES.get(path.rsplit('.', 1)[-1].lower(), 'application/octet-stream')
+            return f"data:{mime};base64,{encoded}"
+
+        return self._get(path, 'data_uri', build, len)
+
+    def image(self, filename, prepare=None, static_folder=None):
+        """
+        Decoded image of a static file, passed through prepare(image) when
+        given (cached per prepare function). Callers must not modify it.
+        """
+        path = self.resolve(filename, static_folder)
+        if not path:
+            return None
+
+        def build():
+            with Image.open(path) as source:
+                source.load()
+                return prepare(source) if prepare else source.copy()
+
+        kind = f"image:{prepare.__qualname__}" if prepare else 'image'
+        return self._get(path, kind, build, _image_size)
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self._bytes, 'max_bytes': self.max_bytes}
+
+
+# Global instance
+asset_cache = AssetCache()
@@ -0,0 +1,280 @@
+import random
+import time
+from datetime import date, datetime, timedelta
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import insert
+
+from app.extensions import db
+from app.models import (
+    AdditionalService, AdditionalServicePrice, Appointment, AppointmentAdditionalService, AppointmentService,
+    BonusPeriod, BonusValue, Clinic, Doctor, Location, Message, Organization, PaymentMethod, Service,
+    ServicePrice, User
+)
+from app.utils.chat_threads import rebuild_threads
+from app.utils.stats_rollup import rebuild_stats
+
+# Working day in 15 minute slots from 09:00
+SLOTS_PER_DAY = 48
+FIRST_SLOT_MINUTE = 9 * 60
+
+CHUNK = 5000
+
+SURNAMES = ('Иванов', 'Петров', 'Сидоров', 'Смирнов', 'Кузнецов', 'Попов', 'Васильев', 'Соколов', 'Михайлов', 'Новиков')
+NAMES = ('Иван', 'Пётр', 'Алексей', 'Сергей', 'Андрей', 'Дмитрий', 'Ольга', 'Анна', 'Мария', 'Елена')
+PATRONYMICS = ('Иванович', 'Петрович', 'Сергеевич', 'Андреевич', 'Алексеевич', 'Дмитриевич')
+SERVICE_NAMES = ('КТ', 'ОПТГ', 'ТРГ', 'КТ челюсти', 'КТ ВНЧС', 'Снимок зуба', 'КТ пазух', 'ОПТГ детская')
+PAYMENT_METHODS = ('Наличные', 'Безнал', 'Карта')
+
+
+def _person(rng):
+    return f"{rng.choice(SURNAMES)} {rng.choice(NAMES)} {rng.choice(PATRONYMICS)}"
+
+
+def _time(slot):
+    minute = FIRST_SLOT_MINUTE + slot * 15
+    return f"{minute // 60:02d}:{minute % 60:02d}"
+
+
+def _insert_returning_ids(model, rows):
+    ids = []
+    for start in range(0, len(rows), CHUNK):
+        ids.extend(db.session.scalars(
+            insert(model).returning(model.id, sort_by_parameter_order=True), rows[start:start + CHUNK]
+        ))
+    return ids
+
+
+def _bulk_insert(model, rows):
+    for start in range(0, len(rows), CHUNK):
+        db.session.execute(insert(model), rows[start:start + CHUNK])
+
+
+def seed(cities=3, centers_per_city=2, doctors=60, clinics=40, services=20, additional_services=8,
+         days=730, appointments_per_day=30, messages_per_thread=20, until=None, seed_value=1):
+    """
+    Fills an empty database with synthetic data for benchmarks: the same
+    arguments always produce the same rows. Appointments cover `days` days
+    up to `until` for every center, without overlaps; the statistics
+    rollup and chat_threads are rebuilt at the end. Returns row counts;
+    the caller commits.
+    """
+    if Appointment.query.first() is not None or Location.query.first() is not None:
+        raise click.ClickException("The database already has locations or appointments; seed an empty one.")
+    if not 0 < appointments_per_day <= SLOTS_PER_DAY:
+        raise click.ClickException(f"appointments_per_day must be between 1 and {SLOTS_PER_DAY}.")
+
+    rng = random.Random(seed_value)
+    until = until or date.today()
+    first_day = until - timedelta(days=days - 1)
+    counts = {}
+
+    # --- Reference data ---
+    city_rows = [Location(name=f"Город {n + 1}", type='city') for n in range(cities)]
+    db.session.add_all(city_rows)
+    db.session.flush()
+    center_rows = [
+        Location(name=f"Центр {city.name[6:]}-{n + 1}", type='center', parent_id=city.id)
+        for city in city_rows for n in range(centers_per_city)
+    ]
+    db.session.add_all(center_rows)
+
+    payment_methods = [PaymentMethod(name=name) for name in PAYMENT_METHODS]
+    db.session.add_all(payment_methods)
+
+    clinic_rows = [
+        Clinic(name=f"Клиника {n + 1:03d}", city_id=rng.choice(city_rows).id, is_cashless=rng.random() < 0.2)
+        for n in range(clinics)
+    ]
+    db.session.add_all(clinic_rows)
+
+    service_rows = [
+        Service(name=f"{SERVICE_NAMES[n % len(SERVICE_NAMES)]} {n + 1}", price=float(rng.randrange(1500, 6000, 100)))
+        for n in range(services)
+    ]
+    extra_rows = [
+        AdditionalService(name=f"Доп. услуга {n + 1}", price=float(rng.randrange(200, 1500, 50)))
+        for n in range(additional_services)
+    ]
+    db.session.add_all(service_rows + extra_rows)
+    db.session.flush()
+
+    managers = [
+        User(username=f"manager{n + 1}", email=f"manager{n + 1}@bench.local", role='admin', is_confirmed=True)
+        for n in range(max(1, doctors // 20))
+    ]
+    doctor_rows = []
+    for n in range(doctors):
+        doctor = Doctor(
+            name=f"{_person(rng)} {n + 1}", specialization='Стоматолог',
+            manager=rng.choice(managers).username, bonus_type=rng.choice((None, 1, 2))
+        )
+        doctor.clinics = rng.sample(clinic_rows, k=min(len(clinic_rows), rng.randint(1, 2)))
+        doctor_rows.append(doctor)
+    db.session.add_all(managers + doctor_rows)
+    db.session.flush()
+
+    # One price per service and year, the current one open-ended
+    years = range(first_day.year, until.year + 1)
+    _bulk_insert(ServicePrice, [
+        {
+            'service_id': service.id,
+            'price': round(service.price * (1 + 0.1 * (year - until.year)), -1),
+            'start_date': date(year, 1, 1),
+            'end_date': date(year, 12, 31) if year < until.year else None,
+        }
+        for service in service_rows for year in years
+    ])
+    _bulk_insert(AdditionalServicePrice, [
+        {
+            'additional_service_id': extra.id,
+            'price': round(extra.price * (1 + 0.1 * (year - until.year)), -1),
+            'start_date': date(year, 1, 1),
+            'end_date': date(year, 12, 31) if year < until.year else None,
+        }
+        for extra in extra_rows for year in years
+    ])
+    for year in years:
+        period = BonusPeriod(
+            start_date=date(year, 1, 1), end_date=date(year, 12, 31) if year < until.year else None, columns=2
+        )
+        db.session.add(period)
+        db.session.flush()
+        _bulk_insert(BonusValue, [
+            {'period_id': period.id, 'service_id': service.id, 'column_index': column, 'value': float(rng.randrange(100, 600, 50))}
+            for service in service_rows for column in (1, 2)
+        ])
+
+    # --- Users ---
+    admin = User(username='bench_admin', email='bench_admin@bench.local', role='superadmin', is_confirmed=True)
+    lab_techs = [
+        User(username=f"lab{n + 1}", email=f"lab{n + 1}@bench.local", role='lab_tech', is_confirmed=True,
+             city_id=center.parent_id, center_id=center.id)
+        for n, center in enumerate(center_rows)
+    ]
+    org_users = []
+    for n, clinic in enumerate(clinic_rows):
+        organization = Organization(name=clinic.name)
+        db.session.add(organization)
+        org_users.append(User(
+            username=f"org{n + 1}", email=f"org{n + 1}@bench.local", role='org', is_confirmed=True,
+            organization=organization, city_id=clinic.city_id, clinic_id=clinic.id
+        ))
+    doctor_users = [
+        User(username=f"doctor{n + 1}", email=f"doctor{n + 1}@bench.local", role='doctor', is_confirmed=True,
+             doctor_id=doctor.id)
+        for n, doctor in enumerate(doctor_rows[:max(1, doctors // 4)])
+    ]
+    db.session.add_all([admin] + lab_techs + org_users + doctor_users)
+    db.session.flush()
+    counts.update(cities=cities, centers=len(center_rows), clinics=clinics, doctors=doctors,
+                  services=services, users=1 + len(managers) + len(lab_techs) + len(org_users) + len(doctor_users))
+
+    # --- Appointments ---
+    authors = [admin.id] + [user.id for user in lab_techs + org_users]
+    appointments, service_links, extra_links = [], [], []
+
+    def write_appointments():
+        ids = _insert_returning_ids(Appointment, appointments)
+        _bulk_insert(AppointmentService, [dict(link, appointment_id=ids[i]) for i, link in service_links])
+        _bulk_insert(AppointmentAdditionalService, [dict(link, appointment_id=ids[i]) for i, link in extra_links])
+        counts['appointments'] = counts.get('appointments', 0) + len(ids)
+        appointments.clear()
+        service_links.clear()
+        extra_links.clear()
+        db.session.commit()
+
+    for offset in range(days):
+        day = first_day + timedelta(days=offset)
+        for center in center_rows:
+            for slot in sorted(rng.sample(range(SLOTS_PER_DAY), appointments_per_day)):
+                service = rng.choice(service_rows)
+                doctor = rng.choice(doctor_rows)
+                quantity = 1 if rng.random() < 0.9 else 2
+                cost = service.price * quantity
+                extra = rng.choice(extra_rows) if extra_rows and rng.random() < 0.2 else None
+                if extra:
+                    cost += extra.price
+                paid = day < until and rng.random() < 0.8
+                discount = float(rng.choice((0, 0, 0, 100, 200)))
+                service_links.append((len(appointments), {'service_id': service.id, 'quantity': quantity}))
+                if extra:
+                    extra_links.append((len(appointments), {'additional_service_id': extra.id, 'quantity': 1}))
+                appointments.append({
+                    'patient_name': _person(rng),
+                    'patient_phone': f"+7900{rng.randrange(10 ** 7):07d}",
+                    'doctor': doctor.name,
+                    'doctor_id': doctor.id,
+                    'service': service.name,
+                    'date': day,
+                    'time': _time(slot),
+                    'duration': 15,
+                    'author_id': rng.choice(authors),
+                    'clinic_id': rng.choice(doctor.clinics).id if doctor.clinics else None,
+                    'center_id': center.id,
+                    'cost': cost,
+                    'amount_paid': cost - discount if paid else 0.0,
+                    'discount': discount,
+                    'payment_method_id': rng.choice(payment_methods).id if paid else None,
+                    'manager_id': rng.choice(managers).id,
+                    'is_child': rng.random() < 0.1,
+                    'allow_overlap': False,
+                    'created_at': datetime.combine(day, datetime.min.time()),
+                })
+        if len(appointments) >= CHUNK:
+            write_appointments()
+    write_appointments()
+
+    # --- Support chat ---
+    messages = []
+    span = timedelta(days=days)
+    for user in org_users + doctor_users:
+        started = datetime.combine(first_day, datetime.min.time())
+        for n in range(messages_per_thread):
+            at = started + span * (n + rng.random()) / max(messages_per_thread, 1)
+            to_support = n % 2 == 0
+            messages.append({
+                'sender_id': user.id if to_support else admin.id,
+                'recipient_id': None if to_support else user.id,
+                'body': f"Сообщение {n + 1} по записи пациента",
+                'timestamp': at,
+                # The last messages of a thread are still unread
+                'is_read': n < messages_per_thread - 2,
+            })
+    messages.sort(key=lambda row: row['timestamp'])
+    _bulk_insert(Message, messages)
+    counts['messages'] = len(messages)
+
+    counts['stats_rows'] = rebuild_stats()
+    counts['threads'] = rebuild_threads()
+    return counts
+
+
+# --- CLI: flask bench seed ---
+
+bench_cli = AppGroup('bench', help='Synthetic data for benchmarks.')
+
+
+@bench_cli.command('seed')
+@click.option('--cities', type=int, default=3, show_default=True)
+@click.option('--centers-per-city', type=int, default=2, show_default=True)
+@click.option('--doctors', type=int, default=60, show_default=True)
+@click.option('--clinics', type=int, default=40, show_default=True)
+@click.option('--services', type=int, default=20, show_default=True)
+@click.option('--days', type=int, default=730, show_default=True, help='Days of appointments up to --until.')
+@click.option('--per-day', type=int, default=30, show_default=True, help='Appointments per center and day.')
+@click.option('--messages', type=int, default=20, show_default=True, help='Chat messages per org/doctor user.')
+@click.option('--until', type=click.DateTime(formats=['%Y-%m-%d']), default=None, help='Last day (default: today).')
+@click.option('--seed', 'seed_value', type=int, default=1, show_default=True)
+def seed_command(cities, centers_per_city, doctors, clinics, services, days, per_day, messages, until, seed_value):
+    """Fills an empty database with deterministic synthetic data."""
+    started = time.monotonic()
+    counts = seed(
+        cities=cities, centers_per_city=centers_per_city, doctors=doctors, clinics=clinics,
+        services=services, days=days, appointments_per_day=per_day, messages_per_thread=messages,
+        until=until.date() if until else None, seed_value=seed_value
+    )
+    db.session.commit()
+    click.echo(', '.join(f"{key}: {value}" for key, value in counts.items()))
+    click.echo(f"Seeded in {time.monotonic() - started:.1f} s")
@@ -0,0 +1,204 @@
+import logging
+import threading
+from io import BytesIO
+
+from PIL import Image, ImageChops, ImageDraw, ImageFont
+
+from app.utils.assets import asset_cache
+
+logger = logging.getLogger(__name__)
+
+PAGE_WIDTH = 1121
+PAGE_HEIGHT = 1585
+
+# Text cells of the KND 1151156 form: field -> (startX, startY, spacing between characters).
+# certificate_render.html reads the same map, so both backends place text identically.
+FIELD_LAYOUT = {
+    'top_inn': (352, 28.5, 26.7),
+    'top_kpp': (352, 68.5, 26.7),
+    'page_no': (622, 68.5, 26.7),
+    'cert_no': (164.5, 248.5, 26.7),
+    'correction': (702, 248.5, 26.7),
+    'year': (992, 248.5, 26.7),
+    'org_l1': (37, 348.5, 26.7),
+    'org_l2': (37, 385.5, 26.7),
+    'org_l3': (37, 422.5, 26.7),
+    'org_l4': (37, 459.5, 26.7),
+    'surname': (139, 575.5, 26.7),
+    'name': (139, 621.0, 26.7),
+    'patronymic': (139, 666.5, 26.7),
+    'p_inn': (139, 712.0, 26.7),
+    'b_day': (700, 712.0, 26.7),
+    'b_month': (781, 712.0, 26.7),
+    'b_year': (862, 712.0, 26.7),
+    'doc_code': (219, 800.5, 26.7),
+    'doc_info': (567.7, 800.5, 26.7),
+    'i_day': (219, 846.0, 26.7),
+    'i_month': (300, 846.0, 26.7),
+    'i_year': (381, 846.0, 26.7),
+    'amount': (621.1, 955.5, 26.7),
+    'amount_kop': (994.9, 955.5, 26.7),
+    'c_day': (307, 1282.5, 26.7),
+    'c_month': (388, 1282.5, 26.7),
+    'c_year': (469, 1282.5, 26.7),
+    'rep_surname': (140, 1150.5, 26.7),
+    'rep_name': (140, 1196.0, 26.7),
+    'rep_patronymic': (140, 1241.5, 26.7),
+    # Page 2 bottom date of the OP form: Day -> Dot -> Month -> Dot -> Year on one grid
+    'c_day_bottom': (639, 3119.5, 19.7),
+    'c_month_bottom': (692.1, 3119.5, 19.7),
+    'c_year_bottom': (745.2, 3119.5, 19.7),
+}
+
+# Fields with a _p2 suffix repeat a page 1 field, lifted by 358px onto page 2
+P2_SUFFIX = '_p2'
+P2_OFFSET = PAGE_HEIGHT - 358
+
+# Per form type: page backgrounds (static paths), stamp positions (left, top) and fixed dots
+FORM_LAYOUTS = {
+    'default': {
+        'backgrounds': ['uploads/certificate_bg.png'],
+        'stamps': [(34, 1210)],
+        'dots': [],
+    },
+    'knd1151156_op': {
+        'backgrounds': ['uploads/stampz_page-0001.jpg', 'uploads/stampz_page-0002.jpg'],
+        'stamps': [(34, 1210), (428, 2985)],
+        'dots': [(674.4, 3119.5), (727.5, 3119.5)],
+    },
+}
+
+STAMP_WIDTH = 264
+CHAR_BOX = 26
+FONT_SIZE = 22
+# Arial is what the browser renders with; metric-compatible fallbacks follow
+FONT_CANDIDATES = ('arial.ttf', 'Arial.ttf', 'LiberationSans-Regular.ttf', 'DejaVuSans.ttf')
+
+_lock = threading.Lock()
+
+
+def form_layout(form_type):
+    return FORM_LAYOUTS.get(form_type, FORM_LAYOUTS['default'])
+
+
+def _to_int(value):
+    # parseInt() of the template: truncates, anything unparsable is 0
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return 0
+
+
+class CertificateCompositor:
+    """
+    Draws certificates with Pillow instead of a browser: the page
+    backgrounds, every character of the form fields centred in its
+    CHAR_BOX cell and the stamp (multiplied onto the page, like the
+    template's mix-blend-mode). Decoded backgrounds and scaled stamps come
+    from the shared asset cache; the font is loaded once.
+    """
+
+    def __init__(self):
+        self.font_path = None
+        self._font = None
+
+    def init_app(self, app):
+        self.font_path = app.config.get('CERT_FONT_PATH')
+        with _lock:
+            self._font = None
+
+    # --- Cached resources (images live in the shared asset cache) ---
+
+    @staticmethod
+    def _background(source):
+        return source.convert('RGB').resize((PAGE_WIDTH, PAGE_HEIGHT), Image.LANCZOS)
+
+    @staticmethod
+    def _stamp(source):
+        # Flattened on white: multiplying by white leaves the page unchanged
+        source = source.convert('RGBA')
+        height = round(source.height * STAMP_WIDTH / source.width)
+        source = source.resize((STAMP_WIDTH, height), Image.LANCZOS)
+        flat = Image.new('RGB', source.size, 'white')
+        flat.paste(source, mask=source.getchannel('A'))
+        return flat
+
+    def _get_font(self):
+        if self._font is None:
+            font = None
+            for candidate in ([self.font_path] if self.font_path else []) + list(FONT_CANDIDATES):
+                try:
+                    font = ImageFont.truetype(candidate, FONT_SIZE)
+                    break
+                except OSError:
+                    continue
+            if font is None:
+                logger.warning("No TrueType font for certificates found, using the Pillow default")
+                font = ImageFont.load_default(size=FONT_SIZE)
+            self._font = font
+        return self._font
+
+    # --- Rendering ---
+
+    def compose(self, static_folder, form_type, form_data, calibration=None, stamp_path=None):
+        """List of RGB page images of the certificate."""
+        layout = form_layout(form_type)
+        calibration = calibration or {}
+        global_x, global_y = _to_int(calibration.get('x', 0)), _to_int(calibration.get('y', 0))
+        offsets = calibration.get('offsets') or {}
+
+        canvas = Image.new('RGB', (PAGE_WIDTH, PAGE_HEIGHT * len(layout['backgrounds'])), 'white')
+        for index, background in enumerate(layout['backgrounds']):
+            image = asset_cache.image(background, self._background, static_folder)
+            if image is not None:
+                canvas.paste(image, (0, PAGE_HEIGHT * index))
+
+        draw = ImageDraw.Draw(canvas)
+        font = self._get_font()
+
+        def draw_char(left, top, char):
+            draw.text((left + CHAR_BOX / 2, top + CHAR_BOX / 2), char, font=font, fill='black', anchor='mm')
+
+        for field, value in form_data.items():
+            base, page_offset = field, 0
+            if field.endswith(P2_SUFFIX):
+                base, page_offset = field[:-len(P2_SUFFIX)], P2_OFFSET
+            cell = FIELD_LAYOUT.get(base)
+            if not cell:
+                continue
+            start_x, start_y, spacing = cell
+            off = offsets.get(field) or {}
+            off_x, off_y = float(off.get('x') or 0), float(off.get('y') or 0)
+            top = start_y + global_y + off_y + page_offset - 2
+            for i, char in enumerate(str(value if value is not None else '')):
+                if char.strip():
+                    draw_char(start_x + i * spacing + global_x + off_x, top, char)
+
+        for left, top in layout['dots']:
+            draw_char(left + global_x, top + global_y - 2, '.')
+
+        stamp = asset_cache.image(stamp_path, self._stamp, static_folder)
+        if stamp is not None:
+            for left, top in layout['stamps']:
+                box = (left + global_x, top + global_y, left + global_x + stamp.width, top + global_y + stamp.height)
+                canvas.paste(ImageChops.multiply(canvas.crop(box), stamp), box[:2])
+
+        # The template's blur(0.15px) is not repeated: with that sigma the
+        # neighbour weight is ~1e-10, it changes no pixel but costs ~100 ms here
+        return [
+            canvas.crop((0, PAGE_HEIGHT * index, PAGE_WIDTH, PAGE_HEIGHT * (index + 1)))
+            for index in range(len(layout['backgrounds']))
+        ]
+
+    def render(self, static_folder, form_type, form_data, calibration=None, stamp_path=None, quality=95):
+        """JPEG bytes of each page, like CertificateRenderer.render."""
+        pages = []
+        for page in self.compose(static_folder, form_type, form_data, calibration, stamp_path):
+            out = BytesIO()
+            page.save(out, format='JPEG', quality=quality)
+            pages.append(out.getvalue())
+        return pages
+
+
+# Global instance
+certificate_compositor = CertificateCompositor()
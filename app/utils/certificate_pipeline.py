@@ -0,0 +1,76 @@
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from PIL import Image, ImageEnhance, ImageFilter
+
+# Quality of the stored JPEG pages (also embedded as-is in the PDF)
+OUTPUT_QUALITY = 90
+
+
+def postprocess_page(page, quality=OUTPUT_QUALITY):
+    """
+    Makes one captured page look scanned (slight rotation, contrast,
+    brightness, softening) and returns it JPEG-encoded. `page` is either
+    encoded image bytes from the browser or a PIL image from the compositor.
+    """
+    if isinstance(page, (bytes, bytearray)):
+        with Image.open(BytesIO(page)) as source:
+            img = source.convert('RGB')
+    else:
+        img = page.convert('RGB')
+
+    # 1. Subtle random rotation
+    img = img.rotate(random.uniform(-0.3, 0.3), resample=Image.BICUBIC, expand=False, fillcolor='white')
+    # 2. Enhance contrast
+    img = ImageEnhance.Contrast(img).enhance(1.1)
+    # 3. Adjust brightness
+    img = ImageEnhance.Brightness(img).enhance(0.98)
+    # 4. Filter
+    img = img.filter(ImageFilter.GaussianBlur(radius=0.1))
+
+    out = BytesIO()
+    img.save(out, format='JPEG', quality=quality)
+    return out.getvalue()
+
+
+class CertificatePipeline:
+    """
+    Post-processing of captured certificate pages, kept in memory from the
+    screenshot to the stored files: every page is encoded once and the same
+    bytes are written as the page JPEG and embedded in the PDF (img2pdf
+    copies JPEG data without re-encoding). Multi-page forms are processed
+    on a small shared thread pool; Pillow releases the GIL while filtering
+    and encoding, so the pages run in parallel.
+    """
+
+    def __init__(self):
+        self.workers = 2
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.workers = app.config.get('CERT_POSTPROCESS_WORKERS', 2)
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='cert-post')
+            return self._executor
+
+    def process(self, pages):
+        """JPEG bytes of each post-processed page, in order."""
+        if len(pages) < 2 or self.workers < 2:
+            return [postprocess_page(page) for page in pages]
+        return list(self._get_executor().map(postprocess_page, pages))
+
+    @staticmethod
+    def to_pdf(jpeg_pages):
+        """PDF bytes with the given JPEG pages embedded unchanged."""
+        import img2pdf
+        return img2pdf.convert(jpeg_pages)
+
+
+# Global instance
+certificate_pipeline = CertificatePipeline()
@@ -0,0 +1,188 @@
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+PAGE_WIDTH = 1121
+PAGE_HEIGHT = 1585
+
+# Set by certificate_render.html once images are decoded and fonts are loaded
+READY_CONDITION = 'window.certificateReady === true'
+
+# Render timings kept for stats()
+METRICS_WINDOW = 200
+
+
+class RendererBusy(Exception):
+    """The render queue is full; the client should retry later."""
+
+
+class _RenderJob:
+    __slots__ = ('html', 'pages', 'future', 'queued_at')
+
+    def __init__(self, html, pages):
+        self.html = html
+        self.pages = pages
+        self.future = Future()
+        self.queued_at = time.monotonic()
+
+
+class CertificateRenderer:
+    """
+    Renders certificate HTML to JPEG pages on a small pool of long-lived
+    Chromium instances.
+
+    Playwright's sync API is bound to the thread that started it, so every
+    worker thread owns one browser and one warm page, and requests hand
+    their HTML over a bounded queue. A full queue raises RendererBusy
+    instead of piling up requests. Browsers are started on first use and
+    replaced after a failure or CERT_RENDER_RECYCLE renders.
+    """
+
+    def __init__(self):
+        self.workers = 2
+        self.queue_size = 8
+        self.timeout = 30
+        self.recycle_after = 200
+        self.quality = 95
+        self._queue = None
+        self._threads = []
+        self._lock = threading.Lock()
+        self._timings = deque(maxlen=METRICS_WINDOW)
+        self._counters = {'rendered': 0, 'failed': 0, 'rejected': 0}
+
+    def init_app(self, app):
+        self.workers = app.config.get('CERT_RENDER_WORKERS', 2)
+        self.queue_size = app.config.get('CERT_RENDER_QUEUE', 8)
+        self.timeout = app.config.get('CERT_RENDER_TIMEOUT', 30)
+        self.recycle_after = app.config.get('CERT_RENDER_RECYCLE', 200)
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._queue is not None:
+                return
+            self._queue = queue.Queue(maxsize=self.queue_size)
+            for index in range(self.workers):
+                thread = threading.Thread(target=self._worker, name=f'cert-render-{index}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    # --- Public API ---
+
+    def render(self, html, pages=1):
+        """
+        JPEG bytes of each PAGE_HEIGHT-tall page of `html`, top to bottom.
+        Raises RendererBusy when the queue is full and TimeoutError when the
+        render does not finish within CERT_RENDER_TIMEOUT seconds.
+        """
+        self._ensure_started()
+        job = _RenderJob(html, pages)
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            self._count('rejected')
+            raise RendererBusy()
+        try:
+            # Waiting time in the queue counts towards the timeout
+            return job.future.result(timeout=self.timeout * 2)
+        except TimeoutError:
+            # Not picked up yet: the worker skips it
+            job.future.cancel()
+            raise
+
+    def stats(self):
+        """Counters and queue/render timings (ms) of the last METRICS_WINDOW renders."""
+        with self._lock:
+            timings = list(self._timings)
+            counters = dict(self._counters)
+        result = dict(counters, queued=self._queue.qsize() if self._queue else 0, workers=self.workers)
+        for index, name in ((0, 'wait_ms'), (1, 'render_ms')):
+            values = sorted(t[index] for t in timings)
+            result[name] = {
+                'avg': round(sum(values) / len(values), 1) if values else None,
+                'p95': round(values[min(len(values) - 1, int(len(values) * 0.95))], 1) if values else None
+            }
+        return result
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    # --- Worker thread ---
+
+    def _worker(self):
+        while True:
+            try:
+                from playwright.sync_api import sync_playwright
+
+                with sync_playwright() as playwright:
+                    self._serve(playwright)
+            except Exception as e:
+                logger.exception("Certificate renderer could not start")
+                # Fail the next request instead of leaving it to time out
+                job = self._queue.get()
+                if job.future.set_running_or_notify_cancel():
+                    self._count('failed')
+                    job.future.set_exception(e)
+                self._queue.task_done()
+
+    def _serve(self, playwright):
+        browser = page = None
+        renders = 0
+        while True:
+            job = self._queue.get()
+            if job.future.set_running_or_notify_cancel():
+                started = time.monotonic()
+                try:
+                    if page is None:
+                        browser = playwright.chromium.launch()
+                        page = browser.new_page(viewport={'width': PAGE_WIDTH, 'height': PAGE_HEIGHT})
+                    result = self._render_page(page, job)
+                except Exception as e:
+                    logger.exception("Certificate render failed")
+                    self._count('failed')
+                    job.future.set_exception(e)
+                    # Start from a fresh browser after any failure
+                    browser, page, renders = self._close(browser), None, 0
+                else:
+                    finished = time.monotonic()
+                    wait_ms, render_ms = (started - job.queued_at) * 1000, (finished - started) * 1000
+                    with self._lock:
+                        self._counters['rendered'] += 1
+                        self._timings.append((wait_ms, render_ms))
+                    logger.info("Certificate rendered in %.0f ms (queued %.0f ms)", render_ms, wait_ms)
+                    job.future.set_result(result)
+                    renders += 1
+                    if renders >= self.recycle_after:
+                        browser, page, renders = self._close(browser), None, 0
+            self._queue.task_done()
+
+    def _render_page(self, page, job):
+        timeout_ms = self.timeout * 1000
+        page.set_viewport_size({'width': PAGE_WIDTH, 'height': PAGE_HEIGHT * job.pages})
+        page.set_content(job.html, wait_until='load', timeout=timeout_ms)
+        page.wait_for_function(READY_CONDITION, timeout=timeout_ms)
+        return [
+            page.screenshot(
+                type='jpeg', quality=self.quality,
+                clip={'x': 0, 'y': PAGE_HEIGHT * index, 'width': PAGE_WIDTH, 'height': PAGE_HEIGHT}
+            )
+            for index in range(job.pages)
+        ]
+
+    @staticmethod
+    def _close(browser):
+        try:
+            if browser:
+                browser.close()
+        except Exception:
+            logger.warning("Could not close certificate renderer browser", exc_info=True)
+        return None
+
+
+# Global instance
+certificate_renderer = CertificateRenderer()
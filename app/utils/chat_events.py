@@ -0,0 +1,110 @@
+import logging
+import threading
+import time
+from collections import deque
+
+from sqlalchemy import text
+
+from app.extensions import db
+from app.utils.pg_listen import pg_listener
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'chat_events'
+
+# Events kept for waiters that are between two waits
+EVENT_BUFFER = 1000
+
+
+class ChatBroker:
+    """
+    Wakes up chat streams when something happens in a thread.
+
+    Events are (seq, thread_user_id, kind, message_id) with kind 'message',
+    'read' (Support read the user's messages) or 'user_read' (the user read
+    Support's replies); a thread is identified by its org/doctor user. They carry no
+    message data: streams wait for an event of their thread (or any event
+    for the support inbox) and then load the messages after their id
+    cursor. Within a process events go through a Condition; on PostgreSQL
+    publish() sends NOTIFY and the process-wide pg_listener delivers them,
+    so every worker sees every event.
+    """
+
+    def __init__(self):
+        self.use_notify = True
+        self._cond = threading.Condition()
+        self._seq = 0
+        self._events = deque(maxlen=EVENT_BUFFER)
+        # Waiters reload everything after a gap in the event stream
+        pg_listener.subscribe(CHANNEL, self._on_notify, lambda: self._deliver(None, 'reset', None))
+
+    def init_app(self, app):
+        self.use_notify = app.config.get('CHAT_PG_NOTIFY', True)
+
+    # --- Publishing ---
+
+    def publish(self, thread_user_id, kind='message', message_id=None):
+        """Announces a committed change in a thread."""
+        if self._notify_enabled():
+            try:
+                pg_listener.ensure()
+                payload = f"{kind}:{thread_user_id}:{message_id or ''}"
+                db.session.execute(text("SELECT pg_notify(:channel, :payload)"), {'channel': CHANNEL, 'payload': payload})
+                db.session.commit()
+                return
+            except Exception:
+                db.session.rollback()
+                logger.warning("Chat NOTIFY failed, delivering locally", exc_info=True)
+        self._deliver(thread_user_id, kind, message_id)
+
+    def _deliver(self, thread_user_id, kind, message_id):
+        with self._cond:
+            self._seq += 1
+            self._events.append((self._seq, thread_user_id, kind, message_id))
+            self._cond.notify_all()
+
+    # --- Waiting ---
+
+    def cursor(self):
+        """Current event sequence; take it before loading data, then wait(cursor)."""
+        if self._notify_enabled():
+            pg_listener.ensure()
+        with self._cond:
+            return self._seq
+
+    def wait(self, seq, thread_user_id=None, timeout=25):
+        """
+        Events after `seq` for one thread (all threads when None), waiting
+        up to `timeout` seconds for the first. Returns (new seq, events).
+        """
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                if self._events and self._events[0][0] > seq + 1:
+                    # Fell behind the buffer: report a gap so the caller reloads
+                    return self._seq, [(self._seq, thread_user_id, 'reset', None)]
+                # Thread-less events (resets) concern everybody
+                events = [
+                    e for e in self._events
+                    if e[0] > seq and (thread_user_id is None or e[1] in (thread_user_id, None))
+                ]
+                if events:
+                    return self._seq, events
+                seq = self._seq
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return seq, []
+                self._cond.wait(remaining)
+
+    # --- PostgreSQL fan-out ---
+
+    def _notify_enabled(self):
+        return self.use_notify and pg_listener.available()
+
+    def _on_notify(self, payload):
+        kind, thread_user_id, message_id = payload.split(':')
+        self._deliver(int(thread_user_id), kind, int(message_id) if message_id else None)
+
+
+# Global instance
+chat_broker = ChatBroker()
@@ -0,0 +1,209 @@
+from datetime import datetime
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import false, func, select, tuple_
+
+from app.extensions import db
+from app.models import ChatThread, Message, Organization, User
+from app.utils.search import normalize_search_text
+
+PREVIEW_LENGTH = 200
+THREAD_ROLES = ('org', 'doctor')
+
+
+def org_display_name(role, organization_name):
+    """The org name shown next to the username in the inbox"""
+    if role == 'org' and organization_name:
+        return organization_name
+    return "Врач" if role == 'doctor' else "Пользователь"
+
+
+def _search_text(user):
+    # By id: the relationship is stale right after organization_id changes
+    organization = db.session.get(Organization, user.organization_id) if user.organization_id else None
+    org_name = organization.name if organization else ''
+    return normalize_search_text(f"{user.username} {org_name}")
+
+
+def _upsert(values, update):
+    if db.engine.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    stmt = insert(ChatThread).values(**values)
+    db.session.execute(stmt.on_conflict_do_update(
+        index_elements=[ChatThread.user_id], set_=update(stmt.excluded)
+    ))
+
+
+def _unread_count(user_id):
+    return select(func.count(Message.id)).where(
+        Message.sender_id == user_id, Message.recipient_id.is_(None), Message.is_read == false()
+    ).scalar_subquery()
+
+
+# --- Maintenance (same transaction as the message write; the caller commits) ---
+
+def record_message(message, thread_user):
+    """Moves the thread of `thread_user` to `message` (flushed, so it has an id)."""
+    to_support = message.recipient_id is None
+    _upsert(
+        {
+            'user_id': thread_user.id,
+            'last_message_id': message.id,
+            'last_message_preview': (message.body or '')[:PREVIEW_LENGTH],
+            'last_message_at': message.timestamp or datetime.utcnow(),
+            'unread_for_support': 1 if to_support else 0,
+            'search_text': _search_text(thread_user),
+        },
+        lambda excluded: {
+            'last_message_id': excluded.last_message_id,
+            'last_message_preview': excluded.last_message_preview,
+            'last_message_at': excluded.last_message_at,
+            'unread_for_support': ChatThread.unread_for_support + excluded.unread_for_support,
+            'search_text': excluded.search_text,
+        }
+    )
+
+
+def record_support_read(thread_user_id):
+    """
+    Recounts the unread messages of a thread after Support read it; a
+    message arriving concurrently stays counted.
+    """
+    ChatThread.query.filter_by(user_id=thread_user_id).update(
+        {'unread_for_support': _unread_count(thread_user_id)}, synchronize_session=False
+    )
+
+
+def record_rename(users):
+    """Rewrites the search text of the threads of `users` after their username or organization changed."""
+    for user in users:
+        ChatThread.query.filter_by(user_id=user.id).update(
+            {'search_text': _search_text(user)}, synchronize_session=False
+        )
+
+
+def rebuild_threads():
+    """Recreates chat_threads from the messages table. Returns the number of threads; the caller commits."""
+    thread_user = func.coalesce(Message.recipient_id, Message.sender_id)
+    last_ids = select(func.max(Message.id)).group_by(thread_user)
+    unread = dict(db.session.execute(
+        select(Message.sender_id, func.count(Message.id))
+        .where(Message.recipient_id.is_(None), Message.is_read == false())
+        .group_by(Message.sender_id)
+    ).all())
+
+    db.session.query(ChatThread).delete(synchronize_session=False)
+    count = 0
+    for message in Message.query.filter(Message.id.in_(last_ids)).order_by(Message.id):
+        user = db.session.get(User, message.recipient_id or message.sender_id)
+        if user is None:
+            continue
+        db.session.add(ChatThread(
+            user_id=user.id,
+            last_message_id=message.id,
+            last_message_preview=(message.body or '')[:PREVIEW_LENGTH],
+            last_message_at=message.timestamp or datetime.utcnow(),
+            unread_for_support=unread.get(user.id, 0),
+            search_text=_search_text(user),
+        ))
+        count += 1
+    db.session.flush()
+    return count
+
+
+# --- Inbox ---
+
+def encode_cursor(thread):
+    return f"{thread['unread_count']}:{thread['last_timestamp']}:{thread['user_id']}"
+
+
+def _decode_cursor(cursor):
+    try:
+        unread, rest = cursor.split(':', 1)
+        timestamp, user_id = rest.rsplit(':', 1)
+        return int(unread), datetime.fromisoformat(timestamp.rstrip('Z')), int(user_id)
+    except (AttributeError, ValueError):
+        return None
+
+
+def inbox_page(search='', limit=100, cursor=None):
+    """
+    One page of the support inbox, unread threads first, then newest: one
+    query over chat_threads (keyset on the inbox index). With a search, the
+    first page also lists matching org/doctor users without messages yet.
+    Returns (threads, next cursor or None).
+    """
+    tokens = normalize_search_text(search).split()
+    query = (
+        select(ChatThread, User.username, User.role, Organization.name)
+        .join(User, User.id == ChatThread.user_id)
+        .outerjoin(Organization, Organization.id == User.organization_id)
+        .order_by(ChatThread.unread_for_support.desc(), ChatThread.last_message_at.desc(), ChatThread.user_id.desc())
+        .limit(limit)
+    )
+    for token in tokens:
+        query = query.where(ChatThread.search_text.contains(token, autoescape=True))
+    position = _decode_cursor(cursor) if cursor else None
+    if position:
+        query = query.where(
+            tuple_(ChatThread.unread_for_support, ChatThread.last_message_at, ChatThread.user_id) < position
+        )
+
+    threads = []
+    for thread, username, role, organization_name in db.session.execute(query):
+        org_name = org_display_name(role, organization_name)
+        threads.append({
+            'user_id': thread.user_id,
+            'username': username,
+            'org_name': org_name,
+            'display_name': f"{username} - {org_name}",
+            'last_message': thread.last_message_preview,
+            'last_timestamp': thread.last_message_at.isoformat() + 'Z',
+            'unread_count': thread.unread_for_support
+        })
+    next_cursor = encode_cursor(threads[-1]) if len(threads) == limit else None
+
+    if tokens and not cursor and len(threads) < limit:
+        threads.extend(_users_without_threads(tokens, limit - len(threads)))
+    return threads, next_cursor
+
+
+def _users_without_threads(tokens, limit):
+    query = (
+        select(User.id, User.username, User.role, Organization.name)
+        .outerjoin(Organization, Organization.id == User.organization_id)
+        .outerjoin(ChatThread, ChatThread.user_id == User.id)
+        .where(User.role.in_(THREAD_ROLES), ChatThread.user_id.is_(None))
+        .order_by(User.username)
+        .limit(limit)
+    )
+    for token in tokens:
+        query = query.where(
+            (func.lower(User.username).contains(token, autoescape=True)) |
+            (func.lower(Organization.name).contains(token, autoescape=True))
+        )
+    return [{
+        'user_id': user_id,
+        'username': username,
+        'org_name': org_display_name(role, organization_name),
+        'display_name': f"{username} - {org_display_name(role, organization_name)}",
+        'last_message': '',
+        'last_timestamp': None,
+        'unread_count': 0
+    } for user_id, username, role, organization_name in db.session.execute(query)]
+
+
+# --- CLI: flask chat rebuild-threads ---
+
+chat_cli = AppGroup('chat', help='Support chat maintenance.')
+
+
+@chat_cli.command('rebuild-threads')
+def rebuild_threads_command():
+    """Recomputes chat_threads from the messages table."""
+    count = rebuild_threads()
+    db.session.commit()
+    click.echo(f"Chat threads written: {count}")
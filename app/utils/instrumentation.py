@@ -0,0 +1,271 @@
+import bisect
+import json
+import logging
+import re
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime, timedelta
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app.extensions import db
+from app.models import RequestMetric
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the latency histogram buckets; the last bucket is open
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+_WHITESPACE = re.compile(r'\s+')
+_IN_LIST = re.compile(r'\((?:\s*(?:\?|%s|%\(\w+\)s|:\w+)\s*,)+\s*(?:\?|%s|%\(\w+\)s|:\w+)\s*\)')
+
+
+def normalize_statement(statement, limit=1000):
+    """One line, IN lists collapsed, so the same query with other ids groups together."""
+    text = _WHITESPACE.sub(' ', statement).strip()
+    return _IN_LIST.sub('(?, ...)', text)[:limit]
+
+
+def redact_parameters(parameters):
+    """Parameter types only: values may hold patient data."""
+    if isinstance(parameters, dict):
+        return {key: type(value).__name__ for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        if parameters and isinstance(parameters[0], (dict, list, tuple)):
+            # executemany: the first row stands for all
+            return {'rows': len(parameters), 'first': redact_parameters(parameters[0])}
+        return [type(value).__name__ for value in parameters]
+    return type(parameters).__name__
+
+
+def quantile(buckets, q, max_ms=0):
+    """Approximate quantile from histogram counts: the upper bound of its bucket."""
+    total = sum(buckets)
+    if not total:
+        return 0
+    rank = q * total
+    seen = 0
+    for bound, count in zip(LATENCY_BUCKETS_MS, buckets):
+        seen += count
+        if seen >= rank:
+            return round(min(bound, max_ms), 1) if max_ms else bound
+    return round(max_ms, 1)
+
+
+def _empty():
+    return {
+        'requests': 0, 'errors': 0, 'total_ms': 0.0, 'max_ms': 0.0,
+        'buckets': [0] * (len(LATENCY_BUCKETS_MS) + 1),
+        'queries': 0, 'sql_ms': 0.0, 'max_queries': 0,
+        'repeated_statement': None, 'repeated_count': 0,
+    }
+
+
+class RequestMetrics:
+    """
+    Per-request latency and SQL instrumentation.
+
+    Request hooks time every request and SQLAlchemy cursor events count
+    the statements it runs and their time. Numbers are aggregated per
+    endpoint in memory (a latency histogram over LATENCY_BUCKETS_MS, query
+    totals, the statement repeated most often within one request) and
+    flush() writes them as one RequestMetric row per endpoint and period.
+    Statements slower than METRICS_SLOW_QUERY_MS are kept in a bounded log
+    with their parameters reduced to type names.
+    """
+
+    def __init__(self):
+        self.enabled = True
+        self.slow_query_ms = 200
+        self.repeat_threshold = 5
+        self.retention_days = 14
+        self.ignore_endpoints = ('static',)
+        self._lock = threading.Lock()
+        self._period_start = datetime.utcnow()
+        self._endpoints = {}
+        self._slow = deque(maxlen=50)
+        self._listening = False
+
+    def init_app(self, app):
+        self.enabled = app.config.get('METRICS_ENABLED', True)
+        self.slow_query_ms = app.config.get('METRICS_SLOW_QUERY_MS', 200)
+        self.repeat_threshold = app.config.get('METRICS_REPEAT_THRESHOLD', 5)
+        self.retention_days = app.config.get('METRICS_RETENTION_DAYS', 14)
+        self.ignore_endpoints = tuple(app.config.get('METRICS_IGNORE_ENDPOINTS', ('static',)))
+        self._slow = deque(maxlen=app.config.get('METRICS_SLOW_LOG_SIZE', 50))
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        if not self._listening:
+            # Once per process: every engine reports to this instance
+            event.listen(Engine, 'before_cursor_execute', self._before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', self._after_cursor_execute)
+            event.listen(Engine, 'handle_error', self._handle_error)
+            self._listening = True
+
+    # --- Request hooks ---
+
+    def _before_request(self):
+        if self.enabled and request.endpoint not in self.ignore_endpoints:
+            g._request_metrics = {'started': time.perf_counter(), 'queries': 0, 'sql_ms': 0.0, 'statements': Counter()}
+
+    def _after_request(self, response):
+        current = g.pop('_request_metrics', None)
+        if current is not None:
+            elapsed_ms = (time.perf_counter() - current['started']) * 1000
+            self.record(request.endpoint or 'unmatched', elapsed_ms, response.status_code, current)
+        return response
+
+    def record(self, endpoint, elapsed_ms, status_code, current):
+        """Adds one finished request to the in-memory aggregates."""
+        repeated, repeat_count = (None, 0)
+        if current['statements']:
+            repeated, repeat_count = current['statements'].most_common(1)[0]
+
+        with self._lock:
+            stats = self._endpoints.setdefault(endpoint, _empty())
+            stats['requests'] += 1
+            stats['errors'] += status_code >= 500
+            stats['total_ms'] += elapsed_ms
+            stats['max_ms'] = max(stats['max_ms'], elapsed_ms)
+            stats['buckets'][bisect.bisect_left(LATENCY_BUCKETS_MS, elapsed_ms)] += 1
+            stats['queries'] += current['queries']
+            stats['sql_ms'] += current['sql_ms']
+            stats['max_queries'] = max(stats['max_queries'], current['queries'])
+            if repeat_count >= self.repeat_threshold and repeat_count > stats['repeated_count']:
+                stats['repeated_statement'], stats['repeated_count'] = repeated, repeat_count
+
+    # --- SQL events ---
+
+    @staticmethod
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+    @staticmethod
+    def _handle_error(context):
+        # A failed statement gets no after_cursor_execute
+        started = context.connection.info.get('query_started') if context.connection is not None else None
+        if started:
+            started.pop()
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        started = conn.info.get('query_started')
+        if not started:
+            return
+        elapsed_ms = (time.perf_counter() - started.pop()) * 1000
+
+        current = g.get('_request_metrics') if has_request_context() else None
+        if current is not None:
+            current['queries'] += 1
+            current['sql_ms'] += elapsed_ms
+            current['statements'][normalize_statement(statement)] += 1
+
+        if elapsed_ms >= self.slow_query_ms and self.enabled:
+            entry = {
+                'at': datetime.utcnow().isoformat(timespec='seconds'),
+                'endpoint': request.endpoint if has_request_context() else None,
+                'ms': round(elapsed_ms, 1),
+                'statement': normalize_statement(statement),
+                'parameters': redact_parameters(parameters),
+            }
+            with self._lock:
+                self._slow.append(entry)
+            logger.warning("Slow query (%.0f ms) in %s: %s", elapsed_ms, entry['endpoint'], entry['statement'][:200])
+
+    # --- Persistence ---
+
+    def flush(self, now=None):
+        """Writes the aggregates since the last flush and drops expired rows. Returns the rows written."""
+        now = now or datetime.utcnow()
+        with self._lock:
+            endpoints, self._endpoints = self._endpoints, {}
+            period_start, self._period_start = self._period_start, now
+        for endpoint, stats in endpoints.items():
+            db.session.add(RequestMetric(
+                period_start=period_start,
+                endpoint=endpoint[:120],
+                requests=stats['requests'],
+                errors=stats['errors'],
+                total_ms=stats['total_ms'],
+                max_ms=stats['max_ms'],
+                latency_buckets=json.dumps(stats['buckets']),
+                queries=stats['queries'],
+                sql_ms=stats['sql_ms'],
+                max_queries=stats['max_queries'],
+                repeated_statement=stats['repeated_statement'],
+                repeated_count=stats['repeated_count'],
+            ))
+        RequestMetric.query.filter(
+            RequestMetric.period_start < now - timedelta(days=self.retention_days)
+        ).delete(synchronize_session=False)
+        db.session.commit()
+        return len(endpoints)
+
+    # --- Reporting ---
+
+    def summary(self, hours=24, limit=20):
+        """
+        Per-endpoint percentiles over the stored periods of the last `hours`
+        plus what this process has not flushed yet, slowest p95 first, and
+        the endpoints with the most repeated statement per request.
+        """
+        merged = {}
+
+        def merge(endpoint, stats):
+            target = merged.setdefault(endpoint, _empty())
+            for key in ('requests', 'errors', 'total_ms', 'queries', 'sql_ms'):
+                target[key] += stats[key]
+            target['max_ms'] = max(target['max_ms'], stats['max_ms'])
+            target['max_queries'] = max(target['max_queries'], stats['max_queries'])
+            target['buckets'] = [a + b for a, b in zip(target['buckets'], stats['buckets'])]
+            if stats['repeated_count'] > target['repeated_count']:
+                target['repeated_statement'] = stats['repeated_statement']
+                target['repeated_count'] = stats['repeated_count']
+
+        since = datetime.utcnow() - timedelta(hours=hours)
+        for row in RequestMetric.query.filter(RequestMetric.period_start >= since):
+            merge(row.endpoint, {
+                'requests': row.requests, 'errors': row.errors, 'total_ms': row.total_ms, 'max_ms': row.max_ms,
+                'buckets': json.loads(row.latency_buckets), 'queries': row.queries, 'sql_ms': row.sql_ms,
+                'max_queries': row.max_queries, 'repeated_statement': row.repeated_statement,
+                'repeated_count': row.repeated_count,
+            })
+        with self._lock:
+            pending = {endpoint: dict(stats, buckets=list(stats['buckets'])) for endpoint, stats in self._endpoints.items()}
+            slow = list(self._slow)
+        for endpoint, stats in pending.items():
+            merge(endpoint, stats)
+
+        endpoints = []
+        for endpoint, stats in merged.items():
+            count = stats['requests'] or 1
+            endpoints.append({
+                'endpoint': endpoint,
+                'requests': stats['requests'],
+                'errors': stats['errors'],
+                'avg_ms': round(stats['total_ms'] / count, 1),
+                'p50': quantile(stats['buckets'], 0.5, stats['max_ms']),
+                'p95': quantile(stats['buckets'], 0.95, stats['max_ms']),
+                'p99': quantile(stats['buckets'], 0.99, stats['max_ms']),
+                'max_ms': round(stats['max_ms'], 1),
+                'avg_queries': round(stats['queries'] / count, 1),
+                'avg_sql_ms': round(stats['sql_ms'] / count, 1),
+                'max_queries': stats['max_queries'],
+                'repeated_statement': stats['repeated_statement'],
+                'repeated_count': stats['repeated_count'],
+            })
+        n_plus_one = sorted(
+            (e for e in endpoints if e['repeated_count']), key=lambda e: e['repeated_count'], reverse=True
+        )[:limit]
+        endpoints.sort(key=lambda e: (e['p95'], e['avg_ms']), reverse=True)
+        return {
+            'endpoints': endpoints[:limit],
+            'n_plus_one': n_plus_one,
+            'slow_queries': list(reversed(slow)),
+        }
+
+
+# Global instance
+request_metrics = RequestMetrics()
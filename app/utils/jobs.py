@@ -0,0 +1,224 @@
+import glob
+import json
+import logging
+import os
+import tempfile
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import func
+from sqlalchemy.exc import SQLAlchemyError
+
+from app.extensions import db
+
+logger = logging.getLogger(__name__)
+
+# Warnings kept on the job row (the full count is stored separately)
+MAX_STORED_WARNINGS = 200
+
+UPLOAD_PREFIX = 'job_upload_'
+
+
+class JobContext:
+    """
+    Handed to a job function as its first argument. Collects progress
+    counters and per-row warnings; they are written to the job row at most
+    once per `flush_interval` seconds so pollers see live progress.
+    """
+
+    def __init__(self, job_id, flush_interval=1.0, live=True):
+        self.job_id = job_id
+        self.total = None
+        self.processed = 0
+        self.warnings = []
+        self.flush_interval = flush_interval
+        self.live = live
+        self._last_flush = 0.0
+
+    def set_total(self, total):
+        self.total = total
+        self.flush()
+
+    def advance(self, count=1):
+        self.processed += count
+        self.flush()
+
+    def progress(self, processed, total=None):
+        self.processed = processed
+        if total is not None:
+            self.total = total
+        self.flush()
+
+    def warn(self, message):
+        self.warnings.append(message)
+
+    def state(self):
+        return {
+            'total': self.total,
+            'processed': self.processed,
+            'warning_count': len(self.warnings),
+            'warnings': json.dumps(self.warnings[:MAX_STORED_WARNINGS], ensure_ascii=False)
+        }
+
+    def flush(self, force=False):
+        # Synchronous jobs share the request connection: no intermediate commits there
+        if not self.live:
+            return
+        now = time.monotonic()
+        if not force and now - self._last_flush < self.flush_interval:
+            return
+        self._last_flush = now
+
+        from app.models import BackgroundJob
+        # Separate connection so the job's own transaction is not committed
+        with db.engine.begin() as conn:
+            conn.execute(
+                BackgroundJob.__table__.update()
+                .where(BackgroundJob.__table__.c.id == self.job_id)
+                .values(**self.state())
+            )
+
+
+class JobQueue:
+    """
+    Runs long admin operations (imports, recalculations) on a thread pool
+    and tracks them in the background_jobs table.
+
+    Job functions are called as func(ctx, *args, **kwargs) inside an app
+    context and return a JSON-serialisable report, usually
+    {'message': ..., 'category': ...}. An exception marks the job failed
+    and rolls back its session.
+
+    With JOBS_SYNC (default in TESTING) jobs run inline in the request.
+
+    Jobs live only in the process that runs them: on startup, jobs still
+    queued or running after JOB_STALE_AFTER seconds are marked failed and
+    their leftover upload files are removed.
+    """
+
+    def __init__(self):
+        self.sync = False
+        self.max_workers = 2
+        self.stale_after = 2 * 3600
+        self._executor = None
+
+    def init_app(self, app):
+        self.sync = app.config.get('JOBS_SYNC', app.config.get('TESTING', False))
+        self.max_workers = app.config.get('JOB_WORKERS', 2)
+        self.stale_after = app.config.get('JOB_STALE_AFTER', 2 * 3600)
+        with app.app_context():
+            self.recover_stale()
+
+    def recover_stale(self, now=None):
+        """
+        Fails jobs left queued/running by a process that died (worker
+        restart, deploy) and removes orphaned upload files. Returns the
+        number of jobs marked failed.
+        """
+        from app.models import BackgroundJob
+
+        cutoff = (now or datetime.utcnow()) - timedelta(seconds=self.stale_after)
+        try:
+            count = BackgroundJob.query.filter(
+                BackgroundJob.status.in_(('queued', 'running')),
+                func.coalesce(BackgroundJob.started_at, BackgroundJob.created_at) < cutoff
+            ).update({
+                'status': 'failed',
+                'error': 'Задача прервана: процесс был перезапущен до её завершения',
+                'finished_at': datetime.utcnow()
+            }, synchronize_session=False)
+            db.session.commit()
+        except SQLAlchemyError:
+            # No background_jobs table yet (fresh database before migrations)
+            db.session.rollback()
+            count = 0
+        if count:
+            logger.warning("Marked %d interrupted background jobs as failed", count)
+
+        removed = remove_stale_uploads(time.time() - self.stale_after)
+        if removed:
+            logger.info("Removed %d orphaned job upload files", removed)
+        return count
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='job')
+        return self._executor
+
+    def enqueue(self, kind, func, *args, user_id=None, **kwargs):
+        """Creates the job row and schedules func. Returns the job id."""
+        from app.models import BackgroundJob
+
+        job = BackgroundJob(kind=kind, status='queued', user_id=user_id)
+        db.session.add(job)
+        db.session.commit()
+        job_id = job.id
+
+        if self.sync:
+            self._run(job_id, func, args, kwargs, live=False)
+        else:
+            app = current_app._get_current_object()
+            self._get_executor().submit(self._run_in_app, app, job_id, func, args, kwargs)
+        return job_id
+
+    def _run_in_app(self, app, job_id, func, args, kwargs):
+        with app.app_context():
+            self._run(job_id, func, args, kwargs, live=True)
+
+    def _run(self, job_id, func, args, kwargs, live):
+        from app.models import BackgroundJob
+
+        job = db.session.get(BackgroundJob, job_id)
+        job.status = 'running'
+        job.started_at = datetime.utcnow()
+        db.session.commit()
+
+        ctx = JobContext(job_id, live=live)
+        try:
+            report = func(ctx, *args, **kwargs)
+            status, error = 'done', None
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.error(f"Job {job_id} failed: {traceback.format_exc()}")
+            report, status, error = None, 'failed', str(e)
+
+        job = db.session.get(BackgroundJob, job_id)
+        for key, value in ctx.state().items():
+            setattr(job, key, value)
+        job.status = status
+        job.error = error
+        job.result = json.dumps(report, ensure_ascii=False, default=str) if report is not None else None
+        job.finished_at = datetime.utcnow()
+        db.session.commit()
+
+
+def save_upload(file):
+    """
+    Copies an uploaded file to a temp path so a job can read it after the
+    request has finished. The job is responsible for removing it.
+    """
+    _, ext = os.path.splitext(file.filename or '')
+    fd, path = tempfile.mkstemp(prefix=UPLOAD_PREFIX, suffix=ext.lower())
+    with os.fdopen(fd, 'wb') as out:
+        file.save(out)
+    return path
+
+
+def remove_stale_uploads(older_than):
+    """Removes save_upload files last modified before the `older_than` timestamp. Returns how many."""
+    removed = 0
+    for path in glob.glob(os.path.join(tempfile.gettempdir(), UPLOAD_PREFIX + '*')):
+        try:
+            if os.path.getmtime(path) < older_than:
+                os.remove(path)
+                removed += 1
+        except OSError:
+            continue
+    return removed
+
+
+# Global instance
+job_queue = JobQueue()
@@ -0,0 +1,361 @@
+import re
+from datetime import datetime, date
+from itertools import islice
+
+from sqlalchemy import insert
+
+from app.extensions import db
+from app.models import (
+    User, Doctor, Clinic, Service, AdditionalService, PaymentMethod, Appointment,
+    AppointmentService, AppointmentAdditionalService, AppointmentHistory
+)
+from app.utils.pricing import price_resolver
+from app.utils.stats_rollup import refresh_stats_days
+from app.utils.slots import slot_engine
+
+# Rows per INSERT statement (appointments and association rows)
+BATCH_SIZE = 1000
+
+DEFAULT_COL_MAP = {
+    'date': 0, 'contract': 3, 'patient': 4, 'is_child': 5, 'doctor': 6,
+    'clinic': 8, 'service': 9, 'additional_services': 10, 'quantity': 11,
+    'payment': 14, 'discount': 15, 'cost': 16, 'comment': 12
+}
+
+DATE_FORMATS = ['%d.%m.%Y', '%Y-%m-%d', '%d.%m.%y', '%d/%m/%Y']
+
+
+def normalize_name(value):
+    """Case-folded, whitespace-collapsed key used for every catalog lookup."""
+    return re.sub(r'\s+', ' ', str(value or '')).strip().casefold()
+
+
+# --- Stage 1: Parse ---
+
+def detect_columns(rows):
+    """Returns (col_map, header_row_idx) from the headers in the first two rows."""
+    headers = [str(h).strip().lower() if h else '' for h in rows[0]]
+    header_row_idx = 0
+    if 'дата' not in headers and len(rows) > 1:
+        headers = [str(h).strip().lower() if h else '' for h in rows[1]]
+        header_row_idx = 1
+
+    col_map = {}
+    for idx, h in enumerate(headers):
+        if 'дата' in h and 'рождения' not in h: col_map['date'] = idx
+        elif 'пациент' in h: col_map['patient'] = idx
+        elif 'врач' in h: col_map['doctor'] = idx
+        elif 'исследование' in h or 'услуга' in h: col_map['service'] = idx
+        elif 'оплата' in h: col_map['payment'] = idx
+        elif 'скидка' in h: col_map['discount'] = idx
+        elif 'сумма' in h: col_map['cost'] = idx
+        elif 'стоимость' in h and 'cost' not in col_map: col_map['cost'] = idx
+        elif 'договор' in h: col_map['contract'] = idx
+        elif 'ребенок' in h: col_map['is_child'] = idx
+        elif 'клиника' in h: col_map['clinic'] = idx
+        elif 'кол-во' in h: col_map['quantity'] = idx
+        elif 'доп' in h and 'услуги' in h: col_map['additional_services'] = idx
+        elif 'комментарий' in h: col_map['comment'] = idx
+
+    if 'date' not in col_map or 'patient' not in col_map:
+        col_map = dict(DEFAULT_COL_MAP)
+
+    return col_map, header_row_idx
+
+
+def parse_date(value):
+    if isinstance(value, datetime): return value.date()
+    if isinstance(value, date): return value
+    if isinstance(value, str):
+        # Replace comma with dot (e.g. 09,12.2025 -> 09.12.2025)
+        val_str = value.strip().replace(',', '.')
+        for fmt in DATE_FORMATS:
+            try:
+                return datetime.strptime(val_str, fmt).date()
+            except ValueError:
+                pass
+    return None
+
+
+def parse_quantity(value):
+    if not value:
+        return 1
+    try:
+        return int(float(str(value).replace(',', '.')))
+    except ValueError:
+        return 1
+
+
+def parse_discount(value):
+    if value is None:
+        return 0.0
+    if isinstance(value, (int, float)):
+        return float(value)
+    d_str = str(value).replace(u'\xa0', '').replace(' ', '').replace(',', '.')
+    try:
+        return float(d_str)
+    except ValueError:
+        return 0.0
+
+
+def parse_is_child(value):
+    if not value:
+        return False
+    if isinstance(value, bool):
+        return value
+    return str(value).lower() in ['true', 'yes', 'да', '1', '+']
+
+
+# --- Stage 2: Resolve ---
+
+class ImportLookups:
+    """
+    Catalog dictionaries built once per import (one query per table).
+    Keys are normalize_name() of the catalog name; on duplicates the
+    lowest id wins.
+    """
+
+    def __init__(self):
+        self.doctors = {}
+        self.doctor_rows = []
+        for doc_id, name, manager in db.session.query(Doctor.id, Doctor.name, Doctor.manager).order_by(Doctor.id):
+            key = normalize_name(name)
+            self.doctors.setdefault(key, (doc_id, name, manager))
+            self.doctor_rows.append((key, (doc_id, name, manager)))
+
+        self.users = self._index(db.session.query(User.username, User.id).order_by(User.id))
+        self.clinics = self._index(db.session.query(Clinic.name, Clinic.id).order_by(Clinic.id))
+        self.services = self._index(db.session.query(Service.name, Service.id, Service.name).order_by(Service.id))
+        self.additional_services = self._index(db.session.query(AdditionalService.name, AdditionalService.id).order_by(AdditionalService.id))
+        self.payment_methods = self._index(db.session.query(PaymentMethod.name, PaymentMethod.id).order_by(PaymentMethod.id))
+
+        self._fuzzy_doctors = {}
+
+    @staticmethod
+    def _index(query):
+        result = {}
+        for row in query:
+            value = row[1] if len(row) == 2 else tuple(row[1:])
+            result.setdefault(normalize_name(row[0]), value)
+        return result
+
+    def find_doctor(self, doctor_name):
+        """(id, name, manager) or None. Exact match first, then tokens in order ("Ivanov%Ivan")."""
+        key = normalize_name(doctor_name)
+        doc = self.doctors.get(key)
+        if doc or not key:
+            return doc
+
+        if key not in self._fuzzy_doctors:
+            pattern = re.compile('.*'.join(re.escape(part) for part in key.split(' ')), re.DOTALL)
+            self._fuzzy_doctors[key] = next(
+                (doc for name_key, doc in self.doctor_rows if pattern.fullmatch(name_key)), None
+            )
+        return self._fuzzy_doctors[key]
+
+    def payment_method_id(self, name):
+        """Existing payment method id; unknown names are created once per import."""
+        key = normalize_name(name)
+        if key not in self.payment_methods:
+            pm = PaymentMethod(name=name)
+            db.session.add(pm)
+            db.session.flush()
+            self.payment_methods[key] = pm.id
+        return self.payment_methods[key]
+
+
+def resolve_journal_rows(rows, col_map, header_row_idx, lookups, warnings):
+    """
+    Matches raw data rows (everything after the header row) against the
+    catalog and validates them. Yields resolved rows lazily; rows failing a
+    strict rule are skipped with a message appended to `warnings`.
+    """
+    for i, row in enumerate(rows, start=header_row_idx + 1):
+        if not row or len(row) < 5: continue
+
+        def get_val(key):
+            idx = col_map.get(key)
+            if idx is not None and idx < len(row):
+                return row[idx]
+            return None
+
+        date_val = get_val('date')
+        if not date_val: continue
+        if isinstance(date_val, str) and not date_val.strip(): continue
+
+        appt_date = parse_date(date_val)
+        if not appt_date:
+            warnings.append(f"Строка {i+1}: Неверный формат даты '{date_val}'.")
+            continue
+
+        patient = str(get_val('patient') or '').strip()
+        if not patient: continue
+
+        # 1. DOCTOR MATCHING (empty doctor -> "Без врача")
+        doctor_name = str(get_val('doctor') or '').strip() or "Без врача"
+        doc = lookups.find_doctor(doctor_name)
+        if not doc:
+            warnings.append(f"Строка {i+1}: Врач '{doctor_name}' не найден (даже с нечетким поиском).")
+            continue
+        doctor_id, doctor_display, doctor_manager = doc
+
+        # 2. MANAGER AUTO-ASSIGN
+        manager_id = lookups.users.get(normalize_name(doctor_manager)) if doctor_manager else None
+
+        # 3. CLINIC MATCHING
+        clinic_name = str(get_val('clinic') or '').strip()
+        clinic_id = lookups.clinics.get(normalize_name(clinic_name)) if clinic_name else None
+
+        # 4. SERVICE MATCHING
+        service_name = str(get_val('service') or '').strip()
+        service = None
+        if service_name:
+            service = lookups.services.get(normalize_name(service_name))
+            if not service:
+                warnings.append(f"Строка {i+1}: Услуга '{service_name}' не найдена (игнорируется, так как не найдена в каталоге).")
+
+        # 5. ADDITIONAL SERVICES MATCHING
+        add_services_str = str(get_val('additional_services') or '').strip()
+        add_service_ids = []
+        if add_services_str:
+            for raw_name in add_services_str.split(','):
+                name = raw_name.strip()
+                if not name: continue
+                add_id = lookups.additional_services.get(normalize_name(name))
+                if not add_id:
+                    warnings.append(f"Строка {i+1}: Доп. услуга '{name}' не найдена.")
+                    # Strict: listed but not found -> skip the row
+                    add_service_ids = []
+                    service = None
+                    break
+                if add_id not in add_service_ids:
+                    add_service_ids.append(add_id)
+
+        # VALIDATION: Must have either Main Service OR Additional Services
+        if not service and not add_service_ids:
+            if not warnings: # Don't duplicate if we already warned about invalid service
+                warnings.append(f"Строка {i+1}: Не указана ни основная, ни доп. услуга.")
+            continue
+
+        # COST: main service (quantity 1) + additional services * quantity
+        quantity = parse_quantity(get_val('quantity'))
+        cost = 0.0
+        if service:
+            cost += price_resolver.get_price(service[0], appt_date, kind='service') or 0.0
+        for add_id in add_service_ids:
+            cost += (price_resolver.get_price(add_id, appt_date, kind='additional') or 0.0) * quantity
+
+        yield {
+            'date': appt_date,
+            'patient': patient,
+            'service_id': service[0] if service else None,
+            'service_name': service[1] if service else None,
+            'doctor_id': doctor_id,
+            'doctor_name': doctor_display,
+            'clinic_id': clinic_id,
+            'manager_id': manager_id,
+            'contract': str(get_val('contract') or '').strip(),
+            'cost': cost,
+            'discount': parse_discount(get_val('discount')),
+            'payment': str(get_val('payment') or '').strip(),
+            'is_child': parse_is_child(get_val('is_child')),
+            'quantity': quantity,
+            'add_service_ids': add_service_ids,
+            'comment': str(get_val('comment') or '').strip()
+        }
+
+
+# --- Stage 3: Write ---
+
+def delete_center_days(center_id, dates):
+    """Removes existing appointments (and their dependent rows) of a center on the given dates."""
+    appt_ids = [a[0] for a in db.session.query(Appointment.id).filter(
+        Appointment.center_id == center_id,
+        Appointment.date.in_(dates)
+    )]
+    if not appt_ids:
+        return 0
+
+    for start in range(0, len(appt_ids), BATCH_SIZE):
+        chunk = appt_ids[start:start + BATCH_SIZE]
+        # query.delete bypasses ORM cascade, so dependencies go first
+        AppointmentAdditionalService.query.filter(AppointmentAdditionalService.appointment_id.in_(chunk)).delete(synchronize_session=False)
+        AppointmentService.query.filter(AppointmentService.appointment_id.in_(chunk)).delete(synchronize_session=False)
+        AppointmentHistory.query.filter(AppointmentHistory.appointment_id.in_(chunk)).delete(synchronize_session=False)
+        Appointment.query.filter(Appointment.id.in_(chunk)).delete(synchronize_session=False)
+    return len(appt_ids)
+
+
+def bulk_insert_appointments(valid_rows, center_id, author_id, lookups, delete_old=False, progress=None):
+    """
+    Inserts resolved rows in batches of BATCH_SIZE, consuming them lazily.
+    With delete_old, each day of the center is cleared the first time it
+    appears, before any new row of that day is written. `progress` is called
+    with the running count after each batch. The statistics rollup of every
+    touched day is refreshed, and its cached slot bitmap is dropped when the
+    caller commits.
+    Returns the number of appointments created.
+    """
+    created_count = 0
+    cleaned_dates = set()
+    touched_dates = set()
+    valid_rows = iter(valid_rows)
+    while True:
+        batch = list(islice(valid_rows, BATCH_SIZE))
+        if not batch:
+            break
+
+        if delete_old:
+            new_dates = {data['date'] for data in batch} - cleaned_dates
+            if new_dates:
+                delete_center_days(center_id, new_dates)
+                cleaned_dates |= new_dates
+
+        appt_values = [{
+            'center_id': center_id,
+            'date': data['date'],
+            'time': "09:00",
+            'patient_name': data['patient'],
+            'service': data['service_name'] or "Доп. услуги",
+            'doctor': data['doctor_name'],
+            'doctor_id': data['doctor_id'],
+            'manager_id': data['manager_id'],
+            'clinic_id': data['clinic_id'],
+            'cost': float(data['cost']),
+            'discount': data['discount'],
+            'payment_method_id': lookups.payment_method_id(data['payment']) if data['payment'] else None,
+            'is_child': data['is_child'],
+            'contract_number': data['contract'],
+            'quantity': 1, # Always 1 for main service
+            'author_id': author_id,
+            'comment': data['comment'],
+            'allow_overlap': True # Journal rows carry no real time
+        } for data in batch]
+        touched_dates.update(data['date'] for data in batch)
+
+        appt_ids = db.session.scalars(
+            insert(Appointment).returning(Appointment.id, sort_by_parameter_order=True),
+            appt_values
+        ).all()
+
+        main_values = []
+        additional_values = []
+        for appt_id, data in zip(appt_ids, batch):
+            if data['service_id']:
+                main_values.append({'appointment_id': appt_id, 'service_id': data['service_id'], 'quantity': 1})
+            for add_id in data['add_service_ids']:
+                additional_values.append({'appointment_id': appt_id, 'additional_service_id': add_id, 'quantity': data['quantity']})
+
+        if main_values:
+            db.session.execute(insert(AppointmentService), main_values)
+        if additional_values:
+            db.session.execute(insert(AppointmentAdditionalService), additional_values)
+
+        created_count += len(appt_ids)
+        if progress:
+            progress(created_count)
+
+    refresh_stats_days((center_id, day) for day in touched_dates)
+    # Core inserts and deletes bypass the session listener of the slot engine
+    slot_engine.invalidate_on_commit((center_id, day) for day in touched_dates)
+    return created_count
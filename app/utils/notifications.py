@@ -0,0 +1,79 @@
+from datetime import datetime
+
+from sqlalchemy import false, literal, select, update
+
+from app.extensions import db
+from app.models import Notification, NotificationStatus, User
+
+
+def recipient_filter(target_type, target_role=None, target_user_id=None):
+    """Conditions on User selecting the recipients; None when the target is incomplete."""
+    if target_type == 'all':
+        return [User.is_blocked == false()]
+    if target_type == 'role' and target_role:
+        return [User.role == target_role, User.is_blocked == false()]
+    if target_type == 'user' and target_user_id:
+        try:
+            return [User.id == int(target_user_id)]
+        except (TypeError, ValueError):
+            return None
+    return None
+
+
+def _insert(model):
+    if db.engine.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(model)
+
+
+def fan_out(notification, conditions):
+    """
+    Creates the unread statuses of a flushed notification with one
+    INSERT ... SELECT from users. Returns the number of recipients; the
+    caller commits.
+    """
+    if conditions is None:
+        count = 0
+    else:
+        rows = select(literal(notification.id), User.id, false()).where(*conditions)
+        result = db.session.execute(
+            _insert(NotificationStatus).from_select(['notification_id', 'user_id', 'is_read'], rows)
+        )
+        count = result.rowcount
+    notification.recipient_count = count
+    return count
+
+
+def mark_read(notification, user_id):
+    """
+    Marks `notification` read for one user and counts the first read on
+    Notification.read_count. Returns False when the user is not a
+    recipient; the caller commits.
+    """
+    now = datetime.utcnow()
+    changed = db.session.execute(
+        update(NotificationStatus)
+        .where(
+            NotificationStatus.notification_id == notification.id,
+            NotificationStatus.user_id == user_id,
+            NotificationStatus.is_read == false()
+        )
+        .values(is_read=True, read_at=now),
+        execution_options={'synchronize_session': False}
+    ).rowcount
+
+    if not changed:
+        # Already read, or not a recipient at all
+        return db.session.execute(
+            select(NotificationStatus.id).filter_by(notification_id=notification.id, user_id=user_id)
+        ).first() is not None
+
+    db.session.execute(
+        update(Notification)
+        .where(Notification.id == notification.id)
+        .values(read_count=Notification.read_count + 1),
+        execution_options={'synchronize_session': False}
+    )
+    return True
@@ -0,0 +1,191 @@
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+
+logger = logging.getLogger(__name__)
+
+SOURCE_NAME = 'source.pdf'
+PAGE_DPI = 200
+THUMB_DPI = 36
+
+SESSION_ID_RE = re.compile(r'^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$')
+
+
+class InvalidSession(Exception):
+    """Unknown or malformed stamp tool session."""
+
+
+def _tree_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+class PdfPageRasterizer:
+    """
+    Page-on-demand rasterization of documents uploaded to the stamp tool.
+
+    An upload only stores the PDF in uploads/temp_docs/<session> and reads
+    its page count; pages are rendered one at a time (pdf2image first_page/
+    last_page) when requested - full pages at PAGE_DPI as page_<n>.png,
+    thumbnails at THUMB_DPI as thumb_<n>.jpg - and kept in the session
+    directory as a cache. After a full page is served the next one is
+    prefetched on a small thread pool. sweep() removes sessions not used
+    for STAMP_TOOL_SESSION_TTL seconds.
+    """
+
+    def __init__(self):
+        self.ttl = 6 * 3600
+        self.threads = 2
+        self._executor = None
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.ttl = app.config.get('STAMP_TOOL_SESSION_TTL', 6 * 3600)
+        self.threads = app.config.get('STAMP_TOOL_RENDER_THREADS', 2)
+
+    @staticmethod
+    def root(static_folder=None):
+        return os.path.join(static_folder or current_app.static_folder, 'uploads', 'temp_docs')
+
+    def session_dir(self, session_id, static_folder=None):
+        """Directory of an existing session; raises InvalidSession otherwise."""
+        if not session_id or not SESSION_ID_RE.match(session_id):
+            raise InvalidSession(session_id)
+        path = os.path.join(self.root(static_folder), session_id)
+        if not os.path.isfile(os.path.join(path, SOURCE_NAME)):
+            raise InvalidSession(session_id)
+        return path
+
+    # --- Upload ---
+
+    def open_session(self, file_storage, session_id):
+        """Stores the uploaded PDF and returns its page count."""
+        from pdf2image import pdfinfo_from_path
+
+        path = os.path.join(self.root(), session_id)
+        os.makedirs(path, exist_ok=True)
+        pdf_path = os.path.join(path, SOURCE_NAME)
+        file_storage.save(pdf_path)
+        try:
+            return int(pdfinfo_from_path(pdf_path)['Pages'])
+        except Exception:
+            shutil.rmtree(path, ignore_errors=True)
+            raise
+
+    # --- Pages ---
+
+    @staticmethod
+    def page_filename(page_number, thumb=False):
+        return f'thumb_{page_number}.jpg' if thumb else f'page_{page_number}.png'
+
+    def page_path(self, session_id, page_number, thumb=False, static_folder=None):
+        """
+        Path of a rendered page (1-based), rendering it on a cache miss.
+        Raises InvalidSession, or ValueError for a page outside the document.
+        """
+        path = self.session_dir(session_id, static_folder)
+        target = os.path.join(path, self.page_filename(page_number, thumb))
+        if not os.path.exists(target):
+            with self._page_lock(target):
+                if not os.path.exists(target):
+                    self._render(path, page_number, thumb, target)
+        # Keeps the session alive for the sweeper
+        os.utime(path)
+        return target
+
+    def prefetch(self, session_id, page_number, static_folder=None):
+        """Renders a full page in the background unless it is cached already."""
+        try:
+            path = self.session_dir(session_id, static_folder)
+        except InvalidSession:
+            return
+        target = os.path.join(path, self.page_filename(page_number))
+        if os.path.exists(target):
+            return
+        static_folder = static_folder or current_app.static_folder
+        self._get_executor().submit(self._prefetch, session_id, page_number, static_folder)
+
+    def _prefetch(self, session_id, page_number, static_folder):
+        try:
+            self.page_path(session_id, page_number, static_folder=static_folder)
+        except (InvalidSession, ValueError):
+            pass
+        except Exception:
+            logger.warning("Prefetch of page %s in %s failed", page_number, session_id, exc_info=True)
+
+    def _render(self, path, page_number, thumb, target):
+        from pdf2image import convert_from_path
+
+        if page_number < 1:
+            raise ValueError(f'Page {page_number} does not exist')
+        started = time.monotonic()
+        images = convert_from_path(
+            os.path.join(path, SOURCE_NAME),
+            dpi=THUMB_DPI if thumb else PAGE_DPI,
+            first_page=page_number, last_page=page_number
+        )
+        if not images:
+            raise ValueError(f'Page {page_number} does not exist')
+
+        # Written under a temporary name so readers never see a partial file
+        partial = f'{target}.part'
+        if thumb:
+            images[0].convert('RGB').save(partial, 'JPEG', quality=80)
+        else:
+            images[0].save(partial, 'PNG')
+        os.replace(partial, target)
+        logger.info("Rasterized %s in %.0f ms", target, (time.monotonic() - started) * 1000)
+
+    def _page_lock(self, target):
+        with self._lock:
+            return self._locks.setdefault(target, threading.Lock())
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix='pdf-pages')
+            return self._executor
+
+    # --- Sweeper ---
+
+    def sweep(self, static_folder=None, now=None):
+        """Removes expired session directories; returns (sessions removed, bytes reclaimed)."""
+        root = self.root(static_folder)
+        if not os.path.isdir(root):
+            return 0, 0
+        cutoff = (now or time.time()) - self.ttl
+        removed = reclaimed = 0
+        with os.scandir(root) as entries:
+            for entry in entries:
+                try:
+                    if not entry.is_dir() or entry.stat().st_mtime >= cutoff:
+                        continue
+                except OSError:
+                    continue
+                size = _tree_size(entry.path)
+                shutil.rmtree(entry.path, ignore_errors=True)
+                with self._lock:
+                    for key in [k for k in self._locks if k.startswith(entry.path + os.sep)]:
+                        del self._locks[key]
+                removed += 1
+                reclaimed += size
+        if removed:
+            logger.info("Removed %d stamp tool sessions (%d bytes)", removed, reclaimed)
+        return removed, reclaimed
+
+
+# Global instance
+pdf_pages = PdfPageRasterizer()
@@ -0,0 +1,105 @@
+import logging
+import threading
+import time
+
+from app.extensions import db
+
+logger = logging.getLogger(__name__)
+
+# Seconds between checks for channels subscribed after the listener started
+POLL_INTERVAL = 1.0
+
+
+class PgListener:
+    """
+    One LISTEN connection per process for every PostgreSQL NOTIFY channel
+    the app uses.
+
+    Modules register a channel with subscribe(channel, on_notify, on_reset)
+    and call ensure() before relying on notifications: it starts the
+    listener thread on a dedicated connection (detached from the pool) and
+    waits until LISTEN is active. on_notify(payload) runs on that thread
+    for every notification; on_reset() runs after the connection was lost,
+    since notifications sent meanwhile are gone.
+    """
+
+    def __init__(self):
+        self._callbacks = {}
+        self._listening = set()
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._thread = None
+
+    def subscribe(self, channel, on_notify, on_reset=None):
+        with self._lock:
+            self._callbacks[channel] = (on_notify, on_reset)
+
+    @staticmethod
+    def available():
+        """Whether the current app's database is PostgreSQL."""
+        try:
+            return db.engine.dialect.name == 'postgresql'
+        except RuntimeError:
+            # Outside an application context
+            return False
+
+    def ensure(self, engine=None, timeout=5):
+        """Starts the listener if needed; waits until LISTEN is active (NOTIFYs sent before would be lost)."""
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(
+                        target=self._run, args=(engine or db.engine,), name='pg-listener', daemon=True
+                    )
+                    self._thread.start()
+        self._ready.wait(timeout)
+
+    def _listen_new(self, connection):
+        with self._lock:
+            channels = [channel for channel in self._callbacks if channel not in self._listening]
+        for channel in channels:
+            connection.execute(f"LISTEN {channel}")
+            self._listening.add(channel)
+
+    def _run(self, engine):
+        while True:
+            try:
+                raw = engine.raw_connection()
+                # A dedicated connection, never returned to the pool
+                raw.detach()
+                connection = raw.driver_connection
+                connection.rollback()
+                connection.autocommit = True
+                self._listening = set()
+                self._listen_new(connection)
+                self._ready.set()
+                while True:
+                    for notify in connection.notifies(timeout=POLL_INTERVAL):
+                        self._dispatch(notify.channel, notify.payload)
+                    self._listen_new(connection)
+            except Exception:
+                logger.warning("PostgreSQL listener connection lost, reconnecting", exc_info=True)
+                self._reset()
+                time.sleep(1)
+
+    def _dispatch(self, channel, payload):
+        on_notify, _ = self._callbacks.get(channel, (None, None))
+        if on_notify is None:
+            return
+        try:
+            on_notify(payload)
+        except Exception:
+            logger.exception("Handler of NOTIFY on %s failed", channel)
+
+    def _reset(self):
+        with self._lock:
+            handlers = [on_reset for _, on_reset in self._callbacks.values() if on_reset]
+        for on_reset in handlers:
+            try:
+                on_reset()
+            except Exception:
+                logger.exception("PostgreSQL listener reset handler failed")
+
+
+# Global instance
+pg_listener = PgListener()
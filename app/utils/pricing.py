@@ -0,0 +1,220 @@
+import threading
+import time
+from bisect import bisect_right
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app.extensions import db
+
+
+class _PriceIndex:
+    """
+    Snapshot of one price catalog (services or additional services).
+
+    Every price period of a service is flattened into non-overlapping
+    segments sorted by start date, so a (service_id, date) lookup is a
+    single bisect. Overlapping periods resolve to the most recently created
+    one (highest id), same as the old per-call query did.
+    """
+
+    def __init__(self, base_rows, price_rows):
+        # service_id -> (base_price, parent_id)
+        self.base = {row.id: (row.price, row.parent_id) for row in base_rows}
+
+        periods = {}
+        for row in price_rows:
+            periods.setdefault(row.owner_id, []).append((row.id, row.start_date, row.end_date, row.price))
+
+        # service_id -> (segment_starts, segment_prices); price None = no period covers it
+        self.segments = {sid: self._flatten(rows) for sid, rows in periods.items()}
+
+    @staticmethod
+    def _flatten(rows):
+        bounds = set()
+        for _, start, end, _ in rows:
+            bounds.add(start)
+            if end is not None:
+                bounds.add(end + timedelta(days=1))
+
+        starts = []
+        prices = []
+        for point in sorted(bounds):
+            winner = None
+            for row_id, start, end, price in rows:
+                if start <= point and (end is None or end >= point):
+                    if winner is None or row_id > winner[0]:
+                        winner = (row_id, price)
+            value = winner[1] if winner else None
+            # Merge adjacent segments with the same price
+            if prices and prices[-1] == value:
+                continue
+            starts.append(point)
+            prices.append(value)
+        return starts, prices
+
+    def lookup(self, service_id, date_obj):
+        seen = set()
+        while service_id is not None and service_id not in seen:
+            seen.add(service_id)
+            if service_id not in self.base:
+                return None
+
+            segments = self.segments.get(service_id)
+            if segments:
+                pos = bisect_right(segments[0], date_obj) - 1
+                if pos >= 0 and segments[1][pos] is not None:
+                    return segments[1][pos]
+
+            base_price, parent_id = self.base[service_id]
+            if base_price > 0 or parent_id is None:
+                return base_price
+            service_id = parent_id
+        return None
+
+    def resolved_segments(self):
+        """
+        Flattened, inheritance-resolved price table:
+        [(service_id, start_date, end_date, price), ...] with start inclusive,
+        end exclusive and None meaning unbounded. Used to push prices into SQL.
+        """
+        result = []
+        for service_id in self.base:
+            # The price only changes where some service in the parent chain changes
+            points = set()
+            node, seen = service_id, set()
+            while node is not None and node not in seen and node in self.base:
+                seen.add(node)
+                if node in self.segments:
+                    points.update(self.segments[node][0])
+                node = self.base[node][1]
+
+            segments = []
+            current = self.lookup(service_id, date.min)
+            start = None
+            for point in sorted(points):
+                price = self.lookup(service_id, point)
+                if price != current:
+                    segments.append((service_id, start, point, current))
+                    start, current = point, price
+            segments.append((service_id, start, None, current))
+            result.extend(segments)
+        return result
+
+
+class PriceResolver:
+    """
+    Process-wide price resolver for Service / AdditionalService.
+
+    Loads all price periods once and answers (service_id, date) lookups from
+    memory, including parent inheritance. The snapshot is dropped whenever a
+    committed session touched a catalog row, and also expires after
+    PRICE_CACHE_TTL seconds so other workers pick up changes.
+    """
+
+    def __init__(self):
+        self.ttl = 60
+        self._lock = threading.Lock()
+        self._indexes = {}
+        self._listening = False
+
+    def init_app(self, app):
+        self.ttl = app.config.get('PRICE_CACHE_TTL', 60)
+        self.invalidate()
+        if not self._listening:
+            event.listen(Session, 'after_flush', self._on_flush)
+            event.listen(Session, 'after_commit', self._on_commit)
+            event.listen(Session, 'after_rollback', self._on_commit)
+            self._listening = True
+
+    def invalidate(self, kind=None):
+        with self._lock:
+            if kind is None:
+                self._indexes.clear()
+            else:
+                self._indexes.pop(kind, None)
+
+    def _load(self, kind):
+        from app.models import Service, ServicePrice, AdditionalService, AdditionalServicePrice
+
+        if kind == 'service':
+            base_rows = db.session.query(Service.id, Service.price, Service.parent_id).all()
+            price_rows = db.session.query(
+                ServicePrice.id, ServicePrice.service_id.label('owner_id'),
+                ServicePrice.start_date, ServicePrice.end_date, ServicePrice.price
+            ).all()
+        elif kind == 'additional':
+            base_rows = db.session.query(AdditionalService.id, AdditionalService.price, AdditionalService.parent_id).all()
+            price_rows = db.session.query(
+                AdditionalServicePrice.id, AdditionalServicePrice.additional_service_id.label('owner_id'),
+                AdditionalServicePrice.start_date, AdditionalServicePrice.end_date, AdditionalServicePrice.price
+            ).all()
+        else:
+            raise ValueError(f"Unknown price kind: {kind}")
+
+        return _PriceIndex(base_rows, price_rows)
+
+    def _get_index(self, kind):
+        now = time.monotonic()
+        entry = self._indexes.get(kind)
+        if entry and now - entry[1] < self.ttl:
+            return entry[0]
+
+        with self._lock:
+            entry = self._indexes.get(kind)
+            if entry and now - entry[1] < self.ttl:
+                return entry[0]
+            index = self._load(kind)
+            self._indexes[kind] = (index, time.monotonic())
+            return index
+
+    @staticmethod
+    def _normalize_date(date_obj):
+        if not date_obj:
+            return datetime.now().date()
+        if isinstance(date_obj, datetime):
+            return date_obj.date()
+        return date_obj
+
+    def get_price(self, service_id, date_obj=None, kind='service'):
+        """Price of a single service on a date, or None if the service does not exist."""
+        return self._get_index(kind).lookup(service_id, self._normalize_date(date_obj))
+
+    def resolve_prices(self, pairs, kind='service'):
+        """
+        Batch lookup: [(service_id, date), ...] -> [price, ...] in the same order.
+        Unknown services resolve to None.
+        """
+        index = self._get_index(kind)
+        return [index.lookup(service_id, self._normalize_date(date_obj)) for service_id, date_obj in pairs]
+
+    def resolved_segments(self, kind='service'):
+        return self._get_index(kind).resolved_segments()
+
+    # --- Invalidation on catalog writes ---
+
+    def _on_flush(self, session, flush_context):
+        from app.models import Service, ServicePrice, AdditionalService, AdditionalServicePrice
+
+        touched = session.info.setdefault('price_kinds_touched', set())
+        for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+            if isinstance(obj, (Service, ServicePrice)):
+                touched.add('service')
+            elif isinstance(obj, (AdditionalService, AdditionalServicePrice)):
+                touched.add('additional')
+
+    def _on_commit(self, session):
+        # Also used after rollback: a snapshot may have been built from flushed, now discarded rows
+        touched = session.info.pop('price_kinds_touched', None)
+        if touched:
+            for kind in touched:
+                self.invalidate(kind)
+
+
+# Global instance
+price_resolver = PriceResolver()
+
+
+def resolve_prices(pairs, kind='service'):
+    return price_resolver.resolve_prices(pairs, kind=kind)
@@ -0,0 +1,150 @@
+from datetime import date
+
+from sqlalchemy import Date, Float, Integer, String, and_, case, column, func, or_, select, update, values
+
+from app.extensions import db
+from app.models import Appointment, AppointmentAdditionalService, Service
+from app.utils.pricing import price_resolver
+
+# Changes returned by a dry run (the count is always exact)
+MAX_DIFF_ROWS = 500
+
+
+def _price_table(kind, name):
+    """Date-effective price view of a catalog as a VALUES CTE (parent inheritance already resolved)."""
+    # Open bounds become date.min/date.max so every VALUES column has a concrete
+    # type (untyped NULL columns resolve to text on PostgreSQL)
+    rows = [
+        (service_id, start or date.min, end or date.max, price)
+        for service_id, start, end, price in price_resolver.resolved_segments(kind)
+    ]
+    if not rows:
+        # VALUES needs at least one row: an empty range that never matches
+        rows = [(0, date.min, date.min, 0.0)]
+    return values(
+        column('service_id', Integer), column('start_date', Date),
+        column('end_date', Date), column('price', Float),
+        name=name
+    ).data(rows).cte(name)
+
+
+def _effective(prices, service_id_col, date_col):
+    return and_(
+        prices.c.service_id == service_id_col,
+        date_col >= prices.c.start_date,
+        date_col < prices.c.end_date
+    )
+
+
+def _new_costs(center_id, start_date, end_date):
+    """
+    CTE (appointment_id, old_cost, new_cost) for a center and date range.
+
+    Formula as in create_appointment:
+    (ServicePrice * Qty) + (AddServicePriceTotal * AddQty) - Discount, not below 0.
+    The main service is matched by the appointment's service name (case-insensitive,
+    lowest id wins), additional services through their association rows.
+    """
+    appt = Appointment.__table__
+    in_range = and_(
+        appt.c.center_id == center_id,
+        appt.c.date >= start_date,
+        appt.c.date <= end_date,
+        appt.c.service.isnot(None),
+        appt.c.service != ''
+    )
+
+    # Service names are matched in Python so case folding is the same on every backend
+    service_ids_by_name = {}
+    for svc_id, svc_name in db.session.query(Service.id, Service.name).order_by(Service.id):
+        service_ids_by_name.setdefault(svc_name.lower(), svc_id)
+    names = [
+        (name, service_ids_by_name.get(name.lower(), 0))
+        for (name,) in db.session.execute(select(appt.c.service).where(in_range).distinct())
+    ] or [('', 0)]
+    name_map = values(column('service', String), column('service_id', Integer), name='service_map').data(names).cte('service_map')
+
+    main_prices = _price_table('service', 'main_prices')
+    add_prices = _price_table('additional', 'additional_prices')
+
+    assoc = AppointmentAdditionalService.__table__
+    add_totals = (
+        select(assoc.c.appointment_id, func.sum(func.coalesce(add_prices.c.price, 0.0)).label('total'))
+        .select_from(assoc)
+        .join(appt, appt.c.id == assoc.c.appointment_id)
+        .outerjoin(add_prices, _effective(add_prices, assoc.c.additional_service_id, appt.c.date))
+        .where(in_range)
+        .group_by(assoc.c.appointment_id)
+        .cte('additional_totals')
+    )
+
+    qty = func.coalesce(func.nullif(appt.c.quantity, 0), 1)
+    add_qty = func.coalesce(func.nullif(appt.c.additional_service_quantity, 0), 1)
+    raw_cost = (
+        func.coalesce(main_prices.c.price, 0.0) * qty
+        + func.coalesce(add_totals.c.total, 0.0) * add_qty
+        - func.coalesce(appt.c.discount, 0.0)
+    )
+    new_cost = case((raw_cost < 0, 0.0), else_=raw_cost)
+
+    return (
+        select(appt.c.id.label('appointment_id'), appt.c.cost.label('old_cost'), new_cost.label('new_cost'))
+        .select_from(appt)
+        .outerjoin(name_map, name_map.c.service == appt.c.service)
+        .outerjoin(main_prices, _effective(main_prices, name_map.c.service_id, appt.c.date))
+        .outerjoin(add_totals, add_totals.c.appointment_id == appt.c.id)
+        .where(in_range)
+        .cte('new_costs')
+    )
+
+
+def _changed(new_costs):
+    return or_(
+        new_costs.c.old_cost.is_(None),
+        func.abs(new_costs.c.new_cost - new_costs.c.old_cost) > 0.0001
+    )
+
+
+def recalculate_costs(center_id, start_date, end_date, dry_run=False):
+    """
+    Recalculates appointment costs of a center for [start_date, end_date] with a
+    single UPDATE ... FROM against the date-effective price tables.
+
+    Returns {'total': appointments considered, 'changed': rows whose cost changes,
+    'diff': [...]} where diff (dry run only) lists
+    {'id', 'old_cost', 'new_cost'} of up to MAX_DIFF_ROWS changed rows.
+    The caller commits.
+    """
+    new_costs = _new_costs(center_id, start_date, end_date)
+
+    counts = db.session.execute(
+        select(
+            func.count(),
+            func.coalesce(func.sum(case((_changed(new_costs), 1), else_=0)), 0)
+        ).select_from(new_costs)
+    ).one()
+    result = {'total': counts[0], 'changed': int(counts[1]), 'diff': []}
+
+    if dry_run:
+        rows = db.session.execute(
+            select(new_costs.c.appointment_id, new_costs.c.old_cost, new_costs.c.new_cost)
+            .where(_changed(new_costs))
+            .order_by(new_costs.c.appointment_id)
+            .limit(MAX_DIFF_ROWS)
+        )
+        result['diff'] = [
+            {'id': row.appointment_id, 'old_cost': row.old_cost, 'new_cost': row.new_cost}
+            for row in rows
+        ]
+        return result
+
+    if result['changed']:
+        appt = Appointment.__table__
+        db.session.execute(
+            update(appt)
+            .where(appt.c.id == new_costs.c.appointment_id)
+            .where(_changed(new_costs))
+            .values(cost=new_costs.c.new_cost),
+            execution_options={'synchronize_session': False}
+        )
+    return result
@@ -0,0 +1,185 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import select, delete
+
+from app.extensions import db
+from app.models import MedicalCertificate
+from app.utils.pdf_pages import pdf_pages
+
+logger = logging.getLogger(__name__)
+
+
+def certificate_files(filename, pdf_filename=None):
+    """File names of one certificate: its pages (joined by '|') and the PDF."""
+    names = [name for name in (filename or '').split('|') if name]
+    if pdf_filename:
+        names.append(pdf_filename)
+    return names
+
+
+def _remove(path):
+    """Size of the removed file, None when it was already gone or is locked."""
+    try:
+        size = os.path.getsize(path)
+        os.remove(path)
+        return size
+    except FileNotFoundError:
+        return None
+    except OSError:
+        logger.warning("Could not remove %s", path, exc_info=True)
+        return None
+
+
+class CertificateRetention:
+    """
+    Retention of generated certificates and stamp tool leftovers.
+
+    Expired MedicalCertificate rows are selected in keyset chunks of
+    CERT_RETENTION_CHUNK ids (id, filename, pdf_filename only); each chunk
+    is bulk-deleted and committed before its page JPEGs and PDF are
+    removed on a thread pool, so a failed commit never leaves rows without
+    files. Files nothing points to are swept by directory scan:
+    unreferenced certificates, stale uploads/temp files and expired
+    uploads/temp_docs sessions. Files younger than CERT_RETENTION_GRACE
+    seconds are left alone, their rows may not be committed yet.
+    """
+
+    def __init__(self):
+        self.days = 30
+        self.chunk = 500
+        self.workers = 4
+        self.grace = 3600
+        self.temp_ttl = 24 * 3600
+        self._lock = threading.Lock()
+        self._last = None
+        self._totals = {'runs': 0, 'rows': 0, 'files': 0, 'bytes': 0}
+
+    def init_app(self, app):
+        self.days = app.config.get('CERT_RETENTION_DAYS', 30)
+        self.chunk = app.config.get('CERT_RETENTION_CHUNK', 500)
+        self.workers = app.config.get('CERT_RETENTION_WORKERS', 4)
+        self.grace = app.config.get('CERT_RETENTION_GRACE', 3600)
+        self.temp_ttl = app.config.get('UPLOAD_TEMP_TTL', 24 * 3600)
+
+    @staticmethod
+    def _dir(*parts):
+        return os.path.join(current_app.static_folder, 'uploads', *parts)
+
+    # --- Entry point ---
+
+    def run(self, now=None):
+        """One retention pass; returns (and keeps for stats()) its report."""
+        started = time.monotonic()
+        now = now or datetime.utcnow()
+        report = {'rows': 0, 'files': 0, 'orphans': 0, 'temp_files': 0, 'temp_sessions': 0, 'bytes': 0}
+
+        now_ts = time.time()
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='cert-retention') as executor:
+            self._expire(executor, now - timedelta(days=self.days), report)
+            self._sweep_orphans(executor, now_ts, report)
+            self._sweep_temp(executor, now_ts, report)
+
+        report['temp_sessions'], temp_doc_bytes = pdf_pages.sweep()
+        report['bytes'] += temp_doc_bytes
+        report['duration_ms'] = round((time.monotonic() - started) * 1000, 1)
+
+        with self._lock:
+            self._last = dict(report, finished_at=datetime.utcnow().isoformat())
+            self._totals['runs'] += 1
+            self._totals['rows'] += report['rows']
+            self._totals['files'] += report['files'] + report['orphans'] + report['temp_files']
+            self._totals['bytes'] += report['bytes']
+        logger.info(
+            "Certificate retention: %d rows, %d files, %d orphans, %d temp files, %d sessions, %d bytes in %.0f ms",
+            report['rows'], report['files'], report['orphans'], report['temp_files'],
+            report['temp_sessions'], report['bytes'], report['duration_ms']
+        )
+        return report
+
+    def stats(self):
+        """Totals since start and the report of the last run."""
+        with self._lock:
+            return {'last_run': dict(self._last) if self._last else None, 'totals': dict(self._totals)}
+
+    @staticmethod
+    def _count(report, key, sizes):
+        removed = [size for size in sizes if size is not None]
+        report[key] += len(removed)
+        report['bytes'] += sum(removed)
+
+    # --- Expired rows ---
+
+    def _expire(self, executor, cutoff, report):
+        cert_dir = self._dir('certificates')
+        last_id = 0
+        while True:
+            rows = db.session.execute(
+                select(MedicalCertificate.id, MedicalCertificate.filename, MedicalCertificate.pdf_filename)
+                .where(MedicalCertificate.generated_at < cutoff, MedicalCertificate.id > last_id)
+                .order_by(MedicalCertificate.id)
+                .limit(self.chunk)
+            ).all()
+            if not rows:
+                break
+            last_id = rows[-1].id
+
+            db.session.execute(
+                delete(MedicalCertificate).where(MedicalCertificate.id.in_([row.id for row in rows])),
+                execution_options={'synchronize_session': False}
+            )
+            db.session.commit()
+            report['rows'] += len(rows)
+
+            paths = [
+                os.path.join(cert_dir, os.path.basename(name))
+                for row in rows for name in certificate_files(row.filename, row.pdf_filename)
+            ]
+            sizes = list(executor.map(_remove, paths))
+            self._count(report, 'files', sizes)
+
+    # --- Directory scans ---
+
+    @staticmethod
+    def _old_files(directory, cutoff):
+        if not os.path.isdir(directory):
+            return []
+        found = []
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_file() and entry.stat().st_mtime < cutoff:
+                        found.append(entry)
+                except OSError:
+                    continue
+        return found
+
+    def _sweep_orphans(self, executor, now_ts, report):
+        candidates = self._old_files(self._dir('certificates'), now_ts - self.grace)
+        if not candidates:
+            return
+        referenced = set()
+        rows = db.session.execute(
+            select(MedicalCertificate.filename, MedicalCertificate.pdf_filename)
+            .execution_options(yield_per=self.chunk)
+        )
+        for row in rows:
+            referenced.update(certificate_files(row.filename, row.pdf_filename))
+
+        orphans = [entry.path for entry in candidates if entry.name not in referenced]
+        sizes = list(executor.map(_remove, orphans))
+        self._count(report, 'orphans', sizes)
+
+    def _sweep_temp(self, executor, now_ts, report):
+        stale = [entry.path for entry in self._old_files(self._dir('temp'), now_ts - self.temp_ttl)]
+        sizes = list(executor.map(_remove, stale))
+        self._count(report, 'temp_files', sizes)
+
+
+# Global instance
+certificate_retention = CertificateRetention()
@@ -0,0 +1,161 @@
+import codecs
+import csv
+from itertools import chain, islice
+
+import openpyxl
+
+# Bytes read from the upload per step; also the window used for sniffing
+CHUNK_SIZE = 64 * 1024
+
+CSV_ENCODINGS = ['utf-8-sig', 'cp1251']
+
+
+def is_supported(filename):
+    name = filename.lower()
+    return name.endswith('.csv') or name.endswith('.xlsx')
+
+
+def _sniff_encoding(chunk):
+    """First encoding that decodes the leading chunk (a trailing partial character is tolerated)."""
+    for encoding in CSV_ENCODINGS:
+        try:
+            codecs.getincrementaldecoder(encoding)().decode(chunk, final=False)
+            return encoding
+        except UnicodeDecodeError:
+            continue
+    return None
+
+
+def _decoding_attempts(first_chunk):
+    """
+    (encoding, errors) pairs to try in order: the sniffed encoding, the
+    candidates after it, and finally lossy UTF-8 which never fails.
+    """
+    encoding = _sniff_encoding(first_chunk)
+    attempts = []
+    if encoding:
+        attempts = [(e, 'strict') for e in CSV_ENCODINGS[CSV_ENCODINGS.index(encoding):]]
+    attempts.append(('utf-8', 'replace'))
+    return attempts
+
+
+def _iter_text(stream, first_chunk, encoding, errors='strict'):
+    decoder = codecs.getincrementaldecoder(encoding)(errors=errors)
+
+    chunk = first_chunk
+    while chunk:
+        yield decoder.decode(chunk)
+        chunk = stream.read(CHUNK_SIZE)
+    yield decoder.decode(b'', final=True)
+
+
+def _normalize_newlines(pieces):
+    """Universal newlines across chunk boundaries (\r\n and bare \r become \n)."""
+    pending = ''
+    for piece in pieces:
+        piece = pending + piece
+        pending = ''
+        if piece.endswith('\r'):
+            piece, pending = piece[:-1], '\r'
+        yield piece.replace('\r\n', '\n').replace('\r', '\n')
+    if pending:
+        yield '\n'
+
+
+def _iter_lines(pieces):
+    """Splits decoded chunks into lines so csv.reader can pull them lazily."""
+    partial = ''
+    for piece in pieces:
+        lines = (partial + piece).split('\n')
+        partial = lines.pop()
+        for line in lines:
+            yield line + '\n'
+    if partial:
+        yield partial
+
+
+def _sniff_dialect(pieces):
+    """Dialect from the first 2048 decoded characters; returns it with the pieces consumed for it."""
+    head = ''
+    buffered = []
+    for piece in pieces:
+        buffered.append(piece)
+        head += piece
+        if len(head) >= 2048:
+            break
+
+    try:
+        dialect = csv.Sniffer().sniff(head[:2048], delimiters=";,|\t")
+    except csv.Error:
+        dialect = csv.excel
+    return dialect, buffered
+
+
+def iter_csv_rows(stream):
+    """
+    Yields CSV rows from a binary stream without reading it whole.
+    Encoding (UTF-8 / cp1251) and dialect are sniffed from the first chunk.
+    If a later chunk does not decode, the stream is read again from the
+    start with the next encoding, skipping the rows already yielded.
+    """
+    first_chunk = stream.read(CHUNK_SIZE)
+    if not first_chunk:
+        return
+
+    dialect = None
+    yielded = 0
+    for attempt, (encoding, errors) in enumerate(_decoding_attempts(first_chunk)):
+        if attempt:
+            stream.seek(0)
+            first_chunk = stream.read(CHUNK_SIZE)
+        pieces = _iter_text(stream, first_chunk, encoding, errors)
+        try:
+            sniffed, buffered = _sniff_dialect(pieces)
+            dialect = dialect or sniffed
+            lines = _iter_lines(_normalize_newlines(chain(buffered, pieces)))
+            for index, row in enumerate(csv.reader(lines, dialect)):
+                if index < yielded:
+                    continue
+                yield row
+                yielded += 1
+            return
+        except UnicodeDecodeError:
+            continue
+
+
+def iter_xlsx_rows(file):
+    """Yields rows of the active sheet using openpyxl read-only mode."""
+    wb = openpyxl.load_workbook(file, read_only=True, data_only=True)
+    try:
+        for row in wb.active.iter_rows(values_only=True):
+            yield list(row)
+    finally:
+        wb.close()
+
+
+def cell_str(value):
+    """Stripped string value of a cell, None for empty cells."""
+    if value is None:
+        return None
+    value = str(value).strip()
+    return value or None
+
+
+def iter_rows(file, filename):
+    """
+    Lazily yields rows (lists of cell values) of an uploaded CSV/XLSX file.
+    Raises ValueError for other formats.
+    """
+    name = filename.lower()
+    if name.endswith('.csv'):
+        return iter_csv_rows(getattr(file, 'stream', file))
+    if name.endswith('.xlsx'):
+        return iter_xlsx_rows(file)
+    raise ValueError(f"Unsupported file format: {filename}")
+
+
+def peek_rows(rows, count=2):
+    """Returns (first `count` rows, iterator over all rows) without losing the peeked ones."""
+    rows = iter(rows)
+    head = list(islice(rows, count))
+    return head, chain(head, rows)
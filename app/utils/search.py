@@ -0,0 +1,241 @@
+import re
+import threading
+
+from sqlalchemy import event, func, or_, select
+from sqlalchemy.orm import Session
+
+from app.extensions import db
+
+# Candidate ids the in-process fallback passes to one SQL filter query
+FALLBACK_BATCH = 2000
+
+_NON_WORD = re.compile(r'[^\w]+|_')
+_NON_DIGIT = re.compile(r'\D+')
+
+
+def normalize_search_text(text):
+    """Lower-cased, ё -> е, punctuation replaced by single spaces."""
+    if not text:
+        return ''
+    text = text.lower().replace('ё', 'е')
+    return ' '.join(_NON_WORD.sub(' ', text).split())
+
+
+def normalize_phone(phone):
+    """Digits only."""
+    if not phone:
+        return ''
+    return _NON_DIGIT.sub('', phone)
+
+
+def _trigrams(text):
+    """pg_trgm style trigrams: every word padded with two spaces in front and one behind."""
+    grams = set()
+    for word in text.split():
+        padded = f"  {word} "
+        for i in range(len(padded) - 2):
+            grams.add(padded[i:i + 3])
+    return grams
+
+
+def similarity(a, b):
+    """Same measure as pg_trgm similarity(): shared / all distinct trigrams."""
+    grams_a, grams_b = _trigrams(a), _trigrams(b)
+    if not grams_a or not grams_b:
+        return 0.0
+    return len(grams_a & grams_b) / len(grams_a | grams_b)
+
+
+class NgramIndex:
+    """
+    In-process trigram index over (id, searchable text) rows, used where
+    pg_trgm is not available (SQLite in tests and local runs).
+
+    A document matches when every query token is a substring of its text
+    (same as the LIKE '%token%' conditions on PostgreSQL); trigrams of the
+    tokens only narrow down the documents that have to be checked.
+    """
+
+    def __init__(self, rows):
+        self.texts = {}
+        self.postings = {}
+        for doc_id, text in rows:
+            self.texts[doc_id] = text
+            for gram in self._token_grams(text):
+                self.postings.setdefault(gram, set()).add(doc_id)
+
+    @staticmethod
+    def _token_grams(text):
+        # Unpadded trigrams: they are present in any text containing the token
+        grams = set()
+        for token in text.split():
+            for i in range(len(token) - 2):
+                grams.add(token[i:i + 3])
+        return grams
+
+    def search(self, tokens, score_text):
+        """[(id, score)] of the matching documents, best first."""
+        candidates = None
+        for token in tokens:
+            for i in range(len(token) - 2):
+                docs = self.postings.get(token[i:i + 3], set())
+                candidates = docs if candidates is None else candidates & docs
+                if not candidates:
+                    return []
+        if candidates is None:
+            # Only tokens shorter than a trigram: check every document
+            candidates = self.texts.keys()
+
+        matches = []
+        for doc_id in candidates:
+            text = self.texts[doc_id]
+            if all(token in text for token in tokens):
+                matches.append((doc_id, similarity(score_text, text)))
+        matches.sort(key=lambda m: -m[1])
+        return matches
+
+
+class SearchService:
+    """
+    Patient name search over appointments and the patients card index.
+
+    Texts are matched on normalised columns (Appointment.search_name,
+    Patient.search_text / search_phone). On PostgreSQL the LIKE conditions
+    are served by pg_trgm GIN indexes and results are ranked by
+    similarity(); elsewhere an in-process NgramIndex answers the same
+    question. Callers get ids in rank order and load the columns they need.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._indexes = {}
+        self._listening = False
+
+    def init_app(self, app):
+        self.invalidate()
+        if not self._listening:
+            event.listen(Session, 'after_flush', self._on_flush)
+            self._listening = True
+
+    def invalidate(self, kind=None):
+        with self._lock:
+            if kind is None:
+                self._indexes.clear()
+            else:
+                self._indexes.pop(kind, None)
+
+    def _on_flush(self, session, flush_context):
+        from app.models import Appointment, Patient
+
+        for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+            if isinstance(obj, Appointment):
+                self.invalidate('appointments')
+            elif isinstance(obj, Patient):
+                self.invalidate('patients')
+
+    @staticmethod
+    def _use_trigram_sql():
+        return db.engine.dialect.name == 'postgresql'
+
+    # --- Fallback index ---
+
+    def _fallback_index(self, kind):
+        from app.models import Appointment, Patient
+
+        if kind == 'appointments':
+            table, text_cols = Appointment.__table__, [Appointment.search_name]
+        else:
+            table, text_cols = Patient.__table__, [Patient.search_text, Patient.search_phone]
+
+        # Bulk inserts bypass the flush listener: the row count and last id catch them
+        signature = tuple(db.session.execute(select(func.count(), func.max(table.c.id)).select_from(table)).one())
+        entry = self._indexes.get(kind)
+        if entry and entry[0] == signature:
+            return entry[1]
+
+        with self._lock:
+            rows = db.session.execute(select(table.c.id, *text_cols))
+            index = NgramIndex((row[0], ' '.join(part for part in row[1:] if part)) for row in rows)
+            self._indexes[kind] = (signature, index)
+            return index
+
+    def _fallback_ids(self, kind, tokens, score_text, model, where, order_by, limit):
+        matches = self._fallback_index(kind).search(tokens, score_text)
+        scores = dict(matches)
+        rows = []
+        batches = 0
+        # The SQL filters run before the limit: candidates go through them best
+        # first, batch by batch, until no later one can rank among the first `limit`
+        for start in range(0, len(matches), FALLBACK_BATCH):
+            if len(rows) >= limit and matches[start][1] < scores[rows[limit - 1]]:
+                break
+            batch = [doc_id for doc_id, _ in matches[start:start + FALLBACK_BATCH]]
+            rows.extend(db.session.execute(
+                select(model.id).where(model.id.in_(batch), *where).order_by(*order_by)
+            ).scalars())
+            batches += 1
+            # Stable sort keeps order_by as the tie-break within the same score
+            rows.sort(key=lambda doc_id: -scores[doc_id])
+
+        if batches > 1 and rows:
+            # Equal scores from different batches: order_by decides among the kept rows once more
+            cutoff = scores[rows[min(limit, len(rows)) - 1]]
+            kept = [doc_id for doc_id in rows if scores[doc_id] >= cutoff]
+            rows = db.session.execute(
+                select(model.id).where(model.id.in_(kept)).order_by(*order_by)
+            ).scalars().all()
+            rows.sort(key=lambda doc_id: -scores[doc_id])
+        return rows[:limit]
+
+    # --- Public API ---
+
+    def search_appointment_ids(self, query, where=(), limit=20):
+        """
+        Ids of appointments whose patient name contains every word of `query`,
+        most similar first, then newest. `where` adds SQL filters.
+        """
+        from app.models import Appointment
+
+        text = normalize_search_text(query)
+        tokens = text.split()
+        if not tokens:
+            return []
+        order_by = [Appointment.date.desc(), Appointment.time.desc(), Appointment.id.desc()]
+
+        if not self._use_trigram_sql():
+            return self._fallback_ids('appointments', tokens, text, Appointment, where, order_by, limit)
+
+        conditions = [Appointment.search_name.contains(token, autoescape=True) for token in tokens]
+        score = func.similarity(Appointment.search_name, text)
+        return db.session.execute(
+            select(Appointment.id).where(*conditions, *where).order_by(score.desc(), *order_by).limit(limit)
+        ).scalars().all()
+
+    def search_patient_ids(self, query, limit=20):
+        """
+        Ids of patients whose full name or phone (digits) contains every word
+        of `query`, most similar first, then by name.
+        """
+        from app.models import Patient
+
+        text = normalize_search_text(query)
+        tokens = text.split()
+        if not tokens:
+            return []
+        order_by = [Patient.surname, Patient.name, Patient.id]
+
+        if not self._use_trigram_sql():
+            return self._fallback_ids('patients', tokens, text, Patient, (), order_by, limit)
+
+        conditions = [
+            or_(Patient.search_text.contains(token, autoescape=True), Patient.search_phone.contains(token, autoescape=True))
+            for token in tokens
+        ]
+        score = func.similarity(Patient.search_text, text)
+        return db.session.execute(
+            select(Patient.id).where(*conditions).order_by(score.desc(), *order_by).limit(limit)
+        ).scalars().all()
+
+
+# Global instance
+search_service = SearchService()
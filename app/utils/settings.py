@@ -0,0 +1,156 @@
+import logging
+import threading
+import time
+
+from sqlalchemy import event, select, text
+from sqlalchemy.orm import Session
+
+from app.extensions import db
+from app.models import GlobalSetting
+from app.utils.pg_listen import pg_listener
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'global_settings'
+
+# Known keys: (type, default). Other keys read as plain strings.
+SETTINGS = {
+    'chat_image': (str, None),
+    'stamp_image': (str, None),
+    'guacamole_base_url': (str, 'https://guacamole.medical-system.ru'),
+}
+
+
+def _convert(key, value):
+    kind, default = SETTINGS.get(key, (str, None))
+    if value is None or value == '':
+        return default
+    try:
+        return kind(value)
+    except (TypeError, ValueError):
+        logger.warning("Invalid value for setting %s: %r", key, value)
+        return default
+
+
+class SettingsRegistry:
+    """
+    In-memory copy of the global_settings table.
+
+    All rows are loaded with one query on first use and kept together with
+    a version stamp; reads after that cost no query. A commit that touched
+    a GlobalSetting marks the copy stale in this process and, on
+    PostgreSQL, sends NOTIFY from the same transaction so the pg_listener
+    of every other worker does the same. SETTINGS_MAX_AGE (seconds) bounds
+    how long a copy is trusted without a notification, e.g. on SQLite
+    with several processes or after a lost listener connection.
+    """
+
+    def __init__(self):
+        self.max_age = 60
+        self.use_notify = True
+        self.version = 0
+        self._values = None
+        self._loaded_at = 0
+        self._lock = threading.Lock()
+        pg_listener.subscribe(CHANNEL, lambda payload: self.invalidate(), self.invalidate)
+        event.listen(Session, 'after_flush', self._after_flush)
+        event.listen(Session, 'after_commit', self._after_commit)
+        event.listen(Session, 'after_rollback', self._after_rollback)
+
+    def init_app(self, app):
+        self.max_age = app.config.get('SETTINGS_MAX_AGE', 60)
+        self.use_notify = app.config.get('SETTINGS_PG_NOTIFY', True)
+        # A new app may point at another database
+        self.invalidate()
+
+    # --- Reading ---
+
+    def get(self, key, default=None):
+        """Typed value of a setting. Unset, it reads as `default` when one is given, else as its SETTINGS default."""
+        stored = self._snapshot().get(key)
+        if default is not None and stored in (None, ''):
+            return default
+        value = _convert(key, stored)
+        return default if value is None else value
+
+    def all(self):
+        """Typed values of every stored and known setting."""
+        values = self._snapshot()
+        return {key: _convert(key, values.get(key)) for key in set(values) | set(SETTINGS)}
+
+    @property
+    def chat_image(self):
+        return self.get('chat_image')
+
+    @property
+    def stamp_image(self):
+        return self.get('stamp_image')
+
+    @property
+    def guacamole_base_url(self):
+        return self.get('guacamole_base_url')
+
+    def _snapshot(self):
+        values = self._values
+        if values is not None and time.monotonic() - self._loaded_at < self.max_age:
+            return values
+        return self._load()
+
+    def _load(self):
+        if self._notify_enabled():
+            pg_listener.ensure()
+        with self._lock:
+            version = self.version
+        values = dict(db.session.execute(select(GlobalSetting.key, GlobalSetting.value)).all())
+        with self._lock:
+            # An invalidation during the query keeps the copy stale
+            if version == self.version:
+                self._values = values
+                self._loaded_at = time.monotonic()
+        return values
+
+    # --- Writing ---
+
+    def set(self, key, value):
+        """Stores a setting in the current session; the caller commits, which refreshes the copy."""
+        setting = db.session.get(GlobalSetting, key)
+        if setting is None:
+            setting = GlobalSetting(key=key)
+            db.session.add(setting)
+        setting.value = value
+        return setting
+
+    def invalidate(self):
+        with self._lock:
+            self.version += 1
+            self._values = None
+
+    def _after_flush(self, session, flush_context):
+        touched = any(
+            isinstance(obj, GlobalSetting)
+            for obj in (*session.new, *session.dirty, *session.deleted)
+        )
+        if not touched:
+            return
+        session.info['settings_changed'] = True
+        connection = session.connection()
+        if self.use_notify and connection.dialect.name == 'postgresql':
+            # Delivered by PostgreSQL only if the transaction commits
+            connection.execute(text("SELECT pg_notify(:channel, '')"), {'channel': CHANNEL})
+
+    def _after_commit(self, session):
+        if session.info.pop('settings_changed', False):
+            self.invalidate()
+
+    @staticmethod
+    def _after_rollback(session):
+        session.info.pop('settings_changed', None)
+
+    # --- PostgreSQL fan-out ---
+
+    def _notify_enabled(self):
+        return self.use_notify and pg_listener.available()
+
+
+# Global instance
+settings_registry = SettingsRegistry()
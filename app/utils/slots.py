@@ -0,0 +1,313 @@
+import threading
+import time
+from collections import namedtuple
+from datetime import timedelta
+
+from flask import current_app
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+
+from app.extensions import db
+
+SLOT_MINUTES = 15
+SLOTS_PER_DAY = 24 * 60 // SLOT_MINUTES
+
+# Roles that may only book the :15 and :45 slots
+RESTRICTED_ROLES = ('org', 'doctor')
+
+_lock = threading.Lock()
+
+Booking = namedtuple('Booking', 'id time start end contract_number clinic_id')
+
+
+def time_to_minutes(value):
+    """'HH:MM' (or 'HH:MM:SS') -> minutes since midnight; unparsable values count as 0."""
+    try:
+        parts = value.split(':')
+        return int(parts[0]) * 60 + int(parts[1])
+    except (AttributeError, IndexError, ValueError):
+        return 0
+
+
+def minutes_to_time(minutes):
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+def slot_mask(start_minutes, duration):
+    """Bits of the 15-minute slots that [start, start + duration) touches."""
+    if duration <= 0:
+        return 0
+    first = max(start_minutes // SLOT_MINUTES, 0)
+    last = min((start_minutes + duration - 1) // SLOT_MINUTES, SLOTS_PER_DAY - 1)
+    if last < first:
+        return 0
+    return ((1 << (last - first + 1)) - 1) << first
+
+
+def _working_mask(weekend, restricted):
+    # Weekdays 08:00 - 19:30, weekends 09:00 - 17:45 (last slot start), no slots in the 13:00 lunch hour
+    start, end = (9 * 60, 17 * 60 + 45) if weekend else (8 * 60, 19 * 60 + 30)
+    mask = 0
+    for minutes in range(start, end + 1, SLOT_MINUTES):
+        if minutes // 60 == 13:
+            continue
+        if restricted and minutes % 30 != 15:
+            continue
+        mask |= 1 << (minutes // SLOT_MINUTES)
+    return mask
+
+
+WORKING_MASKS = {
+    (weekend, restricted): _working_mask(weekend, restricted)
+    for weekend in (False, True) for restricted in (False, True)
+}
+
+
+def working_mask(day, role=None):
+    """Slots offered for booking on `day` to a user with `role`."""
+    return WORKING_MASKS[(day.weekday() >= 5, role in RESTRICTED_ROLES)]
+
+
+def mask_times(mask):
+    """'HH:MM' of every set bit, in order."""
+    times = []
+    while mask:
+        low = mask & -mask
+        times.append(minutes_to_time((low.bit_length() - 1) * SLOT_MINUTES))
+        mask ^= low
+    return times
+
+
+class DayOccupancy:
+    """
+    Bookings of one center-day as a 96-bit integer, one bit per 15-minute
+    slot. `shared` marks slots held by more than one appointment, so a
+    single appointment can be left out (editing it) without a rebuild.
+    """
+
+    __slots__ = ('bookings', 'masks', 'mask', 'shared')
+
+    def __init__(self, rows=()):
+        self.bookings = []
+        self.masks = {}
+        self.mask = 0
+        self.shared = 0
+        for appt_id, time_str, duration, contract_number, clinic_id in rows:
+            start = time_to_minutes(time_str)
+            end = start + (duration or SLOT_MINUTES)
+            self.bookings.append(Booking(appt_id, time_str, start, end, contract_number, clinic_id))
+            bits = slot_mask(start, end - start)
+            self.masks[appt_id] = bits
+            self.shared |= self.mask & bits
+            self.mask |= bits
+        self.bookings.sort(key=lambda b: (b.start, b.id))
+
+    def occupied(self, exclude_id=None):
+        """Occupied slots, optionally without one appointment."""
+        bits = self.masks.get(_as_id(exclude_id), 0)
+        return (self.mask & ~bits) | (self.shared & bits)
+
+    def free_times(self, day, role=None, exclude_id=None):
+        return mask_times(working_mask(day, role) & ~self.occupied(exclude_id))
+
+    def conflict(self, start_minutes, duration, exclude_id=None):
+        """
+        The first booking overlapping [start, start + duration), or None.
+        The bitmap answers the common free case; on a hit the exact minute
+        ranges are compared, so off-grid times are not over-reported.
+        """
+        if not self.occupied(exclude_id) & slot_mask(start_minutes, duration):
+            return None
+        exclude_id = _as_id(exclude_id)
+        end = start_minutes + duration
+        for booking in self.bookings:
+            if booking.id != exclude_id and booking.end > start_minutes and booking.start < end:
+                return booking
+        return None
+
+
+def _as_id(value):
+    try:
+        return int(value) if value not in (None, '') else None
+    except (TypeError, ValueError):
+        return None
+
+
+class SlotEngine:
+    """
+    Per center-day occupancy bitmaps behind /api/slots and /api/slots/week.
+    Days are built from a narrow projection of appointments
+    and cached for SLOT_CACHE_TTL seconds. The days touched by ORM writes
+    are dropped once their transaction commits; bulk writers register
+    theirs with invalidate_on_commit().
+    """
+
+    def __init__(self):
+        self._days = {}
+        # appointment id -> cached (center_id, date) holding it
+        self._located = {}
+        # Bumped by every invalidation: a load that raced one is not cached
+        self._generation = 0
+        self._listening = False
+
+    def init_app(self, app):
+        self.invalidate()
+        if not self._listening:
+            event.listen(Session, 'after_flush', self._after_flush)
+            event.listen(Session, 'after_commit', self._after_commit)
+            event.listen(Session, 'after_rollback', self._after_rollback)
+            self._listening = True
+
+    def invalidate(self):
+        with _lock:
+            self._days.clear()
+            self._located.clear()
+            self._generation += 1
+
+    def _drop(self, key):
+        entry = self._days.pop(key, None)
+        if entry:
+            for appt_id in entry[1].masks:
+                if self._located.get(appt_id) == key:
+                    del self._located[appt_id]
+
+    def invalidate_days(self, keys):
+        """Drops the cached (center_id, date) pairs."""
+        with _lock:
+            for key in keys:
+                self._drop(key)
+            self._generation += 1
+
+    @staticmethod
+    def invalidate_on_commit(keys, session=None):
+        """Drops the cached (center_id, date) pairs when the current transaction commits."""
+        session = session or db.session
+        session.info.setdefault('slot_days', set()).update(keys)
+
+    def _after_flush(self, session, flush_context):
+        from app.models import Appointment
+
+        keys = set()
+        for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+            if not isinstance(obj, Appointment):
+                continue
+            keys.add((obj.center_id, obj.date))
+            # A moved appointment also frees the center-day it was cached in
+            # (its old values are not loaded when the instance was expired)
+            if obj.id in self._located:
+                keys.add(self._located[obj.id])
+        if keys:
+            # Dropped only after the commit: until then other requests would cache the old rows again
+            self.invalidate_on_commit(keys, session)
+
+    def _after_commit(self, session):
+        keys = session.info.pop('slot_days', None)
+        if keys:
+            self.invalidate_days(keys)
+
+    @staticmethod
+    def _after_rollback(session):
+        session.info.pop('slot_days', None)
+
+    # --- Loading ---
+
+    @staticmethod
+    def _load(center_id, start, end):
+        """{date: DayOccupancy} for start <= date < end, from one query."""
+        from app.models import Appointment
+
+        rows = {}
+        for day, *row in db.session.execute(
+            select(
+                Appointment.date, Appointment.id, Appointment.time, Appointment.duration,
+                Appointment.contract_number, Appointment.clinic_id
+            ).where(Appointment.center_id == center_id, Appointment.date >= start, Appointment.date < end)
+        ):
+            rows.setdefault(day, []).append(row)
+
+        days = {}
+        day = start
+        while day < end:
+            days[day] = DayOccupancy(rows.get(day, ()))
+            day += timedelta(days=1)
+        return days
+
+    def days(self, center_id, start, count=1, fresh=False):
+        """{date: DayOccupancy} for `count` days from `start`; uncached days come from one query."""
+        ttl = current_app.config.get('SLOT_CACHE_TTL', 30)
+        now = time.monotonic()
+        wanted = [start + timedelta(days=i) for i in range(count)]
+
+        result = {}
+        if not fresh:
+            for day in wanted:
+                entry = self._days.get((center_id, day))
+                if entry and now - entry[0] < ttl:
+                    result[day] = entry[1]
+        missing = [day for day in wanted if day not in result]
+        if missing:
+            generation = self._generation
+            loaded = self._load(center_id, missing[0], missing[-1] + timedelta(days=1))
+            with _lock:
+                # A commit invalidated days while this ran: the rows may predate it, serve them uncached
+                cache = generation == self._generation
+                for stale in [k for k, (stamp, _) in self._days.items() if now - stamp >= ttl]:
+                    self._drop(stale)
+                for day in missing:
+                    result[day] = loaded[day]
+                    if not cache:
+                        continue
+                    self._days[(center_id, day)] = (now, loaded[day])
+                    for appt_id in loaded[day].masks:
+                        self._located[appt_id] = (center_id, day)
+        return result
+
+    def day(self, center_id, day, fresh=False):
+        return self.days(center_id, day, 1, fresh)[day]
+
+    # --- Public API ---
+
+    def free_slots(self, center_id, day, role=None, exclude_id=None):
+        """Bookable start times ('HH:MM') of a center-day."""
+        return self.day(center_id, day).free_times(day, role, exclude_id)
+
+    def week_free_slots(self, center_id, start, role=None, count=7):
+        """{'YYYY-MM-DD': [free times]} for `count` days from `start`."""
+        return {
+            day.isoformat(): occupancy.free_times(day, role)
+            for day, occupancy in self.days(center_id, start, count).items()
+        }
+
+    def find_conflict(self, center_id, day, time_str, duration, exclude_id=None):
+        """
+        Booking that [time_str, +duration) overlaps, or None. Any row of the
+        center-day blocks a regular booking, allow_overlap ones included. Used
+        to name the blocking appointment once the database has rejected a write.
+        """
+        from app.models import Appointment
+
+        if not center_id:
+            return None
+        start = time_to_minutes(time_str)
+        row = db.session.execute(
+            select(
+                Appointment.id, Appointment.time, Appointment.start_minute, Appointment.end_minute,
+                Appointment.contract_number, Appointment.clinic_id
+            ).where(
+                Appointment.center_id == center_id, Appointment.date == day,
+                Appointment.start_minute < start + duration, Appointment.end_minute > start,
+                Appointment.id != (_as_id(exclude_id) or 0)
+            ).order_by(Appointment.start_minute, Appointment.id).limit(1)
+        ).first()
+        return Booking(*row) if row else None
+
+
+def is_overlap_violation(error):
+    """Whether an IntegrityError comes from the appointment overlap constraint."""
+    from app.models import OVERLAP_CONSTRAINT
+
+    return OVERLAP_CONSTRAINT in str(getattr(error, 'orig', error))
+
+
+# Global instance
+slot_engine = SlotEngine()
@@ -0,0 +1,189 @@
+from datetime import date, timedelta
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import and_, delete, extract, func, insert, select, true
+
+from app.extensions import db
+from app.models import Appointment, AppointmentDailyStat, AppointmentService, Service
+
+# Days refreshed per statement
+BATCH_SIZE = 500
+
+
+def is_kt_service(name):
+    return 'КТ' in name or 'KT' in name
+
+
+def _center_filter(column, center_id):
+    return column.is_(None) if center_id is None else column == center_id
+
+
+def _aggregate(where):
+    """
+    Rollup rows (dicts ready for insert) for the appointments matching `where`,
+    keyed by center, date, payment method and child/adult.
+
+    KT / OPTG counts follow calculate_stats: every main service (or the legacy
+    service string when there are none) adds the appointment quantity to its
+    category.
+    """
+    appt = Appointment.__table__
+
+    service_names = {}
+    for appt_id, name in db.session.execute(
+        select(AppointmentService.appointment_id, Service.name)
+        .join(Service, Service.id == AppointmentService.service_id)
+        .join(appt, appt.c.id == AppointmentService.appointment_id)
+        .where(where)
+    ):
+        service_names.setdefault(appt_id, []).append(name)
+
+    totals = {}
+    for row in db.session.execute(
+        select(
+            appt.c.id, appt.c.center_id, appt.c.date, appt.c.payment_method_id,
+            appt.c.is_child, appt.c.cost, appt.c.quantity, appt.c.service
+        ).where(where)
+    ):
+        is_child = bool(row.is_child)
+        key = (row.center_id, row.date, row.payment_method_id, is_child)
+        entry = totals.get(key)
+        if entry is None:
+            entry = totals[key] = {
+                'center_id': row.center_id,
+                'date': row.date,
+                'payment_method_id': row.payment_method_id,
+                'is_child': is_child,
+                'appointment_count': 0,
+                'cost_sum': 0.0,
+                'kt_count': 0,
+                'optg_count': 0
+            }
+        entry['appointment_count'] += 1
+        entry['cost_sum'] += row.cost or 0.0
+
+        qty = row.quantity if row.quantity else 1
+        for name in service_names.get(row.id) or [row.service]:
+            if not name:
+                continue
+            if is_kt_service(name):
+                entry['kt_count'] += qty
+            else:
+                entry['optg_count'] += qty
+
+    return list(totals.values())
+
+
+def refresh_stats_days(days):
+    """
+    Recomputes the rollup rows of the given (center_id, date) pairs from the
+    appointments table. Call it after writing appointments, in the same
+    transaction; the caller commits.
+    """
+    by_center = {}
+    for center_id, day in days:
+        if day is not None:
+            by_center.setdefault(center_id, set()).add(day)
+    if not by_center:
+        return
+
+    db.session.flush()
+    appt = Appointment.__table__
+    stat = AppointmentDailyStat.__table__
+    for center_id, dates in by_center.items():
+        dates = sorted(dates)
+        for start in range(0, len(dates), BATCH_SIZE):
+            chunk = dates[start:start + BATCH_SIZE]
+            db.session.execute(
+                delete(stat).where(_center_filter(stat.c.center_id, center_id), stat.c.date.in_(chunk))
+            )
+            rows = _aggregate(and_(_center_filter(appt.c.center_id, center_id), appt.c.date.in_(chunk)))
+            if rows:
+                db.session.execute(insert(stat), rows)
+
+
+def rebuild_stats(center_id=None, start_date=None, end_date=None):
+    """
+    Rebuilds the rollup for a center (all centers when None) and an optional
+    date range, one month of appointments at a time.
+    Returns the number of rollup rows written. The caller commits.
+    """
+    appt = Appointment.__table__
+    stat = AppointmentDailyStat.__table__
+
+    def scope(table):
+        conditions = []
+        if center_id is not None:
+            conditions.append(table.c.center_id == center_id)
+        if start_date:
+            conditions.append(table.c.date >= start_date)
+        if end_date:
+            conditions.append(table.c.date <= end_date)
+        return and_(true(), *conditions)
+
+    db.session.flush()
+    db.session.execute(delete(stat).where(scope(stat)))
+
+    first, last = db.session.execute(select(func.min(appt.c.date), func.max(appt.c.date)).where(scope(appt))).one()
+    if first is None:
+        return 0
+
+    written = 0
+    month = first.replace(day=1)
+    while month <= last:
+        next_month = (month + timedelta(days=32)).replace(day=1)
+        rows = _aggregate(and_(scope(appt), appt.c.date >= month, appt.c.date < next_month))
+        if rows:
+            db.session.execute(insert(stat), rows)
+            written += len(rows)
+        month = next_month
+    return written
+
+
+def load_period_stats(center_id, year, month=None):
+    """
+    Rollup of a month (one period per day) or of a year (one period per month).
+    Rows have period (date or month number), payment_method_id, is_child,
+    appointment_count, cost_sum, kt_count and optg_count.
+    """
+    stat = AppointmentDailyStat.__table__
+    if month:
+        start_date = date(year, month, 1)
+        end_date = date(year + 1, 1, 1) if month == 12 else date(year, month + 1, 1)
+        period = stat.c.date
+    else:
+        start_date, end_date = date(year, 1, 1), date(year + 1, 1, 1)
+        period = extract('month', stat.c.date)
+
+    query = (
+        select(
+            period.label('period'), stat.c.payment_method_id, stat.c.is_child,
+            func.sum(stat.c.appointment_count).label('appointment_count'),
+            func.sum(stat.c.cost_sum).label('cost_sum'),
+            func.sum(stat.c.kt_count).label('kt_count'),
+            func.sum(stat.c.optg_count).label('optg_count')
+        )
+        .where(stat.c.date >= start_date, stat.c.date < end_date)
+        .group_by(period, stat.c.payment_method_id, stat.c.is_child)
+    )
+    if center_id:
+        query = query.where(stat.c.center_id == center_id)
+    return db.session.execute(query).all()
+
+
+# --- CLI: flask stats rebuild ---
+
+stats_cli = AppGroup('stats', help='Statistics rollup maintenance.')
+
+
+@stats_cli.command('rebuild')
+@click.option('--center-id', type=int, default=None, help='Only this center.')
+@click.option('--year', type=int, default=None, help='Only this year.')
+def rebuild_command(center_id, year):
+    """Recomputes appointment_daily_stats from the appointments table."""
+    start_date = date(year, 1, 1) if year else None
+    end_date = date(year, 12, 31) if year else None
+    written = rebuild_stats(center_id, start_date, end_date)
+    db.session.commit()
+    click.echo(f"Rollup rows written: {written}")
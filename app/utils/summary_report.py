@@ -0,0 +1,153 @@
+import csv
+import io
+import threading
+import time
+from datetime import date
+
+from flask import current_app
+from sqlalchemy import extract, func, select
+
+from app.extensions import db
+from app.models import Appointment, Clinic, Doctor
+
+RUSSIAN_MONTHS = {
+    1: 'Январь', 2: 'Февраль', 3: 'Март', 4: 'Апрель',
+    5: 'Май', 6: 'Июнь', 7: 'Июль', 8: 'Август',
+    9: 'Сентябрь', 10: 'Октябрь', 11: 'Ноябрь', 12: 'Декабрь'
+}
+
+VIEW_TYPES = ('doctors', 'clinics')
+
+_cache_lock = threading.Lock()
+
+
+def month_periods(months, today=None):
+    """Current month and the (months - 1) previous ones, newest first."""
+    today = today or date.today()
+    periods = []
+    for i in range(months):
+        year = today.year
+        month = today.month - i
+        while month <= 0:
+            month += 12
+            year -= 1
+        periods.append({
+            'year': year,
+            'month': month,
+            'label': f"{RUSSIAN_MONTHS[month]} {year}",
+            'start': date(year, month, 1),
+            'end': date(year + (month == 12), month % 12 + 1, 1)
+        })
+    return periods
+
+
+def _month_counts(group_columns, periods):
+    """
+    One grouped query over the whole period: {(group values..., (year, month)): count}.
+    The date filter is a plain range; months are only extracted for grouping.
+    """
+    year_col = extract('year', Appointment.date)
+    month_col = extract('month', Appointment.date)
+    query = (
+        select(*group_columns, year_col, month_col, func.count())
+        .where(Appointment.date >= periods[-1]['start'], Appointment.date < periods[0]['end'])
+        .group_by(*group_columns, year_col, month_col)
+    )
+    counts = {}
+    for row in db.session.execute(query):
+        *keys, year, month, count = row
+        counts[(*keys, (int(year), int(month)))] = count
+    return counts
+
+
+def _doctor_rows(periods, search):
+    doctors_query = Doctor.query
+    if search:
+        doctors_query = doctors_query.filter(Doctor.name.ilike(f'%{search}%'))
+    doctors = doctors_query.order_by(Doctor.name).all()
+
+    # An appointment counts for the doctor it links to and for every doctor
+    # whose name is in its legacy `doctor` string (once per doctor)
+    ids_by_name = {}
+    for doctor in doctors:
+        ids_by_name.setdefault(doctor.name, []).append(doctor.id)
+
+    cells = {}
+    for (doctor_id, doctor_name, month_key), count in _month_counts(
+        [Appointment.doctor_id, Appointment.doctor], periods
+    ).items():
+        owners = {doctor_id} if doctor_id is not None else set()
+        owners.update(ids_by_name.get(doctor_name, ()))
+        for owner in owners:
+            cells[(owner, month_key)] = cells.get((owner, month_key), 0) + count
+
+    return [{
+        'id': doctor.id,
+        'name': doctor.name,
+        'months': [
+            {'label': p['label'], 'count': cells.get((doctor.id, (p['year'], p['month'])), 0)}
+            for p in periods
+        ]
+    } for doctor in doctors]
+
+
+def _clinic_rows(periods, search):
+    clinics_query = Clinic.query
+    if search:
+        clinics_query = clinics_query.filter(Clinic.name.ilike(f'%{search}%'))
+    clinics = clinics_query.order_by(Clinic.name).all()
+
+    cells = _month_counts([Appointment.clinic_id], periods)
+    return [{
+        'id': clinic.id,
+        'name': clinic.name,
+        'months': [
+            {'label': p['label'], 'count': cells.get((clinic.id, (p['year'], p['month'])), 0)}
+            for p in periods
+        ]
+    } for clinic in clinics]
+
+
+def build_summary(view_type='doctors', months=1, search=''):
+    """
+    Doctor (or clinic) x month appointment counts for the summary report:
+    {view_type: [{'id', 'name', 'months': [{'label', 'count'}]}], 'months': [labels]}
+    """
+    if view_type not in VIEW_TYPES:
+        raise ValueError(f"Unknown view type: {view_type}")
+    periods = month_periods(max(months, 1))
+    rows = _doctor_rows(periods, search) if view_type == 'doctors' else _clinic_rows(periods, search)
+    return {view_type: rows, 'months': [p['label'] for p in periods]}
+
+
+def cached_summary(view_type='doctors', months=1, search=''):
+    """
+    build_summary behind a per-app cache keyed by the parameters (and today's
+    date, so month labels roll over). Entries live REPORT_CACHE_TTL seconds.
+    """
+    ttl = current_app.config.get('REPORT_CACHE_TTL', 60)
+    cache = current_app.extensions.setdefault('summary_report_cache', {})
+    key = (view_type, months, search, date.today())
+
+    now = time.monotonic()
+    entry = cache.get(key)
+    if entry and now - entry[0] < ttl:
+        return entry[1]
+
+    data = build_summary(view_type, months, search)
+    with _cache_lock:
+        # Drop expired entries so the cache does not grow with every search term
+        for stale in [k for k, (stamp, _) in cache.items() if now - stamp >= ttl]:
+            cache.pop(stale, None)
+        cache[key] = (now, data)
+    return data
+
+
+def summary_csv(data, view_type):
+    """CSV (semicolon separated, UTF-8 with BOM for Excel) of a summary built above."""
+    out = io.StringIO()
+    writer = csv.writer(out, delimiter=';')
+    writer.writerow(['Врач' if view_type == 'doctors' else 'Клиника'] + data['months'])
+    for row in data[view_type]:
+        writer.writerow([row['name']] + [cell['count'] for cell in row['months']])
+    return '\ufeff' + out.getvalue()
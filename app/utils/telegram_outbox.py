@@ -0,0 +1,318 @@
+import itertools
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+SPOOL_SUFFIX = '.json'
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, OSError):
+        return True
+    return True
+
+
+class TokenBucket:
+    """`rate` tokens per second, at most `burst` saved up."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def delay(self):
+        """Seconds until a token is available (0 when one was taken)."""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+class TelegramOutbox:
+    """
+    Delivery of Telegram Bot API calls through one background worker.
+
+    Calls are queued by API method name ('sendMessage', 'sendPhoto'); the
+    URL, which contains the bot token, is built from `base_url` when the
+    call is sent, so spool files hold no token and messages recovered after
+    a token rotation go to the current bot.
+
+    Every call is spooled to TELEGRAM_OUTBOX_DIR (one JSON file each) before
+    it enters a bounded in-memory queue, and the file is removed once
+    Telegram accepted it or gave up on it, so pending messages survive a
+    restart: on start the worker picks up files left by processes that
+    are no longer running. Sending uses one pooled requests.Session, a
+    token bucket (TELEGRAM_RATE_PER_MINUTE, TELEGRAM_BURST) and retries with
+    exponential backoff, honouring Telegram's retry_after on 429.
+
+    Repeated errors (same digest key) are sent once and then counted;
+    after TELEGRAM_DIGEST_WINDOW seconds one digest message reports the
+    repetitions.
+    """
+
+    def __init__(self):
+        self.base_url = None
+        self.spool_dir = None
+        self.max_queue = 500
+        self.rate_per_minute = 20
+        self.burst = 5
+        self.max_attempts = 5
+        self.max_backoff = 60
+        self.digest_window = 60
+        self._queue = None
+        self._worker = None
+        self._lock = threading.Lock()
+        self._session = None
+        self._ids = itertools.count()
+        self._recovered = False
+        self._digests = {}
+        self._counters = {'sent': 0, 'failed': 0, 'dropped': 0, 'retried': 0, 'coalesced': 0}
+
+    def init_app(self, app, base_url=None):
+        self.base_url = base_url
+        self.spool_dir = app.config.get('TELEGRAM_OUTBOX_DIR') or os.path.join(app.instance_path, 'telegram_outbox')
+        self.max_queue = app.config.get('TELEGRAM_QUEUE_SIZE', 500)
+        self.rate_per_minute = app.config.get('TELEGRAM_RATE_PER_MINUTE', 20)
+        self.burst = app.config.get('TELEGRAM_BURST', 5)
+        self.max_attempts = app.config.get('TELEGRAM_MAX_ATTEMPTS', 5)
+        self.max_backoff = app.config.get('TELEGRAM_MAX_BACKOFF', 60)
+        self.digest_window = app.config.get('TELEGRAM_DIGEST_WINDOW', 60)
+
+    # --- Public API ---
+
+    def enqueue(self, method, json_payload=None, data=None, files=None):
+        """Spools and queues one API call. False when the queue is full (the call is dropped)."""
+        self._ensure_started()
+        item = {'method': method, 'json': json_payload, 'data': data, 'files': files, 'attempts': 0}
+        item['spool'] = self._spool(item)
+        try:
+            self._queue.put_nowait(item)
+            return True
+        except queue.Full:
+            self._discard(item)
+            self._count('dropped')
+            logger.warning("Telegram outbox full, message dropped")
+            return False
+
+    def enqueue_coalesced(self, key, method, json_payload, digest_text):
+        """
+        Queues the first message of `key` per digest window; repeats are
+        only counted and later summarised by digest_text(count).
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._digests.get(key)
+            if entry is not None and now - entry['since'] < self.digest_window:
+                entry['count'] += 1
+                self._counters['coalesced'] += 1
+                return True
+            self._digests[key] = {'since': now, 'count': 0, 'method': method, 'payload': json_payload, 'text': digest_text}
+        return self.enqueue(method, json_payload)
+
+    def has_pending(self):
+        """Whether spool files are waiting (e.g. left by a previous run)."""
+        try:
+            return any(name.endswith(SPOOL_SUFFIX) for name in os.listdir(self.spool_dir))
+        except (OSError, TypeError):
+            return False
+
+    def start(self):
+        """Starts the worker, which also picks up spooled messages."""
+        self._ensure_started()
+
+    def drain(self, timeout=5):
+        """Waits up to `timeout` seconds for the queue to empty (used at exit)."""
+        deadline = time.monotonic() + timeout
+        while self._queue is not None and self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.05)
+        return self._queue is None or not self._queue.unfinished_tasks
+
+    def stats(self):
+        with self._lock:
+            result = dict(self._counters, digests_open=len(self._digests))
+        result['queued'] = self._queue.qsize() if self._queue else 0
+        return result
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._counters[name] += amount
+
+    # --- Spool ---
+
+    def _spool(self, item):
+        if not self.spool_dir:
+            return None
+        try:
+            os.makedirs(self.spool_dir, exist_ok=True)
+            name = f"{time.time_ns()}-{os.getpid()}-{next(self._ids)}{SPOOL_SUFFIX}"
+            path = os.path.join(self.spool_dir, name)
+            with open(f"{path}.tmp", 'w', encoding='utf-8') as f:
+                json.dump({k: v for k, v in item.items() if k != 'spool'}, f, ensure_ascii=False)
+            os.replace(f"{path}.tmp", path)
+            return path
+        except OSError:
+            logger.warning("Could not spool Telegram message", exc_info=True)
+            return None
+
+    @staticmethod
+    def _discard(item):
+        if item.get('spool'):
+            try:
+                os.remove(item['spool'])
+            except OSError:
+                pass
+
+    def _recover(self):
+        """Queues spool files of processes that are gone (renamed first, so only one process takes each)."""
+        if not self.spool_dir or not os.path.isdir(self.spool_dir):
+            return 0
+        recovered = 0
+        for name in sorted(os.listdir(self.spool_dir)):
+            if not name.endswith(SPOOL_SUFFIX):
+                continue
+            try:
+                pid = int(name.split('-')[1])
+            except (IndexError, ValueError):
+                continue
+            # Our own pid can only be a previous incarnation (e.g. pid 1 in a container):
+            # recovery runs before this process spools anything
+            if pid != os.getpid() and _pid_alive(pid):
+                continue
+            source = os.path.join(self.spool_dir, name)
+            target = os.path.join(self.spool_dir, f"{time.time_ns()}-{os.getpid()}-{next(self._ids)}{SPOOL_SUFFIX}")
+            try:
+                os.rename(source, target)
+                with open(target, encoding='utf-8') as f:
+                    item = json.load(f)
+            except (OSError, ValueError):
+                continue
+            item['spool'] = target
+            if 'method' not in item:
+                # Spooled with the full URL by an older version: keep only the method
+                item['method'] = item.pop('url', '').rsplit('/', 1)[-1]
+            try:
+                self._queue.put_nowait(item)
+                recovered += 1
+            except queue.Full:
+                break
+        if recovered:
+            logger.info("Recovered %d spooled Telegram messages", recovered)
+        return recovered
+
+    # --- Worker ---
+
+    def _ensure_started(self):
+        if self._worker is not None and self._worker.is_alive():
+            return
+        with self._lock:
+            if self._worker is not None and self._worker.is_alive():
+                return
+            if self._queue is None:
+                self._queue = queue.Queue(maxsize=self.max_queue)
+            self._session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=2)
+            self._session.mount('https://', adapter)
+            self._session.mount('http://', adapter)
+            self._worker = threading.Thread(target=self._run, name='telegram-outbox', daemon=True)
+            self._worker.start()
+            recover, self._recovered = not self._recovered, True
+        if recover:
+            self._recover()
+
+    def _run(self):
+        bucket = TokenBucket(self.rate_per_minute / 60.0, self.burst)
+        while True:
+            self._flush_digests()
+            try:
+                item = self._queue.get(timeout=1)
+            except queue.Empty:
+                continue
+            try:
+                self._deliver(item, bucket)
+            except Exception:
+                logger.exception("Telegram outbox worker error")
+            finally:
+                self._queue.task_done()
+
+    def _flush_digests(self):
+        now = time.monotonic()
+        due = []
+        with self._lock:
+            for key, entry in list(self._digests.items()):
+                if now - entry['since'] >= self.digest_window:
+                    del self._digests[key]
+                    if entry['count']:
+                        due.append(entry)
+        for entry in due:
+            payload = dict(entry['payload'], text=entry['text'](entry['count']))
+            self.enqueue(entry['method'], payload)
+
+    def _deliver(self, item, bucket):
+        while True:
+            wait = bucket.delay()
+            if wait:
+                time.sleep(wait)
+                continue
+
+            item['attempts'] += 1
+            retry_after = None
+            try:
+                response = self._post(item)
+                if response.status_code < 400:
+                    self._count('sent')
+                    self._discard(item)
+                    return
+                if response.status_code == 429:
+                    try:
+                        retry_after = response.json().get('parameters', {}).get('retry_after')
+                    except ValueError:
+                        pass
+                elif response.status_code < 500:
+                    # Bad request, blocked bot...: retrying will not help
+                    logger.error("Telegram rejected message: %s %s", response.status_code, response.text[:200])
+                    self._count('failed')
+                    self._discard(item)
+                    return
+                reason = f"HTTP {response.status_code}"
+            except FileNotFoundError as e:
+                logger.error("Telegram attachment missing, message dropped: %s", e)
+                self._count('failed')
+                self._discard(item)
+                return
+            except (requests.RequestException, OSError) as e:
+                reason = str(e)
+
+            if item['attempts'] >= self.max_attempts:
+                logger.error("Telegram message dropped after %d attempts: %s", item['attempts'], reason)
+                self._count('failed')
+                self._discard(item)
+                return
+            self._count('retried')
+            time.sleep(min(self.max_backoff, retry_after or 2 ** (item['attempts'] - 1)))
+
+    def _post(self, item):
+        url = f"{self.base_url}/{item['method']}"
+        if item.get('files'):
+            handles = {key: open(path, 'rb') for key, path in item['files'].items()}
+            try:
+                return self._session.post(url, data=item.get('data'), files=handles, timeout=30)
+            finally:
+                for handle in handles.values():
+                    handle.close()
+        return self._session.post(url, json=item.get('json'), timeout=10)
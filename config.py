@@ -41,6 +41,10 @@ class Config:
     MAX_CONTENT_LENGTH = 128 * 1024 * 1024
     ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
 
+    # Chat push over SSE keeps a worker busy per open page: enable only with a threaded
+    # or async worker class (gunicorn -k gthread --threads N, or gevent). Otherwise pages poll.
+    CHAT_SSE_ENABLED = os.environ.get('CHAT_SSE_ENABLED') == '1'
+
     # Telegram Bot
     TELEGRAM_BOT_TOKEN = os.environ.get('TELEGRAM_BOT_TOKEN')
     TELEGRAM_CHAT_ID = os.environ.get('TELEGRAM_CHAT_ID')
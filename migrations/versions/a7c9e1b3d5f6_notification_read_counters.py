@@ -0,0 +1,50 @@
+"""Add notification read counters
+
+Revision ID: a7c9e1b3d5f6
+Revises: f6b8d0a2c4e5
+Create Date: 2026-10-17 21:14:52.630184
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7c9e1b3d5f6'
+down_revision = 'f6b8d0a2c4e5'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('notifications', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('recipient_count', sa.Integer(), server_default='0', nullable=False))
+        batch_op.add_column(sa.Column('read_count', sa.Integer(), server_default='0', nullable=False))
+
+    # One status per notification and user before the unique constraint: the
+    # oldest read one if the user read any duplicate, else the oldest
+    op.execute(
+        "DELETE FROM notification_statuses WHERE id NOT IN ("
+        "SELECT COALESCE(MIN(CASE WHEN is_read THEN id END), MIN(id)) "
+        "FROM notification_statuses GROUP BY notification_id, user_id)"
+    )
+    op.execute(sa.text(
+        "UPDATE notifications SET "
+        "recipient_count = (SELECT COUNT(*) FROM notification_statuses s WHERE s.notification_id = notifications.id), "
+        "read_count = (SELECT COUNT(*) FROM notification_statuses s WHERE s.notification_id = notifications.id "
+        "AND s.is_read = :read)"
+    ).bindparams(read=True))
+
+    with op.batch_alter_table('notification_statuses', schema=None) as batch_op:
+        batch_op.create_unique_constraint('_notification_user_uc', ['notification_id', 'user_id'])
+        batch_op.create_index('ix_notification_statuses_user', ['user_id', 'is_read'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('notification_statuses', schema=None) as batch_op:
+        batch_op.drop_index('ix_notification_statuses_user')
+        batch_op.drop_constraint('_notification_user_uc', type_='unique')
+
+    with op.batch_alter_table('notifications', schema=None) as batch_op:
+        batch_op.drop_column('read_count')
+        batch_op.drop_column('recipient_count')
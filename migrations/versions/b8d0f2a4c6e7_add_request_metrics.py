@@ -0,0 +1,44 @@
+"""Add request_metrics table
+
+Revision ID: b8d0f2a4c6e7
+Revises: a7c9e1b3d5f6
+Create Date: 2026-10-17 22:02:18.947351
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b8d0f2a4c6e7'
+down_revision = 'a7c9e1b3d5f6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('request_metrics',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('period_start', sa.DateTime(), nullable=False),
+        sa.Column('endpoint', sa.String(length=120), nullable=False),
+        sa.Column('requests', sa.Integer(), nullable=False),
+        sa.Column('errors', sa.Integer(), nullable=False),
+        sa.Column('total_ms', sa.Float(), nullable=False),
+        sa.Column('max_ms', sa.Float(), nullable=False),
+        sa.Column('latency_buckets', sa.Text(), nullable=False),
+        sa.Column('queries', sa.Integer(), nullable=False),
+        sa.Column('sql_ms', sa.Float(), nullable=False),
+        sa.Column('max_queries', sa.Integer(), nullable=False),
+        sa.Column('repeated_statement', sa.Text(), nullable=True),
+        sa.Column('repeated_count', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('request_metrics', schema=None) as batch_op:
+        batch_op.create_index('ix_request_metrics_period_endpoint', ['period_start', 'endpoint'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('request_metrics', schema=None) as batch_op:
+        batch_op.drop_index('ix_request_metrics_period_endpoint')
+
+    op.drop_table('request_metrics')
@@ -0,0 +1,42 @@
+"""Add appointment hot path indexes
+
+Revision ID: c3e5a7b9d1f2
+Revises: b2d4f6a8c0e1
+Create Date: 2026-10-17 15:41:08.226573
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c3e5a7b9d1f2'
+down_revision = 'b2d4f6a8c0e1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    is_postgres = op.get_bind().dialect.name == 'postgresql'
+    if is_postgres:
+        # Trigram operator class for the ILIKE '%...%' index below
+        op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+
+    with op.batch_alter_table('appointments', schema=None) as batch_op:
+        batch_op.create_index('ix_appointments_center_date', ['center_id', 'date'], unique=False)
+        batch_op.create_index('ix_appointments_date_payment_method', ['date', 'payment_method_id'], unique=False)
+        batch_op.create_index('ix_appointments_author_date', ['author_id', 'date'], unique=False)
+        batch_op.create_index('ix_appointments_doctor_date', ['doctor_id', 'date'], unique=False)
+        batch_op.create_index(
+            'ix_appointments_patient_name_trgm', ['patient_name'], unique=False,
+            postgresql_using='gin', postgresql_ops={'patient_name': 'gin_trgm_ops'}
+        )
+
+
+def downgrade():
+    with op.batch_alter_table('appointments', schema=None) as batch_op:
+        batch_op.drop_index('ix_appointments_patient_name_trgm')
+        batch_op.drop_index('ix_appointments_doctor_date')
+        batch_op.drop_index('ix_appointments_author_date')
+        batch_op.drop_index('ix_appointments_date_payment_method')
+        batch_op.drop_index('ix_appointments_center_date')
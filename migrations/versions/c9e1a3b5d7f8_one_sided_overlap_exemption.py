@@ -0,0 +1,70 @@
+"""Compare regular bookings with allow_overlap rows too
+
+Revision ID: c9e1a3b5d7f8
+Revises: b8d0f2a4c6e7
+Create Date: 2026-10-18 10:12:40.518204
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'c9e1a3b5d7f8'
+down_revision = 'b8d0f2a4c6e7'
+branch_labels = None
+depends_on = None
+
+OVERLAP_CONSTRAINT = 'ex_appointments_no_overlap'
+
+SQLITE_EVENTS = (
+    ('insert', 'INSERT', ''),
+    ('update', 'UPDATE OF center_id, date, start_minute, end_minute, allow_overlap', 'a.id != NEW.id AND '),
+)
+
+
+def _sqlite_triggers(compare):
+    for suffix, event, check in SQLITE_EVENTS:
+        op.execute(f"DROP TRIGGER IF EXISTS {OVERLAP_CONSTRAINT}_{suffix}")
+        op.execute(
+            f"CREATE TRIGGER {OVERLAP_CONSTRAINT}_{suffix} BEFORE {event} ON appointments "
+            "WHEN NOT NEW.allow_overlap BEGIN "
+            f"SELECT RAISE(ABORT, '{OVERLAP_CONSTRAINT}') WHERE EXISTS (SELECT 1 FROM appointments a "
+            f"WHERE {check}a.center_id = NEW.center_id AND a.date = NEW.date {compare}"
+            "AND a.start_minute < NEW.end_minute AND a.end_minute > NEW.start_minute); END"
+        )
+
+
+def upgrade():
+    conn = op.get_bind()
+    if conn.dialect.name == 'postgresql':
+        # The exclusion constraint keeps covering regular pairs; flagged rows are checked here
+        op.execute(
+            f"CREATE OR REPLACE FUNCTION {OVERLAP_CONSTRAINT}_flagged() RETURNS trigger AS $$ "
+            "BEGIN "
+            "IF NEW.center_id IS NULL THEN RETURN NEW; END IF; "
+            "PERFORM pg_advisory_xact_lock(NEW.center_id, NEW.date - DATE '2000-01-01'); "
+            "IF NOT NEW.allow_overlap AND EXISTS (SELECT 1 FROM appointments a "
+            "WHERE a.id <> NEW.id AND a.center_id = NEW.center_id AND a.date = NEW.date AND a.allow_overlap "
+            "AND a.start_minute < NEW.end_minute AND a.end_minute > NEW.start_minute) THEN "
+            f"RAISE EXCEPTION 'conflicting key value violates exclusion constraint \"{OVERLAP_CONSTRAINT}\"' "
+            f"USING ERRCODE = 'exclusion_violation', CONSTRAINT = '{OVERLAP_CONSTRAINT}'; "
+            "END IF; "
+            "RETURN NEW; "
+            "END $$ LANGUAGE plpgsql"
+        )
+        op.execute(
+            f"CREATE TRIGGER {OVERLAP_CONSTRAINT}_flagged "
+            "BEFORE INSERT OR UPDATE OF center_id, date, start_minute, end_minute, allow_overlap ON appointments "
+            f"FOR EACH ROW EXECUTE FUNCTION {OVERLAP_CONSTRAINT}_flagged()"
+        )
+    elif conn.dialect.name == 'sqlite':
+        _sqlite_triggers('')
+
+
+def downgrade():
+    conn = op.get_bind()
+    if conn.dialect.name == 'postgresql':
+        op.execute(f"DROP TRIGGER IF EXISTS {OVERLAP_CONSTRAINT}_flagged ON appointments")
+        op.execute(f"DROP FUNCTION IF EXISTS {OVERLAP_CONSTRAINT}_flagged()")
+    elif conn.dialect.name == 'sqlite':
+        _sqlite_triggers('AND NOT a.allow_overlap ')
@@ -0,0 +1,89 @@
+"""Add normalized search columns
+
+Revision ID: d4f6b8a0c2e3
+Revises: c3e5a7b9d1f2
+Create Date: 2026-10-17 17:22:49.615032
+
+"""
+import re
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd4f6b8a0c2e3'
+down_revision = 'c3e5a7b9d1f2'
+branch_labels = None
+depends_on = None
+
+# Copies of app/utils/search.py normalisation as of this revision
+_NON_WORD = re.compile(r'[^\w]+|_')
+_NON_DIGIT = re.compile(r'\D+')
+
+
+def _text(value):
+    if not value:
+        return ''
+    return ' '.join(_NON_WORD.sub(' ', value.lower().replace('ё', 'е')).split())
+
+
+def _phone(value):
+    return _NON_DIGIT.sub('', value) if value else ''
+
+
+def _backfill(conn, table, select_cols, compute):
+    rows = conn.execute(sa.text(f"SELECT id, {', '.join(select_cols)} FROM {table}")).all()
+    updates = [dict(compute(row), row_id=row[0]) for row in rows]
+    if updates:
+        columns = ', '.join(f"{key} = :{key}" for key in updates[0] if key != 'row_id')
+        conn.execute(sa.text(f"UPDATE {table} SET {columns} WHERE id = :row_id"), updates)
+
+
+def upgrade():
+    with op.batch_alter_table('appointments', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('search_name', sa.String(length=100), nullable=True))
+        batch_op.drop_index('ix_appointments_patient_name_trgm')
+
+    with op.batch_alter_table('patients', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('search_text', sa.String(length=200), nullable=True))
+        batch_op.add_column(sa.Column('search_phone', sa.String(length=20), nullable=True))
+
+    conn = op.get_bind()
+    _backfill(conn, 'appointments', ['patient_name'], lambda row: {'search_name': _text(row[1])})
+    _backfill(conn, 'patients', ['surname', 'name', 'patronymic', 'phone'], lambda row: {
+        'search_text': _text(' '.join(part for part in row[1:4] if part)),
+        'search_phone': _phone(row[4])
+    })
+
+    with op.batch_alter_table('appointments', schema=None) as batch_op:
+        batch_op.create_index(
+            'ix_appointments_search_name_trgm', ['search_name'], unique=False,
+            postgresql_using='gin', postgresql_ops={'search_name': 'gin_trgm_ops'}
+        )
+
+    with op.batch_alter_table('patients', schema=None) as batch_op:
+        batch_op.create_index(
+            'ix_patients_search_text_trgm', ['search_text'], unique=False,
+            postgresql_using='gin', postgresql_ops={'search_text': 'gin_trgm_ops'}
+        )
+        batch_op.create_index(
+            'ix_patients_search_phone_trgm', ['search_phone'], unique=False,
+            postgresql_using='gin', postgresql_ops={'search_phone': 'gin_trgm_ops'}
+        )
+
+
+def downgrade():
+    with op.batch_alter_table('patients', schema=None) as batch_op:
+        batch_op.drop_index('ix_patients_search_phone_trgm')
+        batch_op.drop_index('ix_patients_search_text_trgm')
+        batch_op.drop_column('search_phone')
+        batch_op.drop_column('search_text')
+
+    with op.batch_alter_table('appointments', schema=None) as batch_op:
+        batch_op.drop_index('ix_appointments_search_name_trgm')
+        batch_op.create_index(
+            'ix_appointments_patient_name_trgm', ['patient_name'], unique=False,
+            postgresql_using='gin', postgresql_ops={'patient_name': 'gin_trgm_ops'}
+        )
+        batch_op.drop_column('search_name')
@@ -0,0 +1,91 @@
+"""Add appointment minute span and overlap constraint
+
+Revision ID: e5a7c9b1d3f4
+Revises: d4f6b8a0c2e3
+Create Date: 2026-10-17 18:40:12.284517
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5a7c9b1d3f4'
+down_revision = 'd4f6b8a0c2e3'
+branch_labels = None
+depends_on = None
+
+OVERLAP_CONSTRAINT = 'ex_appointments_no_overlap'
+
+
+# Copy of app/utils/slots.py time_to_minutes as of this revision
+def _minutes(value):
+    try:
+        parts = value.split(':')
+        return int(parts[0]) * 60 + int(parts[1])
+    except (AttributeError, IndexError, ValueError):
+        return 0
+
+
+def upgrade():
+    with op.batch_alter_table('appointments', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('start_minute', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('end_minute', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('allow_overlap', sa.Boolean(), server_default=sa.false(), nullable=False))
+
+    conn = op.get_bind()
+    rows = conn.execute(sa.text("SELECT id, time, duration FROM appointments")).all()
+    updates = []
+    for row_id, time_str, duration in rows:
+        start = _minutes(time_str)
+        updates.append({'row_id': row_id, 'start': start, 'end': start + (duration or 15)})
+    if updates:
+        conn.execute(sa.text("UPDATE appointments SET start_minute = :start, end_minute = :end WHERE id = :row_id"), updates)
+
+    # Rows already overlapping an earlier booking of their center-day keep existing;
+    # they are left out of the constraint like journal entries
+    conn.execute(sa.text(
+        "UPDATE appointments SET allow_overlap = :allowed WHERE EXISTS ("
+        "SELECT 1 FROM appointments b WHERE b.center_id = appointments.center_id "
+        "AND b.date = appointments.date AND b.id < appointments.id "
+        "AND b.start_minute < appointments.end_minute AND b.end_minute > appointments.start_minute)"
+    ), {'allowed': True})
+
+    with op.batch_alter_table('appointments', schema=None) as batch_op:
+        batch_op.alter_column('start_minute', existing_type=sa.Integer(), nullable=False)
+        batch_op.alter_column('end_minute', existing_type=sa.Integer(), nullable=False)
+
+    if conn.dialect.name == 'postgresql':
+        op.execute("CREATE EXTENSION IF NOT EXISTS btree_gist")
+        op.execute(
+            f"ALTER TABLE appointments ADD CONSTRAINT {OVERLAP_CONSTRAINT} EXCLUDE USING gist "
+            "(center_id WITH =, date WITH =, int4range(start_minute, end_minute) WITH &&) "
+            "WHERE (NOT allow_overlap)"
+        )
+    elif conn.dialect.name == 'sqlite':
+        for event, check in (
+            ('INSERT', ''),
+            ('UPDATE OF center_id, date, start_minute, end_minute, allow_overlap', 'a.id != NEW.id AND '),
+        ):
+            suffix = 'insert' if event == 'INSERT' else 'update'
+            op.execute(
+                f"CREATE TRIGGER {OVERLAP_CONSTRAINT}_{suffix} BEFORE {event} ON appointments "
+                "WHEN NOT NEW.allow_overlap BEGIN "
+                f"SELECT RAISE(ABORT, '{OVERLAP_CONSTRAINT}') WHERE EXISTS (SELECT 1 FROM appointments a "
+                f"WHERE {check}a.center_id = NEW.center_id AND a.date = NEW.date AND NOT a.allow_overlap "
+                "AND a.start_minute < NEW.end_minute AND a.end_minute > NEW.start_minute); END"
+            )
+
+
+def downgrade():
+    conn = op.get_bind()
+    if conn.dialect.name == 'postgresql':
+        op.execute(f"ALTER TABLE appointments DROP CONSTRAINT IF EXISTS {OVERLAP_CONSTRAINT}")
+    elif conn.dialect.name == 'sqlite':
+        op.execute(f"DROP TRIGGER IF EXISTS {OVERLAP_CONSTRAINT}_insert")
+        op.execute(f"DROP TRIGGER IF EXISTS {OVERLAP_CONSTRAINT}_update")
+
+    with op.batch_alter_table('appointments', schema=None) as batch_op:
+        batch_op.drop_column('allow_overlap')
+        batch_op.drop_column('end_minute')
+        batch_op.drop_column('start_minute')
@@ -0,0 +1,91 @@
+"""Add chat_threads inbox summary and message thread indexes
+
+Revision ID: f6b8d0a2c4e5
+Revises: e5a7c9b1d3f4
+Create Date: 2026-10-17 20:05:31.402918
+
+"""
+import re
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f6b8d0a2c4e5'
+down_revision = 'e5a7c9b1d3f4'
+branch_labels = None
+depends_on = None
+
+# Copy of app/utils/search.py normalize_search_text as of this revision
+_NON_WORD = re.compile(r'[^\w]+|_')
+
+
+def _text(value):
+    if not value:
+        return ''
+    return ' '.join(_NON_WORD.sub(' ', value.lower().replace('ё', 'е')).split())
+
+
+def upgrade():
+    with op.batch_alter_table('messages', schema=None) as batch_op:
+        batch_op.create_index('ix_messages_sender_recipient', ['sender_id', 'recipient_id'], unique=False)
+        batch_op.create_index('ix_messages_recipient', ['recipient_id'], unique=False)
+
+    op.create_table('chat_threads',
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('last_message_id', sa.Integer(), nullable=False),
+        sa.Column('last_message_preview', sa.String(length=200), nullable=False),
+        sa.Column('last_message_at', sa.DateTime(), nullable=False),
+        sa.Column('unread_for_support', sa.Integer(), nullable=False),
+        sa.Column('search_text', sa.String(length=400), nullable=False),
+        sa.ForeignKeyConstraint(['last_message_id'], ['messages.id'], ),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+        sa.PrimaryKeyConstraint('user_id')
+    )
+
+    # One row per org/doctor user with messages: the latest one and the unread count
+    conn = op.get_bind()
+    rows = conn.execute(sa.text(
+        "SELECT u.id, u.username, o.name, m.id, m.body, m.timestamp, "
+        "(SELECT COUNT(*) FROM messages x WHERE x.sender_id = u.id AND x.recipient_id IS NULL "
+        "AND x.is_read = :unread) "
+        "FROM users u "
+        "LEFT JOIN organizations o ON o.id = u.organization_id "
+        "JOIN messages m ON m.id = (SELECT MAX(y.id) FROM messages y "
+        "WHERE (y.sender_id = u.id AND y.recipient_id IS NULL) OR y.recipient_id = u.id) "
+        "WHERE u.role IN ('org', 'doctor')"
+    ), {'unread': False}).all()
+    threads = [{
+        'user_id': user_id,
+        'last_message_id': message_id,
+        'last_message_preview': (body or '')[:200],
+        'last_message_at': timestamp,
+        'unread_for_support': unread,
+        'search_text': _text(f"{username} {org_name or ''}"),
+    } for user_id, username, org_name, message_id, body, timestamp, unread in rows if timestamp is not None]
+    if threads:
+        conn.execute(sa.text(
+            "INSERT INTO chat_threads (user_id, last_message_id, last_message_preview, last_message_at, "
+            "unread_for_support, search_text) VALUES (:user_id, :last_message_id, :last_message_preview, "
+            ":last_message_at, :unread_for_support, :search_text)"
+        ), threads)
+
+    with op.batch_alter_table('chat_threads', schema=None) as batch_op:
+        batch_op.create_index('ix_chat_threads_inbox', ['unread_for_support', 'last_message_at', 'user_id'], unique=False)
+        batch_op.create_index(
+            'ix_chat_threads_search_text_trgm', ['search_text'], unique=False,
+            postgresql_using='gin', postgresql_ops={'search_text': 'gin_trgm_ops'}
+        )
+
+
+def downgrade():
+    with op.batch_alter_table('chat_threads', schema=None) as batch_op:
+        batch_op.drop_index('ix_chat_threads_search_text_trgm')
+        batch_op.drop_index('ix_chat_threads_inbox')
+
+    op.drop_table('chat_threads')
+
+    with op.batch_alter_table('messages', schema=None) as batch_op:
+        batch_op.drop_index('ix_messages_recipient')
+        batch_op.drop_index('ix_messages_sender_recipient')
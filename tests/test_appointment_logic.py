@@ -0,0 +1,122 @@
+import unittest
+import difflib
+import random
+import time
+from datetime import date, timedelta
+from types import SimpleNamespace
+from app.utils.appointment_logic import PaidNameIndex, get_appointments_with_status_logic
+
+SURNAMES = ['иванов', 'иванова', 'петров', 'сидоров', 'смирнов', 'кузнецов', 'попов', 'васильев', 'соколов', 'михайлов']
+FIRST_NAMES = ['иван', 'пётр', 'анна', 'мария', 'олег', 'ирина', 'сергей', 'елена']
+
+def reference_match(appt_raw_name, paid_names):
+    """Pairwise matcher the index replaces (kept verbatim for comparison)."""
+    if appt_raw_name in paid_names:
+        return True
+    appt_parts = appt_raw_name.split()
+    for p_full_name in paid_names:
+        if not p_full_name: continue
+        if p_full_name.startswith(appt_raw_name):
+            return True
+        p_parts = p_full_name.split()
+        if len(appt_parts) >= 1 and len(p_parts) >= 1:
+            if appt_parts[0] == p_parts[0]:
+                if len(appt_parts) == 1:
+                    return True
+                if len(appt_parts) > 1 and len(p_parts) > 1:
+                    if appt_parts[1].startswith(p_parts[1][0]) or p_parts[1].startswith(appt_parts[1][0]):
+                        return True
+        if difflib.SequenceMatcher(None, appt_raw_name.replace(' ', ''), p_full_name.replace(' ', '')).ratio() > 0.8:
+            return True
+    return False
+
+def random_name(rng):
+    surname = rng.choice(SURNAMES)
+    # Typos, initials, surname only, full names
+    if rng.random() < 0.2:
+        i = rng.randrange(len(surname))
+        surname = surname[:i] + rng.choice('абвгдеж') + surname[i + 1:]
+    kind = rng.random()
+    if kind < 0.2:
+        return surname
+    first = rng.choice(FIRST_NAMES)
+    if kind < 0.5:
+        return f"{surname} {first[0]}."
+    return f"{surname} {first} {rng.choice(FIRST_NAMES)}ович"
+
+SYLLABLES = ['ка', 'ли', 'мо', 'ро', 'ва', 'се', 'ни', 'ту', 'бе', 'за', 'ша', 'ко', 'де', 'ри', 'ля', 'фе', 'гу', 'хо', 'че', 'ю']
+SUFFIXES = ['ов', 'ова', 'ин', 'ина', 'ский', 'ская', 'енко', 'ук']
+
+def realistic_name(rng):
+    surname = ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 3))) + rng.choice(SUFFIXES)
+    if rng.random() < 0.3:
+        return f"{surname} {rng.choice(FIRST_NAMES)[0]}."
+    return f"{surname} {rng.choice(FIRST_NAMES)} {rng.choice(FIRST_NAMES)}ович"
+
+def make_appt(i, day, name, paid):
+    data = {'id': i, 'patient_name': name}
+    return SimpleNamespace(
+        id=i, date=day, time='09:00', patient_name=name, author_id=1,
+        payment_method_id=1 if paid else None,
+        to_dict_lite=lambda data=data: dict(data)
+    )
+
+class PaidNameIndexTestCase(unittest.TestCase):
+    def test_rules(self):
+        index = PaidNameIndex(['иванов иван', 'петров пётр петрович', 'сидорова', ''])
+        self.assertTrue(index.matches('иванов'))         # prefix
+        self.assertTrue(index.matches('иванов и.'))      # surname + initial
+        self.assertTrue(index.matches('петров п'))
+        self.assertTrue(index.matches('сидорва'))        # typo
+        self.assertFalse(index.matches('иванов п.'))
+        self.assertFalse(index.matches('кузнецов'))
+        self.assertFalse(PaidNameIndex(['']).matches('иванов'))
+
+    def test_same_results_as_pairwise_matching(self):
+        rng = random.Random(42)
+        for _ in range(30):
+            paid = [
+                random_name(rng) if rng.random() < 0.7 else realistic_name(rng)
+                for _ in range(rng.randint(0, 40))
+            ]
+            index = PaidNameIndex(paid)
+            for _ in range(40):
+                name = random_name(rng) if rng.random() < 0.7 else realistic_name(rng)
+                self.assertEqual(index.matches(name), reference_match(name, paid), (name, paid))
+
+    def test_week_view_benchmark(self):
+        # Dashboard week view of a busy center: 2100 calendar entries, most of them
+        # paid in the journal under a slightly different spelling, some no-shows
+        rng = random.Random(7)
+        start = date(2025, 3, 3)
+        appointments = []
+        while len(appointments) < 2100:
+            day = start + timedelta(days=rng.randrange(7))
+            name = realistic_name(rng)
+            if rng.random() < 0.8:
+                appointments.append(make_appt(len(appointments), day, name, paid=True))
+                surname = name.split()[0]
+                name = rng.choice([name, surname, f"{surname} {name.split()[1][0]}.", surname[:-1] + 'а' + name[len(surname):]])
+            appointments.append(make_appt(len(appointments), day, name, paid=False))
+
+        t0 = time.perf_counter()
+        results = get_appointments_with_status_logic(appointments, 'superadmin', 1)
+        elapsed = time.perf_counter() - t0
+
+        paid_by_date = {}
+        for appt in appointments:
+            if appt.payment_method_id is not None:
+                paid_by_date.setdefault(appt.date, []).append(appt.patient_name)
+        t0 = time.perf_counter()
+        expected = [
+            appt.payment_method_id is not None or reference_match(appt.patient_name, paid_by_date.get(appt.date, []))
+            for appt in appointments
+        ]
+        reference_elapsed = time.perf_counter() - t0
+
+        self.assertEqual([r['status'] == 'completed' for r in results], expected)
+        # Absolute timings depend on the machine (about 50-100 ms here), the ratio does not
+        self.assertLess(elapsed * 10, reference_elapsed, f"status logic took {elapsed * 1000:.1f} ms")
+
+if __name__ == '__main__':
+    unittest.main()
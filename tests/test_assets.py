@@ -0,0 +1,107 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from PIL import Image
+from app import create_app, db
+from app.models import User, GlobalSetting
+from app.utils.assets import AssetCache, asset_cache
+
+
+def png_bytes(color, size=(20, 10)):
+    out = io.BytesIO()
+    Image.new('RGB', size, color).save(out, format='PNG')
+    return out.getvalue()
+
+
+class AssetCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.static = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.static, 'uploads'))
+        self.write('uploads/bg.png', 'red')
+        self.cache = AssetCache()
+
+    def tearDown(self):
+        shutil.rmtree(self.static, ignore_errors=True)
+
+    def write(self, name, color, mtime=None):
+        path = os.path.join(self.static, name)
+        with open(path, 'wb') as f:
+            f.write(png_bytes(color))
+        if mtime:
+            os.utime(path, (mtime, mtime))
+        return path
+
+    def test_data_uri_and_images_are_cached_until_the_file_changes(self):
+        uri = self.cache.data_uri('/uploads/bg.png', self.static)
+        self.assertTrue(uri.startswith('data:image/png;base64,'))
+        self.assertIs(self.cache.data_uri('uploads/bg.png', self.static), uri)
+        self.assertIsNone(self.cache.data_uri('uploads/missing.png', self.static))
+
+        def halve(image):
+            return image.resize((image.width // 2, image.height // 2))
+        image = self.cache.image('uploads/bg.png', halve, self.static)
+        self.assertEqual(image.size, (10, 5))
+        self.assertIs(self.cache.image('uploads/bg.png', halve, self.static), image)
+        self.assertEqual(self.cache.image('uploads/bg.png', None, self.static).size, (20, 10))
+
+        self.write('uploads/bg.png', 'blue', mtime=os.path.getmtime(os.path.join(self.static, 'uploads/bg.png')) + 10)
+        self.assertNotEqual(self.cache.data_uri('uploads/bg.png', self.static), uri)
+        self.assertEqual(self.cache.image('uploads/bg.png', halve, self.static).getpixel((0, 0)), (0, 0, 255))
+        # Replaced versions do not linger
+        self.assertEqual(self.cache.stats()['entries'], 3)
+
+    def test_byte_budget_evicts_least_recently_used(self):
+        for name in ('a', 'b', 'c'):
+            self.write(f'uploads/{name}.png', 'green')
+        self.cache.max_bytes = 2 * 20 * 10 * 3
+        self.cache.image('uploads/a.png', None, self.static)
+        self.cache.image('uploads/b.png', None, self.static)
+        self.cache.image('uploads/a.png', None, self.static)
+        self.cache.image('uploads/c.png', None, self.static)
+        cached = {os.path.basename(key[0]) for key in self.cache._entries}
+        self.assertEqual(cached, {'a.png', 'c.png'})
+        self.assertLessEqual(self.cache.stats()['bytes'], self.cache.max_bytes)
+
+class StampUploadTestCase(unittest.TestCase):
+    def setUp(self):
+        self.static = tempfile.mkdtemp()
+        test_config = {
+            'TESTING': True,
+            'SQLALCHEMY_DATABASE_URI': 'sqlite:///:memory:',
+            'WTF_CSRF_ENABLED': False
+        }
+        self.app = create_app(test_config)
+        self.app.static_folder = self.static
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.admin = User(username='admin', email='admin@test.com', role='superadmin')
+        db.session.add(self.admin)
+        db.session.commit()
+        self.client = self.app.test_client()
+        with self.client.session_transaction() as sess:
+            sess['_user_id'] = str(self.admin.id)
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+        shutil.rmtree(self.static, ignore_errors=True)
+
+    def upload(self, color):
+        return self.client.post('/admin/stamp/upload', data={
+            'stamp_image': (io.BytesIO(png_bytes(color)), 'stamp.png')
+        }, content_type='multipart/form-data')
+
+    def test_replacing_the_stamp_invalidates_the_cache(self):
+        self.upload('red')
+        path = GlobalSetting.query.get('stamp_image').value
+        first = asset_cache.data_uri(path)
+        # Same name, possibly within the same mtime tick
+        self.upload('blue')
+        self.assertNotEqual(asset_cache.data_uri(path), first)
+
+if __name__ == '__main__':
+    unittest.main()
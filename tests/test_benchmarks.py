@@ -0,0 +1,177 @@
+"""
+Hot endpoints on `flask bench seed` data.
+
+Every run compares the SQL statements per request with
+tests/bench_baseline.json and fails when an endpoint needs more (N+1
+regressions). With pytest-benchmark installed the latency is measured as
+well; its median must stay under the stored budget, and CI can compare
+against a saved run:
+
+    pytest tests/test_benchmarks.py --benchmark-autosave
+    pytest tests/test_benchmarks.py --benchmark-compare --benchmark-compare-fail=median:25%
+
+BENCH_SCALE multiplies the seeded days and appointments per day; the
+query counts still hold, the latency budgets are for the default scale
+and are not checked otherwise. BENCH_UPDATE_BASELINE=1 rewrites the
+baseline from the current run (keep BENCH_SCALE unset when committing
+it). The latency tests need requirements-dev.txt.
+"""
+import io
+import json
+import os
+from datetime import date, timedelta
+
+import pytest
+from sqlalchemy import event
+
+from app import create_app, db
+from app.models import Location, User
+from app.utils.bench import seed
+
+try:
+    import pytest_benchmark
+except ImportError:
+    pytest_benchmark = None
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'bench_baseline.json')
+SCALE = max(1, int(os.environ.get('BENCH_SCALE', 1)))
+UPDATE_BASELINE = os.environ.get('BENCH_UPDATE_BASELINE') == '1'
+
+UNTIL = date(2025, 6, 30)
+IMPORT_DAY = UNTIL + timedelta(days=30)
+IMPORT_ROWS = 200
+HEADER = "Дата;Договор;ФИО Пациента;Ребенок;ФИО Врача;Клиника;Исследование;Доп.услуги;Кол-во;Оплата;Скидка;Комментарий"
+
+
+def _journal_csv():
+    day = IMPORT_DAY.strftime('%d.%m.%Y')
+    lines = [
+        f"{day};{n};Пациент {n};;Врач {n % 5};Клиника 00{n % 8 + 1};КТ 1;;1;Наличные;;"
+        for n in range(IMPORT_ROWS)
+    ]
+    return "\n".join([HEADER] + lines).encode('utf-8')
+
+
+# name -> (method, url, form data factory)
+ENDPOINTS = {
+    'dashboard': ('GET', lambda c: f"/dashboard?center_id={c}&start_date={UNTIL - timedelta(days=6)}", None),
+    'api_appointments': (
+        'GET', lambda c: f"/api/appointments?center_id={c}&start_date={UNTIL - timedelta(days=6)}&end_date={UNTIL}", None
+    ),
+    'api_slots': ('GET', lambda c: f"/api/slots?center_id={c}&date={UNTIL}", None),
+    'journal': ('GET', lambda c: f"/journal?center_id={c}&date={UNTIL}", None),
+    'statistics': ('GET', lambda c: f"/statistics?center_id={c}&year={UNTIL.year}", None),
+    'import_journal_data': ('POST', lambda c: "/admin/journal/import", lambda c: {
+        'file': (io.BytesIO(_journal_csv()), 'journal.csv'), 'center_id': c, 'delete_old': 'on'
+    }),
+    'reports_bonuses': ('GET', lambda c: f"/admin/reports/api/bonuses?month={UNTIL:%Y-%m}", None),
+    'reports_summary_data': ('GET', lambda c: "/admin/reports/summary/data?months=3", None),
+    'chat_threads': ('GET', lambda c: "/api/chat/threads", None),
+}
+
+
+def _load_baseline():
+    try:
+        with open(BASELINE_PATH, encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+@pytest.fixture(scope='module')
+def bench():
+    app = create_app({
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///:memory:',
+        'WTF_CSRF_ENABLED': False,
+        # Every request builds the report instead of reading the cache
+        'REPORT_CACHE_TTL': 0,
+    })
+    with app.app_context():
+        db.create_all()
+        seed(
+            cities=1, centers_per_city=2, doctors=12, clinics=8, services=8, additional_services=4,
+            days=60 * SCALE, appointments_per_day=12 * SCALE, messages_per_thread=6, until=UNTIL
+        )
+        db.session.commit()
+        admin_id = User.query.filter_by(username='bench_admin').one().id
+        center_id = Location.query.filter_by(type='center').order_by(Location.id).first().id
+        # One in-memory database: the engine outlives the contexts
+        engine = db.engine
+
+    # No app context stays pushed: every request gets a fresh session, as in production
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['_user_id'] = str(admin_id)
+
+    measured = {}
+    yield {'client': client, 'engine': engine, 'center_id': center_id, 'measured': measured}
+
+    if UPDATE_BASELINE and measured:
+        baseline = _load_baseline()
+        for name, values in measured.items():
+            baseline.setdefault(name, {}).update(values)
+        with open(BASELINE_PATH, 'w', encoding='utf-8') as f:
+            json.dump(dict(sorted(baseline.items())), f, indent=2)
+            f.write('\n')
+    with app.app_context():
+        db.drop_all()
+
+
+def _request(bench, name):
+    method, url, data = ENDPOINTS[name]
+    center_id = bench['center_id']
+    if method == 'POST':
+        response = bench['client'].post(url(center_id), data=data(center_id), content_type='multipart/form-data')
+    else:
+        response = bench['client'].get(url(center_id))
+    # The journal import redirects to its (finished) job
+    assert response.status_code == (302 if method == 'POST' else 200), f"{name}: {response.status_code}"
+    return response
+
+
+def _count_queries(bench, name):
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(bench['engine'], 'before_cursor_execute', record)
+    try:
+        _request(bench, name)
+    finally:
+        event.remove(bench['engine'], 'before_cursor_execute', record)
+    return len(statements)
+
+
+@pytest.mark.parametrize('name', sorted(ENDPOINTS))
+def test_query_count(bench, name):
+    # Warm up per-process caches (slot bitmaps, settings) like a running server
+    _request(bench, name)
+    queries = _count_queries(bench, name)
+    bench['measured'].setdefault(name, {})['queries'] = queries
+    if UPDATE_BASELINE:
+        return
+    expected = _load_baseline().get(name, {}).get('queries')
+    assert expected is not None, f"No baseline for {name}: run with BENCH_UPDATE_BASELINE=1"
+    assert queries <= expected, f"{name} ran {queries} SQL statements, baseline {expected}"
+
+
+@pytest.mark.skipif(pytest_benchmark is None, reason='pytest-benchmark is not installed')
+@pytest.mark.parametrize('name', sorted(ENDPOINTS))
+def test_latency(bench, benchmark, name):
+    benchmark.group = 'endpoints'
+    benchmark.pedantic(_request, args=(bench, name), rounds=10, warmup_rounds=1)
+    if benchmark.stats is None:
+        # --benchmark-disable: the request ran once, nothing was timed
+        return
+    median_ms = benchmark.stats.stats.median * 1000
+    if SCALE != 1:
+        return
+    if UPDATE_BASELINE:
+        # Budget with headroom for slower CI machines
+        bench['measured'].setdefault(name, {})['median_ms_budget'] = max(50, round(median_ms * 5))
+        return
+    budget = _load_baseline().get(name, {}).get('median_ms_budget')
+    if budget is not None:
+        assert median_ms <= budget, f"{name} median {median_ms:.0f} ms, budget {budget} ms"
@@ -0,0 +1,134 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from datetime import date
+from io import BytesIO
+from PIL import Image, ImageChops, ImageStat
+from app import create_app, db
+from app.models import User, Appointment, MedicalCertificate
+from app.utils.certificate_compositor import CertificateCompositor, FIELD_LAYOUT, CHAR_BOX
+
+STATIC = os.path.join(os.path.dirname(__file__), '..', 'app', 'static')
+STAMP = 'uploads/stamps/orbital_stamp.png'
+FORM_DATA = {'surname': 'ИВАНОВ', 'name': 'ИВАН', 'cert_no': '17', 'year': '2025', 'surname_p2': 'ИВАНОВ'}
+
+
+def chromium_available():
+    try:
+        from playwright.sync_api import sync_playwright
+        with sync_playwright() as p:
+            return os.path.exists(p.chromium.executable_path)
+    except Exception:
+        return False
+
+
+class CertificateCompositorTestCase(unittest.TestCase):
+    def setUp(self):
+        self.compositor = CertificateCompositor()
+
+    def test_pages_and_speed(self):
+        self.assertEqual(len(self.compositor.compose(STATIC, 'knd1151156', FORM_DATA, {}, STAMP)), 1)
+        pages = self.compositor.compose(STATIC, 'knd1151156_op', FORM_DATA, {}, STAMP)
+        self.assertEqual([page.size for page in pages], [(1121, 1585)] * 2)
+
+        # Decoded backgrounds and the stamp are cached after the first call
+        started = time.perf_counter()
+        for _ in range(5):
+            self.compositor.compose(STATIC, 'knd1151156_op', FORM_DATA, {}, STAMP)
+        self.assertLess((time.perf_counter() - started) / 5, 0.1)
+
+    def test_text_lands_in_field_cells(self):
+        blank = self.compositor.compose(STATIC, 'knd1151156', {}, {}, None)[0]
+        filled = self.compositor.compose(STATIC, 'knd1151156', {'cert_no': '17'}, {'x': 3, 'y': -2}, None)[0]
+        left, top, right, bottom = ImageChops.difference(blank, filled).getbbox()
+
+        start_x, start_y, spacing = FIELD_LAYOUT['cert_no']
+        self.assertGreaterEqual(left, start_x + 3)
+        self.assertLessEqual(right, start_x + 3 + spacing + CHAR_BOX)
+        self.assertGreaterEqual(top, start_y - 2 - 2)
+        self.assertLessEqual(bottom, start_y - 2 - 2 + CHAR_BOX)
+
+    def test_stamp_is_multiplied(self):
+        blank = self.compositor.compose(STATIC, 'knd1151156', {}, {}, None)[0]
+        stamped = self.compositor.compose(STATIC, 'knd1151156', {}, {}, STAMP)[0]
+        box = (34, 1210, 34 + 264, 1210 + 100)
+        # Multiply only darkens
+        self.assertEqual(ImageChops.subtract(stamped.crop(box), blank.crop(box)).getbbox(), None)
+        self.assertIsNotNone(ImageChops.difference(stamped.crop(box), blank.crop(box)).getbbox())
+
+    @unittest.skipUnless(chromium_available(), 'Chromium for Playwright is not installed')
+    def test_matches_playwright_output(self):
+        from app.blueprints.main import render_certificate_html
+        from app.utils.certificate_renderer import CertificateRenderer
+
+        app = create_app({'TESTING': True, 'SQLALCHEMY_DATABASE_URI': 'sqlite:///:memory:'})
+        renderer = CertificateRenderer()
+        renderer.workers = 1
+        for form_type in ('knd1151156', 'knd1151156_op'):
+            with app.test_request_context():
+                html = render_certificate_html(form_type, FORM_DATA, {'x': 0, 'y': 0}, STAMP)
+            browser_pages = renderer.render(html, pages=2 if form_type.endswith('_op') else 1)
+            pillow_pages = self.compositor.compose(app.static_folder, form_type, FORM_DATA, {'x': 0, 'y': 0}, STAMP)
+            for browser_page, pillow_page in zip(browser_pages, pillow_pages):
+                with Image.open(BytesIO(browser_page)) as shot:
+                    diff = ImageChops.difference(shot.convert('RGB'), pillow_page)
+                # Glyph rasterisation differs slightly; layout errors show up as large means
+                self.assertLess(max(ImageStat.Stat(diff).mean), 3.0, form_type)
+
+class PillowBackendEndpointTestCase(unittest.TestCase):
+    def setUp(self):
+        # Outputs go to a throwaway static folder
+        self.static = tempfile.mkdtemp()
+        for path in ('uploads/certificate_bg.png', STAMP):
+            os.makedirs(os.path.dirname(os.path.join(self.static, path)), exist_ok=True)
+            shutil.copy(os.path.join(STATIC, path), os.path.join(self.static, path))
+
+        test_config = {
+            'TESTING': True,
+            'SQLALCHEMY_DATABASE_URI': 'sqlite:///:memory:',
+            'WTF_CSRF_ENABLED': False,
+            'CERT_RENDER_BACKEND': 'pillow'
+        }
+        self.app = create_app(test_config)
+        self.app.static_folder = self.static
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        self.admin = User(username='admin', email='admin@test.com', role='superadmin')
+        db.session.add(self.admin)
+        db.session.commit()
+        self.appointment = Appointment(date=date(2025, 1, 10), time='09:00', patient_name='Иванов Иван', cost=1500)
+        db.session.add(self.appointment)
+        db.session.commit()
+
+        self.client = self.app.test_client()
+        with self.client.session_transaction() as sess:
+            sess['_user_id'] = str(self.admin.id)
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+        shutil.rmtree(self.static, ignore_errors=True)
+
+    def test_generate_certificate(self):
+        response = self.client.post('/stamp-tool/certificate/generate', json={
+            'appointment_id': self.appointment.id, 'form_type': 'knd1151156', 'form_data': FORM_DATA
+        })
+        data = response.get_json()
+        self.assertTrue(data['success'], data)
+        cert = MedicalCertificate.query.one()
+        cert_dir = os.path.join(self.static, 'uploads', 'certificates')
+        with Image.open(os.path.join(cert_dir, cert.filename)) as img:
+            self.assertEqual(img.size, (1121, 1585))
+        # The PDF carries the stored page JPEG without re-encoding
+        with open(os.path.join(cert_dir, cert.filename), 'rb') as f:
+            page_jpeg = f.read()
+        with open(os.path.join(cert_dir, cert.pdf_filename), 'rb') as f:
+            self.assertIn(page_jpeg, f.read())
+
+if __name__ == '__main__':
+    unittest.main()
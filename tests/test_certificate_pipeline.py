@@ -0,0 +1,54 @@
+import time
+import unittest
+from io import BytesIO
+from PIL import Image
+from app.utils.certificate_pipeline import CertificatePipeline, postprocess_page
+
+
+def page_bytes(color):
+    out = BytesIO()
+    Image.new('RGB', (1121, 1585), color).save(out, format='JPEG', quality=95)
+    return out.getvalue()
+
+
+class CertificatePipelineTestCase(unittest.TestCase):
+    def setUp(self):
+        self.pipeline = CertificatePipeline()
+
+    def test_accepts_bytes_and_images(self):
+        for page in (page_bytes('white'), Image.new('RGB', (1121, 1585), 'white')):
+            with Image.open(BytesIO(postprocess_page(page))) as img:
+                self.assertEqual((img.format, img.size), ('JPEG', (1121, 1585)))
+
+    def test_pages_keep_order(self):
+        jpegs = self.pipeline.process([page_bytes('white'), page_bytes('black')])
+        means = []
+        for jpeg in jpegs:
+            with Image.open(BytesIO(jpeg)) as img:
+                means.append(img.convert('L').getpixel((560, 790)))
+        self.assertGreater(means[0], 200)
+        self.assertLess(means[1], 50)
+
+    def test_pdf_embeds_page_bytes_unchanged(self):
+        jpegs = self.pipeline.process([page_bytes('white'), page_bytes('gray')])
+        pdf = self.pipeline.to_pdf(jpegs)
+        for jpeg in jpegs:
+            self.assertIn(jpeg, pdf)
+
+    def test_pages_run_concurrently(self):
+        pages = [page_bytes('white'), page_bytes('white')]
+        self.pipeline.process(pages)  # warm the pool
+
+        started = time.perf_counter()
+        for page in pages:
+            postprocess_page(page)
+        serial = time.perf_counter() - started
+
+        started = time.perf_counter()
+        self.pipeline.process(pages)
+        parallel = time.perf_counter() - started
+        # Generous bound: shared CI machines may have a single core
+        self.assertLess(parallel, serial * 1.5)
+
+if __name__ == '__main__':
+    unittest.main()
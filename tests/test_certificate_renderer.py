@@ -0,0 +1,57 @@
+import unittest
+from app import create_app, db
+from app.models import User
+from app.utils.certificate_renderer import CertificateRenderer, RendererBusy
+
+class CertificateRendererTestCase(unittest.TestCase):
+    def test_full_queue_rejects_requests(self):
+        # No workers: nothing leaves the queue
+        renderer = CertificateRenderer()
+        renderer.workers = 0
+        renderer.queue_size = 1
+        renderer.timeout = 0.05
+
+        with self.assertRaises(TimeoutError):
+            renderer.render('<html></html>')
+        with self.assertRaises(RendererBusy):
+            renderer.render('<html></html>')
+
+        stats = renderer.stats()
+        self.assertEqual((stats['rejected'], stats['rendered'], stats['queued']), (1, 0, 1))
+        self.assertIsNone(stats['render_ms']['avg'])
+
+class RendererStatsEndpointTestCase(unittest.TestCase):
+    def setUp(self):
+        test_config = {
+            'TESTING': True,
+            'SQLALCHEMY_DATABASE_URI': 'sqlite:///:memory:',
+            'WTF_CSRF_ENABLED': False
+        }
+        self.app = create_app(test_config)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.admin = User(username='admin', email='admin@test.com', role='superadmin')
+        db.session.add(self.admin)
+        db.session.commit()
+        self.client = self.app.test_client()
+        with self.client.session_transaction() as sess:
+            sess['_user_id'] = str(self.admin.id)
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_stats_and_readiness_signal(self):
+        stats = self.client.get('/stamp-tool/renderer-stats').get_json()
+        self.assertIn('render_ms', stats)
+
+        from app.blueprints.main import render_certificate_html
+        with self.app.test_request_context():
+            html = render_certificate_html('knd1151156_op', {'surname_p2': 'А'}, {'x': 0, 'y': 0}, None)
+        self.assertIn('"c_day_bottom": [', html)
+        self.assertIn('window.certificateReady = true', html)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,161 @@
+import threading
+import time
+import unittest
+from flask import g
+from datetime import datetime
+from app import create_app, db
+from app.models import User, Message
+from app.utils.chat_events import ChatBroker, chat_broker
+
+
+class ChatBrokerTestCase(unittest.TestCase):
+    def test_wait_filters_by_thread(self):
+        broker = ChatBroker()
+        seq = broker.cursor()
+        broker._deliver(1, 'message', 10)
+        broker._deliver(2, 'read', None)
+
+        new_seq, events = broker.wait(seq, thread_user_id=2, timeout=0)
+        self.assertEqual([(e[1], e[2]) for e in events], [(2, 'read')])
+        self.assertEqual(len(broker.wait(seq, timeout=0)[1]), 2)
+        self.assertEqual(broker.wait(new_seq, thread_user_id=1, timeout=0.05), (new_seq, []))
+
+    def test_wait_wakes_on_publish(self):
+        broker = ChatBroker()
+        seq = broker.cursor()
+        threading.Timer(0.05, broker.publish, args=(5, 'message', 1)).start()
+        started = time.monotonic()
+        _, events = broker.wait(seq, thread_user_id=5, timeout=5)
+        self.assertEqual(events[0][1:], (5, 'message', 1))
+        self.assertLess(time.monotonic() - started, 2)
+
+
+class ChatPushTestCase(unittest.TestCase):
+    def setUp(self):
+        test_config = {
+            'TESTING': True,
+            'SQLALCHEMY_DATABASE_URI': 'sqlite:///:memory:',
+            'WTF_CSRF_ENABLED': False,
+            'CHAT_STREAM_TIMEOUT': 0.2,
+            'CHAT_SSE_ENABLED': True
+        }
+        self.app = create_app(test_config)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        self.support = User(username='support', email='support@test.com', role='superadmin')
+        self.org = User(username='org1', email='org1@test.com', role='org')
+        self.other = User(username='org2', email='org2@test.com', role='org')
+        db.session.add_all([self.support, self.org, self.other])
+        db.session.commit()
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def login(self, user):
+        with self.client.session_transaction() as sess:
+            sess['_user_id'] = str(user.id)
+        # The test app context outlives requests; drop the cached user
+        g.pop('_login_user', None)
+
+    def add_message(self, sender, recipient=None, body='hi'):
+        msg = Message(sender_id=sender.id, recipient_id=recipient.id if recipient else None,
+                      body=body, timestamp=datetime.now())
+        db.session.add(msg)
+        db.session.commit()
+        return msg.id
+
+    def test_poll_returns_only_new_messages_of_the_thread(self):
+        first = self.add_message(self.org, body='old')
+        second = self.add_message(self.org, body='new')
+        self.add_message(self.other, body='someone else')
+
+        self.login(self.support)
+        data = self.client.get(f'/api/chat/poll?user_id={self.org.id}&after={first}&timeout=0').get_json()
+        self.assertEqual([m['id'] for m in data['messages']], [second])
+        self.assertEqual(data['cursor'], second)
+
+        # Org users always get their own thread
+        self.login(self.other)
+        data = self.client.get(f'/api/chat/poll?user_id={self.org.id}&after=0&timeout=0').get_json()
+        self.assertEqual([m['body'] for m in data['messages']], ['someone else'])
+
+    def test_poll_waits_for_a_message(self):
+        self.login(self.support)
+        after = self.add_message(self.org, body='seen')
+
+        def send():
+            time.sleep(0.1)
+            with self.app.app_context():
+                self.add_message(self.org, body='pushed')
+                chat_broker.publish(self.org.id, 'message')
+
+        sender = threading.Thread(target=send)
+        sender.start()
+        started = time.monotonic()
+        data = self.client.get(f'/api/chat/poll?user_id={self.org.id}&after={after}&timeout=5').get_json()
+        sender.join()
+        self.assertEqual([m['body'] for m in data['messages']], ['pushed'])
+        self.assertLess(time.monotonic() - started, 3)
+
+    def test_send_and_read_are_published(self):
+        self.login(self.org)
+        seq = chat_broker.cursor()
+        message_id = self.client.post('/api/chat/messages/send', json={'body': 'help'}).get_json()['id']
+        self.login(self.support)
+        self.client.post('/api/chat/messages/read', json={'user_id': self.org.id})
+
+        self.login(self.org)
+        self.client.post('/api/chat/messages/read', json={})
+
+        _, events = chat_broker.wait(seq, thread_user_id=self.org.id, timeout=0)
+        self.assertEqual([e[2:] for e in events], [('message', message_id), ('read', None), ('user_read', None)])
+
+    def test_receipts_name_the_reader(self):
+        org_id = self.org.id
+        self.login(self.support)
+        threading.Timer(0.05, chat_broker.publish, args=(org_id, 'user_read')).start()
+        data = self.client.get(f'/api/chat/poll?user_id={org_id}&timeout=5').get_json()
+        self.assertEqual(data['read'], [{'user_id': org_id, 'by': 'user'}])
+
+    def test_inbox_stream_sends_deltas(self):
+        first = self.add_message(self.org, body='old')
+        second = self.add_message(self.other, body='new')
+        other_id = self.other.id
+
+        self.login(self.support)
+        # The stream releases the session while waiting, detaching fixtures
+        response = self.client.get('/api/chat/stream', headers={'Last-Event-ID': str(first)})
+        self.assertEqual(response.mimetype, 'text/event-stream')
+        body = response.get_data(as_text=True)
+        self.assertIn(f'id: {second}\nevent: message\n', body)
+        self.assertIn(f'"thread_user_id": {other_id}', body)
+        self.assertIn('"to_support": true', body)
+        self.assertNotIn('"old"', body)
+
+    def test_stream_resumes_from_last_event_id_and_reports_resets(self):
+        first = self.add_message(self.org, body='old')
+        self.add_message(self.org, body='new')
+
+        self.login(self.support)
+        # Missed events (a lost LISTEN connection): the page has to reload
+        threading.Timer(0.05, chat_broker._deliver, args=(None, 'reset', None)).start()
+        body = self.client.get('/api/chat/stream?after=0', headers={'Last-Event-ID': str(first)}).get_data(as_text=True)
+        self.assertIn('"new"', body)
+        self.assertNotIn('"old"', body)
+        self.assertIn('event: reset\n', body)
+
+    def test_stream_needs_to_be_enabled(self):
+        # Sync workers: no stream, the pages poll instead
+        self.app.config['CHAT_SSE_ENABLED'] = False
+        self.login(self.org)
+        self.assertEqual(self.client.get('/api/chat/stream').status_code, 404)
+        page = self.client.get('/dashboard').get_data(as_text=True)
+        self.assertIn('const chatStreamEnabled = false;', page)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+import unittest
+from datetime import datetime, timedelta
+from flask import g
+from app import create_app, db
+from app.models import User, Organization, Message, ChatThread
+from app.utils.chat_threads import rebuild_threads
+
+
+class ChatThreadsTestCase(unittest.TestCase):
+    def setUp(self):
+        test_config = {
+            'TESTING': True,
+            'SQLALCHEMY_DATABASE_URI': 'sqlite:///:memory:',
+            'WTF_CSRF_ENABLED': False
+        }
+        self.app = create_app(test_config)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        self.support = User(username='support', email='support@test.com', role='superadmin')
+        self.acme = Organization(name='Acme Dental')
+        db.session.add_all([self.support, self.acme])
+        db.session.flush()
+        self.orgs = [
+            User(username=f'org{n}', email=f'org{n}@test.com', role='org', organization_id=self.acme.id if n == 0 else None)
+            for n in range(4)
+        ]
+        self.doctor = User(username='drwho', email='dr@test.com', role='doctor')
+        db.session.add_all(self.orgs + [self.doctor])
+        db.session.commit()
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def login(self, user):
+        with self.client.session_transaction() as sess:
+            sess['_user_id'] = str(user.id)
+        g.pop('_login_user', None)
+
+    def send(self, user, body, recipient=None):
+        self.login(user)
+        response = self.client.post('/api/chat/messages/send', json={
+            'body': body, 'recipient_id': recipient.id if recipient else None
+        })
+        self.assertEqual(response.status_code, 201)
+        return response.get_json()['id']
+
+    def test_send_and_read_maintain_the_summary(self):
+        self.send(self.orgs[0], 'first')
+        last = self.send(self.orgs[0], 'second')
+        thread = db.session.get(ChatThread, self.orgs[0].id)
+        self.assertEqual((thread.last_message_id, thread.last_message_preview, thread.unread_for_support), (last, 'second', 2))
+        self.assertEqual(thread.search_text, 'org0 acme dental')
+
+        # Support replies: new last message, unread count unchanged
+        reply = self.send(self.support, 'answer', recipient=self.orgs[0])
+        db.session.expire_all()
+        thread = db.session.get(ChatThread, self.orgs[0].id)
+        self.assertEqual((thread.last_message_id, thread.unread_for_support), (reply, 2))
+
+        self.client.post('/api/chat/messages/read', json={'user_id': self.orgs[0].id})
+        db.session.expire_all()
+        self.assertEqual(db.session.get(ChatThread, self.orgs[0].id).unread_for_support, 0)
+
+        # Support's own messages never create threads for support users
+        self.send(self.support, 'note to self')
+        self.assertIsNone(db.session.get(ChatThread, self.support.id))
+
+    def test_inbox_order_pagination_and_search(self):
+        for n, user in enumerate(self.orgs):
+            self.send(user, f'hello {n}')
+        self.send(self.orgs[1], 'read me')
+        self.login(self.support)
+        self.client.post('/api/chat/messages/read', json={'user_id': self.orgs[2].id})
+
+        response = self.client.get('/api/chat/threads?limit=2')
+        page = response.get_json()
+        # org1 has 2 unread; org3 and org0 have 1 (newest first); org2 none
+        self.assertEqual([t['username'] for t in page], ['org1', 'org3'])
+        self.assertEqual(page[0]['unread_count'], 2)
+        response = self.client.get(f"/api/chat/threads?limit=2&cursor={response.headers['X-Next-Cursor']}")
+        self.assertEqual([t['username'] for t in response.get_json()], ['org0', 'org2'])
+        self.assertIn('X-Next-Cursor', response.headers)
+        self.assertEqual(self.client.get(f"/api/chat/threads?limit=2&cursor={response.headers['X-Next-Cursor']}").get_json(), [])
+
+        found = self.client.get('/api/chat/threads?search=ACME').get_json()
+        self.assertEqual([(t['username'], t['org_name']) for t in found], [('org0', 'Acme Dental')])
+        # Users without messages are found too, so Support can start a conversation
+        found = self.client.get('/api/chat/threads?search=drwho').get_json()
+        self.assertEqual([(t['username'], t['org_name'], t['last_timestamp']) for t in found], [('drwho', 'Врач', None)])
+
+    def test_renames_are_searchable(self):
+        self.send(self.orgs[0], 'from acme')
+        self.send(self.orgs[1], 'from org1')
+
+        # The org user renames its organization, Support renames a user
+        self.login(self.orgs[0])
+        self.client.post('/profile', data={'action': 'update_profile', 'organization_name': 'Zenith Clinic'})
+        self.login(self.support)
+        self.client.post(f'/admin/users/edit/{self.orgs[1].id}', data={'username': 'renamed', 'role': 'org'})
+
+        found = self.client.get('/api/chat/threads?search=zenith').get_json()
+        self.assertEqual([(t['username'], t['org_name']) for t in found], [('org0', 'Zenith Clinic')])
+        found = self.client.get('/api/chat/threads?search=renamed').get_json()
+        self.assertEqual([(t['username'], t['last_message']) for t in found], [('renamed', 'from org1')])
+        self.assertEqual(self.client.get('/api/chat/threads?search=acme').get_json(), [])
+
+    def test_rebuild_matches_incremental_updates(self):
+        base = datetime(2025, 1, 1, 10, 0)
+        rows = [
+            (self.orgs[0].id, None, False), (self.support.id, self.orgs[0].id, False),
+            (self.doctor.id, None, False), (self.doctor.id, None, True),
+        ]
+        for n, (sender, recipient, is_read) in enumerate(rows):
+            db.session.add(Message(sender_id=sender, recipient_id=recipient, body=f'm{n}',
+                                   timestamp=base + timedelta(minutes=n), is_read=is_read))
+        db.session.commit()
+
+        self.assertEqual(rebuild_threads(), 2)
+        db.session.commit()
+        threads = {t.user_id: t for t in ChatThread.query.all()}
+        self.assertEqual((threads[self.orgs[0].id].last_message_preview, threads[self.orgs[0].id].unread_for_support), ('m1', 1))
+        self.assertEqual((threads[self.doctor.id].last_message_preview, threads[self.doctor.id].unread_for_support), ('m3', 1))
+
+if __name__ == '__main__':
+    unittest.main()
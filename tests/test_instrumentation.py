@@ -0,0 +1,133 @@
+import unittest
+from collections import Counter
+from datetime import datetime, timedelta
+from flask import g
+from app import create_app, db
+from app.models import User, Organization, RequestMetric
+from app.utils.instrumentation import (
+    RequestMetrics, request_metrics, normalize_statement, redact_parameters, quantile, LATENCY_BUCKETS_MS
+)
+
+
+class InstrumentationHelpersTestCase(unittest.TestCase):
+    def test_statements_group_regardless_of_in_list_length(self):
+        a = normalize_statement("SELECT *\n  FROM users WHERE id IN (?, ?, ?)")
+        b = normalize_statement("SELECT * FROM users WHERE id IN (?, ?)")
+        self.assertEqual(a, b)
+        self.assertEqual(a, "SELECT * FROM users WHERE id IN (?, ...)")
+        self.assertEqual(
+            normalize_statement("SELECT 1 WHERE a IN (%(p_1)s, %(p_2)s)"), "SELECT 1 WHERE a IN (?, ...)"
+        )
+
+    def test_parameters_are_reduced_to_types(self):
+        self.assertEqual(redact_parameters(('Иванов', 42)), ['str', 'int'])
+        self.assertEqual(redact_parameters({'name': 'Иванов'}), {'name': 'str'})
+        self.assertEqual(redact_parameters([('a', 1), ('b', 2)]), {'rows': 2, 'first': ['str', 'int']})
+        self.assertNotIn('Иванов', repr(redact_parameters({'name': 'Иванов'})))
+
+    def test_quantiles_from_buckets(self):
+        metrics = RequestMetrics()
+        for ms in [3] * 90 + [40] * 9 + [7000]:
+            metrics.record('main.index', ms, 200, {'queries': 0, 'sql_ms': 0.0, 'statements': Counter()})
+        buckets = metrics._endpoints['main.index']['buckets']
+        self.assertEqual(len(buckets), len(LATENCY_BUCKETS_MS) + 1)
+        self.assertEqual(quantile(buckets, 0.5, 7000), 5)
+        self.assertEqual(quantile(buckets, 0.95, 7000), 50)
+        self.assertEqual(quantile(buckets, 0.999, 7000), 7000)
+        self.assertEqual(quantile([0] * len(buckets), 0.5), 0)
+
+
+class RequestMetricsTestCase(unittest.TestCase):
+    def setUp(self):
+        test_config = {
+            'TESTING': True,
+            'SQLALCHEMY_DATABASE_URI': 'sqlite:///:memory:',
+            'WTF_CSRF_ENABLED': False,
+            'METRICS_REPEAT_THRESHOLD': 3
+        }
+        self.app = create_app(test_config)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.admin = User(username='admin', email='admin@test.com', role='superadmin')
+        db.session.add(self.admin)
+        db.session.commit()
+        # Start without requests of earlier tests
+        request_metrics.flush()
+        RequestMetric.query.delete()
+        db.session.commit()
+        self.client = self.app.test_client()
+        with self.client.session_transaction() as sess:
+            sess['_user_id'] = str(self.admin.id)
+        g.pop('_login_user', None)
+
+        @self.app.route('/_test/n-plus-one')
+        def n_plus_one():
+            for i in range(4):
+                Organization.query.filter_by(id=i).first()
+            return 'ok'
+
+    def tearDown(self):
+        request_metrics.slow_query_ms = 200
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_requests_are_timed_with_their_queries(self):
+        for _ in range(3):
+            self.assertEqual(self.client.get('/_test/n-plus-one').status_code, 200)
+        stats = request_metrics._endpoints['n_plus_one']
+        self.assertEqual(stats['requests'], 3)
+        # The login user lookup plus four organization lookups
+        self.assertGreaterEqual(stats['max_queries'], 4)
+        self.assertEqual(stats['repeated_count'], 4)
+        self.assertIn('FROM organizations', stats['repeated_statement'])
+
+        summary = request_metrics.summary()
+        endpoint = next(e for e in summary['endpoints'] if e['endpoint'] == 'n_plus_one')
+        self.assertEqual(endpoint['requests'], 3)
+        self.assertLessEqual(endpoint['p50'], endpoint['p99'])
+        self.assertEqual(summary['n_plus_one'][0]['endpoint'], 'n_plus_one')
+
+    def test_flush_persists_and_summary_merges_periods(self):
+        self.client.get('/_test/n-plus-one')
+        self.assertEqual(request_metrics.flush(), 1)
+        self.assertEqual(request_metrics._endpoints, {})
+        self.client.get('/_test/n-plus-one')
+
+        row = RequestMetric.query.filter_by(endpoint='n_plus_one').one()
+        self.assertEqual((row.requests, row.repeated_count), (1, 4))
+        endpoint = next(e for e in request_metrics.summary()['endpoints'] if e['endpoint'] == 'n_plus_one')
+        self.assertEqual(endpoint['requests'], 2)
+
+        # Old periods are dropped
+        old = RequestMetric(
+            period_start=datetime.utcnow() - timedelta(days=request_metrics.retention_days + 1),
+            endpoint='main.index', latency_buckets='[]'
+        )
+        db.session.add(old)
+        db.session.commit()
+        request_metrics.flush()
+        self.assertEqual(RequestMetric.query.filter_by(endpoint='main.index').count(), 0)
+        self.assertEqual(RequestMetric.query.filter_by(endpoint='n_plus_one').count(), 2)
+
+    def test_slow_queries_are_logged_without_values(self):
+        request_metrics.slow_query_ms = 0
+        db.session.add(Organization(name='Secret Clinic'))
+        db.session.commit()
+        slow = request_metrics.summary()['slow_queries']
+        insert = next(q for q in slow if q['statement'].startswith('INSERT INTO organizations'))
+        self.assertNotIn('Secret Clinic', repr(insert))
+        self.assertIn('str', repr(insert['parameters']))
+
+    def test_monitoring_page_shows_percentiles(self):
+        self.client.get('/_test/n-plus-one')
+        g.pop('_login_user', None)
+        response = self.client.get('/admin/monitoring')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('n_plus_one', response.get_data(as_text=True))
+        data = self.client.get('/admin/monitoring/performance').get_json()
+        self.assertIn('p95', data['endpoints'][0])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,162 @@
+import unittest
+import io
+import json
+import os
+import time
+from datetime import datetime, timedelta
+from app import create_app, db
+import openpyxl
+from app.models import User, Doctor, Service, BackgroundJob
+from app.utils.jobs import job_queue, save_upload
+
+def _count_job(job, items):
+    job.set_total(len(items))
+    for item in items:
+        job.advance()
+        if item < 0:
+            job.warn(f"Negative item {item}")
+    return {'message': 'ok', 'category': 'success'}
+
+def _failing_job(job):
+    raise ValueError("boom")
+
+class JobQueueTestCase(unittest.TestCase):
+    def setUp(self):
+        test_config = {
+            'TESTING': True,
+            'SQLALCHEMY_DATABASE_URI': 'sqlite:///:memory:',
+            'WTF_CSRF_ENABLED': False
+        }
+        self.app = create_app(test_config)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        self.admin = User(username='admin', email='admin@test.com', role='superadmin')
+        db.session.add(self.admin)
+        db.session.commit()
+
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        job_queue.sync = True
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def login_admin(self):
+        with self.client.session_transaction() as sess:
+            sess['_user_id'] = str(self.admin.id)
+            sess['_fresh'] = True
+
+    def test_sync_job_report(self):
+        job_id = job_queue.enqueue('test', _count_job, [1, -2, 3], user_id=self.admin.id)
+        job = db.session.get(BackgroundJob, job_id)
+
+        self.assertEqual(job.status, 'done')
+        self.assertEqual(job.total, 3)
+        self.assertEqual(job.processed, 3)
+        self.assertEqual(job.warning_count, 1)
+        self.assertEqual(job.to_dict()['warnings'], ["Negative item -2"])
+        self.assertEqual(job.to_dict()['result'], {'message': 'ok', 'category': 'success'})
+
+    def test_failed_job(self):
+        job_id = job_queue.enqueue('test', _failing_job)
+        job = db.session.get(BackgroundJob, job_id)
+
+        self.assertEqual(job.status, 'failed')
+        self.assertEqual(job.error, 'boom')
+        self.assertIsNotNone(job.finished_at)
+
+    def test_thread_pool_job(self):
+        job_queue.sync = False
+        job_id = job_queue.enqueue('test', _count_job, [1, 2])
+        job_queue._executor.shutdown(wait=True)
+        job_queue._executor = None
+
+        db.session.expire_all()
+        job = db.session.get(BackgroundJob, job_id)
+        self.assertEqual(job.status, 'done')
+        self.assertEqual(job.processed, 2)
+
+    def test_import_route_enqueues_and_status_endpoint(self):
+        self.login_admin()
+        csv_content = "Name,Specialization,Manager\nDr. One,Surgeon,\nDr. Two,,"
+        data = {'file': (io.BytesIO(csv_content.encode('utf-8')), 'doctors.csv')}
+
+        response = self.client.post(
+            '/admin/doctors/import', data=data, content_type='multipart/form-data',
+            headers={'X-Requested-With': 'XMLHttpRequest'}
+        )
+        self.assertEqual(response.status_code, 202)
+        payload = response.get_json()
+
+        status = self.client.get(payload['status_url'])
+        self.assertEqual(status.status_code, 200)
+        job = status.get_json()
+        self.assertEqual(job['kind'], 'doctors_import')
+        self.assertEqual(job['status'], 'done')
+        self.assertEqual(job['processed'], 2)
+        self.assertEqual(job['result']['created'], 2)
+        self.assertEqual(Doctor.query.count(), 2)
+
+    def test_service_import_price_cells(self):
+        self.login_admin()
+        csv_content = "Name,Price\nUzi,1500\nNo price\nBlank price, \n"
+        output = io.BytesIO()
+        wb = openpyxl.Workbook()
+        wb.active.append(['Name', 'Price'])
+        wb.active.append(['Rentgen', 2000])
+        wb.active.append(['Empty cell', None])
+        wb.save(output)
+        output.seek(0)
+
+        for content, filename in ((io.BytesIO(csv_content.encode('utf-8')), 'services.csv'), (output, 'services.xlsx')):
+            response = self.client.post(
+                '/admin/services/import', data={'file': (content, filename)}, content_type='multipart/form-data',
+                headers={'X-Requested-With': 'XMLHttpRequest'}
+            )
+            self.assertEqual(response.status_code, 202)
+
+        # CSV rows need a price; an empty XLSX price cell imports as 0 (the parent's price applies)
+        prices = {s.name: s.price for s in Service.query}
+        self.assertEqual(prices, {'Uzi': 1500.0, 'Rentgen': 2000.0, 'Empty cell': 0.0})
+
+    def test_interrupted_jobs_are_failed_on_startup(self):
+        now = datetime.utcnow()
+        old = now - timedelta(seconds=job_queue.stale_after + 60)
+        stuck = BackgroundJob(kind='journal_import', status='running', created_at=old, started_at=old)
+        queued = BackgroundJob(kind='journal_import', status='queued', created_at=old)
+        recent = BackgroundJob(kind='journal_import', status='running', created_at=now, started_at=now)
+        db.session.add_all([stuck, queued, recent])
+        db.session.commit()
+
+        class Upload:
+            filename = 'journal.csv'
+
+            def save(self, out):
+                out.write(b'data')
+
+        orphan, fresh = save_upload(Upload()), save_upload(Upload())
+        os.utime(orphan, (time.time() - job_queue.stale_after - 60,) * 2)
+        try:
+            self.assertEqual(job_queue.recover_stale(), 2)
+            self.assertFalse(os.path.exists(orphan))
+            self.assertTrue(os.path.exists(fresh))
+        finally:
+            for path in (orphan, fresh):
+                if os.path.exists(path):
+                    os.remove(path)
+
+        db.session.expire_all()
+        self.assertEqual((stuck.status, queued.status, recent.status), ('failed', 'failed', 'running'))
+        self.assertTrue(stuck.error)
+        self.assertIsNotNone(stuck.finished_at)
+
+    def test_unknown_job_404(self):
+        self.login_admin()
+        response = self.client.get('/admin/jobs/999')
+        self.assertEqual(response.status_code, 404)
+
+if __name__ == '__main__':
+    unittest.main()
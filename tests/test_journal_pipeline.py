@@ -0,0 +1,125 @@
+import unittest
+import io
+from datetime import date
+from app import create_app, db
+from app.models import (
+    User, Service, AdditionalService, Doctor, Clinic, PaymentMethod, Appointment, Location,
+    AppointmentAdditionalService
+)
+from app.utils.journal_import import ImportLookups, resolve_journal_rows, detect_columns, normalize_name
+
+HEADER = "Дата;Договор;ФИО Пациента;Ребенок;ФИО Врача;Клиника;Исследование;Доп.услуги;Кол-во;Оплата;Скидка;Комментарий"
+
+class JournalPipelineTestCase(unittest.TestCase):
+    def setUp(self):
+        test_config = {
+            'TESTING': True,
+            'SQLALCHEMY_DATABASE_URI': 'sqlite:///:memory:',
+            'WTF_CSRF_ENABLED': False
+        }
+        self.app = create_app(test_config)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        self.admin = User(username='admin', email='admin@test.com', role='superadmin')
+        self.manager = User(username='Manager1', email='m1@test.com', role='admin')
+        self.city = Location(name="Test City", type="city")
+        self.center = Location(name="Test Center", type="center")
+        db.session.add_all([self.admin, self.manager, self.city, self.center])
+        db.session.commit()
+
+        self.service = Service(name="Test Service", price=1000.0)
+        self.extra = AdditionalService(name="Contrast", price=300.0)
+        self.doctor = Doctor(name="Ivanov  Ivan Petrovich", manager="manager1")
+        self.clinic = Clinic(name="Test Clinic", city_id=self.city.id)
+        self.pm = PaymentMethod(name="Cash")
+        db.session.add_all([self.service, self.extra, self.doctor, self.clinic, self.pm])
+        db.session.commit()
+
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def login_admin(self):
+        with self.client.session_transaction() as sess:
+            sess['_user_id'] = str(self.admin.id)
+            sess['_fresh'] = True
+
+    def post_csv(self, lines, delete_old=False):
+        content = "\n".join([HEADER] + lines)
+        data = {
+            'file': (io.BytesIO(content.encode('utf-8')), 'journal.csv'),
+            'center_id': self.center.id
+        }
+        if delete_old:
+            data['delete_old'] = 'on'
+        return self.client.post('/admin/journal/import', data=data, content_type='multipart/form-data', follow_redirects=True)
+
+    def test_normalize_name(self):
+        self.assertEqual(normalize_name("  Ivanov \t IVAN "), "ivanov ivan")
+        self.assertEqual(normalize_name(None), "")
+
+    def test_import_resolves_and_bulk_inserts(self):
+        self.login_admin()
+        response = self.post_csv([
+            "01.03.2025;12;Patient One;да;IVANOV IVAN PETROVICH;test clinic;test service;;1;Cash;100;Note",
+            "01.03.2025;13;Patient Two;;Ivanov Petrovich;;;contrast;3;Card;;",
+        ])
+        self.assertEqual(response.status_code, 200)
+
+        appts = Appointment.query.order_by(Appointment.id).all()
+        self.assertEqual(len(appts), 2)
+
+        first, second = appts
+        self.assertEqual(first.doctor_id, self.doctor.id)
+        self.assertEqual(first.manager_id, self.manager.id)
+        self.assertEqual(first.clinic_id, self.clinic.id)
+        self.assertEqual(first.service, "Test Service")
+        self.assertEqual(first.cost, 1000.0)
+        self.assertEqual(first.discount, 100.0)
+        self.assertTrue(first.is_child)
+        self.assertEqual(first.payment_method_id, self.pm.id)
+        self.assertEqual(len(first.service_associations), 1)
+
+        # Wildcard doctor match, per-row quantity for additional services, new payment method
+        self.assertEqual(second.doctor_id, self.doctor.id)
+        self.assertEqual(second.service, "Доп. услуги")
+        self.assertEqual(second.cost, 900.0)
+        assoc = AppointmentAdditionalService.query.filter_by(appointment_id=second.id).one()
+        self.assertEqual(assoc.quantity, 3)
+        self.assertIsNotNone(PaymentMethod.query.filter_by(name="Card").first())
+
+    def test_warnings_skip_rows(self):
+        rows = [
+            HEADER.split(';'),
+            "xx.03.2025;1;A;;Ivanov Ivan Petrovich;;Test Service;;1;;;".split(';'),
+            "01.03.2025;2;B;;Unknown Doctor;;Test Service;;1;;;".split(';'),
+            "01.03.2025;3;C;;Ivanov Ivan Petrovich;;Test Service;Missing;1;;;".split(';'),
+            "01.03.2025;4;D;;Ivanov Ivan Petrovich;;Test Service;;1;;;".split(';'),
+        ]
+        col_map, header_row_idx = detect_columns(rows[:2])
+        warnings = []
+        valid = list(resolve_journal_rows(rows[header_row_idx + 1:], col_map, header_row_idx, ImportLookups(), warnings))
+
+        self.assertEqual([r['patient'] for r in valid], ['D'])
+        self.assertEqual(valid[0]['date'], date(2025, 3, 1))
+        self.assertEqual(len(warnings), 3)
+        self.assertIn("Строка 2", warnings[0])
+        self.assertIn("Unknown Doctor", warnings[1])
+        self.assertIn("Missing", warnings[2])
+
+    def test_delete_old_replaces_days(self):
+        self.login_admin()
+        self.post_csv(["01.03.2025;1;Old;;Ivanov Ivan Petrovich;;Test Service;Contrast;1;;;"])
+        self.post_csv(["01.03.2025;2;New;;Ivanov Ivan Petrovich;;Test Service;;1;;;"], delete_old=True)
+
+        names = [a.patient_name for a in Appointment.query.all()]
+        self.assertEqual(names, ['New'])
+        self.assertEqual(AppointmentAdditionalService.query.count(), 0)
+
+if __name__ == '__main__':
+    unittest.main()
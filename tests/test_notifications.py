@@ -0,0 +1,98 @@
+import unittest
+from flask import g
+from sqlalchemy import event
+from app import create_app, db
+from app.models import User, Notification, NotificationStatus
+
+
+class NotificationFanOutTestCase(unittest.TestCase):
+    def setUp(self):
+        test_config = {
+            'TESTING': True,
+            'SQLALCHEMY_DATABASE_URI': 'sqlite:///:memory:',
+            'WTF_CSRF_ENABLED': False
+        }
+        self.app = create_app(test_config)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.admin = User(username='admin', email='admin@test.com', role='superadmin')
+        db.session.add(self.admin)
+        for i in range(6):
+            db.session.add(User(username=f'org{i}', email=f'org{i}@test.com', role='org', is_blocked=(i == 5)))
+        db.session.add(User(username='doc', email='doc@test.com', role='doctor'))
+        db.session.commit()
+        self.client = self.app.test_client()
+        self.login(self.admin)
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def login(self, user):
+        with self.client.session_transaction() as sess:
+            sess['_user_id'] = str(user.id)
+        g.pop('_login_user', None)
+
+    def send(self, target_type, **form):
+        data = {'title': 'Hello', 'message': 'Body', 'target_type': target_type}
+        data.update(form)
+        response = self.client.post('/admin/notifications', data=data)
+        self.assertEqual(response.status_code, 302)
+        return Notification.query.order_by(Notification.id.desc()).first()
+
+    def count_inserts(self, action):
+        inserts = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            if statement.lstrip().upper().startswith('INSERT INTO NOTIFICATION_STATUSES'):
+                inserts.append(executemany)
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            result = action()
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+        return result, inserts
+
+    def test_fan_out_is_one_insert_select(self):
+        notif, inserts = self.count_inserts(lambda: self.send('all'))
+        self.assertEqual(inserts, [False])
+        # Blocked users are left out
+        self.assertEqual(notif.recipient_count, 7)
+        self.assertEqual(NotificationStatus.query.filter_by(notification_id=notif.id).count(), 7)
+
+        notif = self.send('role', target_role='org')
+        self.assertEqual(notif.recipient_count, 5)
+        doc = User.query.filter_by(username='doc').first()
+        notif = self.send('user', target_user_id=str(doc.id))
+        self.assertEqual([s.user_id for s in notif.statuses], [doc.id])
+        notif = self.send('role', target_role='')
+        self.assertEqual(notif.recipient_count, 0)
+
+    def test_reads_are_counted_once(self):
+        notif = self.send('role', target_role='org')
+        org = User.query.filter_by(username='org0').first()
+        status = NotificationStatus.query.filter_by(notification_id=notif.id, user_id=org.id).first()
+        self.login(org)
+        for _ in range(2):
+            self.assertEqual(self.client.post(f'/notifications/read/{status.id}').status_code, 200)
+        db.session.refresh(notif)
+        self.assertEqual(notif.read_count, 1)
+
+        # Not the recipient of that status
+        self.login(self.admin)
+        self.assertEqual(self.client.post(f'/notifications/read/{status.id}').status_code, 403)
+
+        self.login(self.admin)
+        page = self.client.get('/admin/notifications')
+        self.assertIn('1 / 5', page.get_data(as_text=True))
+
+    def test_broadcasts_always_create_statuses(self):
+        # The former lazy option is ignored: every recipient gets a status row to see and acknowledge
+        notif = self.send('all', lazy_receipts='1')
+        self.assertEqual(notif.recipient_count, 7)
+        self.assertEqual(NotificationStatus.query.filter_by(notification_id=notif.id).count(), 7)
+
+if __name__ == '__main__':
+    unittest.main()
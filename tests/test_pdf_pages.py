@@ -0,0 +1,114 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+import uuid
+from io import BytesIO
+from PIL import Image
+from app import create_app, db
+from app.models import User
+from app.utils.pdf_pages import PdfPageRasterizer, InvalidSession, pdf_pages
+
+
+def poppler_available():
+    try:
+        import pdf2image  # noqa: F401
+    except ImportError:
+        return False
+    return shutil.which('pdftoppm') is not None and shutil.which('pdfinfo') is not None
+
+
+def make_pdf(pages):
+    import img2pdf
+    images = []
+    for color in ['white', 'black', 'gray'][:pages]:
+        out = BytesIO()
+        Image.new('RGB', (200, 280), color).save(out, format='JPEG')
+        images.append(out.getvalue())
+    return img2pdf.convert(images)
+
+
+class PdfPagesTestCase(unittest.TestCase):
+    def setUp(self):
+        self.static = tempfile.mkdtemp()
+        self.app = create_app({
+            'TESTING': True,
+            'SQLALCHEMY_DATABASE_URI': 'sqlite:///:memory:',
+            'WTF_CSRF_ENABLED': False
+        })
+        self.app.static_folder = self.static
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        self.admin = User(username='admin', email='admin@test.com', role='superadmin')
+        db.session.add(self.admin)
+        db.session.commit()
+
+        self.client = self.app.test_client()
+        with self.client.session_transaction() as sess:
+            sess['_user_id'] = str(self.admin.id)
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+        shutil.rmtree(self.static, ignore_errors=True)
+
+    def make_session(self, age=0):
+        session_id = str(uuid.uuid4())
+        path = os.path.join(PdfPageRasterizer.root(self.static), session_id)
+        os.makedirs(path)
+        with open(os.path.join(path, 'source.pdf'), 'wb') as f:
+            f.write(b'x' * 100)
+        if age:
+            stamp = time.time() - age
+            os.utime(path, (stamp, stamp))
+        return session_id, path
+
+    def test_rejects_unknown_and_malformed_sessions(self):
+        rasterizer = PdfPageRasterizer()
+        for session_id in ('../../etc', str(uuid.uuid4()), ''):
+            with self.assertRaises(InvalidSession):
+                rasterizer.page_path(session_id, 1, static_folder=self.static)
+        self.assertEqual(self.client.get(f'/stamp-tool/documents/{uuid.uuid4()}/pages/1').status_code, 404)
+
+    def test_cached_pages_are_served_without_rendering(self):
+        session_id, path = self.make_session()
+        Image.new('RGB', (10, 10), 'white').save(os.path.join(path, 'page_1.png'))
+        response = self.client.get(f'/stamp-tool/documents/{session_id}/pages/1')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'image/png')
+        response.close()
+
+    def test_sweep_removes_expired_sessions(self):
+        rasterizer = PdfPageRasterizer()
+        rasterizer.ttl = 3600
+        _, old_path = self.make_session(age=7200)
+        _, fresh_path = self.make_session(age=60)
+
+        self.assertEqual(rasterizer.sweep(self.static), (1, 100))
+        self.assertFalse(os.path.exists(old_path))
+        self.assertTrue(os.path.exists(fresh_path))
+        self.assertEqual(rasterizer.sweep(self.static), (0, 0))
+
+    @unittest.skipUnless(poppler_available(), 'pdf2image and poppler are not installed')
+    def test_upload_renders_pages_on_demand(self):
+        response = self.client.post('/stamp-tool/upload', data={
+            'file': (BytesIO(make_pdf(3)), 'scan.pdf')
+        }, content_type='multipart/form-data')
+        data = response.get_json()
+        self.assertEqual(data['total_pages'], 3)
+        path = pdf_pages.session_dir(data['session_id'], self.static)
+        self.assertFalse(os.path.exists(os.path.join(path, 'page_3.png')))
+
+        response = self.client.get(data['pages'][2])
+        with Image.open(BytesIO(response.data)) as img:
+            self.assertLess(img.convert('L').getpixel((img.width // 2, img.height // 2)), 200)
+        response = self.client.get(data['thumbnails'][1])
+        self.assertEqual(response.mimetype, 'image/jpeg')
+        self.assertEqual(self.client.get(data['pages'][0].replace('/pages/1', '/pages/9')).status_code, 404)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import threading
+import time
+import unittest
+from types import SimpleNamespace
+from app.utils.pg_listen import PgListener
+
+
+class FakeConnection:
+    """psycopg connection stand-in: delivers the given notifications, then drops."""
+
+    def __init__(self, notifications):
+        self.executed = []
+        self.notifications = notifications
+        self.autocommit = False
+
+    def rollback(self):
+        pass
+
+    def execute(self, statement):
+        self.executed.append(statement)
+
+    def notifies(self, timeout=None):
+        notifications, self.notifications = self.notifications, []
+        yield from notifications
+        raise OSError("server closed the connection")
+
+
+class FakeEngine:
+    def __init__(self, connections):
+        self.connections = list(connections)
+        self.opened = 0
+        self.blocked = threading.Event()
+
+    def raw_connection(self):
+        if not self.connections:
+            # Reconnects after the scripted connections wait forever
+            self.blocked.wait()
+        self.opened += 1
+        return SimpleNamespace(detach=lambda: None, driver_connection=self.connections.pop(0))
+
+
+class PgListenerTestCase(unittest.TestCase):
+    def test_one_connection_dispatches_every_channel(self):
+        listener = PgListener()
+        received, resets = [], []
+        listener.subscribe('chat_events', received.append, lambda: resets.append('chat'))
+        listener.subscribe('global_settings', lambda payload: received.append('settings'), lambda: resets.append('settings'))
+
+        connection = FakeConnection([
+            SimpleNamespace(channel='chat_events', payload='message:1:2'),
+            SimpleNamespace(channel='global_settings', payload=''),
+            SimpleNamespace(channel='unknown', payload='x'),
+        ])
+        engine = FakeEngine([connection])
+        listener.ensure(engine)
+
+        deadline = time.monotonic() + 2
+        while len(resets) < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(engine.opened, 1)
+        self.assertEqual(connection.executed, ['LISTEN chat_events', 'LISTEN global_settings'])
+        self.assertTrue(connection.autocommit)
+        self.assertEqual(received, ['message:1:2', 'settings'])
+        # The lost connection may have dropped notifications: every subscriber resets
+        self.assertEqual(sorted(resets), ['chat', 'settings'])
+
+if __name__ == '__main__':
+    unittest.main()
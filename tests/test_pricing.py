@@ -0,0 +1,83 @@
+import unittest
+from datetime import date
+from app import create_app, db
+from app.models import Service, ServicePrice, AdditionalService, AdditionalServicePrice
+from app.utils.pricing import price_resolver, resolve_prices
+
+class PriceResolverTestCase(unittest.TestCase):
+    def setUp(self):
+        test_config = {
+            'TESTING': True,
+            'SQLALCHEMY_DATABASE_URI': 'sqlite:///:memory:',
+            'WTF_CSRF_ENABLED': False
+        }
+        self.app = create_app(test_config)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        self.parent = Service(name='Uzi', price=1000)
+        db.session.add(self.parent)
+        db.session.flush()
+        self.child = Service(name='Uzi child', price=0, parent_id=self.parent.id)
+        db.session.add(self.child)
+        db.session.flush()
+
+        db.session.add(ServicePrice(service_id=self.parent.id, price=1200, start_date=date(2024, 1, 1), end_date=date(2024, 6, 30)))
+        db.session.add(ServicePrice(service_id=self.parent.id, price=1500, start_date=date(2024, 7, 1), end_date=None))
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_period_selection(self):
+        self.assertEqual(self.parent.get_price(date(2023, 12, 31)), 1000)
+        self.assertEqual(self.parent.get_price(date(2024, 1, 1)), 1200)
+        self.assertEqual(self.parent.get_price(date(2024, 6, 30)), 1200)
+        self.assertEqual(self.parent.get_price(date(2025, 3, 1)), 1500)
+
+    def test_overlapping_periods_use_latest(self):
+        db.session.add(ServicePrice(service_id=self.parent.id, price=1300, start_date=date(2024, 3, 1), end_date=date(2024, 3, 31)))
+        db.session.commit()
+
+        self.assertEqual(self.parent.get_price(date(2024, 2, 29)), 1200)
+        self.assertEqual(self.parent.get_price(date(2024, 3, 15)), 1300)
+        self.assertEqual(self.parent.get_price(date(2024, 4, 1)), 1200)
+
+    def test_parent_inheritance(self):
+        self.assertEqual(self.child.get_price(date(2023, 1, 1)), 1000)
+        self.assertEqual(self.child.get_price(date(2024, 2, 1)), 1200)
+
+        db.session.add(ServicePrice(service_id=self.child.id, price=900, start_date=date(2024, 2, 1)))
+        db.session.commit()
+        self.assertEqual(self.child.get_price(date(2024, 2, 1)), 900)
+
+    def test_invalidated_after_commit(self):
+        self.assertEqual(self.parent.get_price(date(2023, 1, 1)), 1000)
+        self.parent.price = 1100
+        db.session.commit()
+        self.assertEqual(self.parent.get_price(date(2023, 1, 1)), 1100)
+
+    def test_resolve_prices_batch(self):
+        prices = resolve_prices([
+            (self.parent.id, date(2024, 2, 1)),
+            (self.child.id, date(2024, 8, 1)),
+            (None, date(2024, 2, 1)),
+            (9999, date(2024, 2, 1)),
+        ])
+        self.assertEqual(prices, [1200, 1500, None, None])
+
+    def test_additional_services(self):
+        extra = AdditionalService(name='Contrast', price=300)
+        db.session.add(extra)
+        db.session.flush()
+        db.session.add(AdditionalServicePrice(additional_service_id=extra.id, price=350, start_date=date(2024, 1, 1)))
+        db.session.commit()
+
+        self.assertEqual(extra.get_price(date(2023, 1, 1)), 300)
+        self.assertEqual(price_resolver.get_price(extra.id, date(2024, 5, 1), kind='additional'), 350)
+
+if __name__ == '__main__':
+    unittest.main()
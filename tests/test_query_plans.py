@@ -0,0 +1,89 @@
+import unittest
+from datetime import date, timedelta
+from sqlalchemy import event
+from app import create_app, db
+from app.models import User, Location, Doctor, PaymentMethod, Appointment
+
+class QueryPlanTestCase(unittest.TestCase):
+    """EXPLAIN QUERY PLAN of the appointment hot paths must not scan the whole table."""
+
+    def setUp(self):
+        test_config = {
+            'TESTING': True,
+            'SQLALCHEMY_DATABASE_URI': 'sqlite:///:memory:',
+            'WTF_CSRF_ENABLED': False
+        }
+        self.app = create_app(test_config)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        self.admin = User(username='admin', email='admin@test.com', role='superadmin')
+        self.center = Location(name="Center", type="center")
+        self.doctor = Doctor(name="Доктор")
+        self.cashless = PaymentMethod(name="Безнал")
+        db.session.add_all([self.admin, self.center, self.doctor, self.cashless])
+        db.session.commit()
+
+        start = date(2025, 3, 3)
+        db.session.add_all([
+            Appointment(
+                center_id=self.center.id, date=start + timedelta(days=i % 30), time='09:00',
+                patient_name=f'пациент {i}', author_id=self.admin.id, doctor_id=self.doctor.id,
+                payment_method_id=self.cashless.id if i % 2 else None, allow_overlap=True
+            )
+            for i in range(200)
+        ])
+        db.session.commit()
+        db.session.execute(db.text('ANALYZE'))
+
+        self.client = self.app.test_client()
+        with self.client.session_transaction() as sess:
+            sess['_user_id'] = str(self.admin.id)
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def appointment_selects(self, *urls):
+        """Runs the requests and returns (sql, params) of every SELECT reading appointments."""
+        statements = []
+
+        def capture(conn, cursor, statement, parameters, context, executemany):
+            if statement.lstrip().upper().startswith('SELECT') and 'FROM appointments' in statement:
+                statements.append((statement, parameters))
+
+        event.listen(db.engine, 'before_cursor_execute', capture)
+        try:
+            for url in urls:
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200, url)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', capture)
+        self.assertTrue(statements)
+        return statements
+
+    def plan(self, statement, parameters):
+        rows = db.session.connection().exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters).all()
+        return ' | '.join(row[-1] for row in rows)
+
+    def test_hot_paths_use_indexes(self):
+        center = self.center.id
+        for statement, parameters in self.appointment_selects(
+            f'/api/slots?date=2025-03-04&center_id={center}',
+            f'/dashboard?center_id={center}&start_date=2025-03-03',
+            f'/statistics?center_id={center}&year=2025&month=3',
+            '/admin/reports/summary/data?months=3',
+        ):
+            plan = self.plan(statement, parameters)
+            self.assertNotRegex(plan, r'SCAN appointments(?! USING)', f'{statement}\n{plan}')
+
+    def test_date_range_is_sargable(self):
+        query = Appointment.query.filter(Appointment.date >= date(2025, 3, 1), Appointment.date < date(2025, 4, 1))
+        compiled = query.statement.compile(db.engine)
+        plan = self.plan(str(compiled), tuple(compiled.params[name] for name in compiled.positiontup))
+        self.assertIn('USING INDEX ix_appointments_date_payment_method', plan)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+import unittest
+from datetime import date
+from app import create_app, db
+from app.models import (
+    User, Location, Service, ServicePrice, AdditionalService, AdditionalServicePrice,
+    Appointment, AppointmentAdditionalService
+)
+from app.utils.recalculation import recalculate_costs
+
+class RecalculationTestCase(unittest.TestCase):
+    def setUp(self):
+        test_config = {
+            'TESTING': True,
+            'SQLALCHEMY_DATABASE_URI': 'sqlite:///:memory:',
+            'WTF_CSRF_ENABLED': False
+        }
+        self.app = create_app(test_config)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        self.admin = User(username='admin', email='admin@test.com', role='superadmin')
+        self.center = Location(name="Center", type="center")
+        db.session.add_all([self.admin, self.center])
+        db.session.commit()
+
+        self.parent = Service(name="КТ", price=1000.0)
+        db.session.add(self.parent)
+        db.session.flush()
+        self.child = Service(name="КТ детская", price=0.0, parent_id=self.parent.id)
+        self.extra = AdditionalService(name="Контраст", price=300.0)
+        db.session.add_all([self.child, self.extra])
+        db.session.flush()
+        db.session.add(ServicePrice(service_id=self.parent.id, price=1500.0, start_date=date(2025, 3, 15)))
+        db.session.add(AdditionalServicePrice(additional_service_id=self.extra.id, price=400.0, start_date=date(2025, 3, 1), end_date=date(2025, 3, 10)))
+        db.session.commit()
+
+        self.appts = [
+            # Before the new period, name in another case
+            self.make_appt(date(2025, 3, 5), "кт", quantity=2, discount=100.0),
+            # Child inherits the parent's period price, additional service out of its period
+            self.make_appt(date(2025, 3, 20), "КТ детская", extras=[self.extra.id], add_qty=2),
+            # Discount above the cost is clamped to 0
+            self.make_appt(date(2025, 3, 6), "КТ", extras=[self.extra.id], discount=5000.0),
+            # Unknown service: only additional services count
+            self.make_appt(date(2025, 3, 7), "Неизвестно", extras=[self.extra.id]),
+        ]
+        # Other month is untouched
+        self.other = self.make_appt(date(2025, 4, 1), "КТ", cost=1.0)
+        db.session.commit()
+
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def make_appt(self, day, service, quantity=1, add_qty=1, discount=0.0, extras=(), cost=0.0):
+        appt = Appointment(
+            center_id=self.center.id, date=day, time="09:00", patient_name="P", service=service,
+            quantity=quantity, additional_service_quantity=add_qty, discount=discount, cost=cost
+        )
+        db.session.add(appt)
+        db.session.flush()
+        for extra_id in extras:
+            db.session.add(AppointmentAdditionalService(appointment_id=appt.id, additional_service_id=extra_id, quantity=1))
+        return appt
+
+    def test_dry_run_reports_diff_without_writing(self):
+        result = recalculate_costs(self.center.id, date(2025, 3, 1), date(2025, 3, 31), dry_run=True)
+
+        self.assertEqual(result['total'], 4)
+        self.assertEqual(result['changed'], 3)
+        diff = {row['id']: row['new_cost'] for row in result['diff']}
+        self.assertEqual(diff, {
+            self.appts[0].id: 1900.0,
+            self.appts[1].id: 1500.0 + 300.0 * 2,
+            self.appts[3].id: 400.0,
+        })
+        db.session.expire_all()
+        self.assertEqual(db.session.get(Appointment, self.appts[0].id).cost, 0.0)
+
+    def test_update_in_one_statement(self):
+        result = recalculate_costs(self.center.id, date(2025, 3, 1), date(2025, 3, 31))
+        db.session.commit()
+        db.session.expire_all()
+
+        self.assertEqual(result['changed'], 3)
+        costs = [db.session.get(Appointment, a.id).cost for a in self.appts]
+        self.assertEqual(costs, [1900.0, 2100.0, 0.0, 400.0])
+        self.assertEqual(db.session.get(Appointment, self.other.id).cost, 1.0)
+
+    def test_route_dry_run(self):
+        with self.client.session_transaction() as sess:
+            sess['_user_id'] = str(self.admin.id)
+            sess['_fresh'] = True
+
+        response = self.client.post(
+            '/admin/journal/recalculate',
+            data={'center_id': self.center.id, 'month': '2025-03', 'dry_run': 'on'},
+            headers={'X-Requested-With': 'XMLHttpRequest'}
+        )
+        self.assertEqual(response.status_code, 202)
+        job = self.client.get(response.get_json()['status_url']).get_json()
+        self.assertEqual(job['status'], 'done')
+        self.assertEqual(job['result']['changed'], 3)
+        self.assertEqual(len(job['result']['diff']), 3)
+
+if __name__ == '__main__':
+    unittest.main()
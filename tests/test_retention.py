@@ -0,0 +1,105 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+import uuid
+from datetime import datetime, timedelta
+from app import create_app, db
+from app.models import User, MedicalCertificate
+from app.utils.retention import CertificateRetention, certificate_files
+
+
+class CertificateRetentionTestCase(unittest.TestCase):
+    def setUp(self):
+        self.static = tempfile.mkdtemp()
+        self.app = create_app({
+            'TESTING': True,
+            'SQLALCHEMY_DATABASE_URI': 'sqlite:///:memory:',
+            'WTF_CSRF_ENABLED': False
+        })
+        self.app.static_folder = self.static
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        self.admin = User(username='admin', email='admin@test.com', role='superadmin')
+        db.session.add(self.admin)
+        db.session.commit()
+
+        self.cert_dir = os.path.join(self.static, 'uploads', 'certificates')
+        os.makedirs(self.cert_dir)
+        self.retention = CertificateRetention()
+        self.retention.chunk = 2
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+        shutil.rmtree(self.static, ignore_errors=True)
+
+    def write(self, *parts, age=7200, size=10):
+        path = os.path.join(self.static, 'uploads', *parts)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(b'x' * size)
+        stamp = time.time() - age
+        os.utime(path, (stamp, stamp))
+        return path
+
+    def add_cert(self, name, days_old, pages=1):
+        filenames = [f'{name}_p{n}.jpg' for n in range(1, pages + 1)] if pages > 1 else [f'{name}.jpg']
+        for filename in filenames + [f'{name}.pdf']:
+            self.write('certificates', filename)
+        cert = MedicalCertificate(
+            patient_name=name, filename='|'.join(filenames), pdf_filename=f'{name}.pdf',
+            created_by_id=self.admin.id, generated_at=datetime.utcnow() - timedelta(days=days_old)
+        )
+        db.session.add(cert)
+        db.session.commit()
+        return cert.id
+
+    def test_certificate_files(self):
+        self.assertEqual(certificate_files('a_p1.jpg|a_p2.jpg', 'a.pdf'), ['a_p1.jpg', 'a_p2.jpg', 'a.pdf'])
+        self.assertEqual(certificate_files('a.jpg'), ['a.jpg'])
+
+    def test_expired_certificates_and_all_their_files_go(self):
+        for n in range(5):
+            self.add_cert(f'old{n}', 40, pages=2 if n % 2 else 1)
+        fresh_id = self.add_cert('fresh', 5, pages=2)
+
+        report = self.retention.run()
+        self.assertEqual(report['rows'], 5)
+        # 3 single-page (jpg + pdf) and 2 OP certificates (2 jpg + pdf)
+        self.assertEqual(report['files'], 3 * 2 + 2 * 3)
+        self.assertEqual(report['bytes'], (3 * 2 + 2 * 3) * 10)
+        self.assertEqual([c.id for c in MedicalCertificate.query.all()], [fresh_id])
+        self.assertEqual(sorted(os.listdir(self.cert_dir)), ['fresh.pdf', 'fresh_p1.jpg', 'fresh_p2.jpg'])
+
+    def test_orphans_and_temp_files_are_swept(self):
+        self.add_cert('kept', 1)
+        orphan = self.write('certificates', 'orphan.jpg')
+        just_written = self.write('certificates', 'in_progress.jpg', age=10)
+        stale_temp = self.write('temp', 'upload.xlsx', age=2 * 24 * 3600)
+        fresh_temp = self.write('temp', 'upload2.xlsx', age=60)
+        session_dir = os.path.join(self.static, 'uploads', 'temp_docs', str(uuid.uuid4()))
+        self.write('temp_docs', os.path.basename(session_dir), 'source.pdf', size=50)
+        old = time.time() - 30 * 3600
+        os.utime(session_dir, (old, old))
+
+        report = self.retention.run()
+        self.assertEqual((report['orphans'], report['temp_files'], report['temp_sessions']), (1, 1, 1))
+        self.assertEqual(report['bytes'], 10 + 10 + 50)
+        self.assertFalse(os.path.exists(orphan))
+        self.assertFalse(os.path.exists(stale_temp))
+        self.assertFalse(os.path.exists(session_dir))
+        self.assertTrue(os.path.exists(just_written))
+        self.assertTrue(os.path.exists(fresh_temp))
+        self.assertTrue(os.path.exists(os.path.join(self.cert_dir, 'kept.jpg')))
+
+        stats = self.retention.stats()
+        self.assertEqual(stats['totals']['runs'], 1)
+        self.assertEqual(stats['last_run']['bytes'], 70)
+
+if __name__ == '__main__':
+    unittest.main()
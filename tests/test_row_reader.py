@@ -0,0 +1,65 @@
+import unittest
+import io
+import openpyxl
+from app.utils import row_reader
+from app.utils.row_reader import iter_rows, peek_rows, cell_str
+
+class RowReaderTestCase(unittest.TestCase):
+    def test_csv_cp1251_semicolon(self):
+        content = "Имя;Цена\r\nУзи;1500\r\n\"Рентген; снимок\";2000\r\n".encode('cp1251')
+        rows = list(iter_rows(io.BytesIO(content), 'services.csv'))
+        self.assertEqual(rows, [['Имя', 'Цена'], ['Узи', '1500'], ['Рентген; снимок', '2000']])
+
+    def test_csv_utf8_across_chunks(self):
+        old_chunk = row_reader.CHUNK_SIZE
+        row_reader.CHUNK_SIZE = 7 # Split multi-byte characters and \r\n between reads
+        try:
+            content = "﻿Дата,Пациент\r\n01.03.2025,Иванов\r\n02.03.2025,Петров".encode('utf-8')
+            rows = list(iter_rows(io.BytesIO(content), 'journal.csv'))
+        finally:
+            row_reader.CHUNK_SIZE = old_chunk
+        self.assertEqual(rows, [['Дата', 'Пациент'], ['01.03.2025', 'Иванов'], ['02.03.2025', 'Петров']])
+
+    def test_csv_cp1251_after_ascii_chunk(self):
+        # The first chunk is plain ASCII, the cp1251 bytes only come later
+        content = b"".join(b"%d;1;2\r\n" % n for n in range(20000)) + "Иванов;1;2\r\n".encode('cp1251')
+        self.assertGreater(len(content), row_reader.CHUNK_SIZE)
+        rows = list(iter_rows(io.BytesIO(content), 'journal.csv'))
+        self.assertEqual(len(rows), 20001)
+        self.assertEqual(rows[0], ['0', '1', '2'])
+        self.assertEqual(rows[-1], ['Иванов', '1', '2'])
+
+    def test_csv_undecodable_bytes_are_replaced(self):
+        # 0x98 is undefined in cp1251 and invalid as a UTF-8 start byte
+        content = b"a;b\r\n\x98;c\r\n"
+        rows = list(iter_rows(io.BytesIO(content), 'journal.csv'))
+        self.assertEqual(rows, [['a', 'b'], ['\ufffd', 'c']])
+
+    def test_xlsx_rows(self):
+        output = io.BytesIO()
+        wb = openpyxl.Workbook()
+        ws = wb.active
+        ws.append(['Name', 'Price'])
+        ws.append(['Uzi', 1500])
+        wb.save(output)
+        output.seek(0)
+
+        rows = list(iter_rows(output, 'services.xlsx'))
+        self.assertEqual(rows, [['Name', 'Price'], ['Uzi', 1500]])
+
+    def test_peek_keeps_rows(self):
+        head, rows = peek_rows(iter([[1], [2], [3]]), 2)
+        self.assertEqual(head, [[1], [2]])
+        self.assertEqual(list(rows), [[1], [2], [3]])
+
+    def test_unsupported_format(self):
+        with self.assertRaises(ValueError):
+            iter_rows(io.BytesIO(b''), 'data.xls')
+
+    def test_cell_str(self):
+        self.assertIsNone(cell_str(None))
+        self.assertIsNone(cell_str('  '))
+        self.assertEqual(cell_str(' 12 '), '12')
+
+if __name__ == '__main__':
+    unittest.main()
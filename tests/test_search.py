@@ -0,0 +1,141 @@
+import unittest
+import random
+from datetime import date
+from flask import g
+from sqlalchemy import insert
+from app import create_app, db
+from app.models import User, Location, PaymentMethod, Appointment, Patient
+from app.utils import search
+from app.utils.search import NgramIndex, normalize_search_text, normalize_phone, similarity, search_service
+
+class SearchHelpersTestCase(unittest.TestCase):
+    def test_normalization(self):
+        self.assertEqual(normalize_search_text('  Семёнов-Тян-Шанский,  Пётр '), 'семенов тян шанский петр')
+        self.assertEqual(normalize_search_text(None), '')
+        self.assertEqual(normalize_phone('+7 (912) 345-67-89'), '79123456789')
+
+    def test_similarity(self):
+        self.assertEqual(similarity('иванов', 'иванов'), 1.0)
+        self.assertGreater(similarity('иванов', 'иванов иван'), similarity('иванов', 'петров иван'))
+
+    def test_ngram_index_matches_substring_search(self):
+        rng = random.Random(5)
+        words = ['иванов', 'иванова', 'петров', 'анна', 'ли', 'ян', 'ов']
+        texts = {i: ' '.join(rng.choice(words) for _ in range(rng.randint(1, 3))) for i in range(300)}
+        index = NgramIndex(texts.items())
+        for query in ['иван', 'ов', 'ли ян', 'анна петров', 'ва', 'сидоров']:
+            tokens = query.split()
+            expected = {i for i, text in texts.items() if all(t in text for t in tokens)}
+            self.assertEqual({doc_id for doc_id, _ in index.search(tokens, query)}, expected, query)
+
+class SearchEndpointsTestCase(unittest.TestCase):
+    def setUp(self):
+        test_config = {
+            'TESTING': True,
+            'SQLALCHEMY_DATABASE_URI': 'sqlite:///:memory:',
+            'WTF_CSRF_ENABLED': False
+        }
+        self.app = create_app(test_config)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        self.admin = User(username='admin', email='admin@test.com', role='superadmin')
+        self.org = User(username='org', email='org@test.com', role='org')
+        self.center = Location(name="Center", type="center")
+        self.cash = PaymentMethod(name="Наличные")
+        db.session.add_all([self.admin, self.org, self.center, self.cash])
+        db.session.commit()
+
+        for day, name, author in [
+            (date(2025, 1, 10), 'Семёнов Пётр', self.admin),
+            (date(2025, 2, 10), 'Семенова Анна', self.org),
+            (date(2025, 3, 10), 'Иванов Иван', self.admin),
+            (date(2024, 3, 10), 'Семенов Петр', self.admin),
+        ]:
+            db.session.add(Appointment(
+                date=day, time='09:00', patient_name=name, author_id=author.id,
+                center_id=self.center.id, payment_method_id=self.cash.id
+            ))
+        db.session.add_all([
+            Patient(surname='Семёнов', name='Пётр', patronymic='Ильич', phone='+7 (912) 345-67-89'),
+            Patient(surname='Иванова', name='Мария', phone='8-900-000-00-00'),
+        ])
+        db.session.commit()
+
+        self.client = self.app.test_client()
+        self.login(self.admin)
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def login(self, user):
+        with self.client.session_transaction() as sess:
+            sess['_user_id'] = str(user.id)
+        # The pushed app context outlives requests: drop the cached user
+        g.pop('_login_user', None)
+
+    def test_search_patients_ranked_projection(self):
+        results = self.client.get('/api/search/patients?q=семенов петр').get_json()
+        self.assertEqual([r['patient_name'] for r in results], ['Семёнов Пётр', 'Семенов Петр'])
+        self.assertEqual(results[0]['center_name'], 'Center')
+        self.assertNotIn('history', results[0])
+
+        results = self.client.get('/api/search/patients?q=СЕМЕН').get_json()
+        self.assertEqual(len(results), 3)
+
+        # Restricted roles only find their own appointments
+        self.login(self.org)
+        results = self.client.get('/api/search/patients?q=семен').get_json()
+        self.assertEqual([r['patient_name'] for r in results], ['Семенова Анна'])
+
+    def test_lookup_patients_by_name_and_phone(self):
+        results = self.client.get('/api/patients/lookup?q=петр семенов').get_json()
+        self.assertEqual([r['full_name'] for r in results], ['Семёнов Пётр Ильич'])
+        results = self.client.get('/api/patients/lookup?q=912 345').get_json()
+        self.assertEqual([r['surname'] for r in results], ['Семёнов'])
+        self.assertEqual(self.client.get('/api/patients/lookup?q=сидоров').get_json(), [])
+
+    def test_certificate_tool_search(self):
+        data = self.client.get('/stamp-tool/patients?year=2025&query=семенов').get_json()
+        self.assertTrue(data['success'])
+        self.assertEqual([a['patient_name'] for a in data['appointments']], ['Семёнов Пётр', 'Семенова Анна'])
+        data = self.client.get('/stamp-tool/patients?year=2025').get_json()
+        self.assertEqual(len(data['appointments']), 3)
+
+    def test_fallback_filters_before_the_limit(self):
+        everything = search_service.search_appointment_ids('семен')
+        own = [Appointment.author_id == self.org.id]
+        expected_own = search_service.search_appointment_ids('семен', where=own)
+        self.assertEqual(len(everything), 3)
+        self.assertEqual(len(expected_own), 1)
+
+        # One candidate per SQL query: matches beyond the first batches are still found, in the same order
+        batch = search.FALLBACK_BATCH
+        search.FALLBACK_BATCH = 1
+        try:
+            self.assertEqual(search_service.search_appointment_ids('семен', where=own, limit=1), expected_own)
+            self.assertEqual(search_service.search_appointment_ids('семен'), everything)
+            self.assertEqual(search_service.search_appointment_ids('семен', limit=2), everything[:2])
+        finally:
+            search.FALLBACK_BATCH = batch
+
+    def test_search_columns_follow_writes(self):
+        # Core bulk insert (journal import path) fills search_name through the column default
+        db.session.execute(insert(Appointment), [
+            {'date': date(2025, 4, 1), 'time': '09:00', 'patient_name': 'Ёлкин Фёдор', 'center_id': self.center.id}
+        ])
+        db.session.commit()
+        self.assertEqual(len(self.client.get('/api/search/patients?q=елкин').get_json()), 1)
+
+        appt = Appointment.query.filter_by(patient_name='Иванов Иван').one()
+        appt.patient_name = 'Сидоров Иван'
+        db.session.commit()
+        self.assertEqual(appt.search_name, 'сидоров иван')
+        self.assertEqual(self.client.get('/api/search/patients?q=иванов').get_json(), [])
+        self.assertEqual(len(self.client.get('/api/search/patients?q=сидоров').get_json()), 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+import unittest
+from flask import g, render_template_string
+from sqlalchemy import event
+from app import create_app, db
+from app.models import User, GlobalSetting
+from app.utils.settings import settings_registry
+
+
+class SettingsRegistryTestCase(unittest.TestCase):
+    def setUp(self):
+        test_config = {
+            'TESTING': True,
+            'SQLALCHEMY_DATABASE_URI': 'sqlite:///:memory:',
+            'WTF_CSRF_ENABLED': False
+        }
+        self.app = create_app(test_config)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.admin = User(username='admin', email='admin@test.com', role='superadmin')
+        db.session.add(self.admin)
+        db.session.add(GlobalSetting(key='chat_image', value='uploads/chat/icon.png'))
+        db.session.commit()
+        self.client = self.app.test_client()
+        with self.client.session_transaction() as sess:
+            sess['_user_id'] = str(self.admin.id)
+        g.pop('_login_user', None)
+
+        self.statements = []
+        event.listen(db.engine, 'before_cursor_execute', self.record)
+
+    def tearDown(self):
+        event.remove(db.engine, 'before_cursor_execute', self.record)
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def record(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def settings_queries(self):
+        return [s for s in self.statements if 'global_settings' in s]
+
+    def render(self):
+        with self.app.test_request_context():
+            return render_template_string("{{ chat_image }}|{{ guacamole_base_url }}")
+
+    def test_renders_load_settings_once(self):
+        self.assertEqual(self.render(), 'uploads/chat/icon.png|https://guacamole.medical-system.ru')
+        self.assertEqual(len(self.settings_queries()), 1)
+        for _ in range(5):
+            self.render()
+        self.assertEqual(len(self.settings_queries()), 1)
+
+    def test_committed_writes_refresh_the_copy(self):
+        self.render()
+        version = settings_registry.version
+        settings_registry.set('guacamole_base_url', 'https://guac.example')
+        # Not committed yet: readers keep the previous values
+        self.assertEqual(settings_registry.guacamole_base_url, 'https://guacamole.medical-system.ru')
+        db.session.commit()
+        self.assertGreater(settings_registry.version, version)
+        self.assertEqual(self.render(), 'uploads/chat/icon.png|https://guac.example')
+
+        db.session.delete(GlobalSetting.query.get('chat_image'))
+        db.session.commit()
+        self.assertIsNone(settings_registry.chat_image)
+
+    def test_rolled_back_writes_keep_the_copy(self):
+        self.render()
+        version = settings_registry.version
+        settings_registry.set('chat_image', 'uploads/chat/other.png')
+        db.session.flush()
+        db.session.rollback()
+        self.assertEqual(settings_registry.version, version)
+        self.assertEqual(settings_registry.chat_image, 'uploads/chat/icon.png')
+
+    def test_viewer_form_shows_only_a_stored_url(self):
+        self.assertEqual(settings_registry.get('guacamole_base_url', ''), '')
+        self.assertEqual(settings_registry.guacamole_base_url, 'https://guacamole.medical-system.ru')
+        page = self.client.get('/admin/additional').get_data(as_text=True)
+        self.assertIn('name="guacamole_base_url" value=""', page)
+
+    def test_viewer_settings_form_updates_rendered_pages(self):
+        self.render()
+        # The render above cached an anonymous user on g
+        g.pop('_login_user', None)
+        response = self.client.post('/admin/viewer/settings', data={'guacamole_base_url': 'https://guac.example'})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(GlobalSetting.query.get('guacamole_base_url').value, 'https://guac.example')
+        self.assertEqual(settings_registry.guacamole_base_url, 'https://guac.example')
+
+if __name__ == '__main__':
+    unittest.main()
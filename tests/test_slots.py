@@ -0,0 +1,266 @@
+import unittest
+import random
+from datetime import date
+from flask import g
+from sqlalchemy import event, insert
+from sqlalchemy.exc import IntegrityError
+from app import create_app, db
+from app.models import User, Location, Clinic, Appointment
+from app.utils.slots import DayOccupancy, is_overlap_violation, slot_engine, time_to_minutes
+
+class DayOccupancyTestCase(unittest.TestCase):
+    def reference_conflict(self, rows, start, duration, exclude_id=None):
+        """Minute-by-minute comparison the overlap checks used to run."""
+        for appt_id, time_str, appt_duration, _, _ in rows:
+            if appt_id == exclude_id:
+                continue
+            ex_start = time_to_minutes(time_str)
+            if ex_start + (appt_duration or 15) > start and ex_start < start + duration:
+                return appt_id
+        return None
+
+    def test_conflicts_match_interval_scan(self):
+        rng = random.Random(11)
+        for _ in range(200):
+            rows = []
+            for appt_id in range(1, rng.randint(1, 12)):
+                minutes = rng.choice([rng.randrange(8 * 60, 20 * 60, 15), rng.randrange(8 * 60, 20 * 60)])
+                rows.append((appt_id, f"{minutes // 60:02d}:{minutes % 60:02d}", rng.choice([15, 30, None]), None, None))
+            occupancy = DayOccupancy(rows)
+            for _ in range(20):
+                start = rng.randrange(8 * 60, 20 * 60, rng.choice([15, 5]))
+                duration = rng.choice([15, 30])
+                exclude_id = rng.choice([None, 1, 2])
+                expected = self.reference_conflict(rows, start, duration, exclude_id)
+                found = occupancy.conflict(start, duration, exclude_id)
+                self.assertEqual(found is None, expected is None, (rows, start, duration, exclude_id))
+
+    def test_exclude_keeps_slots_shared_with_others(self):
+        occupancy = DayOccupancy([(1, '09:00', 30, None, None), (2, '09:15', 15, None, None)])
+        self.assertEqual(occupancy.occupied(exclude_id=2), occupancy.occupied())
+        self.assertNotEqual(occupancy.occupied(exclude_id=1), occupancy.occupied())
+        self.assertIsNotNone(occupancy.conflict(time_to_minutes('09:15'), 15, exclude_id=1))
+
+class SlotEndpointsTestCase(unittest.TestCase):
+    def setUp(self):
+        test_config = {
+            'TESTING': True,
+            'SQLALCHEMY_DATABASE_URI': 'sqlite:///:memory:',
+            'WTF_CSRF_ENABLED': False
+        }
+        self.app = create_app(test_config)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        self.admin = User(username='admin', email='admin@test.com', role='superadmin')
+        self.org = User(username='org', email='org@test.com', role='org')
+        self.center = Location(name="Center", type="center")
+        self.city = Location(name="City", type="city")
+        db.session.add_all([self.admin, self.org, self.center, self.city])
+        db.session.flush()
+        self.clinic = Clinic(name="Улыбка", city_id=self.city.id)
+        db.session.add(self.clinic)
+        db.session.commit()
+
+        # Monday
+        self.day = date(2025, 3, 3)
+        self.booked = Appointment(
+            date=self.day, time='09:00', duration=30, patient_name='Пациент',
+            center_id=self.center.id, clinic_id=self.clinic.id, contract_number='A-1'
+        )
+        db.session.add(self.booked)
+        db.session.commit()
+
+        self.client = self.app.test_client()
+        self.login(self.admin)
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def login(self, user):
+        with self.client.session_transaction() as sess:
+            sess['_user_id'] = str(user.id)
+        g.pop('_login_user', None)
+
+    def slots(self, **params):
+        params.setdefault('date', self.day.isoformat())
+        params.setdefault('center_id', self.center.id)
+        query = '&'.join(f'{k}={v}' for k, v in params.items())
+        return self.client.get(f'/api/slots?{query}').get_json()
+
+    def test_free_slots(self):
+        slots = self.slots()
+        self.assertEqual(slots[:3], ['08:00', '08:15', '08:30'])
+        self.assertNotIn('09:00', slots)
+        self.assertNotIn('09:15', slots)
+        self.assertIn('09:30', slots)
+        self.assertFalse([s for s in slots if s.startswith('13:')])
+        self.assertEqual(slots[-1], '19:30')
+
+        self.assertIn('09:15', self.slots(exclude_id=self.booked.id))
+
+        # Weekend hours
+        weekend = self.slots(date='2025-03-08')
+        self.assertEqual((weekend[0], weekend[-1]), ('09:00', '17:45'))
+
+        self.login(self.org)
+        self.assertTrue(all(s.endswith(':15') or s.endswith(':45') for s in self.slots()))
+
+    def test_cache_follows_writes(self):
+        self.assertIn('10:00', self.slots())
+        statements = []
+        def capture(conn, cursor, statement, *args):
+            if 'FROM appointments' in statement:
+                statements.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', capture)
+        try:
+            self.slots()
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', capture)
+        self.assertEqual(statements, [])
+
+        db.session.add(Appointment(date=self.day, time='10:00', patient_name='Другой', center_id=self.center.id))
+        db.session.commit()
+        self.assertNotIn('10:00', self.slots())
+
+        # Moving an appointment frees its old day
+        self.booked.date = date(2025, 3, 4)
+        db.session.commit()
+        self.assertIn('09:00', self.slots())
+        self.assertNotIn('09:00', self.slots(date='2025-03-04'))
+
+    def test_cache_is_dropped_when_the_write_commits(self):
+        key = (self.center.id, self.day)
+        slot_engine.day(*key)
+
+        # Flushed but not committed: other requests still see the old rows, the cached day stays valid
+        db.session.add(Appointment(date=self.day, time='10:00', patient_name='Другой', center_id=self.center.id))
+        db.session.flush()
+        self.assertIn(key, slot_engine._days)
+        db.session.rollback()
+        self.assertIn(key, slot_engine._days)
+        self.assertNotIn('slot_days', db.session.info)
+
+        db.session.add(Appointment(date=self.day, time='10:00', patient_name='Другой', center_id=self.center.id))
+        db.session.commit()
+        self.assertNotIn(key, slot_engine._days)
+
+        # A day loaded while a commit invalidated it is served but not cached
+        load = slot_engine._load
+        def racing_load(*args):
+            days = load(*args)
+            slot_engine.invalidate_days([key])
+            return days
+        slot_engine._load = racing_load
+        try:
+            self.assertNotIn('10:00', slot_engine.day(*key).free_times(self.day))
+        finally:
+            del slot_engine._load
+        self.assertNotIn(key, slot_engine._days)
+
+    def test_week_slots(self):
+        week = self.client.get(f'/api/slots/week?start_date=2025-03-03&center_id={self.center.id}').get_json()
+        self.assertEqual(sorted(week), [f'2025-03-0{d}' for d in range(3, 10)])
+        self.assertEqual(week['2025-03-03'], self.slots())
+        self.assertIn('09:00', week['2025-03-04'])
+        self.assertEqual(week['2025-03-08'][0], '09:00')
+
+    def test_overlap_checks(self):
+        response = self.client.post('/api/appointments', json={
+            'date': self.day.isoformat(), 'time': '09:15', 'center_id': self.center.id, 'patient_name': 'Новый'
+        })
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.get_json()['error'], 'Conflict: Requested 09:15 overlaps with Accession #A-1 at 09:00 (Улыбка)')
+
+        response = self.client.post('/api/appointments', json={
+            'date': self.day.isoformat(), 'time': '09:30', 'center_id': self.center.id, 'patient_name': 'Новый'
+        })
+        self.assertEqual(response.status_code, 201)
+        new_id = response.get_json()['id']
+
+        # Updating an appointment does not collide with itself, but with others
+        response = self.client.put(f'/api/appointments/{self.booked.id}', json={
+            'date': self.day.isoformat(), 'time': '09:00', 'center_id': self.center.id, 'is_double_time': True
+        })
+        self.assertEqual(response.status_code, 200)
+        response = self.client.put(f'/api/appointments/{new_id}', json={
+            'date': self.day.isoformat(), 'time': '09:15', 'center_id': self.center.id
+        })
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(f'overlaps with Existing ID {self.booked.id} (09:00)', response.get_json()['error'])
+
+    def test_database_rejects_overlaps(self):
+        # Writes that skip the API are refused by the database as well
+        with self.assertRaises(IntegrityError) as ctx:
+            db.session.execute(insert(Appointment), [
+                {'date': self.day, 'time': '09:15', 'patient_name': 'Гонка', 'center_id': self.center.id}
+            ])
+        self.assertTrue(is_overlap_violation(ctx.exception))
+        db.session.rollback()
+
+        moved = Appointment(date=self.day, time='11:00', patient_name='Второй', center_id=self.center.id)
+        db.session.add(moved)
+        db.session.commit()
+        moved.time = '09:00'
+        with self.assertRaises(IntegrityError):
+            db.session.commit()
+        db.session.rollback()
+
+        # Journal rows and other centers are not compared
+        db.session.add_all([
+            Appointment(date=self.day, time='09:00', patient_name='Журнал', center_id=self.center.id, allow_overlap=True),
+            Appointment(date=self.day, time='09:00', patient_name='Без центра'),
+        ])
+        db.session.commit()
+        response = self.client.post('/api/appointments', json={
+            'date': self.day.isoformat(), 'time': '09:15', 'center_id': self.center.id,
+            'patient_name': 'Из журнала', 'ignore_overlap': True
+        })
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(Appointment.query.get(response.get_json()['id']).allow_overlap)
+
+        # A calendar edit of a journal row is checked again
+        response = self.client.put(f"/api/appointments/{response.get_json()['id']}", json={'time': '09:15'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Appointment.query.filter_by(patient_name='Из Журнала').one().start_minute, 9 * 60 + 15)
+
+    def test_calendar_booking_collides_with_imported_rows(self):
+        imported = Appointment(
+            date=self.day, time='11:00', patient_name='Импорт', center_id=self.center.id,
+            contract_number='ICS-1', allow_overlap=True
+        )
+        db.session.add(imported)
+        db.session.commit()
+        self.assertNotIn('11:00', self.slots())
+
+        # The slots and the database agree: a regular booking on top of an imported row is refused
+        response = self.client.post('/api/appointments', json={
+            'date': self.day.isoformat(), 'time': '11:00', 'center_id': self.center.id, 'patient_name': 'Новый'
+        })
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Accession #ICS-1 at 11:00', response.get_json()['error'])
+        with self.assertRaises(IntegrityError) as ctx:
+            db.session.execute(insert(Appointment), [
+                {'date': self.day, 'time': '11:00', 'patient_name': 'Гонка', 'center_id': self.center.id}
+            ])
+        self.assertTrue(is_overlap_violation(ctx.exception))
+        db.session.rollback()
+
+        # Moving a regular booking onto it is refused as well
+        self.booked.time = '10:45'
+        with self.assertRaises(IntegrityError):
+            db.session.commit()
+        db.session.rollback()
+
+        # Flagged rows themselves may still overlap anything
+        response = self.client.post('/api/appointments', json={
+            'date': self.day.isoformat(), 'time': '11:00', 'center_id': self.center.id,
+            'patient_name': 'Ещё импорт', 'ignore_overlap': True
+        })
+        self.assertEqual(response.status_code, 201)
+
+if __name__ == '__main__':
+    unittest.main()
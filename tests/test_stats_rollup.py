@@ -0,0 +1,147 @@
+import unittest
+from datetime import date
+from app import create_app, db
+from app.models import User, Location, Service, PaymentMethod, Appointment, AppointmentService, AppointmentDailyStat
+from app.blueprints.main import calculate_stats
+from app.utils.stats_rollup import load_period_stats, rebuild_stats
+from app.utils.slots import slot_engine
+from werkzeug.security import generate_password_hash
+
+class StatsRollupTestCase(unittest.TestCase):
+    def setUp(self):
+        test_config = {
+            'TESTING': True,
+            'SQLALCHEMY_DATABASE_URI': 'sqlite:///:memory:',
+            'WTF_CSRF_ENABLED': False
+        }
+        self.app = create_app(test_config)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        self.admin = User(username='admin', email='admin@test.com', role='superadmin')
+        self.center = Location(name="Center", type="center")
+        self.cash = PaymentMethod(name="Наличные")
+        self.card = PaymentMethod(name="Карта")
+        self.cashless = PaymentMethod(name="Безнал")
+        self.kt = Service(name="КТ головы", price=1000.0)
+        self.optg = Service(name="ОПТГ", price=500.0)
+        db.session.add_all([self.admin, self.center, self.cash, self.card, self.cashless, self.kt, self.optg])
+        db.session.commit()
+
+        self.client = self.app.test_client()
+        with self.client.session_transaction() as sess:
+            sess['_user_id'] = str(self.admin.id)
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def rollup(self):
+        return sorted(
+            (s.center_id, s.date, s.payment_method_id, s.is_child, s.appointment_count, round(s.cost_sum, 2), s.kt_count, s.optg_count)
+            for s in AppointmentDailyStat.query.all()
+        )
+
+    def make_appt(self, day, name, services=(), service=None, payment=None, cost=0.0, quantity=1, is_child=False):
+        appt = Appointment(
+            center_id=self.center.id, date=day, time='09:00', patient_name=name,
+            service=service, cost=cost, quantity=quantity, is_child=is_child,
+            payment_method_id=payment.id if payment else None, allow_overlap=True
+        )
+        db.session.add(appt)
+        db.session.flush()
+        for svc in services:
+            db.session.add(AppointmentService(appointment_id=appt.id, service_id=svc.id, quantity=1))
+        return appt
+
+    def test_api_keeps_rollup_in_sync(self):
+        ids = []
+        for i, (day, svc, payment) in enumerate([
+            ('2025-03-03', self.kt, self.cash),
+            ('2025-03-03', self.optg, self.card),
+            ('2025-03-04', self.kt, None),
+        ]):
+            response = self.client.post('/api/appointments', json={
+                'center_id': self.center.id, 'date': day, 'time': f'1{i}:00',
+                'patient_name': f'пациент {i}', 'services_ids': [svc.id],
+                'payment_method_id': payment.id if payment else None,
+                'is_child': i == 1
+            })
+            self.assertEqual(response.status_code, 201, response.get_json())
+            ids.append(response.get_json()['id'])
+
+        # Move one to another day and pay it, delete another
+        response = self.client.put(f'/api/appointments/{ids[0]}', json={'date': '2025-03-05', 'payment_method_id': self.card.id})
+        self.assertEqual(response.status_code, 200)
+        response = self.client.delete(f'/api/appointments/{ids[2]}')
+        self.assertEqual(response.status_code, 200)
+
+        incremental = self.rollup()
+        self.assertEqual(incremental, [
+            (self.center.id, date(2025, 3, 3), self.card.id, True, 1, 500.0, 0, 1),
+            (self.center.id, date(2025, 3, 5), self.card.id, False, 1, 1000.0, 1, 0),
+        ])
+        rebuild_stats()
+        db.session.commit()
+        self.assertEqual(self.rollup(), incremental)
+
+    def test_year_and_month_views(self):
+        self.make_appt(date(2025, 1, 10), 'a', services=[self.kt, self.optg], payment=self.cash, cost=1500.0, quantity=2)
+        self.make_appt(date(2025, 1, 10), 'b', service='КТ зуба', payment=self.card, cost=800.0, is_child=True)
+        self.make_appt(date(2025, 1, 11), 'c', services=[self.optg], payment=self.cashless, cost=500.0)
+        self.make_appt(date(2025, 2, 1), 'd', services=[self.kt])
+        # Other year
+        self.make_appt(date(2024, 12, 31), 'e', services=[self.kt], payment=self.cash, cost=1000.0)
+        rebuild_stats()
+        db.session.commit()
+
+        stats = calculate_stats(load_period_stats(self.center.id, 2025), breakdown_by='month')
+        self.assertEqual(stats['total_count'], 4)
+        self.assertEqual(stats['total_sum'], 2300.0)
+        self.assertEqual(stats['methods']['Безнал'], {'count': 1, 'sum': 0.0})
+        self.assertEqual(stats['methods']['Наличные'], {'count': 1, 'sum': 1500.0})
+        self.assertEqual((stats['adults_count'], stats['children_count']), (3, 1))
+        self.assertEqual((stats['kt_adults'], stats['kt_children'], stats['optg_adults']), (3, 1, 3))
+        self.assertEqual([row['label'] for row in stats['breakdown']], ['Январь', 'Февраль'])
+        january = stats['breakdown'][0]
+        self.assertEqual((january['total_count'], january['cashless_count'], january['cashless_sum']), (3, 1, 500.0))
+
+        stats = calculate_stats(load_period_stats(self.center.id, 2025, 1), breakdown_by='day')
+        self.assertEqual([(row['label'], row['total_count']) for row in stats['breakdown']], [('10.01', 2), ('11.01', 1)])
+
+    def test_statistics_page(self):
+        self.make_appt(date(2025, 1, 11), 'безналичный пациент', services=[self.optg], payment=self.cashless, cost=500.0)
+        rebuild_stats()
+        db.session.commit()
+
+        response = self.client.get(f'/statistics?center_id={self.center.id}&year=2025')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('безналичный пациент', response.get_data(as_text=True))
+
+    def test_clearing_a_month_updates_rollup_and_slots(self):
+        self.admin.password_hash = generate_password_hash('secret')
+        self.make_appt(date(2025, 2, 10), 'a', services=[self.kt], payment=self.cash, cost=1000.0)
+        self.make_appt(date(2025, 3, 10), 'b', services=[self.kt], payment=self.cash, cost=1000.0)
+        rebuild_stats()
+        db.session.commit()
+        self.assertEqual(len(slot_engine.day(self.center.id, date(2025, 2, 10)).bookings), 1)
+
+        response = self.client.post('/admin/journal/clear', data={
+            'center_id': self.center.id, 'month': '2025-02', 'password': 'secret'
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual([row[1] for row in self.rollup()], [date(2025, 3, 10)])
+        self.assertEqual(slot_engine.day(self.center.id, date(2025, 2, 10)).bookings, [])
+
+    def test_rebuild_command(self):
+        self.make_appt(date(2025, 1, 10), 'a', services=[self.kt], payment=self.cash, cost=1000.0)
+        db.session.commit()
+
+        result = self.app.test_cli_runner().invoke(args=['stats', 'rebuild', '--year', '2025'])
+        self.assertIn('Rollup rows written: 1', result.output)
+        self.assertEqual(len(self.rollup()), 1)
+
+if __name__ == '__main__':
+    unittest.main()
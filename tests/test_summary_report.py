@@ -0,0 +1,119 @@
+import unittest
+from datetime import date
+from sqlalchemy import event, or_
+from app import create_app, db
+from app.models import User, Location, Doctor, Clinic, Appointment
+from app.utils.summary_report import build_summary, month_periods
+
+class SummaryReportTestCase(unittest.TestCase):
+    def setUp(self):
+        test_config = {
+            'TESTING': True,
+            'SQLALCHEMY_DATABASE_URI': 'sqlite:///:memory:',
+            'WTF_CSRF_ENABLED': False
+        }
+        self.app = create_app(test_config)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        self.admin = User(username='admin', email='admin@test.com', role='superadmin')
+        self.city = Location(name="City", type="city")
+        db.session.add_all([self.admin, self.city])
+        db.session.flush()
+        self.ivanov = Doctor(name="Иванов")
+        self.petrov = Doctor(name="Петров")
+        self.petrov_twin = Doctor(name="Петров")
+        self.clinic = Clinic(name="Улыбка", city_id=self.city.id)
+        db.session.add_all([self.ivanov, self.petrov, self.petrov_twin, self.clinic])
+        db.session.commit()
+
+        this_month, last_month = month_periods(2)
+        self.this_month = this_month['start']
+        self.last_month = last_month['start']
+        for day, doctor_id, doctor_name, clinic_id in [
+            (self.this_month, self.ivanov.id, None, self.clinic.id),
+            (self.this_month, self.ivanov.id, "Иванов", self.clinic.id),  # counted once
+            (self.this_month, self.ivanov.id, "Петров", None),           # Иванов and both Петров
+            (self.last_month, None, "Петров", self.clinic.id),
+            (date(2000, 1, 1), self.ivanov.id, None, self.clinic.id),   # outside the period
+        ]:
+            db.session.add(Appointment(
+                date=day, time='09:00', patient_name='п', doctor_id=doctor_id,
+                doctor=doctor_name, clinic_id=clinic_id
+            ))
+        db.session.commit()
+
+        self.client = self.app.test_client()
+        with self.client.session_transaction() as sess:
+            sess['_user_id'] = str(self.admin.id)
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def reference_count(self, doctor, period):
+        """Per-cell query the grouped report replaces."""
+        return Appointment.query.filter(
+            or_(Appointment.doctor_id == doctor.id, Appointment.doctor == doctor.name),
+            Appointment.date >= period['start'], Appointment.date < period['end']
+        ).count()
+
+    def test_doctor_matrix_matches_per_cell_counts(self):
+        statements = []
+        def capture(conn, cursor, statement, *args):
+            if 'FROM appointments' in statement:
+                statements.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', capture)
+        try:
+            data = build_summary('doctors', months=3)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', capture)
+
+        self.assertEqual(len(statements), 1)
+        periods = month_periods(3)
+        self.assertEqual(data['months'], [p['label'] for p in periods])
+        doctors = {d.id: d for d in (self.ivanov, self.petrov, self.petrov_twin)}
+        for row in data['doctors']:
+            self.assertEqual(
+                [cell['count'] for cell in row['months']],
+                [self.reference_count(doctors[row['id']], p) for p in periods]
+            )
+        self.assertEqual([cell['count'] for cell in data['doctors'][0]['months']], [3, 0, 0])
+
+    def test_clinics_view_and_csv(self):
+        response = self.client.get('/admin/reports/summary/data?view_type=clinics&months=2')
+        self.assertEqual(response.status_code, 200)
+        data = response.get_json()
+        self.assertEqual(data['clinics'], [{
+            'id': self.clinic.id, 'name': 'Улыбка',
+            'months': [{'label': label, 'count': count} for label, count in zip(data['months'], [2, 1])]
+        }])
+
+        response = self.client.get('/admin/reports/summary/data?view_type=clinics&months=2&format=csv')
+        self.assertEqual(response.mimetype, 'text/csv')
+        lines = response.get_data(as_text=True).lstrip('\ufeff').splitlines()
+        self.assertEqual(lines[0], ';'.join(['Клиника'] + data['months']))
+        self.assertEqual(lines[1], 'Улыбка;2;1')
+
+        response = self.client.get('/admin/reports/summary/data?view_type=rooms')
+        self.assertEqual(response.status_code, 400)
+
+    def test_cached_by_parameters(self):
+        url = '/admin/reports/summary/data?months=1&search=Иван'
+        first = self.client.get(url).get_json()
+        db.session.add(Appointment(date=self.this_month, time='10:00', patient_name='п', doctor_id=self.ivanov.id))
+        db.session.commit()
+
+        self.assertEqual(self.client.get(url).get_json(), first)
+        # Other parameters are a different entry
+        other = self.client.get('/admin/reports/summary/data?months=2&search=Иван').get_json()
+        self.assertEqual(other['doctors'][0]['months'][0]['count'], first['doctors'][0]['months'][0]['count'] + 1)
+
+        self.app.config['REPORT_CACHE_TTL'] = 0
+        fresh = self.client.get(url).get_json()
+        self.assertEqual(fresh['doctors'][0]['months'][0]['count'], 4)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,195 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from app import create_app
+from app.telegram_bot import TelegramBot
+from app.utils.telegram_outbox import TelegramOutbox, TokenBucket
+
+
+class FakeTelegramServer:
+    """
+    Local stand-in for api.telegram.org: records every request and answers
+    with the queued (status, body) responses first, then 200 OK.
+    """
+
+    def __init__(self):
+        self.requests = []
+        self.responses = []
+        self.connections = set()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                body = self.rfile.read(length)
+                server.connections.add(self.client_address)
+                server.requests.append({'path': self.path, 'body': body, 'at': time.monotonic()})
+                status, payload = server.responses.pop(0) if server.responses else (200, {'ok': True, 'result': {}})
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.httpd.server_address[1]}'
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def texts(self):
+        return [json.loads(r['body'])['text'] for r in self.requests]
+
+    def wait_for(self, count, timeout=5):
+        deadline = time.monotonic() + timeout
+        while len(self.requests) < count and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return len(self.requests) >= count
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class TelegramOutboxTestCase(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeTelegramServer()
+        self.spool = tempfile.mkdtemp()
+        self.app = create_app({
+            'TESTING': True,
+            'SQLALCHEMY_DATABASE_URI': 'sqlite:///:memory:'
+        })
+        # Bot settings only for the bots made here, so the global bot sends
+        # no startup/shutdown notifications to the fake server
+        self.app.config.update({
+            'TELEGRAM_BOT_TOKEN': 'TEST',
+            'TELEGRAM_CHAT_ID': '42',
+            'TELEGRAM_API_URL': self.server.url,
+            'TELEGRAM_OUTBOX_DIR': self.spool,
+            'TELEGRAM_RATE_PER_MINUTE': 6000,
+            'TELEGRAM_BURST': 50,
+            'TELEGRAM_MAX_BACKOFF': 0.05,
+            'TELEGRAM_DIGEST_WINDOW': 0.3,
+        })
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.spool, ignore_errors=True)
+
+    def make_bot(self):
+        bot = TelegramBot()
+        bot.init_app(self.app)
+        return bot
+
+    def spooled(self):
+        return [name for name in os.listdir(self.spool) if name.endswith('.json')]
+
+    def test_messages_share_one_worker_and_connection(self):
+        bot = self.make_bot()
+        before = set(threading.enumerate())
+        for n in range(20):
+            self.assertTrue(bot.send_message(f'm{n}'))
+        # The fake server handles each connection on a thread of its own
+        started = [t.name for t in threading.enumerate() if t not in before and 'process_request' not in t.name]
+        self.assertEqual(started, ['telegram-outbox'])
+        self.assertTrue(self.server.wait_for(20))
+        self.assertTrue(bot.outbox.drain())
+
+        self.assertEqual(self.server.texts(), [f'm{n}' for n in range(20)])
+        self.assertEqual(self.server.requests[0]['path'], '/botTEST/sendMessage')
+        self.assertEqual(len(self.server.connections), 1)
+        self.assertEqual(self.spooled(), [])
+
+    def test_retries_server_errors_and_rate_limits(self):
+        self.server.responses = [
+            (500, {'ok': False}),
+            (429, {'ok': False, 'parameters': {'retry_after': 0.01}}),
+        ]
+        bot = self.make_bot()
+        bot.send_message('important')
+        self.assertTrue(self.server.wait_for(3))
+        self.assertTrue(bot.outbox.drain())
+        self.assertEqual(self.server.texts(), ['important'] * 3)
+        self.assertEqual(bot.outbox.stats()['retried'], 2)
+        self.assertEqual(bot.outbox.stats()['sent'], 1)
+
+    def test_bad_requests_are_not_retried(self):
+        self.server.responses = [(400, {'ok': False, 'description': 'Bad Request'})]
+        bot = self.make_bot()
+        bot.send_message('<broken')
+        bot.send_message('next')
+        self.assertTrue(self.server.wait_for(2))
+        self.assertTrue(bot.outbox.drain())
+        self.assertEqual(self.server.texts(), ['<broken', 'next'])
+        self.assertEqual(bot.outbox.stats()['failed'], 1)
+        self.assertEqual(self.spooled(), [])
+
+    def test_error_storm_becomes_a_digest(self):
+        bot = self.make_bot()
+        with self.app.test_request_context():
+            for _ in range(50):
+                bot.send_error_notification(ValueError('boom'))
+            bot.send_error_notification(KeyError('other'))
+        self.assertTrue(self.server.wait_for(3, timeout=5))
+        texts = self.server.texts()
+        self.assertEqual(len(texts), 3)
+        self.assertIn('boom', texts[0])
+        self.assertIn('other', texts[1])
+        self.assertIn('Ещё 49 раз', texts[2])
+
+    def test_spooled_messages_survive_a_restart(self):
+        # A previous process (pid that cannot exist) left two messages behind,
+        # the second spooled with the URL of a token rotated since
+        left = [
+            {'method': 'sendMessage', 'json': {'chat_id': '42', 'text': 'left 0'}},
+            {'url': f'{self.server.url}/botOLD/sendMessage', 'json': {'chat_id': '42', 'text': 'left 1'}},
+        ]
+        for n, item in enumerate(left):
+            with open(os.path.join(self.spool, f'{n}-99999999-{n}.json'), 'w') as f:
+                json.dump(dict(item, data=None, files=None, attempts=0), f)
+
+        bot = self.make_bot()
+        self.assertTrue(self.server.wait_for(2))
+        self.assertTrue(bot.outbox.drain())
+        self.assertEqual(sorted(self.server.texts()), ['left 0', 'left 1'])
+        self.assertEqual({r['path'] for r in self.server.requests}, {'/botTEST/sendMessage'})
+        self.assertEqual(self.spooled(), [])
+
+    def test_spool_files_hold_no_token(self):
+        outbox = TelegramOutbox()
+        outbox.init_app(self.app, f'{self.server.url}/botSECRET')
+        path = outbox._spool({'method': 'sendMessage', 'json': {'chat_id': '42', 'text': 'x'}, 'attempts': 0})
+        with open(path, encoding='utf-8') as f:
+            content = f.read()
+        self.assertNotIn('SECRET', content)
+        self.assertEqual(json.loads(content)['method'], 'sendMessage')
+
+    def test_full_queue_drops_instead_of_growing(self):
+        outbox = TelegramOutbox()
+        outbox.init_app(self.app, f'{self.server.url}/botTEST')
+        outbox.max_queue = 2
+        outbox.max_attempts = 1
+        outbox.rate_per_minute = 1
+        outbox.burst = 1
+        results = [outbox.enqueue('sendMessage', {'chat_id': '42', 'text': str(n)}) for n in range(10)]
+        self.assertFalse(all(results))
+        # At most one sent, one waiting for a token and two queued
+        self.assertGreaterEqual(outbox.stats()['dropped'], 6)
+
+    def test_token_bucket(self):
+        bucket = TokenBucket(rate=10, burst=2)
+        self.assertEqual(bucket.delay(), 0)
+        self.assertEqual(bucket.delay(), 0)
+        self.assertGreater(bucket.delay(), 0.05)
+
+if __name__ == '__main__':
+    unittest.main()